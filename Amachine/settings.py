@@ -246,6 +246,7 @@ LOGGING = {
 }
 
 # Celery Configuration
+from celery.schedules import crontab
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
@@ -257,6 +258,13 @@ CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 CELERY_TASK_SOFT_TIME_LIMIT = 25 * 60  # 25 minutes
 CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 CELERY_WORKER_MAX_TASKS_PER_CHILD = 1000
+#Tareas periodicas, requieren `celery -A Amachine beat`
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-ventas-diarias': {
+        'task': 'Sifen.tasks.reconcile_ventas_diarias',
+        'schedule': crontab(hour=2, minute=30),
+    },
+}
 
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
@@ -287,4 +295,12 @@ FDOMAIN = os.environ.get('FDOMAIN', 'http://localhost:8000')
 
 # Shopify Configuration
 SHOPIFY_STORE = os.environ.get('SHOPIFY_STORE', '')
-SHOPIFY_API_ADMIN = os.environ.get('SHOPIFY_API_ADMIN', '')
\ No newline at end of file
+SHOPIFY_API_ADMIN = os.environ.get('SHOPIFY_API_ADMIN', '')
+SHOPIFY_SYNC_BATCH_SIZE = int(os.environ.get('SHOPIFY_SYNC_BATCH_SIZE', 500))
+SHOPIFY_SYNC_OVERLAP = int(os.environ.get('SHOPIFY_SYNC_OVERLAP', 300))
+SHOPIFY_HTTP_POOLED = os.environ.get('SHOPIFY_HTTP_POOLED', 'True') == 'True'
+SHOPIFY_HTTP_WORKERS = int(os.environ.get('SHOPIFY_HTTP_WORKERS', 4))
+SHOPIFY_HTTP_MAX_RETRIES = int(os.environ.get('SHOPIFY_HTTP_MAX_RETRIES', 5))
+SHOPIFY_TOKEN_CACHE_TTL = int(os.environ.get('SHOPIFY_TOKEN_CACHE_TTL', 300))
+SHOPIFY_INVOICE_BATCH_SIZE = int(os.environ.get('SHOPIFY_INVOICE_BATCH_SIZE', 500))
+SHOPIFY_INVOICE_ASYNC_MIN = int(os.environ.get('SHOPIFY_INVOICE_ASYNC_MIN', 50))
@@ -6,6 +6,7 @@ from django.contrib.auth.models import User
 from django.http import QueryDict
 from django.db.models import Sum, Q
 from Sifen.models import DocumentHeader
+from Sifen.mng_ventas_diarias import ventas_diarias
 from Cobro.models import Pago
 
 logger = logging.getLogger(__name__)
@@ -226,26 +227,17 @@ class MCobro:
     def get_resumen_cobros(self, *args, **kwargs) -> dict:
         """
         Obtiene un resumen de cobros pendientes.
+        Se lee del resumen diario VentaDiaria (saldo de facturas a credito por dia).
         """
-        facturas_pendientes = DocumentHeader.objects.filter(
-            doc_tipo='FE',
-            doc_cre_tipo_cod=2,
-            doc_saldo__gt=0
-        )
-
-        total_pendiente = facturas_pendientes.aggregate(
-            total=Sum('doc_saldo')
-        )['total'] or Decimal('0')
-
-        cantidad_facturas = facturas_pendientes.count()
+        from datetime import timedelta
+        pendientes = ventas_diarias.totales(doc_tipo='FE')
+        total_pendiente = pendientes['saldo_credito']
+        cantidad_facturas = pendientes['cantidad_credito']
 
         # Facturas vencidas (más de 30 días por defecto)
-        from datetime import timedelta
         fecha_limite = date.today() - timedelta(days=30)
-        facturas_vencidas = facturas_pendientes.filter(doc_fecha__lt=fecha_limite)
-        total_vencido = facturas_vencidas.aggregate(
-            total=Sum('doc_saldo')
-        )['total'] or Decimal('0')
+        vencidas = ventas_diarias.totales(hasta=fecha_limite - timedelta(days=1), doc_tipo='FE')
+        total_vencido = vencidas['saldo_credito']
 
         return {
             'success': True,
@@ -253,6 +245,6 @@ class MCobro:
                 'total_pendiente': float(total_pendiente),
                 'cantidad_facturas': cantidad_facturas,
                 'total_vencido': float(total_vencido),
-                'cantidad_vencidas': facturas_vencidas.count()
+                'cantidad_vencidas': vencidas['cantidad_credito']
             }
         }
@@ -3,7 +3,11 @@ import numpy as np
 import datetime, calendar, importlib, json, re
 import pandas as pd
 from django.forms import model_to_dict
-from django.db.models import Q, F
+from django.db.models import Q, F, Prefetch
+from django.db.models.fields.files import FileField
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+import base64
 import logging
 
 class FConstruc:
@@ -45,7 +49,8 @@ class FConstruc:
             'char': getattr( importlib.import_module(pack_metrics), 'CharField'),
         }        
 
-    def querydict_params(self, q:list, exclude:list):
+    def querydict_params(self, q:list, exclude:list, key_cache: dict | None = None):
+        """key_cache memoriza por clave si queda excluida, lo usa el plan de IoS.seModel"""
         lexc = ['columns', '^start$', 'draw', 'length', 'search','order',r'\b-\b', 'filtro', r'\b_\b',
                 'from_palletl', 'interface', 'demo', 'key_name', 'app_name',
                 'model_name', 'model_key', 'api_key', 'method_call', '^nor_', '^or_',
@@ -70,7 +75,12 @@ class FConstruc:
             key = l[0].split('^')[-1]
             if re.search('startswith|endswith', key) and len(l[1]) > 1:
                 continue
-            if re.search(rsearch, key):
+            excluded = key_cache.get(key) if key_cache is not None else None
+            if excluded is None:
+                excluded = bool(re.search(rsearch, key))
+                if key_cache is not None and not exclude:
+                    key_cache[key] = excluded
+            if excluded:
                 continue
             if isinstance(key, str):
                 if key.strip() == '':
@@ -483,6 +493,211 @@ class FConstruc:
         return rsp
     
 
+    def relation_path(self, model_class, path: str):
+        """
+            Recorre un path con __ sobre los _meta del modelo y devuelve
+            (prefijo de FKs directas, field terminal o None si es metodo/propiedad)
+        """
+        parts = path.split('__')
+        rel = []
+        for idx, part in enumerate(parts):
+            try:
+                field = model_class._meta.get_field(part)
+            except FieldDoesNotExist:
+                return '__'.join(rel), None
+            if idx + 1 == len(parts):
+                return '__'.join(rel), field
+            if not (field.concrete and (field.many_to_one or field.one_to_one)):
+                return '__'.join(rel), None
+            rel.append(part)
+            model_class = field.related_model
+        return '__'.join(rel), None
+
+    def queryset_plan(self, model_class, only: list, sfields: list, fields: list, detail_objs: list = []):
+        """
+            Arma select_related/prefetch a partir de sfields y detail_objs para
+            serializar una pagina con una cantidad fija de queries.
+            values queda con los campos a leer con .values() cuando ninguna
+            columna necesita la instancia (metodos, FKs, archivos, detail_objs)
+        """
+        base_only = list(only)
+        only = list(only)
+        select = set()
+        use_values = not detail_objs
+        for ff in sfields:
+            rel, field = self.relation_path(model_class, ff)
+            if field is not None and field.concrete and (field.many_to_one or field.one_to_one):
+                select.add(ff)
+                use_values = False
+            elif rel:
+                select.add(rel)
+            if field is None or not field.concrete or field.many_to_many or isinstance(field, FileField):
+                use_values = False
+            if only:
+                only.append(ff if field is not None and field.concrete else rel)
+        vfields = []
+        for ff in fields:
+            try:
+                field = model_class._meta.get_field(ff)
+            except FieldDoesNotExist:
+                continue
+            if field.name != ff:
+                #attname de una FK, lo agrega rfields con getattr
+                if ff.endswith('_id'): vfields.append(ff)
+                continue
+            if not field.concrete or field.many_to_many or isinstance(field, FileField):
+                use_values = False
+                continue
+            if getattr(field, 'editable', False):
+                vfields.append(ff)
+        #only incluye los paths de sfields, Django no permite recorrer con select_related una FK diferida
+        return {
+            'only': base_only if use_values else list(filter(lambda x: x, only)),
+            'select_related': sorted(filter(lambda x: x, select)),
+            'prefetch': self.prefetch_specs(model_class, detail_objs),
+            'values': vfields if use_values else None,
+        }
+
+    def prefetch_specs(self, model_class, detail_objs: list):
+        specs = []
+        for deobj in detail_objs:
+            dset = deobj.get('dset', '')
+            descriptor = getattr(model_class, dset, None)
+            rel = getattr(descriptor, 'rel', None)
+            if rel is None:
+                logging.info(f'{dset} no es una relacion de {model_class.__name__}, se consulta por fila')
+                continue
+            dmodel = rel.related_model if getattr(descriptor, 'reverse', True) else rel.model
+            dplan = self.queryset_plan(dmodel, [],
+                                       deobj.get('sfields', []),
+                                       deobj.get('fields', []),
+                                       deobj.get('detail_objs', []))
+            specs.append({
+                'dset': dset,
+                'to_attr': f'_io_{dset}',
+                'model': dmodel,
+                'dfilter': deobj.get('dfilter', {}),
+                'order_by': deobj.get('order_by', []),
+                'select_related': dplan.get('select_related'),
+                'prefetch': dplan.get('prefetch'),
+            })
+        return specs
+
+    def prefetch_lookups(self, specs: list):
+        #Los Prefetch se arman por request, el plan solo guarda la especificacion
+        return [
+            Prefetch(s['dset'],
+                     queryset=s['model']._default_manager
+                        .select_related(*s['select_related'])
+                        .prefetch_related(*self.prefetch_lookups(s['prefetch']))
+                        .filter(**s['dfilter'])
+                        .order_by(*s['order_by']),
+                     to_attr=s['to_attr'])
+            for s in specs
+        ]
+
+    def optimize_qs(self, qs, qplan: dict):
+        if qplan.get('select_related'):
+            qs = qs.select_related(*qplan.get('select_related'))
+        if qplan.get('prefetch'):
+            qs = qs.prefetch_related(*self.prefetch_lookups(qplan.get('prefetch')))
+        return qs
+
+    def values_rows(self, qs, vfields: list, sfields: list):
+        """Arma las filas como rfields pero desde .values(), sin instanciar modelos"""
+        model_name = qs.model._meta.model_name
+        return [ self.values_row(r, vfields, sfields, model_name) for r in qs.values('pk', *vfields, *sfields) ]
+
+    def values_row(self, r: dict, vfields: list, sfields: list, model_name: str) -> dict:
+        x = { f: r[f] for f in vfields }
+        x['pk'] = r['pk']
+        x['id'] = r['pk']
+        x['DT_RowId'] = f'{model_name}{r["pk"]}'
+        for ff in sfields:
+            x[ff] = r[ff]
+        return x
+
+    def count_qs(self, qs, count_mode: str = 'exact', exact_below: int = 100000):
+        """
+            exact = COUNT(*), none = sin conteo, estimate = estadisticas del planner
+            de PostgreSQL; si la estimacion es chica se cuenta exacto igual
+        """
+        if count_mode == 'none':
+            return None
+        if count_mode == 'estimate' and connections[qs.db].vendor == 'postgresql':
+            estimate = self.estimate_count(qs)
+            if estimate >= exact_below:
+                return estimate
+        return qs.count()
+
+    def estimate_count(self, qs) -> int:
+        with connections[qs.db].cursor() as cursor:
+            if not qs.query.where:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [qs.model._meta.db_table])
+                row = cursor.fetchone()
+                #reltuples es -1 si la tabla nunca fue analizada
+                if row and row[0] >= 0:
+                    return row[0]
+            sql, params = qs.order_by().query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def keyset_keys(self, order_field: list) -> list:
+        """Campos del cursor: el orden de la grilla mas pk para desempatar"""
+        keys = list(order_field)
+        if not set(map(lambda x: x.lstrip('-'), keys)).intersection({'pk', 'id'}):
+            keys.append('pk')
+        return keys
+
+    def keyset_order(self, keys: list, reverse: bool = False) -> list:
+        """
+            NULL se ordena como el mayor valor en cualquier direccion (como Postgres:
+            NULLS LAST en asc, NULLS FIRST en desc), asi el cursor puede cruzarlos
+        """
+        order = []
+        for key in keys:
+            desc = key.startswith('-') != reverse
+            field = F(key.lstrip('-'))
+            order.append(field.desc(nulls_first=True) if desc else field.asc(nulls_last=True))
+        return order
+
+    def keyset_q(self, keys: list, values: list, reverse: bool = False):
+        """
+            (k1 > v1) | (k1 = v1 & k2 > v2) | ... respetando la direccion de cada campo,
+            con NULL como el mayor valor (ver keyset_order)
+        """
+        q = Q(pk__in=[])
+        eq = Q()
+        for key, value in zip(keys, values):
+            field = key.lstrip('-')
+            after_greater = key.startswith('-') == reverse
+            if value is None:
+                #Despues de NULL solo hay valores menores
+                step = None if after_greater else Q(**{f'{field}__isnull': False})
+                same = Q(**{f'{field}__isnull': True})
+            else:
+                op = 'gt' if after_greater else 'lt'
+                step = Q(**{f'{field}__{op}': value})
+                if after_greater:
+                    step |= Q(**{f'{field}__isnull': True})
+                same = Q(**{field: value})
+            if step is not None:
+                q |= eq & step
+            eq &= same
+        return q
+
+    def encode_cursor(self, values: list) -> str:
+        return base64.urlsafe_b64encode(json.dumps(values, default=str).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor: str | None) -> list | None:
+        if not cursor:
+            return None
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
     def sfields(self, mobj, efields: list, fields: list, allfields: bool = False, detail_objs: list = []):
         return self.rfields(mobj, efields, fields, allfields=allfields, detail_objs=detail_objs)
     
@@ -507,7 +722,10 @@ class FConstruc:
             for deobj in detail_objs:
                 dset = deobj.get('dset', '')
                 x[dset] = []
-                for do in getattr(mobj, dset).filter(**deobj.get('dfilter', {})).order_by(*deobj.get('order_by', [])):
+                dobjs = getattr(mobj, f'_io_{dset}', None)
+                if dobjs is None:
+                    dobjs = getattr(mobj, dset).filter(**deobj.get('dfilter', {})).order_by(*deobj.get('order_by', []))
+                for do in dobjs:
                     dx = self.rfields(do, 
                             deobj.get('sfields', []),
                             deobj.get('fields', []),
@@ -0,0 +1,168 @@
+"""Exportacion en streaming de las mismas definiciones de grilla que usa IoS.seModel"""
+import csv
+import datetime
+import json
+import logging
+import os
+import tempfile
+import uuid
+from decimal import Decimal
+from django.db.models.fields.files import FieldFile
+from django.http import QueryDict, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from OptsIO.io_serial import IoS
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+CHUNK_SIZE = 2000
+FILE_CHUNK = 64 * 1024
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class Echo:
+    """Pseudo buffer para csv.writer, devuelve la linea en lugar de guardarla"""
+    def write(self, value):
+        return value
+
+
+class IoX:
+    def __init__(self):
+        self.ios = IoS()
+
+    def seExport(self,
+                 userobj: str | None = 'ND',
+                 rq = None,
+                 files = None,
+                 qdict: QueryDict | dict = {}):
+        """
+            Recorre la grilla con iterator(chunk_size) (cursores del lado del servidor en
+            PostgreSQL) y escribe csv, xlsx (openpyxl write-only) o parquet por lotes,
+            la memoria no depende de la cantidad de filas. pdopts no se aplica.
+        """
+        export_format = qdict.get('export_format', 'csv')
+        if export_format not in CONTENT_TYPES:
+            return {'error': f'Formato {export_format} no soportado'}
+        if export_format == 'parquet' and not PYARROW_AVAILABLE:
+            return {'error': 'pyarrow no esta instalado, no es posible exportar a parquet'}
+        export_name = qdict.get('export_name') or f"{qdict.get('model_name', 'export')}_{uuid.uuid4().hex[:6]}"
+        columns = json.loads(qdict.get('export_columns', '[]'))
+        rows = self.iter_rows(qdict)
+        stream = getattr(self, f'stream_{export_format}')(rows, columns)
+        rsp = StreamingHttpResponse(stream, content_type=CONTENT_TYPES[export_format])
+        rsp['Content-Disposition'] = f'attachment; filename="{export_name}.{export_format}"'
+        return rsp
+
+    def iter_rows(self, qdict: QueryDict | dict):
+        plan = self.ios.sePlan(qdict)
+        qf, qf_or = self.ios.seFilters(qdict, plan)
+        qs = self.ios.seQuerySet(plan, qf, qf_or)
+        qplan = plan['qplan']
+        chunk_size = int(qdict.get('chunk_size', CHUNK_SIZE))
+        stsconstruc = self.ios.stsconstruc
+        if plan['annotates']:
+            yield from qs.iterator(chunk_size=chunk_size)
+        elif qplan['values'] is not None:
+            model_name = plan['model_class']._meta.model_name
+            for r in qs.values('pk', *qplan['values'], *plan['sfields']).iterator(chunk_size=chunk_size):
+                yield stsconstruc.values_row(r, qplan['values'], plan['sfields'], model_name)
+        else:
+            qs = stsconstruc.optimize_qs(qs, qplan)
+            for mobj in qs.iterator(chunk_size=chunk_size):
+                yield stsconstruc.sfields(mobj, plan['sfields'], plan['fields'], detail_objs=plan['detail_objs'])
+
+    def iter_columns(self, rows, columns: list):
+        """Toma las columnas de la primera fila si no vienen en export_columns"""
+        first = next(rows, None)
+        if first is None:
+            return columns, iter(())
+        if not columns:
+            columns = list(first.keys())
+        def chained():
+            yield first
+            yield from rows
+        return columns, chained()
+
+    def cell(self, value):
+        if isinstance(value, datetime.datetime) and timezone.is_aware(value):
+            return timezone.localtime(value).replace(tzinfo=None)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, default=str)
+        if isinstance(value, FieldFile):
+            return value.name
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return value
+
+    def stream_csv(self, rows, columns: list):
+        columns, rows = self.iter_columns(rows, columns)
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for r in rows:
+            yield writer.writerow([ self.cell(r.get(c)) for c in columns ])
+
+    def stream_xlsx(self, rows, columns: list):
+        columns, rows = self.iter_columns(rows, columns)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(columns)
+        for r in rows:
+            ws.append([ self.cell(r.get(c)) for c in columns ])
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        wb.save(path)
+        yield from self.stream_file(path)
+
+    def stream_parquet(self, rows, columns: list, batch_size: int = CHUNK_SIZE):
+        columns, rows = self.iter_columns(rows, columns)
+        fd, path = tempfile.mkstemp(suffix='.parquet')
+        os.close(fd)
+        writer = None
+        batch = []
+        def flush(writer, batch):
+            data = { c: [ self.parquet_cell(r.get(c)) for r in batch ] for c in columns }
+            if writer is None:
+                table = pa.Table.from_pydict(data)
+                #Columnas vacias en el primer lote quedarian como null, se fijan como texto
+                schema = pa.schema([ pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                     for f in table.schema ])
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pydict(data, schema=writer.schema))
+            return writer
+        try:
+            for r in rows:
+                batch.append(r)
+                if len(batch) >= batch_size:
+                    writer = flush(writer, batch)
+                    batch = []
+            if batch or writer is None:
+                writer = flush(writer, batch)
+        finally:
+            if writer is not None:
+                writer.close()
+        yield from self.stream_file(path)
+
+    def parquet_cell(self, value):
+        value = self.cell(value)
+        if isinstance(value, Decimal):
+            return float(value)
+        return value
+
+    def stream_file(self, path: str):
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    data = f.read(FILE_CHUNK)
+                    if not data: break
+                    yield data
+        finally:
+            os.remove(path)
+            logging.info(f'Export temporal {path} eliminado')
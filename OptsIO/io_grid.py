@@ -115,14 +115,26 @@ class IoG:
         return c_query_r
     
     def datatables_records(self, qdict: dict, records: dict) -> dict:
+        """
+            Con count_mode=none el total se arma de forma perezosa: lo visto hasta
+            ahora mas una pagina si la actual vino completa, para que DataTables
+            siga habilitando "siguiente" sin contar la tabla
+        """
         trows: int = records.get('trows', 0)
         qs = records.get('qs', [])
         qsr = len(qs)
+        if trows is None:
+            start = int(qdict.get('startRow', 0))
+            length = int(qdict.get('endRow', 0)) - start
+            trows = start + qsr + (length if qsr and qsr >= length else 0)
         if not qsr: qsr = 1
-        return {
+        rsp = {
             "draw": int(qdict.get('draw', 1))+1,
             "recordsTotal": trows,
             "recordsFiltered": trows,
             'data': qs
         }
+        for k in ('next_cursor', 'prev_cursor', 'trows_mode'):
+            if k in records: rsp[k] = records.get(k)
+        return rsp
         
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+Render de reportes HTML a PDF en memoria con WeasyPrint.
+
+El HTML llega como string (ya renderizado por la vista) y se pasa directo
+a WeasyPrint, sin archivos temporales. Cada proceso renderizador mantiene:
+- Un FontConfiguration único
+- Las hojas de estilo ya parseadas (por archivo+mtime o por contenido)
+- Los archivos locales (file://) e imágenes leídos en memoria
+
+Los renders corren en un pool de procesos tibio, el costo de importar
+WeasyPrint y cargar las fuentes se paga una vez por worker.
+Este módulo no accede a settings en el import para poder usarse con spawn.
+"""
+import os
+import atexit
+import hashlib
+import logging
+import threading
+import multiprocessing
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+#Procesos del pool de render (0 = render en el mismo proceso)
+RPT_PDF_WORKERS = int(os.environ.get('RPT_PDF_WORKERS', 2))
+RPT_PDF_START_METHOD = os.environ.get('RPT_PDF_START_METHOD', 'spawn')
+RPT_PDF_TIMEOUT = float(os.environ.get('RPT_PDF_TIMEOUT', 120))
+
+#Unidad por defecto de wkhtmltopdf para medidas sin unidad
+DEFAULT_UNIT = 'mm'
+
+
+def with_unit(value):
+    value = str(value).strip()
+    try:
+        float(value)
+    except ValueError:
+        return value
+    return f'{value}{DEFAULT_UNIT}'
+
+
+def page_css(options: dict) -> str:
+    """Traduce las opciones de pagina estilo wkhtmltopdf a una regla @page"""
+    if options.get('page-width') and options.get('page-height'):
+        size = f"{with_unit(options['page-width'])} {with_unit(options['page-height'])}"
+    else:
+        size = f"{options.get('page-size', 'A4')} {options.get('orientation', 'Portrait').lower()}"
+    rules = [f'size: {size};']
+    for side in ('top', 'right', 'bottom', 'left'):
+        margin = options.get(f'margin-{side}')
+        if margin is not None:
+            rules.append(f'margin-{side}: {with_unit(margin)};')
+    return '@page { %s }' % ' '.join(rules)
+
+
+class PdfRenderer:
+    """Renderizador con fuentes, CSS y archivos locales cacheados"""
+
+    def __init__(self):
+        from weasyprint.text.fonts import FontConfiguration
+        self.font_config = FontConfiguration()
+        self._lock = threading.Lock()
+        # clave -> CSS parseado
+        self._css = {}
+        # path -> (mtime_ns, size, bytes)
+        self._files = {}
+        # cache de imagenes de WeasyPrint, compartido entre documentos
+        self.image_cache = {}
+
+    def read_file(self, path):
+        st = os.stat(path)
+        with self._lock:
+            fc = self._files.get(path)
+        if fc and fc[0] == st.st_mtime_ns and fc[1] == st.st_size:
+            return fc[2]
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        with self._lock:
+            self._files[path] = (st.st_mtime_ns, st.st_size, data)
+        return data
+
+    def url_fetcher(self, url, *args, **kwargs):
+        """Los file:// se sirven desde memoria, el resto con el fetcher de WeasyPrint"""
+        from weasyprint.urls import default_url_fetcher
+        purl = urlparse(url)
+        if purl.scheme == 'file':
+            path = unquote(purl.path)
+            try:
+                return {'string': self.read_file(path), 'filename': os.path.basename(path)}
+            except OSError:
+                logger.warning(f'Recurso local no encontrado {path}')
+        return default_url_fetcher(url, *args, **kwargs)
+
+    def stylesheet(self, spec):
+        """spec: ('file', path) o ('string', css)"""
+        from weasyprint import CSS
+        kind, value = spec
+        if kind == 'file':
+            st = os.stat(value)
+            key = ('file', value, st.st_mtime_ns, st.st_size)
+        else:
+            key = ('string', hashlib.sha256(value.encode('utf-8')).hexdigest())
+        with self._lock:
+            css = self._css.get(key)
+        if css is None:
+            if kind == 'file':
+                css = CSS(string=self.read_file(value).decode('utf-8'),
+                          base_url=value, url_fetcher=self.url_fetcher, font_config=self.font_config)
+            else:
+                css = CSS(string=value, url_fetcher=self.url_fetcher, font_config=self.font_config)
+            with self._lock:
+                self._css[key] = css
+        return css
+
+    def write_pdf(self, html: str, fname=None, stylesheets=(), base_url=None):
+        """Retorna los bytes del PDF, o lo escribe en fname si se indica"""
+        from weasyprint import HTML
+        document = HTML(string=html, base_url=base_url, url_fetcher=self.url_fetcher)
+        return document.write_pdf(fname,
+                                  stylesheets=[ self.stylesheet(s) for s in stylesheets ],
+                                  font_config=self.font_config,
+                                  cache=self.image_cache)
+
+
+#Renderizador del proceso actual (worker del pool o proceso principal)
+_renderer = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_renderer() -> PdfRenderer:
+    global _renderer
+    if _renderer is None:
+        _renderer = PdfRenderer()
+    return _renderer
+
+
+def _pool_init():
+    #Calienta el worker: importa WeasyPrint y carga las fuentes
+    get_renderer()
+
+
+def _pool_render(html, fname, stylesheets, base_url):
+    get_renderer().write_pdf(html, fname, stylesheets, base_url)
+    return fname
+
+
+def get_pool(workers=None):
+    global _pool
+    workers = RPT_PDF_WORKERS if workers is None else workers
+    #Un proceso daemon (p.ej. worker de celery) no puede tener hijos
+    if workers <= 0 or multiprocessing.current_process().daemon:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            logger.info(f'Iniciando pool de render PDF con {workers} procesos')
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context(RPT_PDF_START_METHOD),
+                                        initializer=_pool_init)
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def render_pdf(html: str, fname: str, stylesheets=(), base_url=None, workers=None) -> str:
+    """
+    Renderiza html en fname.
+    stylesheets: lista de ('file', path) o ('string', css), se parsean una vez por proceso.
+    """
+    stylesheets = list(stylesheets)
+    pool = get_pool(workers)
+    if pool is None:
+        return _pool_render(html, fname, stylesheets, base_url)
+    try:
+        return pool.submit(_pool_render, html, fname, stylesheets, base_url).result(timeout=RPT_PDF_TIMEOUT)
+    except BrokenProcessPool:
+        logger.error('Pool de render PDF roto, se reinicia y se renderiza en este proceso')
+        shutdown_pool()
+        return _pool_render(html, fname, stylesheets, base_url)
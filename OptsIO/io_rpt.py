@@ -1,9 +1,6 @@
 import uuid, codecs, json, os
 import pdfkit
-from weasyprint import HTML, CSS
-from weasyprint.text.fonts import FontConfiguration
 from django.http import QueryDict, HttpRequest
-from django.template.loader import render_to_string
 from django.conf import settings
 from django.urls import reverse, resolve
 #from htmlmin.minify import html_minify
@@ -11,6 +8,16 @@ from django.urls import reverse, resolve
 from minify_html import minify as html_minify
 
 import logging
+from OptsIO.io_pdf import render_pdf, page_css
+
+#Motor para los reportes g_pdf_kit: weasyprint (pool en memoria) o wkhtmltopdf
+RPT_PDF_KIT_ENGINE = os.environ.get('RPT_PDF_KIT_ENGINE', 'weasyprint')
+RPT_PAGE_CSS = '''
+    @page {
+        size: A4 landscape;
+        margin: 0.1mm;
+    }
+'''
 
 
 class IoRpt:
@@ -58,62 +65,33 @@ class IoRpt:
     
     def html_to_pdf(self, *args: list, g_html=True, g_pdf=True, g_pdf_kit=False, g_pdf_metro=False, **kwargs: dict) -> dict:
         unique_print = int(uuid.uuid4())
-        rout: str = kwargs.get('rout')
-        rout =  rout.decode('utf-8')
+        rout = kwargs.get('rout')
+        if isinstance(rout, bytes):
+            rout = rout.decode('utf-8')
         rq = kwargs.get('rq')
-        protocol = 'https'
         cwidth = rq.GET.get('width')
-        if rq.META.get('HTTP_REFERER'):
-            protocol = rq.META.get('HTTP_REFERER').split(':')[0]
-        if settings.DEBUG:
-            dhost = 'localhost:8010'
-        else:
-            dhost = rq.META.get('HTTP_HOST')
-        host =  rq.META.get('HTTP_HOST', dhost)
 
         # Create media/rpt directory if it doesn't exist
         media_rpt_dir = os.path.join(settings.MEDIA_ROOT, 'rpt')
         os.makedirs(media_rpt_dir, exist_ok=True)
 
-        ftmpl = f'{settings.BASE_DIR}/templates/rpts/rpt_{unique_print}.html'
-        f = codecs.open(ftmpl, 'wb', encoding='utf-8')
-        f.write(rout)
-        f.close()
-        logging.info(f'Render report {ftmpl} with local file paths')
-        # Use file:// paths for both HTML and PDF generation to ensure styles are applied
-        rout = render_to_string(ftmpl).replace('/static/', f'file://{settings.STATICFILES_DIRS[0]}/').replace('/media/', f'file://{settings.MEDIA_ROOT}/')
-
-        ehtml = f'{settings.BASE_DIR}/templates/rpts/{unique_print}.html'
-        f = codecs.open(ehtml, 'wb', encoding='utf-8')
-        f.write(rout)
-        f.close()
-        #rout_style = render_to_string(ftmpl, {'inline_style': 0}).replace('/static/', f'{protocol}://{host}/static/')
-        rout_style = render_to_string(ftmpl, {'inline_style': 0}).replace('/static/', f'file://{settings.STATICFILES_DIRS[0]}')
-        ehtml_pdf = False
+        # La vista ya entrega el HTML renderizado, solo se resuelven las rutas locales
+        # para que los estilos e imagenes se lean del disco sin pasar por HTTP
+        rout = rout.replace('/static/', f'file://{settings.STATICFILES_DIRS[0]}/').replace('/media/', f'file://{settings.MEDIA_ROOT}/')
+        ehtml_style = False
         if g_html:
             logging.info('Render the html version of the report')
-            ehtml_style = f'{settings.BASE_DIR}/templates/tmp/{unique_print}_style.html'
-            f = codecs.open(ehtml_style, 'wb', encoding='utf-8')
-            f.write(html_minify(rout_style.replace('width: 100%', f'width: {cwidth}')))
-            f.close()
-            ehtml_pdf = f'{settings.BASE_DIR}/templates/tmp/{unique_print}_pdf.html'
-            rout_style = render_to_string(ftmpl, {'inline_style': 0 }).replace('/static/', f'file://{settings.STATICFILES_DIRS[0]}')
-            f = codecs.open(ehtml_pdf, 'wb', encoding='utf-8')
-            f.write(html_minify(rout_style))
-            f.close()
+            tmp_dir = f'{settings.BASE_DIR}/templates/tmp'
+            os.makedirs(tmp_dir, exist_ok=True)
+            ehtml_style = f'{tmp_dir}/{unique_print}_style.html'
+            rout_style = rout.replace('width: 100%', f'width: {cwidth}') if cwidth else rout
+            with codecs.open(ehtml_style, 'wb', encoding='utf-8') as f:
+                f.write(html_minify(rout_style))
         fname = False
         if g_pdf:
-            logging.info('Generate the pdf version with write_pdf')
-            html = HTML(filename=ehtml_pdf)
-            font_config = FontConfiguration()
-            css = CSS(string='''
-                 @page {
-                     size: A4 landscape;
-                     margin: 0.1mm;
-                 }
-             ''')
+            logging.info('Generate the pdf version with weasyprint')
             fname = os.path.join(media_rpt_dir, f'{unique_print}.pdf')
-            html.write_pdf(fname, stylesheets=[css], font_config=font_config)
+            render_pdf(rout, fname, stylesheets=[('string', RPT_PAGE_CSS)], base_url=str(settings.BASE_DIR))
         if g_pdf_kit:
             mstyles = [
                 #f'{settings.BASE_DIR}/static/css/bootstrap.min.css',
@@ -131,7 +109,7 @@ class IoRpt:
                         if os.path.exists(business_css):
                             mstyles.append(business_css)
                             logging.info(f'Added business CSS: {business_css}')
-                except (json.JSONDecodeError, TypeError):
+                except (json.JSONDecodeError, TypeError, AttributeError):
                     pass
             fname = os.path.join(media_rpt_dir, f'{unique_print}.pdf')
             options = {
@@ -155,13 +133,13 @@ class IoRpt:
                 options['margin-left'] = rq.GET.get('margin-left')
             if rq.GET.get('no-outline'):
                 options['no-outline'] = rq.GET.get('no-outline')
-            pdfkit.from_file(ehtml_pdf,
-                    fname,
-                    options = options,
-                    css=mstyles,
-                    verbose=True
-            )
-            logging.info(f'Generate the pdf version with pdfkit options {options} and css {mstyles}')
+            if RPT_PDF_KIT_ENGINE == 'wkhtmltopdf':
+                pdfkit.from_string(rout, fname, options=options, css=mstyles, verbose=True)
+            else:
+                # Los CSS (base y del negocio) quedan parseados en cada worker del pool
+                stylesheets = [ ('file', css) for css in mstyles ] + [ ('string', page_css(options)) ]
+                render_pdf(rout, fname, stylesheets=stylesheets, base_url=str(settings.BASE_DIR))
+            logging.info(f'Generate the pdf version with {RPT_PDF_KIT_ENGINE} options {options} and css {mstyles}')
         if g_pdf_metro:
             mstyles = [
                 f'{settings.BASE_DIR}/static/plugins/global/plugins.bundle.css',
@@ -169,7 +147,7 @@ class IoRpt:
 	            f'{settings.BASE_DIR}/static/base/custom.css',
             ]
             fname = os.path.join(media_rpt_dir, f'{unique_print}.pdf')
-            pdfkit.from_file(ehtml_pdf,
+            pdfkit.from_string(rout,
                     fname,
                     # options = {
                     #     'encoding': "UTF-8",
@@ -183,4 +161,3 @@ class IoRpt:
         tmpl = rq.GET.get("tmpl")
         logging.info(f'Report from template {tmpl} to pdf {fname}  and html {ehtml_style}')
         return {'exitos': 'Hecho', 'pdf_file': fname, 'html_file': ehtml_style}
-    
@@ -14,6 +14,9 @@ import json
 import logging
 from decimal import getcontext, ROUND_HALF_UP
 from django.core.cache import caches
+from collections import OrderedDict
+import hashlib
+import threading
 redisc = caches['default']
 getcontext().prec = 10
 getcontext().rounding = ROUND_HALF_UP
@@ -85,52 +88,50 @@ class IoS(object):
     def __init__(self):
         self.stsconstruc = FConstruc()
 
-    def seModel(self, 
-                userobj: str | None = 'ND', 
-                rq = None, 
-                files = None, 
-                qdict: QueryDict | dict = {}) -> dict:
+    #Cache de planes de seModel compartido entre instancias, clave = forma del request sin valores
+    PLAN_KEYS = ("model_app_name", "model_name", "dbcon", "fields", "allfields", "fakes",
+                 "detail_objs", "methods", "exprs", "qexc", "distinct", "values", "pdopts", "pq_sort")
+    PLAN_CACHE_SIZE = 512
+    plan_cache = OrderedDict()
+    plan_stats = {'hits': 0, 'misses': 0}
+    plan_lock = threading.Lock()
+
+    @classmethod
+    def plan_cache_info(cls) -> dict:
+        with cls.plan_lock:
+            return dict(cls.plan_stats, size=len(cls.plan_cache), maxsize=cls.PLAN_CACHE_SIZE)
+
+    @classmethod
+    def plan_cache_clear(cls):
+        with cls.plan_lock:
+            cls.plan_cache.clear()
+            cls.plan_stats.update({'hits': 0, 'misses': 0})
+
+    def sePlan(self, qdict: QueryDict | dict) -> dict:
+        """
+            Resuelve una sola vez por definicion de grilla el modelo, los campos,
+            las anotaciones y el orden; los filtros se arman por request con los
+            valores usando filter_keys como memo de las claves ya evaluadas
+        """
+        raw = '\x1f'.join(str(qdict.get(k, '')) for k in self.PLAN_KEYS)
+        pkey = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        with self.plan_lock:
+            plan = self.plan_cache.get(pkey)
+            if plan:
+                self.plan_cache.move_to_end(pkey)
+                self.plan_stats['hits'] += 1
+                return plan
+            self.plan_stats['misses'] += 1
         model_app_name: str = qdict.get("model_app_name", '')
         model_name: str = qdict.get("model_name", '')
-        dbcon: str = qdict.get("dbcon", "default")
         appobj = apps.get_app_config(model_app_name)
         model_class = appobj.get_model(model_name)
-        mquery = json.loads(qdict.get("mquery", "[]"))
-        specific_search = json.loads(qdict.get("specific_search", "{}"))
-        specific_populate = json.loads(qdict.get("specific_populate", "{}"))
         fake_values = json.loads(qdict.get("fakes", "[]"))
         only = json.loads(qdict.get("fields", "[]"))
         allfields = qdict.get("allfields", 0)
-        detail_objs = json.loads(qdict.get("detail_objs", "[]"))
-
-
         methods = json.loads(qdict.get("methods", "[]"))
-        r_form_k = qdict.get("r_form_k")
         exprs = json.loads(qdict.get("exprs", "[]"))
-        qexc = json.loads(qdict.get("qexc", "{}"))
-        distinct = json.loads(qdict.get("distinct", "[]"))
-        values = json.loads(qdict.get("values", "[]"))
-        pdopts = json.loads(qdict.get("pdopts", "{}"))
-        # Grids
-        pq_curpage = qdict.get("pq_curpage")
-        pq_rpp = qdict.get("pq_rpp")
         pq_sort = json.loads(qdict.get("pq_sort", "[]"))
-        pq_filter = json.loads(qdict.get("pq_filter", "{}"))
-        startRow = int(qdict.get("startRow", 0))
-        endRow = int(qdict.get("endRow", 100))
-        check_cache = qdict.get('check_cache')
-        if check_cache:
-            caobj = redisc.get(check_cache)
-            if caobj: return caobj
-        if pq_rpp:
-            pq_curpage = int(pq_curpage)
-            if pq_curpage == 0:
-                pq_curpage = 1
-            endRow = pq_curpage * int(pq_rpp)
-            startRow = 0
-            if endRow > int(pq_rpp):
-                startRow = endRow - int(pq_rpp)
-            logging.info("Start = {} End = {}".format(startRow, endRow))
         sfields = self.structFields(only)
         if allfields:
             only = []
@@ -144,50 +145,145 @@ class IoS(object):
             sfields.extend(annotates.keys())
         fields = list(filter(lambda x: x.find("__") < 0, only))
         fields = list(filter(lambda x: x not in fake_values, fields))
-        only = fields
-        trows = 0
-        rdf = {}
-        qd = QueryDict(mutable=True)
-        for q in mquery:
-            qd.update({q.get("field"): q.get("value")})
-        if pq_filter:
-            logging.info("Build filter base on {}".format(pq_filter))
-            qd = self.stsconstruc.pqueryfilter(qd, pq_filter)
         pq_sort_method = []
+        qd = QueryDict(mutable=True)
         if pq_sort:
-            
             qd, pq_sort_method_construct = self.stsconstruc.pquerysort(qd, pq_sort, model_class=model_class)
             pq_sort_method = list(filter(lambda x: x.get("method"), pq_sort))
             if pq_sort_method_construct:
                 pq_sort_method.extend(pq_sort_method_construct)
-            logging.info("Build Sort base on {} result in qd {} pq_sort_method_construc {} extending {}".format(
-                                                        pq_sort,
-                                                        qd, pq_sort_method,
-                                                        pq_sort_method
-                    ))
-        qp = list(qd.lists())
-        order_field = qd.getlist("order_field", [])
-        qf = self.stsconstruc.querydict_params(qp, [])
-        qf_or = self.stsconstruc.querydict_args(qp)
+        plan = {
+            'model_class': model_class,
+            'dbcon': qdict.get("dbcon", "default"),
+            'only': tuple(fields),
+            'fields': tuple(fields),
+            'sfields': tuple(sfields),
+            'annotates': annotates,
+            'detail_objs': tuple(json.loads(qdict.get("detail_objs", "[]"))),
+            'qexc': json.loads(qdict.get("qexc", "{}")),
+            'distinct': tuple(json.loads(qdict.get("distinct", "[]"))),
+            'values': tuple(json.loads(qdict.get("values", "[]"))),
+            'pdopts': json.loads(qdict.get("pdopts", "{}")),
+            'pq_sort': tuple(pq_sort),
+            'pq_sort_method': pq_sort_method,
+            'order_field': tuple(qd.getlist("order_field", [])),
+            'filter_keys': {},
+        }
+        qplan = self.stsconstruc.queryset_plan(model_class, fields, sfields, fields, plan['detail_objs'])
+        #El plan se comparte entre requests, las listas quedan como tuplas
+        for k in ('only', 'select_related', 'values'):
+            if qplan[k] is not None:
+                qplan[k] = tuple(qplan[k])
+        plan['qplan'] = qplan
         logging.info(
             f"""
-            Set query
-                dbcon = {dbcon}
-                only = {only}
+            Set plan {pkey} for {model_app_name}.{model_name}
+                dbcon = {plan['dbcon']}
                 fields = {fields}
                 sfields = {sfields}
-                qf_or = {qf_or}
-                qf = {qf}
-                values = {values}
-                qexc = {qexc}
-                order_field = {order_field}
+                values = {plan['values']}
+                qexc = {plan['qexc']}
+                order_field = {plan['order_field']}
                 annotates = {annotates}
-                distinct = {distinct}
-                pdopts = {pdopts}
-                pq_filter = {pq_filter}
+                distinct = {plan['distinct']}
+                pdopts = {plan['pdopts']}
                 pq_sort = {pq_sort}
         """
         )
+        with self.plan_lock:
+            self.plan_cache[pkey] = plan
+            while len(self.plan_cache) > self.PLAN_CACHE_SIZE:
+                self.plan_cache.popitem(last=False)
+        return plan
+
+    def seFilters(self, qdict: QueryDict | dict, plan: dict):
+        """Arma qf/qf_or con los valores de mquery y pq_filter del request"""
+        mquery = json.loads(qdict.get("mquery", "[]"))
+        pq_filter = json.loads(qdict.get("pq_filter", "{}"))
+        qd = QueryDict(mutable=True)
+        for q in mquery:
+            qd.update({q.get("field"): q.get("value")})
+        if pq_filter:
+            logging.debug("Build filter base on {}".format(pq_filter))
+            qd = self.stsconstruc.pqueryfilter(qd, pq_filter)
+        qp = list(qd.lists())
+        qf = self.stsconstruc.querydict_params(qp, [], key_cache=plan['filter_keys'])
+        qf_or = self.stsconstruc.querydict_args(qp)
+        logging.debug("Set query qf_or = %s qf = %s", qf_or, qf)
+        return qf, qf_or
+
+    def seQuerySet(self, plan: dict, qf: dict, qf_or):
+        model_class = plan['model_class']
+        if plan['annotates']:
+            return (
+                model_class.objects.using(plan['dbcon'])
+                .only(*plan['only'])
+                .filter(*(qf_or,), **qf)
+                .values(*plan['values'])
+                .exclude(**plan['qexc'])
+                .order_by(*plan['order_field'])
+                .annotate(**plan['annotates'])
+            )
+        return (
+            model_class.objects.using(plan['dbcon'])
+            .only(*plan['qplan']['only'])
+            .filter(*(qf_or,), **qf)
+            .exclude(**plan['qexc'])
+            .order_by(*plan['order_field'])
+            .distinct(*plan['distinct'])
+        )
+
+    def seModel(self, 
+                userobj: str | None = 'ND', 
+                rq = None, 
+                files = None, 
+                qdict: QueryDict | dict = {}) -> dict:
+        check_cache = qdict.get('check_cache')
+        if check_cache:
+            caobj = redisc.get(check_cache)
+            if caobj: return caobj
+        plan = self.sePlan(qdict)
+        model_class = plan['model_class']
+        dbcon: str = plan['dbcon']
+        only = plan['only']
+        fields = plan['fields']
+        sfields = plan['sfields']
+        annotates = plan['annotates']
+        #Lo que no es inmutable en el plan cacheado se copia por request
+        detail_objs = copy.deepcopy(plan['detail_objs'])
+        qexc = copy.deepcopy(plan['qexc'])
+        distinct = plan['distinct']
+        values = plan['values']
+        order_field = plan['order_field']
+        qplan = plan['qplan']
+        pdopts = copy.deepcopy(plan['pdopts'])
+        pq_sort_method = copy.deepcopy(plan['pq_sort_method'])
+        specific_search = json.loads(qdict.get("specific_search", "{}"))
+        specific_populate = json.loads(qdict.get("specific_populate", "{}"))
+        r_form_k = qdict.get("r_form_k")
+        # Grids
+        pq_curpage = qdict.get("pq_curpage")
+        pq_rpp = qdict.get("pq_rpp")
+        startRow = int(qdict.get("startRow", 0))
+        endRow = int(qdict.get("endRow", 100))
+        # Paginacion por cursor (opt-in): cursor = ultima/primera fila vista, cursor_dir = next | prev
+        keyset = str(qdict.get("keyset", "")).lower() in ("1", "true", "on") and not distinct
+        cursor_dir = qdict.get("cursor_dir", "next")
+        count_mode = qdict.get("count_mode", "estimate" if keyset else "exact")
+        cursor = {}
+        if pq_rpp:
+            pq_curpage = int(pq_curpage)
+            if pq_curpage == 0:
+                pq_curpage = 1
+            endRow = pq_curpage * int(pq_rpp)
+            startRow = 0
+            if endRow > int(pq_rpp):
+                startRow = endRow - int(pq_rpp)
+            logging.debug("Start = {} End = {}".format(startRow, endRow))
+        trows = 0
+        rdf = {}
+        rows_from_values = False
+        qf, qf_or = self.seFilters(qdict, plan)
         if specific_search:
             module = specific_search.get('module')
             package = specific_search.get('package')
@@ -211,28 +307,25 @@ class IoS(object):
             dobj = getattr(cls, mname)
             qs = dobj(rq=rq, qf_or=qf_or, qf=qf)
         elif annotates:
-            qs = (
-                model_class.objects.using(dbcon)
-                .only(*only)
-                .filter(*(qf_or,), **qf)
-                .values(*values)
-                .exclude(**qexc)
-                .order_by(*order_field)
-                .annotate(**annotates)
-            )
+            qs = self.seQuerySet(plan, qf, qf_or)
             trows = qs.count()
         else:
-            qs = (
-                model_class.objects.using(dbcon)
-                .only(*only)
-                .filter(*(qf_or,), **qf)
-                .exclude(**qexc)
-                .order_by(*order_field)
-                .distinct(*distinct)
-            )
-            trows = qs.count()
+            qs = self.seQuerySet(plan, qf, qf_or)
+            trows = self.stsconstruc.count_qs(qs, count_mode)
+            if keyset:
+                qs, startRow, endRow = self.keyset_page(qs, qdict, order_field, startRow, endRow)
+            rows_from_values = qplan['values'] is not None
+            if not rows_from_values:
+                qs = self.stsconstruc.optimize_qs(qs, qplan)
         qs = qs[startRow:endRow]
-        qs = list(map(lambda x: self.stsconstruc.sfields(x, sfields, fields, detail_objs=detail_objs), qs))
+        if rows_from_values:
+            qs = self.stsconstruc.values_rows(qs, qplan['values'], sfields)
+        else:
+            qs = list(map(lambda x: self.stsconstruc.sfields(x, sfields, fields, detail_objs=detail_objs), qs))
+        if keyset:
+            if cursor_dir == 'prev':
+                qs.reverse()
+            cursor = self.keyset_cursors(model_class, dbcon, order_field, qs)
         if pq_sort_method:
             if not pdopts: pdopts = {}
             pdopts['sort_values'] = []
@@ -253,10 +346,40 @@ class IoS(object):
         if r_form_k:
             qs = self.convert_list_to_dict(qs, r_form_k)
         rsp = {"qs": qs, "rdf": rdf, "trows": trows, "page": pq_curpage}
+        if keyset:
+            rsp.update(cursor)
+            rsp['trows_mode'] = count_mode
         if check_cache:
             redisc.set(check_cache, rsp, 84600)
         return rsp
     
+    def keyset_page(self, qs, qdict, order_field: list, startRow: int, endRow: int):
+        """
+            Ordena por los campos de la grilla + pk y filtra desde el cursor en lugar
+            de usar OFFSET; cursor_dir=prev sin cursor devuelve la ultima pagina
+        """
+        keys = self.stsconstruc.keyset_keys(order_field)
+        reverse = qdict.get("cursor_dir", "next") == 'prev'
+        cursor = self.stsconstruc.decode_cursor(qdict.get("cursor"))
+        qs = qs.order_by(*self.stsconstruc.keyset_order(keys, reverse))
+        if cursor:
+            qs = qs.filter(self.stsconstruc.keyset_q(keys, cursor, reverse))
+        return qs, 0, endRow - startRow
+
+    def keyset_cursors(self, model_class, dbcon: str, order_field: list, rows: list) -> dict:
+        if not rows:
+            return {'next_cursor': None, 'prev_cursor': None}
+        keys = self.stsconstruc.keyset_keys(order_field)
+        fkeys = [ k.lstrip('-') for k in keys ]
+        first, last = rows[0].get('pk'), rows[-1].get('pk')
+        kvalues = { r[0]: list(r[1:]) for r in model_class.objects.using(dbcon)
+                                                 .filter(pk__in=[first, last])
+                                                 .values_list('pk', *fkeys) }
+        return {
+            'next_cursor': self.stsconstruc.encode_cursor(kvalues.get(last)),
+            'prev_cursor': self.stsconstruc.encode_cursor(kvalues.get(first)),
+        }
+
     def seModelForm(self, *args, **kwargs: dict):
         q: dict = kwargs.get('qdict', {}).copy()
         fields = set(json.loads(q.get('fields')))
@@ -0,0 +1,24 @@
+import importlib
+import json
+import time
+from OptsIO import io_serial, io_construct
+#This is to be used in ipython shell
+importlib.reload(io_construct)
+importlib.reload(io_serial)
+N = 500
+ios = io_serial.IoS()
+ios.plan_cache_clear()
+qdict = {
+    'model_app_name': 'Sifen',
+    'model_name': 'DocumentHeader',
+    'fields': json.dumps(['id', 'doc_tipo', 'doc_numero', 'doc_fecha', 'pdv_ruc', 'ek_estado']),
+    'pq_sort': json.dumps([{'dataIndx': 'doc_fecha', 'dir': 'down'}]),
+    'pq_rpp': 50,
+}
+t0 = time.perf_counter()
+for i in range(N):
+    qdict['pq_curpage'] = i % 10 + 1
+    qdict['pq_filter'] = json.dumps({'data': [{'dataIndx': 'doc_tipo', 'condition': 'equal', 'value': 'FE'}]})
+    ios.seModel(qdict=qdict)
+elapsed = time.perf_counter() - t0
+print(f'{N} llamadas en {elapsed:.2f}s ({elapsed/N*1000:.2f} ms/llamada) {ios.plan_cache_info()}')
@@ -1,3 +1,208 @@
+import json
+from django.db.models import F
 from django.test import TestCase
+from OptsIO.io_serial import IoS
+from OptsIO.io_export import IoX
+from OptsIO.io_pdf import PdfRenderer, page_css
+from OptsIO.models import Apps, AppsBookMakrs, TrackBtask
 
-# Create your tests here.
+
+class SeModelQueryCountTest(TestCase):
+    """La serializacion de una pagina de la grilla no debe depender de la cantidad de filas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(30):
+            app = Apps.objects.create(menu='M', app_name=f'app{i}', friendly_name=f'App {i}',
+                                      icon='i', url='/', version='1', background='b')
+            for u in range(3):
+                AppsBookMakrs.objects.create(app=app, username=f'user{u}')
+
+    def se_model(self, model_name, rpp, **params):
+        qdict = {'model_app_name': 'OptsIO', 'model_name': model_name,
+                 'pq_rpp': rpp, 'pq_curpage': 1}
+        qdict.update({k: json.dumps(v) for k, v in params.items()})
+        return IoS().seModel(qdict=qdict)
+
+    def test_fk_columns(self):
+        params = {'fields': ['username', 'app__friendly_name', 'app__get_deferred_fields']}
+        for rpp in (5, 60):
+            with self.assertNumQueries(2):
+                rsp = self.se_model('AppsBookMakrs', rpp, **params)
+        self.assertEqual(len(rsp['qs']), 60)
+        self.assertTrue(rsp['qs'][0]['app__friendly_name'].startswith('App '))
+
+    def test_values_rows(self):
+        with self.assertNumQueries(2):
+            rsp = self.se_model('AppsBookMakrs', 60, fields=['username', 'app__friendly_name'])
+        row = rsp['qs'][0]
+        self.assertEqual(set(row), {'username', 'app__friendly_name', 'pk', 'id', 'DT_RowId'})
+        self.assertEqual(row['DT_RowId'], f"appsbookmakrs{row['pk']}")
+
+    def test_detail_objs(self):
+        detail_objs = [{'dset': 'appsbookmakrs_set', 'fields': ['username'],
+                        'sfields': ['app__app_name'], 'order_by': ['username']}]
+        for rpp in (5, 30):
+            with self.assertNumQueries(3):
+                rsp = self.se_model('Apps', rpp, fields=['app_name'], detail_objs=detail_objs)
+        self.assertEqual(len(rsp['qs']), 30)
+        self.assertEqual([d['username'] for d in rsp['qs'][0]['appsbookmakrs_set']], ['user0', 'user1', 'user2'])
+
+
+class SeModelKeysetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        app = Apps.objects.create(menu='M', app_name='app', friendly_name='App',
+                                  icon='i', url='/', version='1', background='b')
+        AppsBookMakrs.objects.bulk_create([
+            AppsBookMakrs(app=app, username=f'user{i % 7}', prioridad=i % 3) for i in range(45)
+        ])
+
+    def se_model(self, **extra):
+        qdict = {'model_app_name': 'OptsIO', 'model_name': 'AppsBookMakrs', 'keyset': '1',
+                 'fields': json.dumps(['username', 'prioridad']),
+                 'pq_sort': json.dumps([{'dataIndx': 'prioridad', 'dir': 'down'}]),
+                 'pq_rpp': 10, 'pq_curpage': 1}
+        qdict.update(extra)
+        return IoS().seModel(qdict=qdict)
+
+    def test_walk_pages(self):
+        expected = list(AppsBookMakrs.objects.order_by('-prioridad', 'pk').values_list('pk', flat=True))
+        seen, cursor = [], None
+        while True:
+            rsp = self.se_model(cursor=cursor) if cursor else self.se_model()
+            if not rsp['qs']: break
+            seen.extend(r['pk'] for r in rsp['qs'])
+            cursor = rsp['next_cursor']
+        self.assertEqual(seen, expected)
+        self.assertEqual(rsp['trows'], 45)
+
+    def test_last_page_and_back(self):
+        expected = list(AppsBookMakrs.objects.order_by('-prioridad', 'pk').values_list('pk', flat=True))
+        rsp = self.se_model(cursor_dir='prev')
+        self.assertEqual([r['pk'] for r in rsp['qs']], expected[-10:])
+        rsp = self.se_model(cursor_dir='prev', cursor=rsp['prev_cursor'])
+        self.assertEqual([r['pk'] for r in rsp['qs']], expected[-20:-10])
+
+
+class SePlanCacheTest(TestCase):
+    """El plan se arma una vez por forma de grilla y no cambia entre requests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        app = Apps.objects.create(menu='M', app_name='app', friendly_name='App',
+                                  icon='i', url='/', version='1', background='b')
+        AppsBookMakrs.objects.bulk_create([ AppsBookMakrs(app=app, username=f'user{i}') for i in range(5) ])
+
+    def setUp(self):
+        IoS.plan_cache_clear()
+        self.addCleanup(IoS.plan_cache_clear)
+
+    def qdict(self, fields, **extra):
+        qdict = {'model_app_name': 'OptsIO', 'model_name': 'Apps', 'pq_rpp': 10, 'pq_curpage': 1,
+                 'fields': json.dumps(fields),
+                 'pq_sort': json.dumps([{'dataIndx': 'app_name', 'dir': 'down'}]),
+                 'detail_objs': json.dumps([{'dset': 'appsbookmakrs_set', 'fields': ['username']}])}
+        qdict.update(extra)
+        return qdict
+
+    def test_hits_and_misses(self):
+        ios = IoS()
+        ios.seModel(qdict=self.qdict(['app_name']))
+        #Otra pagina y otro filtro usan el mismo plan
+        pq_filter = json.dumps({'data': [{'dataIndx': 'app_name', 'condition': 'equal', 'value': 'app'}]})
+        rsp = ios.seModel(qdict=self.qdict(['app_name'], pq_curpage=2, pq_filter=pq_filter))
+        self.assertEqual(rsp['trows'], 1)
+        ios.seModel(qdict=self.qdict(['app_name', 'friendly_name']))
+        info = IoS.plan_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 2, 2))
+
+    def test_plan_not_mutated(self):
+        ios = IoS()
+        qdict = self.qdict(['app_name'])
+        rsp = ios.seModel(qdict=qdict)
+        plan = ios.sePlan(qdict)
+        for k in ('only', 'fields', 'sfields', 'detail_objs', 'distinct', 'values', 'order_field'):
+            self.assertIsInstance(plan[k], tuple)
+        with self.assertRaises(AttributeError):
+            plan['sfields'].append('friendly_name')
+        snapshot = {k: plan[k] for k in ('fields', 'sfields', 'detail_objs', 'qexc', 'order_field', 'pdopts', 'pq_sort_method')}
+        snapshot = json.loads(json.dumps(snapshot))
+        self.assertEqual(ios.seModel(qdict=qdict)['qs'], rsp['qs'])
+        self.assertEqual(json.loads(json.dumps({k: plan[k] for k in snapshot})), snapshot)
+
+
+class SeModelKeysetNullsTest(TestCase):
+    """El cursor recorre las filas con NULL en el campo de orden"""
+
+    @classmethod
+    def setUpTestData(cls):
+        TrackBtask.objects.bulk_create([
+            TrackBtask(task_id=str(i), state=None if i % 3 == 0 else f'S{i % 4}') for i in range(25)
+        ])
+
+    def se_model(self, direc, **extra):
+        qdict = {'model_app_name': 'OptsIO', 'model_name': 'TrackBtask', 'keyset': '1',
+                 'fields': json.dumps(['task_id', 'state']),
+                 'pq_sort': json.dumps([{'dataIndx': 'state', 'dir': direc}]),
+                 'pq_rpp': 4, 'pq_curpage': 1}
+        qdict.update(extra)
+        return IoS().seModel(qdict=qdict)
+
+    def walk(self, direc, cursor_dir='next'):
+        seen, cursor = [], None
+        while True:
+            extra = {'cursor_dir': cursor_dir}
+            if cursor: extra['cursor'] = cursor
+            rsp = self.se_model(direc, **extra)
+            if not rsp['qs']: break
+            page = [ r['pk'] for r in rsp['qs'] ]
+            seen = seen + page if cursor_dir == 'next' else page + seen
+            cursor = rsp['next_cursor'] if cursor_dir == 'next' else rsp['prev_cursor']
+        return seen
+
+    def test_walk_across_nulls(self):
+        qs = TrackBtask.objects.all()
+        for direc, order in (('up', F('state').asc(nulls_last=True)), ('down', F('state').desc(nulls_first=True))):
+            expected = list(qs.order_by(order, 'pk').values_list('pk', flat=True))
+            self.assertEqual(self.walk(direc), expected)
+            self.assertEqual(self.walk(direc, cursor_dir='prev'), expected)
+
+
+class SeExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        app = Apps.objects.create(menu='M', app_name='app', friendly_name='App',
+                                  icon='i', url='/', version='1', background='b')
+        AppsBookMakrs.objects.bulk_create([ AppsBookMakrs(app=app, username=f'user{i}') for i in range(25) ])
+
+    def test_stream_csv(self):
+        rsp = IoX().seExport(qdict={'model_app_name': 'OptsIO', 'model_name': 'AppsBookMakrs',
+                                    'fields': json.dumps(['username', 'app__friendly_name']),
+                                    'export_columns': json.dumps(['pk', 'username', 'app__friendly_name']),
+                                    'chunk_size': 10})
+        lines = b''.join(rsp.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'pk,username,app__friendly_name')
+        self.assertEqual(len(lines), 26)
+        self.assertTrue(lines[1].endswith(',App'))
+
+
+class IoPdfTest(TestCase):
+    """Render en memoria: opciones de pagina y hojas de estilo parseadas una sola vez"""
+
+    def test_page_css(self):
+        css = page_css({'page-size': 'A5', 'orientation': 'Portrait', 'page-width': '210.000088',
+                        'page-height': '250.000212', 'margin-top': '0', 'margin-left': '2cm'})
+        self.assertIn('size: 210.000088mm 250.000212mm;', css)
+        self.assertIn('margin-top: 0mm;', css)
+        self.assertIn('margin-left: 2cm;', css)
+        self.assertNotIn('margin-right', css)
+        self.assertIn('size: B5 landscape;', page_css({'page-size': 'B5', 'orientation': 'Landscape'}))
+
+    def test_render_reuses_stylesheets(self):
+        renderer = PdfRenderer()
+        sheets = [('string', page_css({'page-size': 'A5'})), ('string', 'p { color: #333; }')]
+        for i in range(3):
+            pdf = renderer.write_pdf(f'<html><body><p>Reporte {i}</p></body></html>', stylesheets=sheets)
+            self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(len(renderer._css), 2)
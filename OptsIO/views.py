@@ -19,6 +19,7 @@ from random import randint
 from django.apps import apps
 from django.conf import settings
 from django.http import JsonResponse
+from django.http.response import HttpResponseBase
 from django.middleware.csrf import get_token
 
 
@@ -117,12 +118,16 @@ def iom(request):
             )
         )
     else:
-        tj = to_json(ioe.execute_module(request,
+        rsp = ioe.execute_module(request,
                                 g.get('module'),
                                 g.get('package'),
                                 g.get('attr'),
                                 mname=g.get('mname'),
-                            ))
+                            )
+        #Las exportaciones (IoX.seExport) devuelven su propia respuesta en streaming
+        if isinstance(rsp, HttpResponseBase):
+            return rsp
+        tj = to_json(rsp)
     return HttpResponse(tj, content_type='application/javascript')
 
 @csrf_exempt
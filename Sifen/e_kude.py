@@ -3,19 +3,45 @@ from decouple import Config, RepositoryEnv
 from openpyxl import load_workbook
 from celery.execute import send_task
 import os, arrow
+import io
+import time
 import logging
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from datetime import datetime, timedelta
 from django.conf import settings
+from django.db import connections
+from django.db.models import Prefetch
 from OptsIO.io_serial import moneyfmt, format_codigo_barra, mes_palabra, url_viewfull
 from Sifen.models import Business, DocumentHeader, DocumentDetail, Etimbrado
 import pandas as pd
 from fpdf import FPDF
+from PyPDF2 import PdfWriter
 import re
 
+#Renderizador de cada proceso del pool, se arma una sola vez por worker
+_kude_worker = None
+
+
+def _kude_pool_init(ruc, bobj):
+    global _kude_worker
+    #Los workers no pueden compartir las conexiones heredadas del proceso padre
+    connections.close_all()
+    _kude_worker = EKude(ruc, bobj=bobj)
+
+
+def _kude_pool_render(headerobj, **kwargs):
+    try:
+        return _kude_worker.render_doc(headerobj, **kwargs)
+    except Exception as e:
+        logging.exception(f'Error generando KuDE {headerobj.prof_number}')
+        return {'error': str(e), 'prof_number': str(headerobj.prof_number)}
+
+
 class EKude:
-    def __init__(self, ruc: str):
-        self.bobj = Business.objects.get(ruc=ruc)
+    def __init__(self, ruc: str, bobj: Business = None):
+        self.bobj = bobj or Business.objects.select_related('actividadecoobj', 'ciudadobj').get(ruc=ruc)
         self.BASE_APP  = f'{settings.BASE_DIR}/Sifen'
         self.header_image = f'{self.BASE_APP}/assets/logo.png'
         self.header_image_x = 1.5
@@ -25,6 +51,14 @@ class EKude:
         self.mnpps = {'places':0, 'sep':'.'}
         self.paper = 'legal'
         self.coords = [0.7, 11.3, 22.1]
+        self._header_image_data = None
+
+    def get_header_image(self):
+        #El logo se lee del disco una sola vez por instancia (por worker en eprint_batch)
+        if self._header_image_data is None:
+            with open(self.header_image, 'rb') as fh:
+                self._header_image_data = fh.read()
+        return io.BytesIO(self._header_image_data)
 
     def set_full_page(self):
         self.coords = [1.8]
@@ -343,7 +377,7 @@ class EKude:
             epdf.line(0.9, coorde+3.8, 20.6, coorde+3.8) # titulos de la table, arti, cantidad, precio, exenta, etc
             if digital:
                 #LEFT
-                epdf.image(self.header_image, 
+                epdf.image(self.get_header_image(), 
                             x=self.header_image_x, 
                             y=coorde+self.header_image_y, 
                             w=self.header_image_w, 
@@ -465,9 +499,12 @@ class EKude:
         attr_exenta = 'exenta'
         attr_gravada_5 = 'gravada_5'
         attr_gravada_10 = 'gravada_10'
+        details = headerobj.__dict__.get('kude_details')
+        if details is None:
+            details = DocumentDetail.objects.filter(documentheaderobj=headerobj,anulado=False).exclude(prod_cod=90000).order_by('pk')
         for idx, coorde in enumerate(self.coords):
             start_point = 4
-            for pidx, p in enumerate(DocumentDetail.objects.filter(documentheaderobj=headerobj,anulado=False).exclude(prod_cod=90000).order_by('pk')):
+            for pidx, p in enumerate(details):
                 articulo_descripcion = p.prod_descripcion
                 if isinstance(articulo_descripcion, str):
                     articulo_descripcion = articulo_descripcion.encode('utf-8').decode('latin-1', errors='replace')
@@ -678,73 +715,99 @@ class EKude:
     def eprint_docs(self, *args, **kwargs):
         userobj = args[0]
         qdict = kwargs.get('query_dict')
-        impresora = qdict.get('impresora')
         digital = qdict.get('digital')
-        layout = qdict.get('layout')
-        ncopies = qdict.get('ncopies', 1)
         set_name = qdict.get('set_name')
+        merge = qdict.get('merge')
+        workers = qdict.get('workers')
         peds = qdict.getlist('prof_number')
-        rsp = []
-        for p in peds:
-            rsp.append(self.eprint_doc(userobj, query_dict={'prof_number': p, 
-                                                            'layout': layout, 
-                                                            'impresora': impresora, 
-                                                            'digital':digital, 
-                                                            'set_name': set_name, 
-                                                            'ncopies': ncopies}))
+        rsp = self.eprint_batch(peds,
+                                digital=digital,
+                                set_name=set_name,
+                                merge=merge,
+                                workers=int(workers) if workers else None)
         #bbs = set(map(lambda x: x.get('bloquepk'), rsp))
         # for bb in bbs:
         #     send_task('sales_man.tasks.notification_invoice', args=(bb, ),
         #             kwargs={})
-        return {'exitos': 'Hecho', 'prints': rsp}
+        return {'exitos': 'Hecho', 'prints': rsp.get('prints'), 'merged_file': rsp.get('merged_file')}
 
-    def eprint_doc(self, *args, **kwargs):
+    def load_batch(self, prof_numbers):
+        """
+            Cabeceras con totales y detalles de todo el lote en tres consultas,
+            en el orden de prof_numbers
+        """
+        details = DocumentDetail.objects.filter(anulado=False).exclude(prod_cod=90000).order_by('pk')
+        headers = DocumentHeader.objects.filter(prof_number__in=prof_numbers)\
+                                        .with_totals()\
+                                        .prefetch_related(Prefetch('documentdetail_set',
+                                                                   queryset=details,
+                                                                   to_attr='kude_details'))
+        hmap = { str(h.prof_number): h for h in headers }
+        return [ hmap[str(p)] for p in prof_numbers if str(p) in hmap ]
+
+    def eprint_batch(self, prof_numbers, digital=1, set_name=None, merge=False, workers=None, chunk_size=20):
+        """
+            Genera los KuDE de un lote de documentos en un pool de procesos,
+            actualiza ek_pdf_file en bloque y opcionalmente une todo en un solo PDF
+        """
+        tstart = time.perf_counter()
+        headers = self.load_batch(prof_numbers)
+        found = { str(h.prof_number) for h in headers }
+        prints = [ {'error': 'Documento no encontrado', 'prof_number': str(p)}
+                   for p in prof_numbers if str(p) not in found ]
+        pending = []
+        for headerobj in headers:
+            if not headerobj.doc_numero:
+                prints.append({'error': 'El documento carece de numero', 'prof_number': str(headerobj.prof_number)})
+                continue
+            pending.append(headerobj)
+        workers = workers or os.cpu_count() or 1
+        render = partial(_kude_pool_render, digital=digital, set_name=set_name)
+        if workers <= 1 or len(pending) <= chunk_size:
+            rendered = [ self.render_doc(h, digital=digital, set_name=set_name) for h in pending ]
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_kude_pool_init,
+                                     initargs=(self.bobj.ruc, self.bobj)) as pool:
+                rendered = list(pool.map(render, pending, chunksize=chunk_size))
+        done = []
+        for headerobj, rsp in zip(pending, rendered):
+            if rsp.get('pdf_file'):
+                headerobj.ek_pdf_file = rsp.get('pdf_file')
+                done.append(headerobj)
+        DocumentHeader.objects.bulk_update(done, ['ek_pdf_file'], batch_size=500)
+        prints.extend(rendered)
+        merged_file = None
+        if merge and done:
+            merged_file = self.merge_pdfs([ h.ek_pdf_file.name for h in done ])
+        elapsed = time.perf_counter() - tstart
+        logging.info(f'KuDE generados {len(done)} de {len(prof_numbers)} en {elapsed:.2f}s')
+        return {'exitos': 'Hecho',
+                'prints': prints,
+                'merged_file': merged_file,
+                'elapsed': elapsed}
+
+    def merge_pdfs(self, pdf_files):
+        #Un solo PDF con todos los KuDE del lote para imprimir
         now = datetime.now()
-        tnow = now.strftime('%Y%m%d')
-        userobj = args[0]
-        
-        qdict = kwargs.get('query_dict')
-        prof_number = qdict.get('prof_number')
-        impresora = qdict.get('impresora')
-        digital = qdict.get('digital')
-        set_name = qdict.get('set_name')
-        layout = qdict.get('layout')
-        ncopies = qdict.get('ncopies', 1)
-        # if copies:
-        #     self.set_copies(int(copies))
-        headerobj = DocumentHeader.objects.get(prof_number=prof_number)
-        
-        #Header data
-        doc_numero = headerobj.doc_numero
-        if not doc_numero: return {'error': 'El documento carece de numero'}
-        doc_condicion_pago = headerobj.doc_cre_tipo
-        doc_cre_plazo = headerobj.doc_cre_plazo
-        doc_moneda = 'PYG'
-        if headerobj.doc_moneda != 'GS':
-            moneda = headerobj.doc_moneda
-        doc_relacion = 0
-        if headerobj.doc_loop_link:
-            relacion = headerobj.doc_loop_link
-        pdv_ruc = headerobj.pdv_ruc
-        pdv_razon = headerobj.pdv_nombrefactura
-        pdv_direccion = headerobj.pdv_direccion_entrega
-        pdv_telefono = headerobj.pdv_telefono
-        pdv_email = headerobj.pdv_email
-        tipo_transaccion = headerobj.doc_tipo_ope_desc
-        # obs = u"{} PED {}".format(headerobj.observacion, headerobj.prof_number).strip()
-        impreso_sucursal = headerobj.doc_establecimiento
-        impreso_caja = headerobj.doc_expedicion
-        timbrado = headerobj.ek_timbrado
-        timbrado_vigencia = headerobj.ek_timbrado_vigencia.strftime('%d/%m/%Y')
-        timbrado_vencimiento = headerobj.ek_timbrado_vencimiento.strftime('%d/%m/%Y')
-        #totales dineros en descuento PowerPack
-        full_doc_numero = '{0:}-{1:}-{2: >7} '.format(str(impreso_sucursal).zfill(3),
-                                                str(impreso_caja).zfill(3),
-                                                str(doc_numero).zfill(7))
-        camion = None                                                
-        chofer = None
-        rpt = 0
+        doc_dir = '{}/invoicing_files/{}'.format(self.BASE_APP, now.strftime('%Y%m%d'))
+        os.makedirs(doc_dir, exist_ok=True)
+        merged_path = '{}/kude_lote_{}.pdf'.format(doc_dir, now.strftime('%H%M%S%f'))
+        writer = PdfWriter()
+        for f in pdf_files:
+            writer.append(f)
+        with open(merged_path, 'wb') as fh:
+            writer.write(fh)
+        writer.close()
+        return merged_path
 
+    def render_doc(self, headerobj: DocumentHeader, digital=None, set_name=None):
+        """Dibuja el KuDE de headerobj y lo guarda en invoicing_files/<fecha>, no guarda la cabecera"""
+        tnow = datetime.now().strftime('%Y%m%d')
+        full_doc_numero = '{0:}-{1:}-{2: >7} '.format(str(headerobj.doc_establecimiento).zfill(3),
+                                                str(headerobj.doc_expedicion).zfill(3),
+                                                str(headerobj.doc_numero).zfill(7))
         pdf=FPDF('P','cm',self.paper)
         pdf.add_page()
         pdf.set_font('Arial',style='',size=8)
@@ -765,10 +828,25 @@ class EKude:
         pdf = self.set_footer_full(pdf, headerobj)
         doc_dir = '{}/invoicing_files/{}'.format(self.BASE_APP, tnow)
         pdf_path = '{}/{}.pdf'.format(doc_dir,dfname)
-        try:os.mkdir(doc_dir)
-        except:pass
+        os.makedirs(doc_dir, exist_ok=True)
         pdf.output(pdf_path,'F')
-        headerobj.ek_pdf_file = pdf_path
+        return  {'exitos': 'Hecho',
+                'pdf_file': pdf_path,
+                'prof_number': str(headerobj.prof_number),
+                'filename': dfname,
+                'doc_numero': full_doc_numero.split('-')[-1].strip(),
+                'bloquepk': None
+            }
+
+    def eprint_doc(self, *args, **kwargs):
+        qdict = kwargs.get('query_dict')
+        prof_number = qdict.get('prof_number')
+        digital = qdict.get('digital')
+        set_name = qdict.get('set_name')
+        headerobj = DocumentHeader.objects.get(prof_number=prof_number)
+        if not headerobj.doc_numero: return {'error': 'El documento carece de numero'}
+        rsp = self.render_doc(headerobj, digital=digital, set_name=set_name)
+        headerobj.ek_pdf_file = rsp.get('pdf_file')
         headerobj.save()
         #TODO: See FL Printers
         # if impresora:
@@ -778,16 +856,8 @@ class EKude:
         #         cups_server.imprimir_trabajo(**params_impresion)
         #     headerobj.documento_impreso = True
         #     headerobj.save()
-        bloquepk = None
-        if headerobj.doc_tipo == 'FE':
-            bloquepk = None
-        return  {'exitos': 'Hecho', 
-                'pdf_file': pdf_path,
-                #'location_file': url_viewfull('show_pdf_file', filename=pdf_path),
-                'filename': dfname,
-                'doc_numero': full_doc_numero.split('-')[-1].strip(),
-                'bloquepk': bloquepk
-            }
+        rsp.pop('prof_number')
+        return rsp
 
     def send_kude_console(self, *args, **kwargs):
         qdict = kwargs.get('query_dict')
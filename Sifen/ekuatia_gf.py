@@ -17,6 +17,7 @@ class Egf(object):
         self.ttime = datetime.now(ZoneInfo('America/Asuncion')) - timedelta(minutes=2)
         self.mxml = mng_xml.MngXml()
         self.ROOTFOLDER = '{}/{}/'.format(RFOLDER, tnow)
+        self.businesses = {}
         self.create_dayfolder()
 
     def create_dayfolder(self):
@@ -24,6 +25,17 @@ class Egf(object):
             os.mkdir(self.ROOTFOLDER)
         except:pass
 
+    def get_business(self, ruc):
+        """Business del emisor, se consulta una sola vez por instancia"""
+        ruc = str(ruc)
+        if ruc not in self.businesses:
+            self.businesses[ruc] = Business.objects.select_related(
+                'ciudadobj__distritoobj__dptoobj',
+                'actividadecoobj',
+                'contribuyenteobj',
+            ).get(ruc=ruc)
+        return self.businesses[ruc]
+
     def header_DE(self, sk_xml, cdc, cdc_dv, codseg, prof_number, obs, doc_fecha):
         obs = u"{} PED {}".format(obs, prof_number).strip()
         # tnow = datetime.now().strftime('%Y-%m-%dT%H:%M:%S') 
@@ -143,7 +155,7 @@ class Egf(object):
         return de_xml
 
     def emisor_de(self, de_xml, ruc):
-        eobj = Business.objects.get(ruc=ruc)
+        eobj = self.get_business(ruc)
         ciuobj = eobj.ciudadobj
         actobj = eobj.actividadecoobj
         disobj = ciuobj.distritoobj
@@ -252,7 +264,7 @@ class Egf(object):
         return de_xml
     
     def receptor_de_af(self, de_xml, ruc):
-        eobj = Business.objects.get(ruc=ruc)
+        eobj = self.get_business(ruc)
         ciuobj = eobj.ciudadobj
         
         actobj = eobj.actividadecoobj
@@ -309,7 +321,7 @@ class Egf(object):
             # self.mxml.create_SubElement(gcamfe, 'dFecEmNR', _text=headerobj.pedidoheader.fecha_entrega)
             self.condope_de(gdtipde, headerobj)
         if headerobj.doc_tipo == 'AF':
-            eobj = Business.objects.get(ruc=headerobj.ek_bs_ruc)
+            eobj = self.get_business(headerobj.ek_bs_ruc)
             ciuobj = eobj.ciudadobj
             disobj = ciuobj.distritoobj
             depobj = disobj.dptoobj
@@ -364,7 +376,10 @@ class Egf(object):
         attr_gravada_5 = 'gravada_5'
         attr_gravada_10 = 'gravada_10'
 
-        for pdobj in headerobj.documentdetail_set.filter(anulado=False).order_by('pk'):
+        pdobjs = getattr(headerobj, 'ek_details', None)
+        if pdobjs is None:
+            pdobjs = headerobj.documentdetail_set.filter(anulado=False).order_by('pk')
+        for pdobj in pdobjs:
             self.detalle_de(gdtipde, 
                 headerobj,
                 pdobj,
@@ -749,12 +764,16 @@ class Egf(object):
         return de_xml
 
     def gen_xml_ekuatia(self, **kwargs):
-        """This generate the output of the xml file that is need to be send to the SET"""
+        """This generate the output of the xml file that is need to be send to the SET
+           headerobj can be passed when the caller already prefetched the document
+        """
         logging.info('Running gen_xml_ekuatia')
         qdict = kwargs.get('qdict')
         prof_number = qdict.get('prof_number')
         logging.info('Convertings order {} to xml format for the SET'.format(prof_number))
-        headerobj = DocumentHeader.objects.get(prof_number=prof_number)
+        headerobj = kwargs.get('headerobj')
+        if headerobj is None:
+            headerobj = DocumentHeader.objects.get(prof_number=prof_number)
         codseg = headerobj.ek_cod_seg
         doc_fecha_kude = headerobj.doc_fecha.strftime('%Y-%m-%dT%H:%M:%S')
         cdc = headerobj.ek_cdc
@@ -784,27 +803,30 @@ class Egf(object):
         if qdict.get('reprocess'):
             logging.info('Reprocess file {}'.format(fname))
             self.mxml.save_xml(sk_xml, fname)
-        return {'exitos': 'Hecho', 'xml_file': fname}
+        return {'exitos': 'Hecho', 'xml_file': fname, 'xml_root': sk_xml}
 
-    def sign_xml(self, fname, method, prof_number):
-        headerobj = DocumentHeader.objects.get(prof_number=prof_number)
+    def sign_xml(self, fname, method, prof_number, headerobj=None, xml_root=None, key_material=None):
+        """Firma el DE. xml_root evita releer el archivo generado y key_material
+           recibe el par (cert, key) ya cargado por el llamador
+        """
+        if headerobj is None:
+            headerobj = DocumentHeader.objects.get(prof_number=prof_number)
         xsign = xml_signer.ESigner()
-
-        # Obtener certificado activo del negocio
-        pem_path = None
-        key_path = None
-        try:
-            businessobj = Business.objects.get(ruc=headerobj.ek_bs_ruc)
-            cert_obj = certificate_manager.get_active_certificate_for_business(businessobj)
-            if cert_obj and cert_obj.pem_file and cert_obj.key_file:
-                pem_path = cert_obj.pem_file.path
-                key_path = cert_obj.key_file.path
-                logging.info(f'Usando certificado {cert_obj.nombre} para negocio {businessobj.name}')
-        except Business.DoesNotExist:
-            logging.warning(f'Business con RUC {headerobj.ek_bs_ruc} no encontrado, usando certificado por defecto')
-
+        if key_material is None:
+            key_material = self.get_key_material(headerobj.ek_bs_ruc)
+        cert, key = key_material
         # The order of the methods matters because it is what is recommended
         if method == 'XMLSIGNER':
-            return xsign.digital_signature_xmlsigner(fname, headerobj, pem_path=pem_path, key_path=key_path)
+            return xsign.digital_signature_xmlsigner(fname, headerobj, root=xml_root, cert=cert, key=key)
         return {'error': 'Debe especificar un metodo criptografico'}
-    
+
+    def get_key_material(self, ruc):
+        """Retorna el par (cert, key) en bytes del certificado activo del negocio,
+           cacheado por certificate_manager durante la vida del proceso
+        """
+        businessobj = None
+        try:
+            businessobj = self.get_business(ruc)
+        except Business.DoesNotExist:
+            logging.warning(f'Business con RUC {ruc} no encontrado, usando certificado por defecto')
+        return certificate_manager.get_signing_material(businessobj)
@@ -1,15 +1,32 @@
 import arrow
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from boltons import iterutils
 from django.http import QueryDict
 from django.forms import model_to_dict
-from django.db.models import Q
+from django.db.models import Q, Prefetch, Exists, OuterRef
+from django.db.models.fields.json import KT
+from django.db import transaction, connections, connection
 from datetime import datetime, date
 from tqdm import tqdm
-from Sifen.models import Etimbrado, Enumbers, TrackLote, DocumentRecibo, DocumentHeader, Business, SoapMsg
-from Sifen import  ekuatia_gf, mng_orders_mdata,rq_soap_handler
+from Sifen.models import Etimbrado, Enumbers, TrackLote, DocumentRecibo, DocumentHeader, DocumentDetail, Business, SoapMsg
+from Sifen import  ekuatia_gf, mng_orders_mdata,rq_soap_handler, soap_schemas_xml
+from Sifen.mng_ruc_cache import ruc_cache
+from Sifen.mng_ventas_diarias import ventas_diarias
+from Sifen.fl_sifen_conf import TRACK_WORKERS, TRACK_ROUNDS, TRACK_BACKOFF, TRACK_BACKOFF_MAX, LOTE_WORKERS
 from django.core.files import File
 import logging
 
+
+def _sign_pool_init():
+    #Los workers no pueden compartir las conexiones heredadas del proceso padre
+    connections.close_all()
+
+
+def _sign_pool_batch(prof_numbers, ruc):
+    return Eserial().sign_documents(prof_numbers, ruc)
+
+
 class Eserial(object):
     def __init__(self):
         self.tnow = date.today()
@@ -296,11 +313,42 @@ class Eserial(object):
 
 
 
+    def reserve_numbers(self, timbrado, establecimiento, tipo, cantidad):
+        """Reserva en una sola transaccion las primeras `cantidad` numeraciones libres
+           del timbrado/establecimiento/tipo. Las filas se bloquean con
+           SELECT ... FOR UPDATE SKIP LOCKED, por lo que dos workers numerando sobre
+           el mismo establecimiento nunca toman el mismo numero.
+           Debe llamarse dentro de un transaction.atomic()
+        """
+        #MI is for the internal movements of goods
+        if tipo == 'MI':
+            tipo = 'PD'
+        #of=('self',): solo se bloquean las filas de Enumbers, no el establecimiento
+        #ni el timbrado del join que comparten todos los workers
+        enums = list(Enumbers.objects.select_for_update(skip_locked=True, of=('self',))\
+                            .filter(expobj__establecimiento=establecimiento,
+                                    expobj__timbradoobj__timbrado=timbrado,
+                                    estado='L',
+                                    tipo=tipo)\
+                            .order_by('numero')\
+                            .values_list('pk', 'numero')[:cantidad])
+        if len(enums) < cantidad:
+            return {'error': 'IMPOSIBLE GENERAR LA ORDEN DE IMPRESION, LA CANTIDAD DE NUMEROS ES INSUFICIENTE'}
+        Enumbers.objects.filter(pk__in=[ e[0] for e in enums ]).update(estado='R')
+        numeros = [ e[1] for e in enums ]
+        return {'success': 'Done',
+                'numeros': numeros,
+                'desde': numeros[0],
+                'hasta': numeros[-1],
+                'timbrado': timbrado,
+                'establecimiento': establecimiento,
+                'tipo': tipo
+            }
+
     def set_number(self, *args, **kwargs):
         logging.info('Running set_numbert')
         qdict = kwargs.get('qdict')
         ahora = date.today()
-        ahoraf = ahora.strftime('%Y-%m-%d')
         invoicedate = ahora
         ruc = qdict.get('ruc')
         timbrado = qdict.get('timbrado')
@@ -309,97 +357,71 @@ class Eserial(object):
         prof_number = qdict.getlist('prof_number')
         tipo = qdict.get('tipo')
         sign_document = qdict.get('sign_document', True)
-        #viene por query dict, pero es un proceso interno despues del ruteo
-        #por eso ya esta como lista
-        recobjs = DocumentHeader.objects.filter(prof_number__in=prof_number, doc_tipo=tipo, doc_numero__isnull=True).order_by('prof_number')
-        if not recobjs: return {'error': 'No se puede asignar numero de documentos a los pedidos'}
-        numeros_necesarios = recobjs.count()
-        logging.info('We need upto {} numbers for type {}'.format(numeros_necesarios, tipo))
-        qed = QueryDict(mutable=True)
-        logging.info('Get available timbrado for {} and establishment {}'.format(
-            ruc, establecimiento
-        ))
-        timp = {'ruc': ruc,'establecimiento': establecimiento }
-        
-        #timbradoobj = self.get_available_timbrado(qdict=timp)
         timbradoobj = Etimbrado.objects.get(timbrado=timbrado)
-        
-        # if timbradoobj.get('error'):
-        #     raise ValueError(timbradoobj.get('error'))
-        
         serie = timbradoobj.serie
         vigencia = timbradoobj.inicio
         fcsc = timbradoobj.fcsc
         scsc = timbradoobj.scsc
         venct = timbradoobj.vencimiento
-        logging.info(f'Get available numbers for timbrado {timbradoobj.timbrado} establishment {establecimiento} type {tipo}')
-
-        enumobjs = self.get_available_numbers(qdict={
-            'timbrado': timbradoobj.timbrado,
-            'establecimiento': establecimiento,
-            'tipo': tipo
-        })
-        logging.info('Response of get_available_numbers timbrado {} estaclemiento {} tipo {}'.format(
-            enumobjs.get('timbrado'),
-            enumobjs.get('establecimiento'),
-            enumobjs.get('tipo'),
+        #viene por query dict, pero es un proceso interno despues del ruteo
+        #por eso ya esta como lista
+        with transaction.atomic():
+            recobjs = list(DocumentHeader.objects.select_for_update(skip_locked=True)\
+                            .filter(prof_number__in=prof_number, doc_tipo=tipo, doc_numero__isnull=True)\
+                            .order_by('prof_number'))
+            if not recobjs: return {'error': 'No se puede asignar numero de documentos a los pedidos'}
+            numeros_necesarios = len(recobjs)
+            logging.info(f'Reserve {numeros_necesarios} numbers for timbrado {timbradoobj.timbrado} establishment {establecimiento} type {tipo}')
+            enumobjs = self.reserve_numbers(timbradoobj.timbrado, establecimiento, tipo, numeros_necesarios)
+            if enumobjs.get('error'):
+                raise ValueError(enumobjs.get('error'))
+            #bulk_update no dispara señales, se marcan el dia anterior y el de numeracion
+            for recobj in recobjs:
+                ventas_diarias.mark(recobj.ek_bs_ruc, recobj.doc_fecha)
+                ventas_diarias.mark(recobj.ek_bs_ruc, invoicedate)
+            for recobj, enum in zip(recobjs, enumobjs.get('numeros')):
+                recobj.doc_fecha = invoicedate
+                recobj.doc_numero = enum
+                recobj.ek_serie =  serie
+                recobj.ek_timbrado = timbradoobj.timbrado
+                recobj.ek_timbrado_vencimiento = venct
+                recobj.ek_timbrado_vigencia = vigencia
+                recobj.doc_expedicion = expd
+                recobj.doc_establecimiento = establecimiento
+                recobj.impx_nombre = 'GENERICO'
+                recobj.ek_idcsc = fcsc
+                recobj.ek_idscsc = scsc
+            DocumentHeader.objects.bulk_update(recobjs, [
+                'doc_fecha', 'doc_numero', 'ek_serie', 'ek_timbrado',
+                'ek_timbrado_vencimiento', 'ek_timbrado_vigencia',
+                'doc_expedicion', 'doc_establecimiento', 'impx_nombre',
+                'ek_idcsc', 'ek_idscsc'
+            ], batch_size=1000)
+        logging.info('Numbers {} to {} assigned for type {}'.format(
+            enumobjs.get('desde'), enumobjs.get('hasta'), tipo
         ))
-        if enumobjs.get('error'):
-            raise ValueError(enumobjs.get('error'))
-        
-        if len(enumobjs.get('numeros')) < numeros_necesarios:
-            raise ValueError('IMPOSIBLE GENERAR LA ORDEN DE IMPRESION, LA CANTIDAD DE NUMEROS ES INSUFICIENTE')
-        impreso_caja = expd
-        impreso_sucursal = establecimiento
-        numbers = enumobjs.get('numeros')
-        aorde = QueryDict(mutable=True)
-        tcount = 0
-        for recobj in recobjs:
-            # if pedobj.pedidos_set.all().count() == pedobj.pedidos_set.filter(anulado_040=True).count():
-            #     continue
-            enum, tipo, timbrado = numbers.pop()
-            if not enum:
-                return {'error': 'No hay numeros disponibles'}
-            
-            vencimiento = venct
-            logging.info('Set number {} for type {} and attrib doc_numero'.format(
-                enum, tipo
-            ))
-            recobj.doc_fecha = invoicedate
-            recobj.doc_numero = enum
-            #recobj.doc_op = tipo
-            #recobj.doc_tipo = recobj.pedido_tipo
-            recobj.ek_serie =  serie
-            recobj.ek_timbrado = timbrado
-            recobj.ek_timbrado_vencimiento = vencimiento
-            recobj.ek_timbrado_vigencia = vigencia
-            recobj.doc_expedicion = impreso_caja
-            recobj.doc_establecimiento = impreso_sucursal
-            recobj.impx_nombre = 'GENERICO'
-            recobj.ek_idcsc = fcsc
-            recobj.ek_idscsc = scsc
-            recobj.save()
-            aorde.update({'prof_number': recobj.prof_number})
-            tcount += 1
-            qed.update({'numero': enum})
+        qed = QueryDict(mutable=True)
+        qed.setlist('numero', enumobjs.get('numeros'))
         qed.update({
             'timbrado': timbradoobj.timbrado,
             'establecimiento': establecimiento,
             'ruc': ruc,
-            'tipo': tipo,
+            'tipo': enumobjs.get('tipo'),
             'expd': expd,
             'state': 'R'
         })
+        aorde = QueryDict(mutable=True)
+        aorde.setlist('prof_number', [ r.prof_number for r in recobjs ])
         aorde.update({
             'ruc': ruc
         })
-        self.set_state_numbers(qdict=qed)
         if sign_document:
             self.set_data_ekuatia(qdict=aorde)
         return {'success': 'Done', 
                 'affected_numbers': qed,
                 'affected_orders': aorde,
                 'timbradoobj': timbradoobj,
+                'reserved_range': (enumobjs.get('desde'), enumobjs.get('hasta')),
                 }
     
     def set_data_ekuatia(self, *args, **kwargs):
@@ -438,6 +460,74 @@ class Eserial(object):
                 # )
         return {'success': 'Done'}
 
+    def sign_documents(self, prof_numbers, ruc):
+        """Genera y firma un bloque de documentos del mismo emisor.
+           Cabeceras y detalles se traen en bloque, el material del certificado
+           se carga una vez por proceso y el DE se firma en memoria sin releerlo del disco
+        """
+        morm = mng_orders_mdata.Morders()
+        ek = ekuatia_gf.Egf()
+        key_material = ek.get_key_material(ruc)
+        rsp = morm.generate_pmeta_batch(prof_numbers, ruc)
+        errors = list(rsp.get('errors').values())
+        skip = set(rsp.get('errors').keys())
+        for msg in errors:
+            logging.error(msg)
+        pedobjs = DocumentHeader.objects.filter(prof_number__in=prof_numbers)\
+                        .prefetch_related(Prefetch(
+                            'documentdetail_set',
+                            queryset=DocumentDetail.objects.filter(anulado=False).order_by('pk'),
+                            to_attr='ek_details'))
+        signed = 0
+        for pedobj in pedobjs:
+            if str(pedobj.prof_number) in skip: continue
+            exml = ek.gen_xml_ekuatia(qdict={'prof_number': pedobj.prof_number}, headerobj=pedobj)
+            sixml = ek.sign_xml(exml.get('xml_file'), 'XMLSIGNER', pedobj.prof_number,
+                                headerobj=pedobj,
+                                xml_root=exml.get('xml_root'),
+                                key_material=key_material)
+            signed += 1
+            if pedobj.ek_xml_ekua: continue
+            pedobj.ek_xml_ekua = True
+            pedobj.ek_xml_file = File(open(exml.get('xml_file'), 'rb'), name=exml.get('xml_file').split('/')[-1])
+            pedobj.ek_xml_file_signed = File(open(sixml.get('xmlsigner_file'), 'rb'),name=sixml.get('xmlsigner_file').split('/')[-1])
+            pedobj.ek_qr_link = sixml.get('qpar')
+            pedobj.ek_qr_img = File(open(sixml.get('qri'), 'rb'), name=sixml.get('qri').split('/')[-1])
+            #update_fields: la generacion del xml ajusta telefonos y ruc del receptor solo para el DE
+            pedobj.save(update_fields=['ek_xml_ekua', 'ek_xml_file', 'ek_xml_file_signed', 'ek_qr_link', 'ek_qr_img'])
+        return {'success': 'Done', 'signed': signed, 'errors': errors}
+
+    def set_data_ekuatia_parallel(self, prof_numbers, ruc, workers=None, chunk_size=50):
+        """Reparte la generacion y firma de los documentos en un pool de procesos.
+           Retorna la cantidad firmada y el rendimiento en documentos por segundo
+        """
+        logging.info(f'Sign {len(prof_numbers)} orders with a pool of {workers or "default"} workers')
+        prof_numbers = [ str(p) for p in prof_numbers ]
+        tstart = time.perf_counter()
+        signed = 0
+        errors = []
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_sign_pool_init) as pool:
+            futures = [ pool.submit(_sign_pool_batch, chunk, ruc)
+                        for chunk in iterutils.chunked(prof_numbers, chunk_size) ]
+            for future in as_completed(futures):
+                try:
+                    rsp = future.result()
+                except Exception as e:
+                    logging.exception('Error signing block of orders')
+                    errors.append(str(e))
+                    continue
+                signed += rsp.get('signed')
+                errors.extend(rsp.get('errors'))
+        elapsed = time.perf_counter() - tstart
+        docs_sec = signed / elapsed if elapsed else 0
+        logging.info(f'Signed {signed} orders in {elapsed:.2f}s ({docs_sec:.2f} docs/s)')
+        return {'success': 'Done',
+                'signed': signed,
+                'errors': errors,
+                'elapsed': elapsed,
+                'docs_sec': docs_sec}
+
     def check_consistency_numbers(self, timbrado, ttype, show_p=False):
         rsp = []
         for pedobj in tqdm(DocumentHeader.objects\
@@ -491,57 +581,120 @@ class Eserial(object):
         self.set_data_ekuatia(qdict=aorde)
         return {'success': 'Datos xml firmados', 'prof_number': aorde.getlist('prof_number')}
 
-    def send_pending_signedxml(self, orders):
-        rqsoap = rq_soap_handler.SoapSifen()
+    def send_pending_signedxml(self, orders, workers=None):
         # if len(orders) == 1:
         #     order = orders[0]
         #     docobj = DocumentHeader.objects.get(prof_number=order)
         #     rsp = rqsoap.send_xde(docobj.ek_cdc, docobj.ek_xml_file_signed.path)
         #     return rsp
-        xml_file_signed = [ (d.pk ,d.ek_xml_file_signed.path) for d in DocumentHeader.objects\
-                                    .filter(prof_number__in=orders, ek_xml_file_signed__isnull=False)\
-                                    .order_by('doc_tipo', 'doc_numero') ]
-        for xmlff in iterutils.chunked(xml_file_signed, 20):
-            xfnames = [ x[1] for x in xmlff ]
-            ppks = [ x[0] for x in xmlff ]
-            rsp = rqsoap.send_xde_lote(ppks, xfnames)
-        return {'success': 'Done'}
+        builder = soap_schemas_xml.LoteBuilder()
+        for d in DocumentHeader.objects\
+                    .filter(prof_number__in=orders, ek_xml_file_signed__isnull=False)\
+                    .exclude(ek_xml_file_signed='')\
+                    .only('pk', 'doc_tipo', 'ek_xml_file_signed')\
+                    .order_by('doc_tipo', 'doc_numero'):
+            builder.add(d.doc_tipo, d.pk, d.ek_xml_file_signed.path)
+        lotes = builder.build()
+        logging.info(f'Enviando {len(lotes)} lotes con {workers or LOTE_WORKERS} hilos')
+        results = []
+        with ThreadPoolExecutor(max_workers=workers or LOTE_WORKERS) as executor:
+            futures = { executor.submit(self._send_lote, lote): lote for lote in lotes }
+            for future in as_completed(futures):
+                lote = futures[future]
+                try:
+                    future.result()
+                    results.append({'lote': lote.get('hfname'), 'tipo': lote.get('doc_tipo'), 'docs': len(lote.get('ppks'))})
+                except Exception as e:
+                    logging.error(f"Error enviando lote {lote.get('hfname')}: {e}")
+                    results.append({'lote': lote.get('hfname'), 'tipo': lote.get('doc_tipo'), 'error': str(e)})
+        return {'success': 'Done', 'lotes': results}
 
+    def _send_lote(self, lote):
+        try:
+            rqsoap = rq_soap_handler.SoapSifen()
+            return rqsoap.send_xde_lote(lote.get('ppks'), lote.get('fnames'), lote=lote)
+        finally:
+            connection.close()
 
-    def track_lotes(self, *args, fdate=None, **kwargs):
-        now = arrow.now()
-        nows = now.strftime('%Y-%m-%d')
-        if fdate:
-            nows = fdate
-        rqsoap = rq_soap_handler.SoapSifen()
-        pps = {
-            'fecha__gte': nows,
-            'estado': 'CONCLUIDO',
-            'lote__isnull': False,
-        }
+
+    def pending_lotes(self, nows, estados=('CONCLUIDO',), last=None):
+        """
+            Lotes enviados desde nows que aun no tienen un TrackLote en estados,
+            se resuelve con un solo query en lugar de comparar contra una lista en memoria.
+            Con last solo los ultimos last lotes trackeados cuentan como concluidos
+        """
+        qs = SoapMsg.objects.filter(method_name='SiRecepLoteDE', fproc__gte=nows)\
+                            .annotate(lote=KT('json_rsp__dprotconslote'))\
+                            .filter(lote__isnull=False)
+        if last:
+            tracked = list(TrackLote.objects.filter(fecha__gte=nows, estado__in=estados, lote__isnull=False)
+                           .order_by('pk').values_list('lote', flat=True))
+            qs = qs.exclude(lote__in=tracked[-int(last):])
+        else:
+            tracked = TrackLote.objects.filter(lote=OuterRef('lote'), fecha__gte=nows, estado__in=estados)
+            qs = qs.exclude(Exists(tracked))
+        return list(qs.order_by('lote').values_list('lote', flat=True).distinct())
+
+    def _poll_lote(self, lote):
+        #Cada hilo usa su propia conexion a la base y su sesion del pool de rq_soap_handler
+        try:
+            rqsoap = rq_soap_handler.SoapSifen()
+            rqsoap.qr_lote(lote)
+            loteobj = TrackLote.objects.filter(lote=lote).last()
+            return loteobj.estado if loteobj else 'ND'
+        finally:
+            connection.close()
+
+    def track_lotes(self, *args, fdate=None, workers=None, rounds=None, **kwargs):
+        """
+            Consulta los lotes pendientes en paralelo, los que siguen en
+            RECIBIDO/PROCESANDO se vuelven a consultar con espera exponencial
+        """
+        now = arrow.now(); nows = now.strftime('%Y-%m-%d')
+        if fdate: nows = fdate
         q = kwargs.get('qdict', {})
-        if q.get('remove_estado'):
-            pps.pop('estado')
-            pps.update({'estado__in': ['RECIBIDO', 'PROCESANDO', 'CONCLUIDO']})
-        logging.info('Tracking lotes with params {}'.format(pps))
-        lotes = list(TrackLote.objects.filter(**pps).values_list('lote', flat=True))
-        if q.get('last'):
-            lotes = lotes[-int(q.get('last')):]
-        for soapobj in SoapMsg.objects.filter(method_name='SiRecepLoteDE',fproc__gte=nows):
-            lote = soapobj.json_rsp.get('dprotconslote')
-            if lote == None: continue
-            if lote in lotes: 
-                logging.info('El proceso para el lote {} esta concluido'.format(lote))
-                continue
-            logging.info('Track lote {}'.format(lote))
-            rsp = rqsoap.qr_lote(lote)
-        return {'success': 'Done'}
+        estados = ['CONCLUIDO']
+        if q.get('remove_estado'): estados = ['RECIBIDO', 'PROCESANDO', 'CONCLUIDO']
+        #last conserva su significado original (ultimos lotes concluidos a omitir),
+        #limit consulta solo los ultimos limit lotes pendientes
+        lotes = self.pending_lotes(nows, estados, last=q.get('last'))
+        if q.get('limit'): lotes = lotes[-int(q.get('limit')):]
+        workers = workers or TRACK_WORKERS
+        rounds = TRACK_ROUNDS if rounds is None else rounds
+        delay = TRACK_BACKOFF
+        results = {}
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for rnd in range(rounds + 1):
+                if not lotes: break
+                if rnd:
+                    logging.info(f'Reintentando {len(lotes)} lotes en proceso en {delay}s')
+                    time.sleep(delay)
+                    delay = min(delay * 2, TRACK_BACKOFF_MAX)
+                futures = { executor.submit(self._poll_lote, lote): lote for lote in lotes }
+                for future in as_completed(futures):
+                    lote = futures[future]
+                    try:
+                        results[lote] = future.result()
+                    except Exception as e:
+                        logging.error(f'Error consultando lote {lote}: {e}')
+                        results[lote] = f'ERROR {e}'
+                lotes = [ lote for lote, estado in results.items() if estado in ('RECIBIDO', 'PROCESANDO') ]
+        elapsed = time.perf_counter() - t0
+        logging.info(f'Track lotes {len(results)} consultados en {elapsed:.2f}s')
+        return {'success': 'Done',
+                'lotes': results,
+                'pending': lotes,
+                'elapsed': elapsed}
 
     def send_result_lote(self):
         rqsoap = rq_soap_handler.SoapSifen()
         rqsoap.notification_interactions()
 
-    def qr_ruc(self, ruc, business=None):
-        rqsoap = rq_soap_handler.SoapSifen(business=business)
-        rsp = rqsoap.qr_ruc(ruc)
-        return rsp
+    def qr_ruc(self, ruc, business=None, use_cache=True):
+        def fetch(ruc):
+            rqsoap = rq_soap_handler.SoapSifen(business=business)
+            return rqsoap.qr_ruc(ruc)
+        if not use_cache:
+            return fetch(ruc)
+        return ruc_cache.get(ruc, fetch)
@@ -145,6 +145,36 @@ ROUTE_CONSULTA = '/consultas/consulta.wsdl'
 
 URL_Q = 'https://ekuatia.set.gov.py/consultas/qr?'  # Servidor de prueba
 
+#Pool de sesiones HTTPS por negocio hacia SIFEN
+SESSION_POOL_SIZE = int(os.environ.get('SIFEN_POOL_SIZE', 10))
+SESSION_MAX_RETRIES = int(os.environ.get('SIFEN_MAX_RETRIES', 3))
+SESSION_BACKOFF = float(os.environ.get('SIFEN_BACKOFF', 0.5))
+#(connect, read) en segundos
+SESSION_TIMEOUT = (
+    float(os.environ.get('SIFEN_CONNECT_TIMEOUT', 10)),
+    float(os.environ.get('SIFEN_READ_TIMEOUT', 60)),
+)
+
+#Consulta concurrente de lotes: hilos, rondas de reintento y espera exponencial en segundos
+TRACK_WORKERS = int(os.environ.get('SIFEN_TRACK_WORKERS', 8))
+TRACK_ROUNDS = int(os.environ.get('SIFEN_TRACK_ROUNDS', 3))
+TRACK_BACKOFF = float(os.environ.get('SIFEN_TRACK_BACKOFF', 2))
+TRACK_BACKOFF_MAX = float(os.environ.get('SIFEN_TRACK_BACKOFF_MAX', 30))
+
+#Limites de SiRecepLoteDE: DEs por lote y tamaño del zip en base64 (bytes)
+LOTE_MAX_DES = int(os.environ.get('SIFEN_LOTE_MAX_DES', 50))
+LOTE_MAX_BYTES = int(os.environ.get('SIFEN_LOTE_MAX_BYTES', 1000 * 1024))
+LOTE_SAVE_FILES = os.environ.get('SIFEN_LOTE_SAVE_FILES', 'false').lower() in ('1', 'true', 'yes')
+LOTE_WORKERS = int(os.environ.get('SIFEN_LOTE_WORKERS', 4))
+
+#Cache de siConsRUC: TTL de respuestas positivas y negativas, espera maxima por una consulta en curso (segundos)
+RUC_CACHE_TTL = int(os.environ.get('SIFEN_RUC_CACHE_TTL', 7 * 24 * 3600))
+RUC_CACHE_NEG_TTL = int(os.environ.get('SIFEN_RUC_CACHE_NEG_TTL', 3600))
+RUC_LOCK_TIMEOUT = float(os.environ.get('SIFEN_RUC_LOCK_TIMEOUT', 30))
+
+#Resumen diario de ventas: dias hacia atras que recalcula la reconciliacion nocturna
+VENTAS_DIARIAS_DIAS = int(os.environ.get('SIFEN_VENTAS_DIARIAS_DIAS', 7))
+
 SOAP_NAME_SPACE = '{http://www.w3.org/2003/05/soap-envelope}'
 SIFEN_NAME_SPACE = '{http://ekuatia.set.gov.py/sifen/xsd}'
 XSI_NAME_SPACE = '{http://www.w3.org/2001/XMLSchema-instance}'
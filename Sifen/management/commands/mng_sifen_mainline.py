@@ -14,14 +14,20 @@ class Command(BaseCommand):
         parser.add_argument('--date', nargs='?', help='Date in YYYY-MM-DD format')
         parser.add_argument('--track_lotes', action='store_true', help='Track pending lotes from Sifen')
         parser.add_argument('--send_pending_docs', action='store_true', help='Send pending documents to Sifen')
+        parser.add_argument('--workers', nargs='?', type=int, help='Worker processes for the signing pipeline / threads for track_lotes')
         parser.add_argument('--send_email', action='store_true', help='Send invoice emails to clients')
         parser.add_argument('--load_actividades', action='store_true', help='')
         parser.add_argument('--load_geografias', action='store_true', help='')
         parser.add_argument('--load_medidas', action='store_true', help='')
         parser.add_argument('--set_tipo_contribuyente', action='store_true', help='')
         parser.add_argument('--sync_rucs', action='store_true', help='Download and sync RUC data from DNIT')
+        parser.add_argument('--load_rucs', action='store_true', help='Download and load RUC data from DNIT in this process')
+        parser.add_argument('--delta', action='store_true', help='sync_rucs/load_rucs: skip unchanged files and rows')
         parser.add_argument('--create_core_apps', action='store_true', help='Create core apps entries')
         parser.add_argument('--classify_clients', action='store_true', help='Classify clients as B2B or B2C based on RUC')
+        parser.add_argument('--rebuild_ventas_diarias', action='store_true', help='Rebuild the VentaDiaria rollup (optional --desde/--hasta YYYY-MM-DD)')
+        parser.add_argument('--desde', nargs='?', help='Start date YYYY-MM-DD')
+        parser.add_argument('--hasta', nargs='?', help='End date YYYY-MM-DD')
 
         parser.add_argument('--ruc', nargs='?')
         parser.add_argument('--dv', nargs='?')
@@ -54,13 +60,23 @@ class Command(BaseCommand):
         if options['sync_rucs']:
             self.stdout.write(self.style.SUCCESS('Starting RUC sync process...'))
             rmap = mng_sifen_ruc_mapper.RMap()
-            result = rmap.sync_rucs()
+            result = rmap.sync_rucs(delta=options.get('delta'))
             self.stdout.write(self.style.SUCCESS(f"RUC sync tasks dispatched:"))
             self.stdout.write(f"  - Tasks sent: {result['tasks_sent']}")
-            self.stdout.write(f"  - Total records: {result['total_records']}")
             self.stdout.write(f"  - Task IDs: {', '.join(result['task_ids'][:5])}{'...' if len(result['task_ids']) > 5 else ''}")
             self.stdout.write(self.style.WARNING('Tasks are running asynchronously. Check Celery logs for progress.'))
 
+        if options['load_rucs']:
+            self.stdout.write(self.style.SUCCESS('Loading RUC registry...'))
+            rmap = mng_sifen_ruc_mapper.RMap()
+            result = rmap.load_rucs(workers=options.get('workers'), delta=options.get('delta'))
+            for fr in result['files']:
+                self.stdout.write(f"  - {fr}")
+            self.stdout.write(self.style.SUCCESS(
+                f"RUC load completed in {result['elapsed']}s: {result['created']} created, "
+                f"{result['updated']} updated, {result['unchanged']} unchanged, {result['errors']} errors, "
+                f"{result['skipped']} files skipped"))
+
         if options['track_lotes']:
             fdate = options.get('date')
             if not fdate:
@@ -68,7 +84,7 @@ class Command(BaseCommand):
                 return
             self.stdout.write(self.style.SUCCESS(f'Tracking lotes from {fdate}...'))
             eser = ekuatia_serials.Eserial()
-            result = eser.track_lotes(fdate=fdate)
+            result = eser.track_lotes(fdate=fdate, workers=options.get('workers'))
             self.stdout.write(self.style.SUCCESS(f"Track lotes completed: {result}"))
 
         if options['send_pending_docs']:
@@ -90,15 +106,16 @@ class Command(BaseCommand):
             self.stdout.write(f'  - Found {count} pending documents')
             dobjs.update(ek_xml_ekua=False)
             eser = ekuatia_serials.Eserial()
-            qek = QueryDict(mutable=True)
             profs = []
-            for docobj in dobjs:
-                qek.update({
-                    'prof_number': str(docobj.prof_number),
-                    'ruc': docobj.ek_bs_ruc,
-                })
-                profs.append(str(docobj.prof_number))
-            eser.set_data_ekuatia(qdict=qek)
+            rucs = {}
+            for prof_number, ruc in dobjs.values_list('prof_number', 'ek_bs_ruc'):
+                rucs.setdefault(ruc, []).append(str(prof_number))
+                profs.append(str(prof_number))
+            for ruc, rprofs in rucs.items():
+                rsp = eser.set_data_ekuatia_parallel(rprofs, ruc, workers=options.get('workers'))
+                self.stdout.write(f"  - RUC {ruc}: signed {rsp['signed']} in {rsp['elapsed']:.2f}s ({rsp['docs_sec']:.2f} docs/sec)")
+                for err in rsp['errors']:
+                    self.stdout.write(self.style.WARNING(f'    {err}'))
             eser.send_pending_signedxml(profs)
             self.stdout.write(self.style.SUCCESS(f'Sent {count} documents to Sifen'))
 
@@ -178,6 +195,12 @@ class Command(BaseCommand):
         if options['classify_clients']:
             self.classify_clients()
 
+        if options['rebuild_ventas_diarias']:
+            from Sifen.mng_ventas_diarias import ventas_diarias
+            result = ventas_diarias.rebuild(desde=options.get('desde'), hasta=options.get('hasta'), bs_ruc=options.get('ruc'))
+            self.stdout.write(self.style.SUCCESS(
+                f"VentaDiaria rebuilt: {result['filas']} rows, {result['reemplazadas']} replaced"))
+
     def create_core_apps(self):
         """Create core apps entries if they don't exist"""
         apps_core = [
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sifen', '0083_add_anclaje_cliente_to_clientes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rucqr',
+            index=models.Index(fields=['druccons', '-process_date'], name='rucqr_ruc_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sifen', '0084_rucqr_ruc_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientes',
+            index=models.Index(fields=['pdv_ruc'], name='clientes_pdv_ruc_idx'),
+        ),
+    ]
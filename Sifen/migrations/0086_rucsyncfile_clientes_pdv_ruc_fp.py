@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sifen', '0085_clientes_pdv_ruc_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientes',
+            name='pdv_ruc_fp',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.CreateModel(
+            name='RucSyncFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fname', models.CharField(max_length=60, unique=True)),
+                ('url', models.CharField(max_length=400)),
+                ('sha256', models.CharField(max_length=64)),
+                ('etag', models.CharField(blank=True, max_length=200, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=100, null=True)),
+                ('total', models.IntegerField(default=0)),
+                ('created', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('unchanged', models.IntegerField(default=0)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sifen', '0086_rucsyncfile_clientes_pdv_ruc_fp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bs_ruc', models.CharField(max_length=120)),
+                ('fecha', models.DateField()),
+                ('doc_tipo', models.CharField(max_length=10)),
+                ('doc_moneda', models.CharField(max_length=10)),
+                ('doc_establecimiento', models.IntegerField()),
+                ('cantidad', models.IntegerField(default=0)),
+                ('gravada_10', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('gravada_5', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('base_gravada_10', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('base_gravada_5', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('iva_10', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('iva_5', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('exenta', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('redondeo', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('total', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('saldo', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('saldo_credito', models.DecimalField(decimal_places=6, default=0, max_digits=19)),
+                ('cantidad_credito', models.IntegerField(default=0)),
+                ('actualizado_fecha', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bs_ruc', 'fecha', 'doc_tipo', 'doc_moneda', 'doc_establecimiento'), name='ventadiaria_key_uniq')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='documentheader',
+            index=models.Index(fields=['ek_bs_ruc', 'doc_fecha'], name='dh_bs_fecha_idx'),
+        ),
+    ]
@@ -16,6 +16,7 @@ import logging
 import hashlib
 import base64
 import json
+import threading
 from datetime import datetime, timezone as dt_timezone
 from typing import Tuple, Optional, Dict, Any
 
@@ -26,8 +27,10 @@ from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from cryptography import x509
+from requests_pkcs12 import Pkcs12Adapter
 
 from Sifen.models import Certificate, Business
+from Sifen.fl_sifen_conf import PFX, PASS, PEMF, KEYF
 from OptsIO.io_json import from_json
 
 logger = logging.getLogger(__name__)
@@ -40,6 +43,9 @@ class CertificateManager:
         # Usar SECRET_KEY de Django como base para la clave de encriptación
         # En producción, debería usarse una clave específica
         self.cipher_key = self._derive_key()
+        # Credenciales descifradas y parseadas por (business_id, certificate_id)
+        self._credentials = {}
+        self._lock = threading.Lock()
 
     def _derive_key(self) -> bytes:
         """Deriva una clave Fernet de 32 bytes desde SECRET_KEY."""
@@ -411,6 +417,122 @@ class CertificateManager:
         ).first()
 
 
+    def get_credentials(self, business=None) -> Dict[str, Any]:
+        """
+        Obtiene las credenciales del certificado activo de una empresa, ya descifradas
+        y parseadas, desde un cache en memoria del proceso.
+
+        El cache se indexa por (empresa, certificado) y se descarta cuando el certificado
+        cambia (actualizado_fecha) o con las señales post_save/post_delete de Certificate.
+        Sin certificado activo se usan los archivos de fl_sifen_conf.
+
+        Args:
+            business: Instancia del modelo Business o None
+
+        Returns:
+            Dict con certificate_id, pfx_path, pfx_password, pfx_data, cert y key (PEM en bytes)
+        """
+        cert_obj = self.get_active_certificate_for_business(business) if business else None
+        if cert_obj and not cert_obj.pfx_file:
+            cert_obj = None
+        ckey = (business.pk if business else None, cert_obj.pk if cert_obj else None)
+        version = cert_obj.actualizado_fecha if cert_obj else None
+        creds = self._credentials.get(ckey)
+        if creds and creds['version'] == version:
+            return creds
+        with self._lock:
+            creds = self._credentials.get(ckey)
+            if creds and creds['version'] == version:
+                return creds
+            creds = self._load_credentials(cert_obj)
+            creds['version'] = version
+            # Un solo certificado vigente por empresa en el cache
+            for okey in [ k for k in self._credentials if k[0] == ckey[0] ]:
+                self._credentials.pop(okey, None)
+            self._credentials[ckey] = creds
+        return creds
+
+    def _load_credentials(self, cert_obj) -> Dict[str, Any]:
+        """
+        Descifra el password y lee los archivos PFX, PEM y KEY una sola vez.
+
+        Los tres salen del mismo origen: si el certificado de la empresa no se
+        puede usar (password que no descifra, PEM/KEY sin extraer o archivos
+        ilegibles) se usan los de fl_sifen_conf, nunca una mezcla.
+        """
+        if cert_obj:
+            try:
+                pem_path = cert_obj.get_pem_path()
+                key_path = cert_obj.get_key_path()
+                if not (pem_path and key_path):
+                    raise ValueError(f'El certificado {cert_obj.nombre} no tiene los archivos PEM y KEY extraidos')
+                pfx_password = self.decrypt_password(cert_obj.pfx_password_encrypted)
+                creds = self._read_credentials(cert_obj.pfx_file.path, pfx_password, pem_path, key_path)
+                creds['certificate_id'] = cert_obj.pk
+                logger.info(f'Cargando credenciales del certificado {cert_obj.nombre}')
+                return creds
+            except Exception as e:
+                logger.warning(f'Error obteniendo certificado del modelo: {e}')
+        logger.info('Cargando credenciales por defecto de fl_sifen_conf')
+        return self._read_credentials(PFX, PASS, PEMF, KEYF)
+
+    def _read_credentials(self, pfx_path, pfx_password, pem_path, key_path) -> Dict[str, Any]:
+        with open(pfx_path, 'rb') as f:
+            pfx_data = f.read()
+        with open(pem_path, 'rb') as f:
+            cert = f.read()
+        with open(key_path, 'rb') as f:
+            key = f.read()
+        return {
+            'certificate_id': None,
+            'pfx_path': pfx_path,
+            'pfx_password': pfx_password,
+            'pfx_data': pfx_data,
+            'cert': cert,
+            'key': key,
+            'adapter': None,
+        }
+
+    def get_pkcs12_adapter(self, business=None, **adapter_kwargs) -> Pkcs12Adapter:
+        """
+        Adapter HTTPS con el certificado cliente de la empresa.
+
+        El PKCS#12 se parsea una sola vez y el adapter se reutiliza entre sesiones.
+
+        Args:
+            business: Instancia del modelo Business o None
+            adapter_kwargs: pool_connections, pool_maxsize, max_retries, usados
+                            solo al construir el adapter
+        """
+        creds = self.get_credentials(business)
+        if creds['adapter'] is None:
+            with self._lock:
+                if creds['adapter'] is None:
+                    creds['adapter'] = Pkcs12Adapter(
+                        pkcs12_data=creds['pfx_data'],
+                        pkcs12_password=creds['pfx_password'],
+                        **adapter_kwargs
+                    )
+        return creds['adapter']
+
+    def get_signing_material(self, business=None) -> Tuple[bytes, bytes]:
+        """Retorna el par (cert, key) en PEM para la firma de documentos."""
+        creds = self.get_credentials(business)
+        return creds['cert'], creds['key']
+
+    def invalidate(self, business_id=None, certificate_id=None):
+        """
+        Descarta credenciales cacheadas.
+
+        Sin argumentos limpia todo el cache.
+        """
+        for ckey in list(self._credentials):
+            if business_id is not None and ckey[0] != business_id:
+                continue
+            if certificate_id is not None and ckey[1] != certificate_id:
+                continue
+            self._credentials.pop(ckey, None)
+
 # Singleton para uso global
 certificate_manager = CertificateManager()
 
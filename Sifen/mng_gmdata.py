@@ -1,4 +1,5 @@
 import random, binascii
+import numpy as np
 import qrcode
 from Sifen.fl_sifen_conf import EVERSION, URL_Q, RFOLDER
 from Sifen.models import DocumentHeader
@@ -68,10 +69,26 @@ class Gdata:
                tipo_contribuyente,
                doc_fecha,
                codseg):
-        ruc_empresa = str(ruc_empresa).zfill(8)
+        cdc = self.cdc_base(tipo_doc, ruc_empresa, ruc_dv, establecimiento, expedicion,
+                            doc_numero, tipo_contribuyente, doc_fecha, codseg)
+        cdc_dv = self.calculate_dv(cdc)
+        cdc = "{}{}".format(cdc,cdc_dv)
+        return cdc, cdc_dv
+
+    def cdc_base(self,
+                 tipo_doc, 
+                 ruc_empresa,
+                 ruc_dv,
+                 establecimiento,
+                 expedicion,
+                 doc_numero,
+                 tipo_contribuyente,
+                 doc_fecha,
+                 codseg):
+        """Los 43 digitos del CDC sin el digito verificador"""
         cdc = [
                str(tipo_doc).zfill(2), 
-               ruc_empresa,
+               str(ruc_empresa).zfill(8),
                ruc_dv,
                str(establecimiento).zfill(3),
                str(expedicion).zfill(3),
@@ -81,11 +98,24 @@ class Gdata:
                1,
                str(codseg).zfill(9)
         ]
-        cdc = map(lambda x: str(x), cdc)
-        cdc = ''.join(cdc)
-        cdc_dv = self.calculate_dv(cdc)
-        cdc = "{}{}".format(cdc,cdc_dv)
-        return cdc, cdc_dv
+        return ''.join(map(lambda x: str(x), cdc))
+
+    def calculate_dv_batch(self, values, base_max=11):
+        """
+            calculate_dv (modulo 11) para una lista de cadenas numericas de igual largo
+            en una sola operacion de numpy, las que no cumplen se calculan una por una
+        """
+        if not values:
+            return []
+        width = len(values[0])
+        if any(len(v) != width or not v.isdigit() for v in values):
+            return [ self.calculate_dv(v, base_max=base_max) for v in values ]
+        digits = (np.frombuffer(''.join(values).encode('ascii'), dtype=np.uint8) - 48).reshape(len(values), width)
+        #pesos 2..base_max de derecha a izquierda, como calculate_dv
+        weights = 2 + np.arange(width) % (base_max - 1)
+        total = digits[:, ::-1].astype(np.int64) @ weights
+        rr = total % 11
+        return np.where(rr > 1, 11 - rr, 0).tolist()
 
     def format_qr(self, digest, pedobj: DocumentHeader):
         qpd = 'nVersion={}&Id={}&dFeEmiDE={}&dRucRec={}&dTotGralOpe={}&dTotIVA={}&cItems={}&DigestValue={}&IdCSC={}'
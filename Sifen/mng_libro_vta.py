@@ -0,0 +1,183 @@
+"""
+Libro de ventas.
+
+Los importes de cada documento (gravadas, IVA, exenta, total con redondeo y
+retención) salen de una sola consulta anotada sobre DocumentHeader
+(with_totals) recorrida con iterator. La planilla se escribe con openpyxl en
+modo write-only con estilos con nombre, la memoria usada no depende de la
+cantidad de documentos del periodo.
+"""
+import os
+import logging
+from decimal import Decimal
+
+from django.db.models import F, Value, DecimalField
+from django.db.models.functions import Coalesce
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, Border, Side
+
+from OptsIO import io_styles
+from Sifen.models import DocumentHeader
+
+logger = logging.getLogger(__name__)
+
+AMOUNT = DecimalField(max_digits=19, decimal_places=6)
+COLUMNS = (
+    'dia', 'doc_numero', 'pdv_cliente',
+    'pdv_codigo', 'gravada_10', 'gravada_5',
+    'iva_10', 'iva_5', 'exento',
+    'total', 'redondeo', 'retencion',
+)
+#Celda, titulo y ancho de la cabecera de dos filas
+HEADER = (
+    ('A7', 'Dia', 5.62),
+    ('B7', 'Documento Numero', 10.15),
+    ('C7', 'Cliente de Bienes y Servic', 23.90),
+    ('C8', 'R.Soc/Apell./Nomb', 19.31),
+    ('D8', 'RUC', 10.31),
+    ('E7', 'Valores de ventas y servicios', 40.50),
+    ('E8', 'Grav 10%', 12.69),
+    ('F8', 'Grav 5%', 12.69),
+    ('G8', 'Iva 10%', 12.69),
+    ('H8', 'Iva 5%', 12.69),
+    ('I8', 'Exento', 12.69),
+    ('J8', 'Total', 12.69),
+    ('K7', 'Redondeo', 12.69),
+    ('L7', 'Retencion', 12.69),
+)
+MERGED = ('A2:C2', 'A3:C3', 'A4:F4', 'A5:K5', 'A7:A8', 'B7:B8', 'K7:K8', 'L7:L8', 'C7:D7', 'E7:J7')
+HEADER_ROWS = 8
+
+
+class LibroVentas:
+    CHUNK_SIZE = 2000
+
+    def __init__(self, bsobj, dbcon='default'):
+        self.bsobj = bsobj
+        self.dbcon = dbcon or 'default'
+
+    def filters(self, q: dict) -> dict:
+        pps = {
+            'doc_fecha__range': (q.get('qs_doc_fecha_0'), q.get('qs_doc_fecha_1')),
+            'doc_tipo__in': ['FE', 'AF']
+        }
+        qs_doc_tipo = q.get('qs_doc_tipo')
+        qs_cobranza = q.get('qs_cobranza')
+        qs_clientecodigo_id = q.get('qs_clientecodigo_id')
+        if qs_doc_tipo:
+            pps.pop('doc_tipo__in', None)
+            pps['doc_tipo'] = qs_doc_tipo
+        if qs_cobranza:
+            if qs_cobranza == 'pendiente_cobro':
+                pps['doc_saldo__gt'] = 0
+            else:
+                pps['doc_saldo'] = 0
+        if qs_clientecodigo_id:
+            pps['pdv_codigo'] = qs_clientecodigo_id
+        return pps
+
+    def queryset(self, pps: dict):
+        """
+            Una fila por documento con todos los importes del libro.
+            total = exenta + base 5% + iva 5% + base 10% + iva 10% - redondeo
+            (mismo resultado que get_total_operacion_redondeo)
+        """
+        return DocumentHeader.objects.using(self.dbcon)\
+                    .filter(**pps)\
+                    .with_totals()\
+                    .annotate(lv_total=F('tot_exenta') + F('tot_base_gravada_5_all') + F('tot_iva_5')
+                                       + F('tot_base_gravada_10_all') + F('tot_iva_10') - F('doc_redondeo'),
+                              lv_retencion=Coalesce(F('retencionobj__retencion'), Value(0), output_field=AMOUNT))\
+                    .order_by('doc_numero', 'doc_fecha')\
+                    .values('pk', 'doc_op', 'doc_fecha', 'doc_establecimiento', 'doc_expedicion', 'doc_numero',
+                            'pdv_nombrefactura', 'pdv_ruc', 'doc_redondeo',
+                            'tot_gravada_10', 'tot_gravada_5', 'tot_iva_10', 'tot_iva_5', 'tot_exenta',
+                            'lv_total', 'lv_retencion')
+
+    def doc_row(self, r: dict) -> list:
+        if r['doc_op'] == 'RS':
+            #Las devoluciones se calculan por detalle en el modelo
+            docobj = DocumentHeader.objects.using(self.dbcon).get(pk=r['pk'])
+            gravada_10, gravada_5, exento = docobj.get_total_gravada_10(), docobj.get_total_gravada_5(), docobj.get_total_exenta()
+            total = docobj.get_total_operacion_redondeo()
+        else:
+            gravada_10, gravada_5, exento = r['tot_gravada_10'], r['tot_gravada_5'], r['tot_exenta']
+            total = r['lv_total']
+        return [
+            r['doc_fecha'].day,
+            '{}-{}-{}'.format(str(r['doc_establecimiento']).zfill(3),
+                              str(r['doc_expedicion']).zfill(3),
+                              str(r['doc_numero']).zfill(7)),
+            r['pdv_nombrefactura'],
+            r['pdv_ruc'],
+            gravada_10,
+            gravada_5,
+            r['tot_iva_10'],
+            r['tot_iva_5'],
+            exento,
+            total,
+            r['doc_redondeo'],
+            r['lv_retencion'] or Decimal(0),
+        ]
+
+    def rows(self, qs):
+        for r in qs.iterator(chunk_size=self.CHUNK_SIZE):
+            yield self.doc_row(r)
+
+    def named_styles(self, wb):
+        border_style = 'thin'
+        side = Side(border_style=border_style, color="000000")
+        fog = Font(name='Verdana', size=7, bold=False, italic=False,
+                   vertAlign=None, underline='none', strike=False)
+        styles = {
+            'lv_text': NamedStyle(name='lv_text', font=fog, alignment=io_styles.left_alignment()),
+            'lv_title': NamedStyle(name='lv_title',
+                                   font=io_styles.title_font(font='Verdana', size=7),
+                                   fill=io_styles.title_fill(color="D8D8D8"),
+                                   alignment=io_styles.center_alignment()),
+            'lv_cell': NamedStyle(name='lv_cell', font=fog, alignment=io_styles.left_alignment(),
+                                  border=Border(left=side, right=side, top=side, bottom=side)),
+        }
+        for ns in styles.values():
+            wb.add_named_style(ns)
+        return styles
+
+    def cell(self, ws, value=None, style='lv_text'):
+        c = WriteOnlyCell(ws, value=value)
+        c.style = style
+        return c
+
+    def write(self, fpath: str, sname: str, title: str, rows) -> int:
+        """Escribe la planilla en fpath, retorna la cantidad de documentos"""
+        wb = Workbook(write_only=True)
+        self.named_styles(wb)
+        ws = wb.create_sheet(title=sname)
+        ws.sheet_view.showGridLines = False
+        for cc, _col, width in HEADER:
+            ws.column_dimensions[cc[0]].width = width
+        for mc in MERGED:
+            ws.merged_cells.add(mc)
+
+        ws.append([])
+        ws.append([self.cell(ws, f'Razon Social: {self.bsobj.nombrefactura}')])
+        ws.append([self.cell(ws, f'Ruc: {self.bsobj.ruc}-{self.bsobj.ruc_dv}')])
+        ws.append([self.cell(ws, f'Direccion: {self.bsobj.direccion}')])
+        ws.append([self.cell(ws, title, 'lv_title')] + [ self.cell(ws, style='lv_title') for _ in range(10) ])
+        ws.append([])
+        headers = { cc: col for cc, col, _width in HEADER }
+        for hrow in (7, 8):
+            ws.append([ self.cell(ws, headers.get(f'{c}{hrow}'), 'lv_cell') for c in 'ABCDEFGHIJKL' ])
+
+        #En write-only cada fila se serializa al agregarla, las celdas con estilo se reutilizan
+        dcells = [ self.cell(ws, style='lv_cell') for _ in COLUMNS ]
+        count = 0
+        for row in rows:
+            for c, value in zip(dcells, row):
+                c.value = value
+            ws.append(dcells)
+            count += 1
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        wb.save(fpath)
+        logger.info(f'Libro de ventas {sname}: {count} documentos en {fpath}')
+        return count
@@ -28,9 +28,6 @@ class Morders:
     def generate_pmeta(self, *args, **kwargs):
         """Generate data that is need it by the SET"""
         logging.info('Running generate_pmeta')
-        onum = re.compile('^[A-Za-z]+|\.|\s+|\-')
-        ahoran = datetime.now()
-        ahoras = ahoran.strftime('%Y-%m-%d')
         qdict = kwargs.get('qdict')
         ped_nu = qdict.get('prof_number')
         ruc = qdict.get('ruc')
@@ -55,21 +52,84 @@ class Morders:
             else:
                 error_gen = False
             logging.info('Generate cod_seg {}'.format(codseg))
-        
-        if pedobj.doc_tipo == 'FE':
-            tipo_doc = '01'
-            tipo_doc_desc = u'Factura electrónica'
-        if pedobj.doc_tipo == 'NC':
-            tipo_doc = '05'
-            tipo_doc_desc = u'Nota de crédito electrónica'
-        if pedobj.doc_tipo == 'ND':
-            tipo_doc = '06'
-            tipo_doc_desc = u'Nota de débito electrónica'
-        if pedobj.doc_tipo == 'AF':
-            tipo_doc = '04'
-            tipo_doc_desc = u' Autofactura electrónica'
-            
-        cdc, cdc_dv = mgdata.gen_cdc(
+        cdc, cdc_dv = mgdata.gen_cdc(*self.cdc_parts(pedobj, eobj, codseg))
+        logging.info('Set CDC {}'.format(cdc))
+        self.set_pmeta(pedobj, cdc, cdc_dv, codseg)
+        pedobj.save()
+        if pedobj.doc_tipo in ['NC', 'ND']:
+            #Set the relationship of the document
+            #If this faild the process can not go on
+            rpedobj = DocumentHeader.objects.filter(prof_number=pedobj.doc_loop_link)
+            if not rpedobj:
+                return {'error': 'Sin relacion valida', 'msg': self.relacion_error(pedobj)}
+            self.set_relacion(pedobj, rpedobj.last())
+            pedobj.save()
+        return {'exitos': 'Hecho'}
+
+    def generate_pmeta_batch(self, prof_numbers, ruc):
+        """
+            generate_pmeta para un bloque de documentos del mismo emisor:
+            los codigos de seguridad se reservan con un bulk_create (verificando que no
+            existan en CSeg), el DV de todos los CDC se calcula vectorizado y las
+            cabeceras se guardan con un solo bulk_update
+        """
+        logging.info(f'Running generate_pmeta_batch for {len(prof_numbers)} documents')
+        eobj = Business.objects.select_related('contribuyenteobj').get(ruc=ruc)
+        pedobjs = list(DocumentHeader.objects.filter(prof_number__in=prof_numbers).order_by('pk'))
+        if not pedobjs:
+            return {'exitos': 'Hecho', 'errors': {}}
+        mgdata = mng_gmdata.Gdata()
+        codsegs = self.reserve_codsegs(pedobjs, mgdata)
+        cdcs = [ mgdata.cdc_base(*self.cdc_parts(pedobj, eobj, codseg)) for pedobj, codseg in zip(pedobjs, codsegs) ]
+        dvs = mgdata.calculate_dv_batch(cdcs)
+        links = [ p.doc_loop_link for p in pedobjs if p.doc_tipo in ['NC', 'ND'] ]
+        rpedobjs = {}
+        if links:
+            rpedobjs = { str(r.prof_number): r for r in DocumentHeader.objects.filter(prof_number__in=links).order_by('pk') }
+        errors = {}
+        for pedobj, cdc, dv, codseg in zip(pedobjs, cdcs, dvs, codsegs):
+            self.set_pmeta(pedobj, f'{cdc}{dv}', dv, codseg)
+            if pedobj.doc_tipo in ['NC', 'ND']:
+                rpedobj = rpedobjs.get(str(pedobj.doc_loop_link))
+                if not rpedobj:
+                    errors[str(pedobj.prof_number)] = self.relacion_error(pedobj)
+                    continue
+                self.set_relacion(pedobj, rpedobj)
+        DocumentHeader.objects.bulk_update(pedobjs, self.PMETA_FIELDS + self.RELACION_FIELDS, batch_size=500)
+        return {'exitos': 'Hecho', 'errors': errors}
+
+    def reserve_codsegs(self, pedobjs, mgdata):
+        """Un codigo de seguridad por documento, sin repetir dentro del bloque ni contra CSeg"""
+        codsegs = set()
+        while len(codsegs) < len(pedobjs):
+            candidates = { str(mgdata.gen_codseg()).zfill(9) for _ in range(len(pedobjs) - len(codsegs)) }
+            candidates -= codsegs
+            taken = set(CSeg.objects.filter(codigo_seguridad__in=candidates).values_list('codigo_seguridad', flat=True))
+            codsegs |= candidates - taken
+        codsegs = list(codsegs)
+        CSeg.objects.bulk_create([
+            CSeg(codigo_seguridad=codseg, asignado_model='DocumentHeader', asignado_doc=pedobj.pk)
+            for pedobj, codseg in zip(pedobjs, codsegs)
+        ], batch_size=1000)
+        return codsegs
+
+    TIPO_DOC = {
+        'FE': ('01', u'Factura electrónica'),
+        'NC': ('05', u'Nota de crédito electrónica'),
+        'ND': ('06', u'Nota de débito electrónica'),
+        'AF': ('04', u' Autofactura electrónica'),
+    }
+    PMETA_FIELDS = ['impx_doc_num', 'impx_nombre', 'impx_cargo', 'doc_tipo_imp', 'doc_tipo_imp_desc',
+                    'doc_tipo_ope', 'doc_tipo_ope_desc', 'doc_op_pres_cod', 'doc_op_pres',
+                    'ek_cdc', 'ek_cdc_dv', 'ek_cod_seg', 'doc_tipo_cod', 'doc_tipo_desc',
+                    'impx_tdoc_cod', 'impx_tdoc_nam']
+    RELACION_FIELDS = ['doc_relacion_cod', 'doc_relacion', 'doc_relacion_cdc', 'doc_relacion_timbrado',
+                       'doc_relacion_establecimiento', 'doc_relacion_expedicion', 'doc_relacion_tipo_cod',
+                       'doc_relacion_tipo', 'doc_relacion_fecha']
+
+    def cdc_parts(self, pedobj, eobj, codseg):
+        tipo_doc, tipo_doc_desc = self.TIPO_DOC[pedobj.doc_tipo]
+        return (
             tipo_doc, 
             eobj.ruc,
             eobj.ruc_dv,
@@ -80,7 +140,9 @@ class Morders:
             pedobj.doc_fecha,
             codseg
         )
-        logging.info('Set CDC {}'.format(cdc))
+
+    def set_pmeta(self, pedobj, cdc, cdc_dv, codseg):
+        tipo_doc, tipo_doc_desc = self.TIPO_DOC[pedobj.doc_tipo]
         if pedobj.impx_nombre == 'ND' or pedobj.impx_nombre == 'GENERICO' or not pedobj.impx_nombre:
             pedobj.impx_doc_num = '00000000'
             pedobj.impx_nombre = 'GENERICO'
@@ -90,7 +152,6 @@ class Morders:
         if pedobj.doc_i5 or pedobj.doc_i10:
             pedobj.doc_tipo_imp = 1
             pedobj.doc_tipo_imp_desc =  u'IVA'
-        correos = []
         if not pedobj.doc_tipo_ope:
             pedobj.doc_tipo_ope =  1
             pedobj.doc_tipo_ope_desc =  u'Venta de mercadería'
@@ -107,42 +168,38 @@ class Morders:
         pedobj.impx_tdoc_nam = u'Cédula paraguaya'
         #pedobj.doc_cre_tipo_cod = 2 if pedobj.forma_pago_set == 'CREDITO' else 1
         #pedobj.cre_tipo = u"Crédito" if pedobj.forma_pago_set == 'CREDITO' else "Contado"
-        pedobj.save()
-        if pedobj.doc_tipo in ['NC', 'ND']:
-            #Set the relationship of the document
-            #If this faild the process can not go on
-            rpedobj = DocumentHeader.objects.filter(prof_number=pedobj.doc_loop_link)
-            if not rpedobj:
-                msg = u'<li>[DE] El pedido {} del cliente {}[{}] no tiene una relacion valida {}</li>'.format(
-                                pedobj.prof_number,
-                                pedobj.pdv_nombrefactura,
-                                pedobj.pdv_codigo,
-                                pedobj.doc_loop_link
-                            )
-                return {'error': 'Sin relacion valida', 'msg': msg}
-            rpedobj = rpedobj.last()
-            pedobj.doc_relacion_cod = 1
-            pedobj.doc_relacion = 'Electrónico'
-            pedobj.doc_relacion_cdc = rpedobj.ek_cdc
-            pedobj.doc_relacion_timbrado = rpedobj.ek_timbrado
-            pedobj.doc_relacion_establecimiento = rpedobj.doc_establecimiento
-            pedobj.doc_relacion_expedicion = rpedobj.doc_expedicion
+        return pedobj
 
-            if rpedobj.doc_tipo in ['FE', 'FL']:
-                pedobj.doc_relacion_tipo_cod = 1
-                pedobj.doc_relacion_tipo = u'Factura'
-            if rpedobj.doc_tipo == 'NC':
-                pedobj.doc_relacion_tipo_cod = 2
-                pedobj.doc_relacion_tipo = u'Nota de crédito'
-            if rpedobj.doc_tipo == 'ND':
-                pedobj.doc_relacion_tipo_cod = 3
-                pedobj.doc_relacion_tipo = u'Nota de débito'
-            if rpedobj.doc_tipo == 'AF':
-                pedobj.doc_relacion_tipo_cod = 4
-                pedobj.doc_relacion_tipo = u'Nota de remisión'
-            pedobj.doc_relacion_fecha = rpedobj.doc_fecha.strftime('%Y-%m-%d')
-            pedobj.save()
-        return {'exitos': 'Hecho'}
+    def relacion_error(self, pedobj):
+        return u'<li>[DE] El pedido {} del cliente {}[{}] no tiene una relacion valida {}</li>'.format(
+                        pedobj.prof_number,
+                        pedobj.pdv_nombrefactura,
+                        pedobj.pdv_codigo,
+                        pedobj.doc_loop_link
+                    )
+
+    def set_relacion(self, pedobj, rpedobj):
+        pedobj.doc_relacion_cod = 1
+        pedobj.doc_relacion = 'Electrónico'
+        pedobj.doc_relacion_cdc = rpedobj.ek_cdc
+        pedobj.doc_relacion_timbrado = rpedobj.ek_timbrado
+        pedobj.doc_relacion_establecimiento = rpedobj.doc_establecimiento
+        pedobj.doc_relacion_expedicion = rpedobj.doc_expedicion
+
+        if rpedobj.doc_tipo in ['FE', 'FL']:
+            pedobj.doc_relacion_tipo_cod = 1
+            pedobj.doc_relacion_tipo = u'Factura'
+        if rpedobj.doc_tipo == 'NC':
+            pedobj.doc_relacion_tipo_cod = 2
+            pedobj.doc_relacion_tipo = u'Nota de crédito'
+        if rpedobj.doc_tipo == 'ND':
+            pedobj.doc_relacion_tipo_cod = 3
+            pedobj.doc_relacion_tipo = u'Nota de débito'
+        if rpedobj.doc_tipo == 'AF':
+            pedobj.doc_relacion_tipo_cod = 4
+            pedobj.doc_relacion_tipo = u'Nota de remisión'
+        pedobj.doc_relacion_fecha = rpedobj.doc_fecha.strftime('%Y-%m-%d')
+        return pedobj
 
     def compare_order_xml(self, *args, **kwargs):
         qdict = kwargs.get('qdict')
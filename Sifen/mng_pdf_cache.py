@@ -0,0 +1,166 @@
+"""
+Cache de PDFs de documentos (KuDE de DocumentHeader y recibos).
+
+Los documentos aprobados por SIFEN no cambian, el PDF se guarda en
+media/pdf_cache/<tipo>/<hash>.pdf donde el hash cubre el estado del
+documento (CDC, estado, totales), la versión de las plantillas y el
+branding del negocio. Cualquier cambio (una cancelación, otra plantilla,
+otro CSS) produce otra clave y el PDF se vuelve a generar; la entrada
+anterior del mismo documento se elimina al guardar la nueva.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.forms import model_to_dict
+from django.template.loader import get_template
+
+from Sifen.models import Business, DocumentReciboDetail
+
+logger = logging.getLogger(__name__)
+
+#Estados finales de SIFEN, el documento ya no cambia
+PDF_CACHE_ESTADOS = ('Aprobado', 'Cancelado', 'Inutilizado')
+#Subir para descartar todo el cache (p.ej. plantillas incluidas con un nombre variable)
+PDF_CACHE_VERSION = os.environ.get('SIFEN_PDF_CACHE_VERSION', '1')
+#Campos de DocumentRecibo que no se imprimen, marcar el envio al cliente no regenera el PDF
+RECIBO_KEY_EXCLUDE = ['pdf_file', 'enviado_cliente', 'enviado_cliente_fecha', 'cargado_fecha', 'cargado_usuario',
+                      'actualizado_fecha', 'actualizado_usuario']
+TEMPLATE_REFS = re.compile(rb'{%\s*(?:include|extends)\s+["\']([^"\']+)["\']')
+
+
+def digest(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class PdfCache:
+    """PDFs direccionados por el contenido del documento."""
+
+    def __init__(self, root=None, cache_alias='default'):
+        self.root = root or os.path.join(settings.MEDIA_ROOT, 'pdf_cache')
+        self.cache = caches[cache_alias]
+        self._lock = threading.Lock()
+        # (path, mtime, size) -> (sha256, plantillas incluidas)
+        self._templates = {}
+
+    def template_file(self, name):
+        path = get_template(name).origin.name
+        st = os.stat(path)
+        tkey = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            tinfo = self._templates.get(tkey)
+        if tinfo is None:
+            with open(path, 'rb') as fh:
+                src = fh.read()
+            refs = [ r.decode('utf-8') for r in TEMPLATE_REFS.findall(src) ]
+            tinfo = (hashlib.sha256(src).hexdigest(), refs)
+            with self._lock:
+                self._templates[tkey] = tinfo
+        return tinfo
+
+    def template_version(self, *names) -> str:
+        """Hash de las plantillas y de las que incluyen o extienden por nombre literal"""
+        versions = {}
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in versions:
+                continue
+            version, refs = self.template_file(name)
+            versions[name] = version
+            pending.extend(refs)
+        return digest(versions)
+
+    def business_version(self, ruc) -> str:
+        bobj = Business.objects.filter(ruc=ruc).only('logo_invoice', 'css_invoice_content', 'actualizado_fecha').first()
+        if not bobj:
+            return ''
+        return digest([bobj.logo_invoice.name if bobj.logo_invoice else None,
+                       bobj.css_invoice_content,
+                       bobj.actualizado_fecha])
+
+    def header_key(self, docobj, templates, dattrs=None):
+        """Clave de un DocumentHeader, None si el documento todavía puede cambiar"""
+        if docobj.ek_estado not in PDF_CACHE_ESTADOS:
+            return None
+        totals = { k: str(v) for k, v in docobj.get_totals().items() }
+        return digest({
+            'v': PDF_CACHE_VERSION,
+            'kind': 'documentheader',
+            'pk': docobj.pk,
+            'cdc': docobj.ek_cdc,
+            'estado': docobj.ek_estado,
+            'anulado': docobj.anulado_fecha,
+            'totals': digest(totals),
+            'tmpl': self.template_version(*templates),
+            'bs': self.business_version(docobj.ek_bs_ruc),
+            'dattrs': dattrs,
+        })
+
+    def recibo_key(self, recobj, templates, dattrs=None):
+        """Clave de un DocumentRecibo, cubre la cabecera y sus detalles"""
+        details = list(DocumentReciboDetail.objects.filter(recobj=recobj)
+                                                   .order_by('pk')
+                                                   .values_list('tipo', 'numero', 'cobrado', 'total', 'saldo', 'retencion'))
+        return digest({
+            'v': PDF_CACHE_VERSION,
+            'kind': 'documentrecibo',
+            'doc': model_to_dict(recobj, exclude=RECIBO_KEY_EXCLUDE),
+            'details': details,
+            'tmpl': self.template_version(*templates),
+            'dattrs': dattrs,
+        })
+
+    def path(self, kind, key):
+        return os.path.join(self.root, kind, f'{key}.pdf')
+
+    def url(self, kind, key):
+        return f'{settings.MEDIA_URL}pdf_cache/{kind}/{key}.pdf'
+
+    def get(self, kind, key):
+        """Path del PDF cacheado o None"""
+        if not key:
+            return None
+        path = self.path(kind, key)
+        if os.path.exists(path):
+            logger.info(f'PDF cache hit {kind} {key}')
+            return path
+        return None
+
+    def put(self, kind, pk, key, pdf_file):
+        """Copia pdf_file al cache y elimina la version anterior del mismo documento"""
+        if not key:
+            return None
+        path = self.path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        shutil.copyfile(pdf_file, tmp)
+        os.replace(tmp, path)
+        ikey = f'pdf_cache:{kind}:{pk}'
+        previous = self.cache.get(ikey)
+        if previous and previous != key:
+            self.discard(kind, previous)
+        self.cache.set(ikey, key, None)
+        return path
+
+    def discard(self, kind, key):
+        try:
+            os.remove(self.path(kind, key))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, kind, pk):
+        ikey = f'pdf_cache:{kind}:{pk}'
+        previous = self.cache.get(ikey)
+        if previous:
+            self.discard(kind, previous)
+            self.cache.delete(ikey)
+
+
+pdf_cache = PdfCache()
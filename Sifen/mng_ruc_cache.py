@@ -0,0 +1,149 @@
+"""
+Cache de consultas de RUC contra SIFEN (siConsRUC).
+
+Orden de resolución:
+- Cache de Django/Redis (clave sifen_ruc:{ruc})
+- Tabla RucQr, la última consulta dentro del TTL
+- SIFEN, una sola consulta por RUC aunque varios hilos lo pidan a la vez
+
+Las respuestas negativas (RUC no encontrado) se guardan sólo en el cache
+de Django y con un TTL más corto.
+"""
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.core.cache import caches
+
+from Sifen.models import RucQr
+from Sifen.fl_sifen_conf import RUC_CACHE_TTL, RUC_CACHE_NEG_TTL, RUC_LOCK_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+RUC_FOUND = 'RUC encontrado'
+RUC_FIELDS = ('dcodres', 'dmsgres', 'druccons', 'drazcons', 'dcodestcons', 'ddesestcons', 'drucfactelec')
+
+
+class RucCache:
+    """Resuelve RUCs con TTL y deduplica consultas concurrentes."""
+
+    def __init__(self, ttl=RUC_CACHE_TTL, neg_ttl=RUC_CACHE_NEG_TTL, cache_alias='default'):
+        self.ttl = ttl
+        self.neg_ttl = neg_ttl
+        self.cache = caches[cache_alias]
+        self._lock = threading.Lock()
+        # ruc -> threading.Event de la consulta en curso en este proceso
+        self._inflight = {}
+        self._stats = {'cache': 0, 'db': 0, 'sifen': 0, 'shared': 0, 'errors': 0}
+
+    def cache_key(self, ruc):
+        return f'sifen_ruc:{ruc}'
+
+    def _count(self, tier):
+        with self._lock:
+            self._stats[tier] += 1
+
+    def stats(self) -> dict:
+        """Contadores por nivel y ratio de aciertos (todo lo que no fue a SIFEN)."""
+        with self._lock:
+            st = dict(self._stats)
+        total = st['cache'] + st['db'] + st['sifen'] + st['shared']
+        hits = total - st['sifen']
+        st['total'] = total
+        st['hit_ratio'] = round(hits / total, 4) if total else 0.0
+        return st
+
+    def reset_stats(self):
+        with self._lock:
+            for k in self._stats:
+                self._stats[k] = 0
+
+    def invalidate(self, ruc):
+        self.cache.delete(self.cache_key(str(ruc).strip()))
+
+    def from_db(self, ruc):
+        """Última respuesta positiva de RucQr dentro del TTL."""
+        limit = datetime.now() - timedelta(seconds=self.ttl)
+        robj = RucQr.objects.filter(druccons=ruc, dmsgres=RUC_FOUND, process_date__gte=limit)\
+                            .order_by('-process_date')\
+                            .first()
+        if not robj:
+            return None
+        return {f: getattr(robj, f) for f in RUC_FIELDS}
+
+    def store(self, ruc, rsp):
+        if not isinstance(rsp, dict) or not rsp.get('dmsgres'):
+            return
+        ttl = self.ttl if rsp.get('dmsgres') == RUC_FOUND else self.neg_ttl
+        self.cache.set(self.cache_key(ruc), {f: rsp.get(f) for f in RUC_FIELDS}, ttl)
+
+    def get(self, ruc, fetch):
+        """
+        Retorna la respuesta de siConsRUC para ruc.
+        fetch(ruc) es la consulta real a SIFEN, sólo se ejecuta en un miss.
+        """
+        ruc = str(ruc).strip()
+        rsp = self.cache.get(self.cache_key(ruc))
+        if rsp is not None:
+            self._count('cache')
+            return rsp
+        rsp = self.from_db(ruc)
+        if rsp is not None:
+            self._count('db')
+            self.store(ruc, rsp)
+            return rsp
+        with self._lock:
+            event = self._inflight.get(ruc)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self._inflight[ruc] = event
+        if not owner:
+            # Otro hilo ya está consultando este RUC
+            event.wait(RUC_LOCK_TIMEOUT)
+            rsp = self.cache.get(self.cache_key(ruc))
+            if rsp is not None:
+                self._count('shared')
+                return rsp
+            return self.get_remote(ruc, fetch)
+        try:
+            return self.get_remote(ruc, fetch)
+        finally:
+            with self._lock:
+                self._inflight.pop(ruc, None)
+            event.set()
+
+    def get_remote(self, ruc, fetch):
+        """Consulta SIFEN con un lock en el cache compartido para no repetir la consulta entre procesos."""
+        lkey = f'{self.cache_key(ruc)}:lock'
+        token = uuid.uuid4().hex
+        acquired = self.cache.add(lkey, token, RUC_LOCK_TIMEOUT)
+        if not acquired:
+            deadline = time.monotonic() + RUC_LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(0.2)
+                rsp = self.cache.get(self.cache_key(ruc))
+                if rsp is not None:
+                    self._count('shared')
+                    return rsp
+                if self.cache.add(lkey, token, RUC_LOCK_TIMEOUT):
+                    acquired = True
+                    break
+        try:
+            self._count('sifen')
+            try:
+                rsp = fetch(ruc)
+            except Exception as e:
+                self._count('errors')
+                logger.error(f'Error consultando RUC {ruc} en SIFEN: {e}')
+                raise
+            self.store(ruc, rsp)
+            return rsp
+        finally:
+            #Solo se libera el lock propio, si expiro puede ser de otro proceso
+            if acquired and self.cache.get(lkey) == token:
+                self.cache.delete(lkey)
+
+ruc_cache = RucCache()
@@ -1,8 +1,7 @@
 import uuid, os
 import requests
-import pandas as pd
 from zoneinfo import ZoneInfo
-from collections import namedtuple, OrderedDict
+from collections import namedtuple
 from decimal import Decimal
 import arrow, os, logging
 from datetime import datetime, date, timedelta
@@ -10,26 +9,25 @@ from OptsIO.io_decorators import tracktask
 from OptsIO.io_serial import IoS
 from OptsIO.io_rpt import IoRpt
 from OptsIO.io_json import to_json, from_json
-from OptsIO import io_styles
 from typing import Literal, Union
 from django.contrib.auth.models import User
 from django.http import QueryDict, HttpRequest
 from django.forms import model_to_dict
+from django.db import transaction
 from django.db.models import Sum
 from django.core.files import File
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.conf import settings
 from Sifen.models import DocumentHeader, DocumentDetail, Business, Etimbrado, Eestablecimiento, DocumentRecibo, DocumentReciboDetail, Departamentos, Distrito, Ciudades, Retencion, Cotizacion, Producto, Clientes
-from Sifen import fl_sifen_conf, ekuatia_serials, e_kude, mng_gmdata
+from Sifen import fl_sifen_conf, ekuatia_serials, e_kude, mng_gmdata, mng_libro_vta
+from Sifen.mng_pdf_cache import pdf_cache
+from Sifen.mng_ventas_diarias import ventas_diarias
 from OptsIO.models import UserProfile, UserBusiness
 from Finance import f_calcs
 from celery.execute import send_task
 #from django.utils.html import strip_tags
 from num2words import num2words
-from openpyxl import Workbook
-from openpyxl.styles import Font, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
 
 class MSifen:
     def __init__(self, userobj=None, business=None):
@@ -147,8 +145,8 @@ class MSifen:
                 'id': docpk,
                 'dattrs': to_json(dattrs)
         })
-        pdf_file = f'{settings.BASE_DIR}/{d_pdf.get("pdf_file")}'
-        logging.info(f'PDF generado en {pdf_file}')
+        pdf_file = d_pdf.get('pdf_path') or f'{settings.BASE_DIR}/{d_pdf.get("pdf_file")}'
+        logging.info(f'PDF generado en {pdf_file} cache={d_pdf.get("cached")}')
         xml_file = docobj.ek_xml_file_signed.path
         tp_l = {
             "tipo": tipo,
@@ -243,8 +241,8 @@ class MSifen:
                 'id': docpk,
                 'dattrs': to_json(dattrs)
         })
-        pdf_file = f'{settings.BASE_DIR}/{d_pdf.get("pdf_file")}'
-        logging.info(f'PDF generado en {pdf_file}')
+        pdf_file = d_pdf.get('pdf_path') or f'{settings.BASE_DIR}/{d_pdf.get("pdf_file")}'
+        logging.info(f'PDF generado en {pdf_file} cache={d_pdf.get("cached")}')
         xml_file = docobj.ek_xml_file_signed.path
         tp_l = {
             "tipo": tipo,
@@ -351,6 +349,7 @@ class MSifen:
                 return {'error': '\n'.join(perrs)}
         return {'success': 'Hecho'}
 
+    @ventas_diarias.batch()
     def crear_documentheader(self, *args: list, **kwargs: dict) -> tuple:
         ios = IoS()
         eser = ekuatia_serials.Eserial()
@@ -733,6 +732,18 @@ class MSifen:
         id =  q.get('id')
         dattrs = q.get('dattrs')
         docobj = DocumentHeader.objects.using(dbcon).get(id=id)
+        #Documento en estado final: servir el PDF cacheado si el estado no cambio
+        ckey = pdf_cache.header_key(docobj, ['Sifen/DocumentHeaderRptUi.html', 'BaseAmReportUi.html'], dattrs)
+        cached = pdf_cache.get('documentheader', ckey)
+        if cached:
+            pdf_media_url = pdf_cache.url('documentheader', ckey)
+            return {'success': f'Pdf del documento {docobj.id} creado con exito',
+                    'pdf_file': pdf_media_url,
+                    'pdf_path': cached,
+                    'ek_pdf_file': pdf_media_url,
+                    'html_file': None,
+                    'cached': True
+                }
         mq = QueryDict(mutable=True)
         fv = {''
             'tmpl': 'Sifen/DocumentHeaderRptUi.html',
@@ -777,13 +788,17 @@ class MSifen:
         # We need to return: /media/rpt/12345.pdf
         pdf_filename = os.path.basename(pdf_file)
         pdf_media_url = f'{settings.MEDIA_URL}rpt/{pdf_filename}'
+        pdf_cache.put('documentheader', docobj.pk, ckey, pdf_file)
 
         return {'success': f'Pdf del documento {docobj.id} creado con exito',
                 'pdf_file': pdf_media_url,
+                'pdf_path': pdf_file,
                 'ek_pdf_file': pdf_media_url,
-                'html_file': rp.get('html_file')
+                'html_file': rp.get('html_file'),
+                'cached': False
             }
 
+    @ventas_diarias.batch()
     def crear_proforma(self,
             userobj,
             clientecodigo: int = 0,
@@ -1350,16 +1365,13 @@ class MSifen:
             msg = f'Pedido {headerobj.prof_number} firmado correctamente en archivo {headerobj.ek_xml_file_signed}'
             logging.info(msg)
 
-    def generar_pdf(self, prof_numbers: list):
+    def generar_pdf(self, prof_numbers: list, workers: int = None, merge: bool = False):
         ek = e_kude.EKude(fl_sifen_conf.RUC)
-        for prof_number in prof_numbers:
-            ret = ek.eprint_doc(None, 
-                        query_dict={'layout': 'full_page', 
-                                    'digital': 1, 
-                                    'set_name': 'factura_numero', 
-                                    'prof_number': prof_number}
-            )
-            #print(ret)
+        return ek.eprint_batch(prof_numbers,
+                               digital=1,
+                               set_name='factura_numero',
+                               merge=merge,
+                               workers=workers)
 
     def get_facturas_recibo(self, *args, **kwargs):
         facturas: list = kwargs.get('facturas', [])
@@ -1524,6 +1536,8 @@ class MSifen:
         #Actualizamos las facturas
         fobjs.update(doc_estado='CONCLUIDO', doc_saldo=0, forma_pago_id=forma_pago_id, forma_pago=forma_pago)
         ncobjs.update(doc_estado='CONCLUIDO', doc_saldo=0)
+        ventas_diarias.mark_queryset(fobjs)
+        ventas_diarias.mark_queryset(ncobjs)
         #actualizamos los totales
         total_fe = recobj.documentrecibodetail_set.filter(tipo='FE').aggregate(total=Sum('total')).get('total')
         total_nc = recobj.documentrecibodetail_set.filter(tipo='NC').aggregate(total=Sum('total')).get('total')
@@ -1562,6 +1576,15 @@ class MSifen:
         id =  q.get('id')
         dattrs = q.get('dattrs')
         docobj = DocumentRecibo.objects.using(dbcon).get(id=id)
+        ckey = pdf_cache.recibo_key(docobj, ['Sifen/DocumentReciboRptUi.html', 'BaseAmReportUi.html'], dattrs)
+        cached = pdf_cache.get('documentrecibo', ckey)
+        if cached:
+            return {
+                'success': f'Pdf del documento {docobj.id} creado con exito',
+                'pdf_file': cached,
+                'html_file': None,
+                'cached': True
+            }
         mq = QueryDict(mutable=True)
         fv = {
             'tmpl': 'Sifen/DocumentReciboRptUi.html',
@@ -1594,10 +1617,12 @@ class MSifen:
         with open(pdf_file, 'rb') as f:
             docobj.pdf_file = File(f, name=os.path.basename(pdf_file))
             docobj.save()
+        pdf_cache.put('documentrecibo', docobj.pk, ckey, pdf_file)
         return {
             'success': f'Pdf del documento {docobj.id} creado con exito',
             'pdf_file': pdf_file,
-            'html_file': rp.get('html_file')
+            'html_file': rp.get('html_file'),
+            'cached': False
         }
     
     def search_factura_relacionada(self,*args, **kwargs):
@@ -1617,323 +1642,22 @@ class MSifen:
         return DocumentHeader.objects.filter(**qf).order_by('-doc_numero')[0:10]
 
     def rpt_libro_vta(self, *args: list, **kwargs: dict) -> dict:
-        fog = Font(name='Verdana',
-                     size=7,
-                     bold=False,
-                     italic=False,
-                     vertAlign=None,
-                     underline='none',
-                     strike=False,
-                     )    
-        border_style = 'thin'
-        l_border = Border(
-            left=Side(border_style=border_style, color="000000"),
-        )
-        r_border = Border(
-            right=Side(border_style=border_style, color="000000"),
-        )
-        b_border = Border(
-            bottom=Side(border_style=border_style, color="000000"),
-        )
-        t_border = Border(
-            top=Side(border_style=border_style, color="000000"),
-        )
-        lb_border = Border(
-            left=Side(border_style=border_style, color="000000"),
-            bottom=Side(border_style=border_style, color="000000")
-        )
-
-        rb_border = Border(
-            right=Side(border_style=border_style, color="000000"),
-            bottom=Side(border_style=border_style, color="000000")
-        )
-        lt_border = Border(
-            left=Side(border_style=border_style, color="000000"),
-            top=Side(border_style=border_style, color="000000")
-        )
-
-        rt_border = Border(
-            right=Side(border_style=border_style, color="000000"),
-            top=Side(border_style=border_style, color="000000")
-        )
-        lr_border = Border(
-            left=Side(border_style=border_style, color="000000"),
-            right=Side(border_style=border_style, color="000000"),
-            
-        )
-        all_border = Border(
-            left=Side(border_style=border_style, color="000000"),
-            right=Side(border_style=border_style, color="000000"),
-            top=Side(border_style=border_style, color="000000"),
-            bottom=Side(border_style=border_style, color="000000")
-        )
-        ios = IoS()
-        userobj = kwargs.get('userobj')
         q: dict = kwargs.get('qdict', {})
         dbcon = q.get('dbcon')
-        #ejercicio = q.get('ejercicio')
-        #periodo = q.get('periodo')
         qs_doc_fecha_0 = q.get('qs_doc_fecha_0')
         qs_doc_fecha_1 = q.get('qs_doc_fecha_1')
 
         f_desce = arrow.get(qs_doc_fecha_0).format('DD/MM/YY')
         f_hasta = arrow.get(qs_doc_fecha_1).format('DD/MM/YY')
-        
-        ndata = []
         sname = f'ventas_{qs_doc_fecha_0}_{qs_doc_fecha_1}'.replace('-', '')
-        wb = Workbook()
-        razon_social = self.bsobj.nombrefactura
-
-        left_alignment = io_styles.left_alignment()
-        right_alignment = io_styles.right_alignment()
-        center_alignment = io_styles.center_alignment()
-        title_font = io_styles.title_font(font='Verdana', size=7)
-        title_fill = io_styles.title_fill(color="D8D8D8")
-        swei = wb.active
-        swei.title = sname
-        swei.merge_cells('A5:K5')
-        
-        swei['A5'] = f'LIBRO VENTAS DEL PERIODO {f_desce} AL {f_hasta}'
-        swei['A5'].font = title_font
-        swei['A5'].fill = title_fill
-        swei['A5'].alignment = center_alignment
-        swei.merge_cells('A2:C2')
-        razon_social = 'FRONTLINER S.A.'
-        swei['A2'] = f'Razon Social: {razon_social}'
-        #swei.merge_cells('A3:C3')
-        #swei['B2'] = razon_social
-        swei.merge_cells('A3:C3')
-        ruc = f'{self.bsobj.ruc}-{self.bsobj.ruc_dv}'
-        ruc = '80070523-8'
-        swei['A3'] = f'Ruc: {ruc}'
-        swei.merge_cells('A4:F4')
-        swei['A4'] = f'Direccion: {self.bsobj.direccion}'
-        #swei.merge_cells('A5:B5')
-        #swei['B4'] = self.bsobj.direccion
 
-        
-        swei = io_styles.set_sheet_auto_width(swei, start_row=1)
-        titles = [
-            'A6', 'B6', 'C6',
-            'D6', 'F6', 'G6',
-            'I6', 'J6'
-        ]
-
-        swei.merge_cells('A7:A8')
-        swei.merge_cells('B7:B8')
-        swei.merge_cells('K7:K8')
-        swei.merge_cells('L7:L8')
-        swei.merge_cells('C7:D7')
-        swei.merge_cells('E7:J7')
-
-        header_text = [
-            'A7', 'B7', 'C7', 'D7',
-            'E7', 'F7', 'G7', 'H7', 'I7',
-            'J7', 'K7','L7'
-        ]
-        for tt in titles:
-            swei[tt].font = title_font
-            swei[tt].alignment = left_alignment
-
-        for tt in header_text:
-            swei[tt].font = fog
-            swei[tt].alignment = center_alignment
-        swei.sheet_view.showGridLines = False
-        tc = {
-            'A7': {'col': 'Dia',  'start': 'A7', 'width': 5.62},
-            'B7': {'col': 'Documento Numero',  'start': 'B7', 'width': 10.15},
-            'C7': {'col': 'Cliente de Bienes y Servic',  'start': 'C7', 'width': 23.90},
-            'C8': {'col': 'R.Soc/Apell./Nomb',  'start': 'C8', 'width': 19.31},
-            'D8': {'col': 'RUC',  'start': 'D8', 'width': 10.31},
-            'E7': {'col': 'Valores de ventas y servicios',  'start': 'E7', 'width': 40.50},
-            'E8': {'col': 'Grav 10%',  'start': 'E8', 'width': 12.69},
-            'F8': {'col': 'Grav 5%',  'start': 'F8', 'width': 12.69},
-            'G8': {'col': 'Iva 10%',  'start': 'G8', 'width': 12.69},
-            'H8': {'col': 'Iva 5%',  'start': 'H8', 'width': 12.69},
-            'I8': {'col': 'Exento',  'start': 'I8', 'width': 12.69},
-            'J8': {'col': 'Total',  'start': 'J8', 'width': 12.69},
-            'K7': {'col': 'Redondeo',  'start': 'K7', 'width': 12.69},
-            'L7': {'col': 'Retencion',  'start': 'L7', 'width': 12.69},
-        }
-        for sc, t in tc.items():
-            cf = t.get('start')
-            swei[cf] = t.get('col')
-            swei[cf].font = fog
-            swei[cf].alignment = left_alignment
-            swei.column_dimensions[sc[0]].width = t.get('width') 
-
-        qs_doc_tipo = q.get('qs_doc_tipo')
-        qs_cobranza = q.get('qs_cobranza')
-        qs_clientecodigo_id = q.get('qs_clientecodigo_id')
-
-        pps = {
-            'doc_fecha__range': (qs_doc_fecha_0, qs_doc_fecha_1),
-            # 'doc_fecha__year': ejercicio, 
-            # 'doc_fecha__month': periodo, 
-            'doc_tipo__in': ['FE', 'AF']
-        }
-        if qs_doc_tipo:
-            pps.pop('doc_tipo__in', None)
-            pps['doc_tipo'] = qs_doc_tipo
-        if qs_cobranza:
-            if qs_cobranza == 'pendiente_cobro':
-                pps['doc_saldo__gt'] = 0
-            else:
-                pps['doc_saldo'] = 0
-        if qs_clientecodigo_id:
-            pps['pdv_codigo'] = qs_clientecodigo_id
-        for docobj in DocumentHeader.objects.filter(
-                        **pps
-                ).order_by('doc_numero', 'doc_fecha'):
-            ndata.append({
-                'dia': docobj.doc_fecha.day,
-                'doc_numero': docobj.get_number_full(),
-                'pdv_cliente': docobj.pdv_nombrefactura,
-                'pdv_codigo': docobj.pdv_ruc,
-                'gravada_10': docobj.get_total_gravada_10(),
-                'gravada_5': docobj.get_total_gravada_5(),
-                'iva_10': docobj.get_ivas_10_master(),
-                'iva_5': docobj.get_ivas_5_master(),
-                'exento': docobj.get_total_exenta(),
-                'total': docobj.get_total_operacion_redondeo(),
-                'redondeo': docobj.doc_redondeo,
-                'retencion': docobj.retencionobj.retencion if docobj.retencionobj else 0
-                
-            })
-        if not ndata:
+        lvta = mng_libro_vta.LibroVentas(self.bsobj, dbcon=dbcon)
+        qs = lvta.queryset(lvta.filters(q))
+        if not qs.exists():
             return {'error': f'Sin datos en el periodo {f_desce} al {f_hasta}'}
-        ncols = [
-            'dia','doc_numero','pdv_cliente',
-            'pdv_codigo','gravada_10','gravada_5',
-            'iva_10','iva_5','exento',
-            'total','redondeo','retencion',
-        ]
-        dfp = pd.DataFrame(ndata)
-        rows = dataframe_to_rows(dfp[ncols], index=False, header=False)
-        r_idx = 0
-        for r_idx, row in enumerate(rows, 9):
-            for c_idx, value in enumerate(row, 1):
-                # if c_idx == 8:
-                #     value = round(value, 3)                
-                # if c_idx == 9:
-                #     value = round(value, 2)
-                d = swei.cell(row=r_idx, column=c_idx, value=value)
-                d.font = fog
-                d.alignment = left_alignment
-                # if c_idx in [1, 3,4]:
-                #     d.alignment = center_alignment
-                # if c_idx in [7, 8, 9]:
-                #     d.alignment = right_alignment
-                d.border = all_border
-        lrow = r_idx
-        
-        # tcs = [
-        #     ('A{}:B{}', 'Master Airline:'),
-        #     ('A{}:B{}', 'Fecha Cierre:'),
-        #     ('A{}:B{}', 'Number of Bags:'),
-        #     ('A{}:B{}', 'TOTAL KG:'),
-        #     ('A{}:B{}', 'Fecha CBM:'),
-
-        # ]
-        # for tx, tc in enumerate(tcs):
-        #     lrow += 1
-        #     tr = tc[0].format(lrow, lrow)
-        #     swei.merge_cells(tr)
-        #     swei[tr.split(':')[0]] = tc[1]
-        # lrow += 1
-        # swei.merge_cells(f'A{lrow}:I{lrow}')
-        # swei[f'A{lrow}'] = 'Comment:'
-        # lrow += 1
-        # swei.merge_cells(f'A{lrow}:I{lrow+2}')
-
-        # swei[f'A{lrow}'] = f"""I, Diego Lopez, from {embobj.codoficina.nomoficina}, today, {MONTH} {DAY}st, hereby certify and confirm that ALL shipments prepared by {razon_social} are screened 100% and does not contains any dangerous goods or hazmat materials, nor any restricted or prohibited cargo for air shipping purposes as per IATA, ICAO, OACI or any other domestic and international regulations."""
-        
-
-        # lrow += 3
-        # swei.merge_cells(f'A{lrow}:I{lrow}')
-
-        # swei[f'A{lrow}'] = 'We also declare hereby, that ALL of our shipments are not subject to any export license processes and/or restrictions and they are declare as "EEI NO REQUIRED as per SEC. 30.37 (a) FTSR - EAR99 - NLR".'
-        # lrow += 1
-        # swei.merge_cells(f'A{lrow}:E{lrow}')
-        # swei[f'A{lrow}'] = 'Following the current IATA ICAO DG regulations, I hereby:'
-        # lrow += 1
-        # swei[f'A{lrow}'] = '(Check one)'
-        # lrow += 2
-        # swei[f'A{lrow}'] = 'YES'
-        # swei.merge_cells(f'B{lrow}:I{lrow}')
-        # swei[f'B{lrow}'] = 'CONFIRM this freight contains any kind of Lithium Batteries, in equipment or not. Cargo has been labeled accordingly and under compliance.'
-        # lrow += 1
-        # swei.merge_cells(f'A{lrow}:I{lrow+2}')
-        # swei[f'A{lrow}'] = f"""I Diego Lopez on behalf of {razon_social}, and all its employees and subsidiaries, confirm we will not held Ground Cargo Transportation INC or any of its affiliates responsible or liable of any penalties, fines, damages or loss incur by any of our shipments. The shipper agrees to indemnity Ground Cargo Transportation INC for any and all costs, fees and expenses Ground Cargo Transportation INC incurs as a result of the shipper's violation of any local, state or federal laws or regulations or from tendering any prohibited item for shipment."""
-
-        #Borders
-        borders  = OrderedDict()
-        # borders['bottom'] = ['A3:H3', 'A10:H10', 'F7:F7']
-        # borders['top'] = ['A11:I11', 'F8:F8']
-        # borders['right'] = ['C2:C3', 'E2:E3', 
-        #                     'I2:I3', 
-        #                     'D4:D10', 'B4:B10']
-        # borders['left'] = ['G4:G7','F8:F10','G8:G10', 'J4:J10']
-        # borders['left_bottom'] = ['F7:I7']
-        borders['all'] = ['A7:L8']
-        
-        # if r_idx > 0:
-        #     lrow += 2
-        #     borders['all'].append(f'A{r_idx}:I{lrow}')
-        #     for row in swei[f'A{r_idx}:I{lrow}']:
-        #         for cell in row:
-        #             cell.font = fog
-        #             cell.alignment = left_alignment
-
-        for idx, b in borders.items():
-            if idx == 'all':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = all_border
-            if idx == 'left':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = l_border
-            if idx == 'right':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = r_border
-            if idx == 'bottom':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = b_border
-            if idx == 'top':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = t_border
-            if idx == 'right_bottom':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = rb_border
-            if idx == 'right_top':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = rt_border
-            if idx == 'left_bottom':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = lb_border
-            if idx == 'left_top':
-                for c_bo in b:
-                    for row in swei[c_bo]:
-                        for cell in row:
-                            cell.border = lt_border
         fpath = f'{settings.MEDIA_ROOT}/tmp/{sname}.xls'
         furl = f'media/tmp/{sname}.xls'
-        wb.save(fpath)
+        lvta.write(fpath, sname, f'LIBRO VENTAS DEL PERIODO {f_desce} AL {f_hasta}', lvta.rows(qs))
         return {'success': 'Hecho', 'furl': furl, 'file_name': sname, 'full_path': fpath }
     
     
@@ -2110,46 +1834,16 @@ class MSifen:
                 return list(filter(lambda x: x.get('es_factura_credito') == True , pp))
         return pp
 
-    def create_documentheader(self, *args, **kwargs) -> tuple:
-        """Create DocumentHeader record - Manual invoice creation approach"""
+    def documentheader_fields(self, uc_fields: dict, timbradoobj, doc_establecimiento, userobj=None, pk=None):
+        """Completa uc_fields con los valores por defecto de la cabecera, retorna el mensaje de error si lo hay"""
         ios = IoS()
-        eser = ekuatia_serials.Eserial()
         gdata = mng_gmdata.Gdata()
-        userobj = kwargs.get('userobj')
-        q: dict = kwargs.get('qdict', {})
-        dbcon = q.get('dbcon', 'default')
-        uc_fields: dict = from_json(q.get('uc_fields', {}))
-        send_save = uc_fields.pop('send_save', False)
-
-        pk = uc_fields.get('id')
-
-        # Extract details from uc_fields
-        details = uc_fields.pop('details', [])
-
-        if not details:
-            return {'error': 'Faltan los detalles del documento'}, args, kwargs
-
-        # Get timbrado from form
         if not pk:
             # Set default values
             uc_fields['cargado_usuario'] = userobj.first_name if userobj else 'system'
             uc_fields['cargado_fecha'] = datetime.now(tz=ZoneInfo('America/Asuncion'))
             uc_fields['doc_fecha'] = datetime.now(tz=ZoneInfo('America/Asuncion')).date()
 
-        timbrado_id = uc_fields.pop('timbrado_id', None)
-        if timbrado_id:
-            timbradoobj = Etimbrado.objects.get(pk=timbrado_id)
-        else:
-            timbradoobj = self.timbradoobj
-
-        # Get establecimiento from form
-        doc_establecimiento = uc_fields.get('doc_establecimiento')
-        if not doc_establecimiento:
-            estab_obj = Eestablecimiento.objects.filter(timbradoobj=timbradoobj).first()
-            if not estab_obj:
-                return {'error': 'No hay establecimiento configurado'}, args, kwargs
-            doc_establecimiento = estab_obj.establecimiento
-
         # Calculate RUC DV if not provided
         if not uc_fields.get('pdv_ruc_dv'):
             uc_fields['pdv_ruc_dv'] = gdata.calculate_dv(uc_fields.get('pdv_ruc', ''))
@@ -2204,7 +1898,7 @@ class MSifen:
         doc_cre_tipo_cod = int(uc_fields.get('doc_cre_tipo_cod', 1))
 
         if doc_cre_tipo_cod == 2 and not uc_fields.get('doc_vencimiento'):
-            return {'error': 'Debe especificar los días de crédito para facturas a crédito'}, args, kwargs
+            return 'Debe especificar los días de crédito para facturas a crédito'
         if doc_cre_tipo_cod == 1:
             # Vencimiento
             uc_fields['doc_vencimiento'] = arrow.get().shift(days=30).strftime('%Y-%m-%d')
@@ -2215,7 +1909,7 @@ class MSifen:
                 try:
                     uc_fields['doc_vencimiento'] = datetime.strptime(uc_fields['doc_vencimiento'], '%Y-%m-%d').date()
                 except ValueError:
-                    return {'error': 'Formato de fecha de vencimiento inválido. Use YYYY-MM-DD'}, args, kwargs
+                    return 'Formato de fecha de vencimiento inválido. Use YYYY-MM-DD'
 
         uc_fields['doc_cre_tipo_cod'] = doc_cre_tipo_cod
         uc_fields['doc_cre_tipo'] = fl_sifen_conf.K_CRE_TIPO_COD.get(doc_cre_tipo_cod, 'Contado')
@@ -2266,174 +1960,140 @@ class MSifen:
         ff = ios.form_model_fields(uc_fields, DocumentHeader._meta.fields)
         for rr in ff:
             uc_fields.pop(rr, None)
+        return None
 
-        # Create DocumentHeader
-        if pk:
-            docobj = DocumentHeader.objects.using(dbcon).get(pk=pk)
-            if docobj.lote_estado in ['RECIBIDO', 'PROCESANDO', 'CONCLUIDO']:
-                return {'error': f'No se pude modificar con el lote en estado {docobj.lote_estado}'}, args, kwargs
-            if docobj.lote_msg == 'Aprobado':
-                if not docobj.ek_estado:
-                    docobj.ek_estado = 'Aprobado'
-                    docobj.save()
-                return {'error': 'No se puede modificar un documento ya aprobado por el SIFEN'}, args, kwargs
-            if int(uc_fields['pdv_tipocontribuyente']) == 2:
-                uc_fields['pdv_es_contribuyente'] = True
-            DocumentHeader.objects.using(dbcon).filter(pk=pk).update(**uc_fields)
-            docobj = DocumentHeader.objects.using(dbcon).get(pk=pk)
-            docobj.documentdetail_set.all().delete()
-        else:
-            docobj = DocumentHeader.objects.using(dbcon).create(**uc_fields)
-
-
-
-        # Process details
-        doc_redondeo = 0
-        for d in details:
-            precio_unitario = float(str(d.get('precio_unitario', 0)))
-            cantidad = float(str(d.get('cantidad', 1)))
-
-            # Check if product is from Producto model or manual entry
-            prod_cod = d.get('prod_cod')
-
-            try:
-                prodobj = Producto.objects.get(prod_cod=prod_cod)
-            except Producto.DoesNotExist:
-                prod_autocreado = True
-                # If not found, create dynamic instance with user-defined distribution
-                PAF = namedtuple('PAF', ['prod_cod', 'precio', 'moneda', 'g5', 'g10', 'exenta', 'volumen', 'peso', 'medidaobj', 'porcentaje_iva'])
-                MOBJ = namedtuple('MOBJ', ['medida_cod', 'medida'])
-                IOBJ = namedtuple('IOBJ', ['porcentaje'])
-
-                exenta_pct = float(d.get('exenta', 0))
-                g5_pct = float(d.get('g5', 0))
-                g10_pct = float(d.get('g10', 100))
-
-                # Determine IVA percentage based on distribution
-                if g10_pct > 0:
-                    porcentaje_iva_val = 10
-                elif g5_pct > 0:
-                    porcentaje_iva_val = 5
-                else:
-                    porcentaje_iva_val = 0
-
-                medidaobj = MOBJ(medida_cod=77, medida='UNI')
-                porcentajeobj = IOBJ(porcentaje=porcentaje_iva_val)
-
-                prodobj = PAF(
-                    prod_cod=prod_cod,
-                    precio=precio_unitario,
-                    moneda='GS',
-                    g5=g5_pct,
-                    g10=g10_pct,
-                    exenta=exenta_pct,
-                    volumen=0,
-                    peso=0,
-                    medidaobj=medidaobj,
-                    porcentaje_iva=porcentajeobj
-                )
-            else:
-                prod_autocreado = False
-
-            # Use f_calcs to calculate tax amounts
-            # Get discount values
-            descuento_item = float(d.get('descuento', 0) or 0)
-            descuento_global_item = float(d.get('descuento_global_item', 0) or 0)
-            descuento_total = descuento_item + descuento_global_item
-
-            # Calculate bruto and neto
-            bruto = precio_unitario * cantidad
-            neto = bruto - descuento_total
-            if neto < 0:
-                neto = 0
-
-            # Calculate price based on NETO (after discount) instead of bruto
-            # We need to recalculate using the effective price per unit
-            if cantidad > 0 and neto > 0:
-                precio_efectivo = neto / cantidad
-                pcalc = f_calcs.calculate_price(prodobj, precio_efectivo, cantidad)
+    def documentdetail_fields(self, d: dict, prodobj=None, userobj=None) -> dict:
+        """Valores del DocumentDetail para el detalle d, sin prodobj se arma el producto con la distribucion de d"""
+        precio_unitario = float(str(d.get('precio_unitario', 0)))
+        cantidad = float(str(d.get('cantidad', 1)))
+
+        # Check if product is from Producto model or manual entry
+        prod_cod = d.get('prod_cod')
+
+        prod_autocreado = prodobj is None
+        if prod_autocreado:
+            # If not found, create dynamic instance with user-defined distribution
+            PAF = namedtuple('PAF', ['prod_cod', 'precio', 'moneda', 'g5', 'g10', 'exenta', 'volumen', 'peso', 'medidaobj', 'porcentaje_iva'])
+            MOBJ = namedtuple('MOBJ', ['medida_cod', 'medida'])
+            IOBJ = namedtuple('IOBJ', ['porcentaje'])
+
+            exenta_pct = float(d.get('exenta', 0))
+            g5_pct = float(d.get('g5', 0))
+            g10_pct = float(d.get('g10', 100))
+
+            # Determine IVA percentage based on distribution
+            if g10_pct > 0:
+                porcentaje_iva_val = 10
+            elif g5_pct > 0:
+                porcentaje_iva_val = 5
             else:
-                pcalc = f_calcs.calculate_price(prodobj, precio_unitario, cantidad)
-                # If neto is 0, all values should be 0
-                if neto == 0:
-                    pcalc = {
-                        'exenta': 0, 'iva_5': 0, 'gravada_5': 0, 'base_gravada_5': 0,
-                        'iva_10': 0, 'gravada_10': 0, 'base_gravada_10': 0
-                    }
-
-            exenta = pcalc['exenta']
-            iva_5 = pcalc['iva_5']
-            gravada_5 = pcalc['gravada_5']
-            base_gravada_5 = pcalc['base_gravada_5']
-            iva_10 = pcalc['iva_10']
-            gravada_10 = pcalc['gravada_10']
-            base_gravada_10 = pcalc['base_gravada_10']
-            porcentaje_iva = prodobj.porcentaje_iva.porcentaje if hasattr(prodobj.porcentaje_iva, 'porcentaje') else prodobj.porcentaje_iva
-
-            precio_unitario_siniva = precio_unitario - ((iva_10 + iva_5) / cantidad if cantidad else 0)
-
-            # Get unidad medida code from description
-            prod_unidad_medida_desc = d.get('prod_unidad_medida_desc', '77')
-            try:
-                prod_unidad_medida = int(prod_unidad_medida_desc)
-            except:
-                prod_unidad_medida = 77  # UNI default
-
-            per_tipo_iva = 100
-
-            if pcalc.get('exenta') and pcalc.get('afecto'):
-                #total = pcalc.get('exenta')+pcalc.get('afecto')
-                #per_tipo_iva = (float(prodobj.exenta)*100)/float(total)
-                per_tipo_iva = prodobj.g5+prodobj.g10                
-
-            DocumentDetail.objects.using(dbcon).create(
-                documentheaderobj=docobj,
-                prod_autocreado=prod_autocreado,
-                prod_cod=d.get('prod_cod', 9999),
-                prod_descripcion=d.get('prod_descripcion', ''),
-                prod_unidad_medida=prod_unidad_medida,
-                prod_unidad_medida_desc=d.get('prod_unidad_medida_desc_text', 'UNI'),
-                prod_pais_origen='PRY',
-                prod_pais_origen_desc='Paraguay',
-                porcentaje_iva=porcentaje_iva,
-                precio_unitario_source=precio_unitario,
-                precio_unitario=precio_unitario,
-                precio_unitario_siniva=precio_unitario_siniva,
-                cantidad=cantidad,
-                cantidad_devolucion=0,
-                exenta_pct=Decimal(str(d.get('exenta', 0))),
-                g5_pct=Decimal(str(d.get('g5', 0))),
-                g10_pct=Decimal(str(d.get('g10', 100))),
-                exenta=exenta,
-                iva_5=iva_5,
-                gravada_5=gravada_5,
-                base_gravada_5=base_gravada_5,
-                iva_10=iva_10,
-                gravada_10=gravada_10,
-                base_gravada_10=base_gravada_10,
-                afecto=gravada_5 + gravada_10,
-                per_tipo_iva=per_tipo_iva,
-                bonifica=False,
-                descuento=d.get('descuento', 0),
-                per_descuento=d.get('per_descuento', 0),
+                porcentaje_iva_val = 0
+
+            medidaobj = MOBJ(medida_cod=77, medida='UNI')
+            porcentajeobj = IOBJ(porcentaje=porcentaje_iva_val)
+
+            prodobj = PAF(
+                prod_cod=prod_cod,
+                precio=precio_unitario,
+                moneda='GS',
+                g5=g5_pct,
+                g10=g10_pct,
+                exenta=exenta_pct,
                 volumen=0,
                 peso=0,
-                observacion=None,
-                cargado_usuario=userobj.first_name if userobj else 'system',
-                cargado_fecha=datetime.now()
+                medidaobj=medidaobj,
+                porcentaje_iva=porcentajeobj
             )
 
-        # Update totals from details
-        totals = docobj.documentdetail_set.aggregate(
-            exenta=Sum('exenta'),
-            iva_5=Sum('iva_5'),
-            gravada_5=Sum('gravada_5'),
-            iva_10=Sum('iva_10'),
-            gravada_10=Sum('gravada_10'),
-            afecto=Sum('afecto'),
-            descuento=Sum('descuento')
+        # Use f_calcs to calculate tax amounts
+        # Get discount values
+        descuento_item = float(d.get('descuento', 0) or 0)
+        descuento_global_item = float(d.get('descuento_global_item', 0) or 0)
+        descuento_total = descuento_item + descuento_global_item
+
+        # Calculate bruto and neto
+        bruto = precio_unitario * cantidad
+        neto = bruto - descuento_total
+        if neto < 0:
+            neto = 0
+
+        # Calculate price based on NETO (after discount) instead of bruto
+        # We need to recalculate using the effective price per unit
+        if cantidad > 0 and neto > 0:
+            precio_efectivo = neto / cantidad
+            pcalc = f_calcs.calculate_price(prodobj, precio_efectivo, cantidad)
+        else:
+            pcalc = f_calcs.calculate_price(prodobj, precio_unitario, cantidad)
+            # If neto is 0, all values should be 0
+            if neto == 0:
+                pcalc = {
+                    'exenta': 0, 'iva_5': 0, 'gravada_5': 0, 'base_gravada_5': 0,
+                    'iva_10': 0, 'gravada_10': 0, 'base_gravada_10': 0
+                }
+
+        exenta = pcalc['exenta']
+        iva_5 = pcalc['iva_5']
+        gravada_5 = pcalc['gravada_5']
+        base_gravada_5 = pcalc['base_gravada_5']
+        iva_10 = pcalc['iva_10']
+        gravada_10 = pcalc['gravada_10']
+        base_gravada_10 = pcalc['base_gravada_10']
+        porcentaje_iva = prodobj.porcentaje_iva.porcentaje if hasattr(prodobj.porcentaje_iva, 'porcentaje') else prodobj.porcentaje_iva
+
+        precio_unitario_siniva = precio_unitario - ((iva_10 + iva_5) / cantidad if cantidad else 0)
+
+        # Get unidad medida code from description
+        prod_unidad_medida_desc = d.get('prod_unidad_medida_desc', '77')
+        try:
+            prod_unidad_medida = int(prod_unidad_medida_desc)
+        except:
+            prod_unidad_medida = 77  # UNI default
+
+        per_tipo_iva = 100
+
+        if pcalc.get('exenta') and pcalc.get('afecto'):
+            #total = pcalc.get('exenta')+pcalc.get('afecto')
+            #per_tipo_iva = (float(prodobj.exenta)*100)/float(total)
+            per_tipo_iva = prodobj.g5+prodobj.g10
+
+        return dict(
+            prod_autocreado=prod_autocreado,
+            prod_cod=d.get('prod_cod', 9999),
+            prod_descripcion=d.get('prod_descripcion', ''),
+            prod_unidad_medida=prod_unidad_medida,
+            prod_unidad_medida_desc=d.get('prod_unidad_medida_desc_text', 'UNI'),
+            prod_pais_origen='PRY',
+            prod_pais_origen_desc='Paraguay',
+            porcentaje_iva=porcentaje_iva,
+            precio_unitario_source=precio_unitario,
+            precio_unitario=precio_unitario,
+            precio_unitario_siniva=precio_unitario_siniva,
+            cantidad=cantidad,
+            cantidad_devolucion=0,
+            exenta_pct=Decimal(str(d.get('exenta', 0))),
+            g5_pct=Decimal(str(d.get('g5', 0))),
+            g10_pct=Decimal(str(d.get('g10', 100))),
+            exenta=exenta,
+            iva_5=iva_5,
+            gravada_5=gravada_5,
+            base_gravada_5=base_gravada_5,
+            iva_10=iva_10,
+            gravada_10=gravada_10,
+            base_gravada_10=base_gravada_10,
+            afecto=gravada_5 + gravada_10,
+            per_tipo_iva=per_tipo_iva,
+            bonifica=False,
+            descuento=d.get('descuento', 0),
+            per_descuento=d.get('per_descuento', 0),
+            volumen=0,
+            peso=0,
+            observacion=None,
+            cargado_usuario=userobj.first_name if userobj else 'system',
+            cargado_fecha=datetime.now()
         )
 
+    def documentheader_totals(self, docobj, totals: dict, doc_redondeo=0):
+        """Totales, saldo y redondeo de la cabecera a partir de las sumas de sus detalles, no guarda"""
         doc_total = (totals.get('afecto') or 0) + (totals.get('exenta') or 0)
         docobj.doc_total = doc_total
         docobj.doc_iva = (totals.get('iva_5') or 0) + (totals.get('iva_10') or 0)
@@ -2467,68 +2127,156 @@ class MSifen:
         if docobj.doc_tipo == 'FE':
             docobj.doc_relacion_saldo = docobj.get_total_venta_gs()
 
-        # For NC/ND, populate doc_loop_link with related invoice prof_number
-        if docobj.doc_tipo in ['NC', 'ND'] and uc_fields.get('doc_relacion_cdc'):
-            related_doc = DocumentHeader.objects.filter(
-                ek_cdc=uc_fields.get('doc_relacion_cdc')
-            ).first()
-            if related_doc:
-                docobj.doc_loop_link = related_doc.prof_number
-                docobj.save()
-                related_doc = DocumentHeader.objects.get(prof_number=docobj.doc_loop_link)
-                total_venta_gs = sum([ x.get_total_venta_gs() for x in DocumentHeader.objects.filter(doc_loop_link=related_doc.prof_number) ])
-                if total_venta_gs > related_doc.get_total_venta_gs():
-                    docobj.delete()
-                    return {'error': 'El valor de la NC {:,.2f} es superior al saldo de la factura {:,.2f}'.format(total_venta_gs, related_doc.doc_relacion_saldo) }, args, kwargs
-                related_doc.doc_relacion_saldo = related_doc.get_total_venta_gs() - total_venta_gs
-                related_doc.save()
-        docobj.save()
-        clobj = Clientes.objects.filter(pdv_ruc=uc_fields['pdv_ruc']).first()
-        if not clobj:
-            # Create new Cliente
-            Clientes.objects.create(
-                pdv_ruc=uc_fields['pdv_ruc'],
-                pdv_ruc_dv=uc_fields['pdv_ruc_dv'],
-                pdv_nombrefactura=uc_fields['pdv_nombrefactura'],
-                pdv_nombrefantasia=docobj.pdv_nombrefantasia,
-                pdv_celular=uc_fields['pdv_celular'] or '',
-                pdv_email=uc_fields['pdv_email'] or '',
-                pdv_type_business=uc_fields['pdv_type_business'],
-                pdv_tipocontribuyente=uc_fields.get('pdv_tipocontribuyente'),
-                pdv_es_contribuyente=uc_fields.get('pdv_es_contribuyente', True)
-            )
+    @ventas_diarias.batch()
+    def create_documentheader(self, *args, **kwargs) -> tuple:
+        """Create DocumentHeader record - Manual invoice creation approach"""
+        ios = IoS()
+        eser = ekuatia_serials.Eserial()
+        gdata = mng_gmdata.Gdata()
+        userobj = kwargs.get('userobj')
+        q: dict = kwargs.get('qdict', {})
+        dbcon = q.get('dbcon', 'default')
+        uc_fields: dict = from_json(q.get('uc_fields', {}))
+        send_save = uc_fields.pop('send_save', False)
+
+        pk = uc_fields.get('id')
+
+        # Extract details from uc_fields
+        details = uc_fields.pop('details', [])
+
+        if not details:
+            return {'error': 'Faltan los detalles del documento'}, args, kwargs
+
+        # Get timbrado from form
+        timbrado_id = uc_fields.pop('timbrado_id', None)
+        if timbrado_id:
+            timbradoobj = Etimbrado.objects.get(pk=timbrado_id)
         else:
-            # Update if fields changed
-            
-            updated = False
-            if clobj.pdv_ruc_dv != uc_fields['pdv_ruc_dv']:
-                clobj.pdv_ruc_dv = uc_fields['pdv_ruc_dv']
-                updated = True
-            if clobj.pdv_nombrefactura != uc_fields['pdv_nombrefactura']:
-                clobj.pdv_nombrefactura = uc_fields['pdv_nombrefactura']
-                updated = True
-            if uc_fields['pdv_celular'] and clobj.pdv_celular != uc_fields['pdv_celular']:
-                clobj.pdv_celular = uc_fields['pdv_celular']
-                updated = True
-            if uc_fields['pdv_email'] and clobj.pdv_email != uc_fields['pdv_email']:
-                clobj.pdv_email = uc_fields['pdv_email']
-                updated = True
-            if clobj.pdv_type_business != uc_fields['pdv_type_business']:
-                clobj.pdv_type_business = uc_fields['pdv_type_business']
-                updated = True
-            if uc_fields.get('pdv_tipocontribuyente') and clobj.pdv_tipocontribuyente != uc_fields['pdv_tipocontribuyente']:
-                clobj.pdv_tipocontribuyente = uc_fields['pdv_tipocontribuyente']
-            if clobj.pdv_tipocontribuyente in [1, 2]:
-                clobj.pdv_es_contribuyente = True
+            timbradoobj = self.timbradoobj
+
+        # Get establecimiento from form
+        doc_establecimiento = uc_fields.get('doc_establecimiento')
+        if not doc_establecimiento:
+            estab_obj = Eestablecimiento.objects.filter(timbradoobj=timbradoobj).first()
+            if not estab_obj:
+                return {'error': 'No hay establecimiento configurado'}, args, kwargs
+            doc_establecimiento = estab_obj.establecimiento
+
+        error = self.documentheader_fields(uc_fields, timbradoobj, doc_establecimiento, userobj=userobj, pk=pk)
+        if error:
+            return {'error': error}, args, kwargs
+
+        # Cabecera, detalles, totales y cliente en una sola transaccion
+        with transaction.atomic(using=dbcon):
+            # Create DocumentHeader
+            if pk:
+                docobj = DocumentHeader.objects.using(dbcon).get(pk=pk)
+                if docobj.lote_estado in ['RECIBIDO', 'PROCESANDO', 'CONCLUIDO']:
+                    return {'error': f'No se pude modificar con el lote en estado {docobj.lote_estado}'}, args, kwargs
+                if docobj.lote_msg == 'Aprobado':
+                    if not docobj.ek_estado:
+                        docobj.ek_estado = 'Aprobado'
+                        docobj.save()
+                    return {'error': 'No se puede modificar un documento ya aprobado por el SIFEN'}, args, kwargs
+                if int(uc_fields['pdv_tipocontribuyente']) == 2:
+                    uc_fields['pdv_es_contribuyente'] = True
+                #update() no dispara señales, el dia anterior del documento se marca aca
+                ventas_diarias.mark_queryset(DocumentHeader.objects.using(dbcon).filter(pk=pk))
+                DocumentHeader.objects.using(dbcon).filter(pk=pk).update(**uc_fields)
+                docobj = DocumentHeader.objects.using(dbcon).get(pk=pk)
+                docobj.documentdetail_set.all().delete()
             else:
-                clobj.pdv_es_contribuyente = False
-            updated = True
-            # if clobj.pdv_es_contribuyente != uc_fields.get('pdv_es_contribuyente', True):
-            #     clobj.pdv_es_contribuyente = uc_fields.get('pdv_es_contribuyente', True)
-            #     updated = True
-            if updated:
-                clobj.save()
-        
+                docobj = DocumentHeader.objects.using(dbcon).create(**uc_fields)
+
+
+
+            # Process details
+            doc_redondeo = 0
+            for d in details:
+                try:
+                    prodobj = Producto.objects.get(prod_cod=d.get('prod_cod'))
+                except Producto.DoesNotExist:
+                    prodobj = None
+                DocumentDetail.objects.using(dbcon).create(
+                    documentheaderobj=docobj,
+                    **self.documentdetail_fields(d, prodobj, userobj=userobj)
+                )
+
+            # Update totals from details
+            totals = docobj.documentdetail_set.aggregate(
+                exenta=Sum('exenta'),
+                iva_5=Sum('iva_5'),
+                gravada_5=Sum('gravada_5'),
+                iva_10=Sum('iva_10'),
+                gravada_10=Sum('gravada_10'),
+                afecto=Sum('afecto'),
+                descuento=Sum('descuento')
+            )
+
+            self.documentheader_totals(docobj, totals, doc_redondeo=doc_redondeo)
+
+            # For NC/ND, populate doc_loop_link with related invoice prof_number
+            if docobj.doc_tipo in ['NC', 'ND'] and uc_fields.get('doc_relacion_cdc'):
+                related_doc = DocumentHeader.objects.filter(
+                    ek_cdc=uc_fields.get('doc_relacion_cdc')
+                ).first()
+                if related_doc:
+                    docobj.doc_loop_link = related_doc.prof_number
+                    docobj.save()
+                    related_doc = DocumentHeader.objects.get(prof_number=docobj.doc_loop_link)
+                    total_venta_gs = sum([ x.get_total_venta_gs() for x in DocumentHeader.objects.filter(doc_loop_link=related_doc.prof_number) ])
+                    if total_venta_gs > related_doc.get_total_venta_gs():
+                        docobj.delete()
+                        return {'error': 'El valor de la NC {:,.2f} es superior al saldo de la factura {:,.2f}'.format(total_venta_gs, related_doc.doc_relacion_saldo) }, args, kwargs
+                    related_doc.doc_relacion_saldo = related_doc.get_total_venta_gs() - total_venta_gs
+                    related_doc.save()
+            docobj.save()
+            clobj = Clientes.objects.filter(pdv_ruc=uc_fields['pdv_ruc']).first()
+            if not clobj:
+                # Create new Cliente
+                Clientes.objects.create(
+                    pdv_ruc=uc_fields['pdv_ruc'],
+                    pdv_ruc_dv=uc_fields['pdv_ruc_dv'],
+                    pdv_nombrefactura=uc_fields['pdv_nombrefactura'],
+                    pdv_nombrefantasia=docobj.pdv_nombrefantasia,
+                    pdv_celular=uc_fields['pdv_celular'] or '',
+                    pdv_email=uc_fields['pdv_email'] or '',
+                    pdv_type_business=uc_fields['pdv_type_business'],
+                    pdv_tipocontribuyente=uc_fields.get('pdv_tipocontribuyente'),
+                    pdv_es_contribuyente=uc_fields.get('pdv_es_contribuyente', True)
+                )
+            else:
+                # Update if fields changed
+
+                updated = False
+                if clobj.pdv_ruc_dv != uc_fields['pdv_ruc_dv']:
+                    clobj.pdv_ruc_dv = uc_fields['pdv_ruc_dv']
+                    updated = True
+                if clobj.pdv_nombrefactura != uc_fields['pdv_nombrefactura']:
+                    clobj.pdv_nombrefactura = uc_fields['pdv_nombrefactura']
+                    updated = True
+                if uc_fields['pdv_celular'] and clobj.pdv_celular != uc_fields['pdv_celular']:
+                    clobj.pdv_celular = uc_fields['pdv_celular']
+                    updated = True
+                if uc_fields['pdv_email'] and clobj.pdv_email != uc_fields['pdv_email']:
+                    clobj.pdv_email = uc_fields['pdv_email']
+                    updated = True
+                if clobj.pdv_type_business != uc_fields['pdv_type_business']:
+                    clobj.pdv_type_business = uc_fields['pdv_type_business']
+                    updated = True
+                if uc_fields.get('pdv_tipocontribuyente') and clobj.pdv_tipocontribuyente != uc_fields['pdv_tipocontribuyente']:
+                    clobj.pdv_tipocontribuyente = uc_fields['pdv_tipocontribuyente']
+                if clobj.pdv_tipocontribuyente in [1, 2]:
+                    clobj.pdv_es_contribuyente = True
+                else:
+                    clobj.pdv_es_contribuyente = False
+                updated = True
+                # if clobj.pdv_es_contribuyente != uc_fields.get('pdv_es_contribuyente', True):
+                #     clobj.pdv_es_contribuyente = uc_fields.get('pdv_es_contribuyente', True)
+                #     updated = True
+                if updated:
+                    clobj.save()
+
         if send_save:
             rsp = self.send_to_sifen(
                 userobj=userobj,
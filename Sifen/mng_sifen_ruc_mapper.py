@@ -1,11 +1,17 @@
 import os
+import io
+import csv
+import hashlib
+import time
 import logging
+import tempfile
 import requests
 import zipfile
-import pandas as pd
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from django.conf import settings
-from Sifen.models import Clientes
+from django.db import connection, transaction
+from Sifen.models import Clientes, RucSyncFile
 from celery import current_app
 from boltons.iterutils import chunked
 
@@ -30,212 +36,396 @@ class RMap:
         'https://www.dnit.gov.py/documents/20123/2241042/ruc9.zip/7119717e-1824-2d55-88c0-d516fc6cafe7?t=1762428528667',
     ]
 
+    # Columnas del archivo de DNIT: RUC|NOMBREFACTURA|DV|RUC_VIEJO|ESTADO|
     COLUMN_NAMES = ['RUC', 'NOMBREFACTURA', 'DV', 'RUC_VIEJO', 'ESTADO', 'EMPTY']
+    # Campo de Clientes -> columna de la tabla de staging
+    STAGE_FIELDS = {
+        'pdv_ruc': 'ruc',
+        'pdv_ruc_dv': 'dv',
+        'pdv_nombrefantasia': 'nombre',
+        'pdv_nombrefactura': 'nombre',
+        'pdv_ruc_estado': 'estado',
+        'pdv_ruc_fp': 'fp',
+    }
+    WORKERS = int(os.environ.get('RUC_SYNC_WORKERS', 4))
+    DOWNLOAD_TIMEOUT = (10, 120)
+    DOWNLOAD_CHUNK = 1024 * 1024
+    PROGRESS_ROWS = 100000
 
     def __init__(self):
         self.download_dir = os.path.join(settings.BASE_DIR, 'Sifen', 'rf', 'ruc_data')
         os.makedirs(self.download_dir, exist_ok=True)
 
-    def download_and_extract_zip(self, url, file_index):
+    def download(self, url, file_index, sfobj=None):
         """
-        Download a zip file and extract its contents
+        Download a zip file to a temporary file in chunks, nothing is extracted to disk.
+        With the RucSyncFile of a previous run the request is conditional,
+        returns (None, meta) when the server answers 304
         """
         logger.info(f'Downloading ruc{file_index}.zip from {url}')
-
+        headers = {}
+        if sfobj and sfobj.url == url:
+            if sfobj.etag:
+                headers['If-None-Match'] = sfobj.etag
+            if sfobj.last_modified:
+                headers['If-Modified-Since'] = sfobj.last_modified
+        tmp = tempfile.TemporaryFile(dir=self.download_dir, suffix=f'_ruc{file_index}.zip')
+        sha = hashlib.sha256()
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-
-            with zipfile.ZipFile(BytesIO(response.content)) as zip_file:
-                zip_file.extractall(self.download_dir)
-                txt_files = [f for f in zip_file.namelist() if f.endswith('.txt')]
-                logger.info(f'Extracted files: {txt_files}')
-                return txt_files
-
-        except Exception as e:
-            logger.error(f'Error downloading/extracting ruc{file_index}.zip: {str(e)}')
-            return []
-
-    def read_txt_to_dataframe(self, txt_file_path):
+            with requests.get(url, stream=True, timeout=self.DOWNLOAD_TIMEOUT, headers=headers) as response:
+                meta = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+                if response.status_code == 304:
+                    tmp.close()
+                    return None, meta
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=self.DOWNLOAD_CHUNK):
+                    sha.update(chunk)
+                    tmp.write(chunk)
+            tmp.seek(0)
+            meta['sha256'] = sha.hexdigest()
+            return tmp, meta
+        except Exception:
+            tmp.close()
+            raise
+
+    def iter_zip(self, zip_file):
         """
-        Read a pipe-delimited txt file into a DataFrame
+        Yield (ruc, dv, nombre, estado) from every txt member of the zip without extracting it
         """
-        logger.info(f'Reading {txt_file_path}')
-
-        try:
-            df = pd.read_csv(
-                txt_file_path,
-                sep='|',
-                quotechar='"',
-                names=self.COLUMN_NAMES,
-                encoding='utf-8',
-                dtype={
-                    'RUC': str,
-                    'NOMBREFACTURA': str,
-                    'DV': str,
-                    'RUC_VIEJO': str,
-                    'ESTADO': str
-                },
-                keep_default_na=False,
-                on_bad_lines='skip'
-            )
-
-            # Remove empty rows
-            df = df[df['RUC'].str.strip() != '']
-
-            logger.info(f'Loaded {len(df)} records from {txt_file_path}')
-            return df
+        for name in zip_file.namelist():
+            if not name.endswith('.txt'):
+                continue
+            logger.info(f'Reading {name}')
+            with zip_file.open(name) as fh:
+                text = io.TextIOWrapper(fh, encoding='utf-8', errors='replace', newline='')
+                yield from self.iter_rows(text)
+
+    def iter_rows(self, lines):
+        """
+        Parse pipe-delimited lines, bad lines are skipped
+        """
+        ncols = len(self.COLUMN_NAMES)
+        for rec in csv.reader(lines, delimiter='|', quotechar='"'):
+            if len(rec) > ncols:
+                continue
+            rec += [''] * (ncols - len(rec))
+            ruc = rec[0].strip()
+            if not ruc:
+                continue
+            try:
+                dv = int(rec[2])
+            except ValueError:
+                dv = 0
+            yield ruc, dv, rec[1].strip()[:300], rec[4].strip()[:50]
 
-        except Exception as e:
-            logger.error(f'Error reading {txt_file_path}: {str(e)}')
-            return pd.DataFrame()
+    def fingerprint(self, dv, nombre, estado):
+        """Same value as md5(concat_ws('|', dv, nombre, estado)) in copy_upsert"""
+        return hashlib.md5(f'{dv}|{nombre}|{estado}'.encode('utf-8')).hexdigest()
 
-    def sync_to_database(self, df):
+    def insert_defaults(self):
+        """
+        Columns and values for the Clientes fields not present in the registry,
+        the model defaults live in python so they have to be sent explicitly
         """
-        Sync DataFrame records to Clientes model using bulk operations
+        now = datetime.now()
+        cols, vals = [], []
+        for f in Clientes._meta.concrete_fields:
+            if f.primary_key or f.name in self.STAGE_FIELDS:
+                continue
+            if getattr(f, 'auto_now_add', False):
+                cols.append(f.column)
+                vals.append(now)
+            elif f.has_default():
+                cols.append(f.column)
+                vals.append(f.get_db_prep_save(f.get_default(), connection))
+        return cols, vals
+
+    def copy_upsert(self, rows, file_index, progress=None, delta=False):
         """
-        logger.info(f'Syncing {len(df)} records to database')
+        COPY rows into a temporary staging table and merge it into Clientes with
+        one UPDATE of the changed rows and one INSERT of the missing ones.
+        pdv_ruc is not unique in Clientes so ON CONFLICT has no arbiter to use.
+        In delta mode only the row fingerprint is compared, rows whose registry
+        data did not change since the last run are not touched
+        """
+        qn = connection.ops.quote_name
+        table = qn(Clientes._meta.db_table)
+        stage = f'ruc_stage_{file_index}'
+        col = {f.name: f.column for f in Clientes._meta.concrete_fields}
+        sets = ', '.join(f'{qn(col[f])} = s.{sc}' for f, sc in self.STAGE_FIELDS.items() if f != 'pdv_ruc')
+        if delta:
+            changed = f'c.{qn(col["pdv_ruc_fp"])} IS DISTINCT FROM s.fp'
+        else:
+            changed = ' OR '.join(f'c.{qn(col[f])} IS DISTINCT FROM s.{sc}' for f, sc in self.STAGE_FIELDS.items() if f != 'pdv_ruc')
+        dcols, dvals = self.insert_defaults()
+        icols = ', '.join(qn(c) for c in [col[f] for f in self.STAGE_FIELDS] + dcols)
+        ivals = ', '.join([f's.{sc}' for sc in self.STAGE_FIELDS.values()] + ['%s'] * len(dvals))
+        stream = CopyStream(rows, progress=progress, every=self.PROGRESS_ROWS)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMP TABLE {stage} (n bigserial, ruc varchar(120), dv integer, '
+                           f'nombre varchar(300), estado varchar(50)) ON COMMIT DROP')
+            copy_from(cursor, f'COPY {stage} (ruc, dv, nombre, estado) FROM STDIN', stream)
+            # Un RUC repetido en el archivo queda con su ultima aparicion
+            cursor.execute(f'CREATE TEMP TABLE {stage}_u ON COMMIT DROP AS '
+                           f"SELECT DISTINCT ON (ruc) ruc, dv, nombre, estado, md5(concat_ws('|', dv, nombre, estado)) AS fp "
+                           f'FROM {stage} ORDER BY ruc, n DESC')
+            cursor.execute(f'ANALYZE {stage}_u')
+            cursor.execute(f'SELECT count(*) FROM {stage}_u')
+            unique = cursor.fetchone()[0]
+            cursor.execute(f'UPDATE {table} c SET {sets} FROM {stage}_u s '
+                           f'WHERE c.{qn(col["pdv_ruc"])} = s.ruc AND ({changed})')
+            updated = cursor.rowcount
+            cursor.execute(f'INSERT INTO {table} ({icols}) SELECT {ivals} FROM {stage}_u s '
+                           f'WHERE NOT EXISTS (SELECT 1 FROM {table} c WHERE c.{qn(col["pdv_ruc"])} = s.ruc)', dvals)
+            created = cursor.rowcount
+        return {
+            'total': stream.count,
+            'unique': unique,
+            'created': created,
+            'updated': updated,
+            'unchanged': max(unique - created - updated, 0),
+            'errors': 0,
+        }
 
+    def sync_to_database(self, rows, delta=False):
+        """
+        Sync (ruc, dv, nombre, estado) rows to Clientes using bulk operations,
+        used when the database is not PostgreSQL
+        """
         created_count = 0
         updated_count = 0
+        unchanged_count = 0
         error_count = 0
-
-        # Convert DataFrame to list of dicts
-        records = df.to_dict('records')
+        total = 0
 
         # Process in chunks of 1500
-        for chunk in chunked(records, 1500):
-            logger.info(f'Processing chunk of {len(chunk)} records')
-
+        for chunk in chunked(rows, 1500):
+            total += len(chunk)
+            # Ultima aparicion de cada RUC dentro del chunk
+            records = {r[0]: r for r in chunk}
             try:
-                # Prepare data
-                rucs_in_chunk = []
-                records_to_create = []
-                records_to_update = []
-
-                for row in chunk:
-                    try:
-                        ruc = str(row['RUC']).strip()
-                        if not ruc:
-                            continue
-
-                        # Try to convert DV to integer
-                        try:
-                            dv = int(row['DV'])
-                        except (ValueError, TypeError):
-                            dv = 0
-
-                        rucs_in_chunk.append(ruc)
-
-                        # Store processed data
-                        row['processed_ruc'] = ruc
-                        row['processed_dv'] = dv
-                        row['processed_nombre'] = row['NOMBREFACTURA'].strip()
-                        row['processed_estado'] = row['ESTADO'].strip()
-
-                    except Exception as e:
-                        logger.error(f'Error preparing record: {str(e)}')
-                        error_count += 1
-
-                # Get existing records in one query
-                existing_rucs = set(
-                    Clientes.objects.filter(pdv_ruc__in=rucs_in_chunk)
-                    .values_list('pdv_ruc', flat=True)
-                )
-
-                # Get existing records for update
                 existing_records = {
                     obj.pdv_ruc: obj
-                    for obj in Clientes.objects.filter(pdv_ruc__in=existing_rucs)
+                    for obj in Clientes.objects.filter(pdv_ruc__in=list(records))
                 }
-
-                # Separate into create and update
-                for row in chunk:
-                    if 'processed_ruc' not in row:
-                        continue
-
-                    ruc = row['processed_ruc']
-
-                    if ruc in existing_records:
-                        # Update existing
-                        obj = existing_records[ruc]
-                        obj.pdv_ruc_dv = row['processed_dv']
-                        obj.pdv_nombrefantasia = row['processed_nombre']
-                        obj.pdv_nombrefactura = row['processed_nombre']
-                        obj.pdv_ruc_estado = row['processed_estado']
-                        records_to_update.append(obj)
-                    else:
-                        # Create new
+                records_to_create = []
+                records_to_update = []
+                for ruc, dv, nombre, estado in records.values():
+                    obj = existing_records.get(ruc)
+                    fp = self.fingerprint(dv, nombre, estado)
+                    if obj is None:
                         records_to_create.append(
                             Clientes(
                                 pdv_ruc=ruc,
-                                pdv_ruc_dv=row['processed_dv'],
-                                pdv_nombrefantasia=row['processed_nombre'],
-                                pdv_nombrefactura=row['processed_nombre'],
-                                pdv_ruc_estado=row['processed_estado']
+                                pdv_ruc_dv=dv,
+                                pdv_nombrefantasia=nombre,
+                                pdv_nombrefactura=nombre,
+                                pdv_ruc_estado=estado,
+                                pdv_ruc_fp=fp
                             )
                         )
+                        continue
+                    if delta:
+                        changed = obj.pdv_ruc_fp != fp
+                    else:
+                        changed = (obj.pdv_ruc_dv, obj.pdv_nombrefactura, obj.pdv_nombrefantasia,
+                                   obj.pdv_ruc_estado, obj.pdv_ruc_fp) != (dv, nombre, nombre, estado, fp)
+                    if changed:
+                        obj.pdv_ruc_dv = dv
+                        obj.pdv_nombrefantasia = nombre
+                        obj.pdv_nombrefactura = nombre
+                        obj.pdv_ruc_estado = estado
+                        obj.pdv_ruc_fp = fp
+                        records_to_update.append(obj)
 
-                # Bulk create
                 if records_to_create:
                     Clientes.objects.bulk_create(records_to_create, ignore_conflicts=True)
                     created_count += len(records_to_create)
-                    logger.info(f'Bulk created {len(records_to_create)} records')
-
-                # Bulk update
                 if records_to_update:
                     Clientes.objects.bulk_update(
                         records_to_update,
-                        ['pdv_ruc_dv', 'pdv_nombrefantasia', 'pdv_nombrefactura', 'pdv_ruc_estado']
+                        ['pdv_ruc_dv', 'pdv_nombrefantasia', 'pdv_nombrefactura', 'pdv_ruc_estado', 'pdv_ruc_fp']
                     )
                     updated_count += len(records_to_update)
-                    logger.info(f'Bulk updated {len(records_to_update)} records')
+                unchanged_count += len(records) - len(records_to_create) - len(records_to_update)
 
             except Exception as e:
                 logger.error(f'Error processing chunk: {str(e)}')
                 error_count += len(chunk)
 
         logger.info(f'Sync complete: {created_count} created, {updated_count} updated, {error_count} errors')
-        return created_count, updated_count, error_count
+        return {
+            'total': total,
+            'created': created_count,
+            'updated': updated_count,
+            'unchanged': unchanged_count,
+            'errors': error_count,
+        }
 
-    def sync_rucs(self, *args, **kwargs):
+    def load_file(self, url, file_index, progress=None, delta=False):
         """
-        Main method to download, extract, and sync RUC data using Celery tasks
+        Download, parse and merge one ruc{n}.zip streaming the rows,
+        progress(message, pct) is called between stages.
+        In delta mode a file with the same content hash as the last run is skipped
         """
-        logger.info('Starting RUC sync process')
+        progress = progress or (lambda message, pct: None)
+        t0 = time.perf_counter()
+        fname = f'ruc{file_index}.zip'
+        sfobj = RucSyncFile.objects.filter(fname=fname).first()
+        progress(f'Descargando {fname}', 0)
+        zfh, meta = self.download(url, file_index, sfobj=sfobj if delta else None)
+        if zfh is None or (delta and sfobj and sfobj.sha256 == meta['sha256']):
+            if zfh is not None:
+                zfh.close()
+            logger.info(f'{fname} sin cambios desde {sfobj.synced_at}, omitido')
+            return {'file': fname, 'skipped': True, 'total': 0, 'created': 0, 'updated': 0,
+                    'unchanged': sfobj.total, 'errors': 0,
+                    'elapsed': round(time.perf_counter() - t0, 2)}
+        with zfh, zipfile.ZipFile(zfh) as zip_file:
+            progress(f'{fname} descargado, cargando filas', 10)
+            rows = self.iter_zip(zip_file)
+            if connection.vendor == 'postgresql':
+                result = self.copy_upsert(
+                    rows, file_index, delta=delta,
+                    progress=lambda count: progress(f'{fname}: {count} filas leidas', 50)
+                )
+            else:
+                result = self.sync_to_database(rows, delta=delta)
+        if not result['errors']:
+            RucSyncFile.objects.update_or_create(fname=fname, defaults={
+                'url': url,
+                'sha256': meta['sha256'],
+                'etag': meta['etag'],
+                'last_modified': meta['last_modified'],
+                'total': result['total'],
+                'created': result['created'],
+                'updated': result['updated'],
+                'unchanged': result['unchanged'],
+            })
+        result['file'] = fname
+        result['skipped'] = False
+        result['elapsed'] = round(time.perf_counter() - t0, 2)
+        progress(f"{fname}: {result['created']} nuevos, {result['updated']} actualizados, "
+                 f"{result['unchanged']} sin cambios", 100)
+        logger.info(f'{fname}: {result}')
+        return result
+
+    def _load_file(self, url, file_index, delta=False):
+        try:
+            return self.load_file(url, file_index, delta=delta)
+        finally:
+            connection.close()
 
-        tasks_sent = []
-        total_records = 0
+    def load_rucs(self, *args, workers=None, delta=False, **kwargs):
+        """
+        Load every registry file in this process, downloads and parsing run in parallel threads
+        """
+        logger.info('Starting local RUC load')
+        t0 = time.perf_counter()
+        totals = {'total': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'errors': 0, 'skipped': 0}
+        files = []
+        with ThreadPoolExecutor(max_workers=workers or self.WORKERS) as executor:
+            futures = {
+                executor.submit(self._load_file, url, idx, delta): idx
+                for idx, url in enumerate(self.RUC_URLS)
+            }
+            for fut in as_completed(futures):
+                idx = futures[fut]
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    logger.error(f'Error loading ruc{idx}.zip: {str(e)}')
+                    files.append({'file': f'ruc{idx}.zip', 'error': str(e)})
+                    continue
+                files.append(result)
+                for k in totals:
+                    totals[k] += result.get(k, 0)
+        totals['files'] = sorted(files, key=lambda r: r['file'])
+        totals['elapsed'] = round(time.perf_counter() - t0, 2)
+        logger.info(f'RUC load completed in {totals["elapsed"]}s: {totals["created"]} created, '
+                    f'{totals["updated"]} updated, {totals["unchanged"]} unchanged, {totals["skipped"]} files skipped')
+        return totals
+
+    def sync_rucs(self, *args, delta=None, **kwargs):
+        """
+        Main method to sync RUC data, one Celery task per registry file
+        so the ten files are downloaded and loaded in parallel by the workers
+        """
+        q: dict = kwargs.get('qdict', {}) or {}
+        if delta is None:
+            delta = str(q.get('delta', '')).lower() in ('1', 'true', 'yes')
+        logger.info(f'Starting RUC sync process delta={delta}')
 
-        # Download and extract all files
+        tasks_sent = []
         for idx, url in enumerate(self.RUC_URLS):
-            txt_files = self.download_and_extract_zip(url, idx)
-
-            # Read each extracted txt file
-            for txt_file in txt_files:
-                txt_path = os.path.join(self.download_dir, txt_file)
-                df = self.read_txt_to_dataframe(txt_path)
-
-                if not df.empty:
-                    # Remove duplicates in this dataframe (keep last occurrence)
-                    df = df.drop_duplicates(subset=['RUC'], keep='last')
-                    logger.info(f'Sending {len(df)} records from {txt_file} to Celery task')
-
-                    # Convert DataFrame to dict for serialization
-                    df_dict = df.to_dict('records')
-
-                    # Send task to Celery
-                    task = current_app.send_task(
-                        'Sifen.tasks.sync_database',
-                        args=[df_dict]
-                    )
-                    tasks_sent.append(task.id)
-                    total_records += len(df)
-                    logger.info(f'Task {task.id} sent for {txt_file}')
+            task = current_app.send_task(
+                'Sifen.tasks.sync_database',
+                args=[idx, url],
+                kwargs={'delta': delta}
+            )
+            tasks_sent.append(task.id)
+            logger.info(f'Task {task.id} sent for ruc{idx}.zip')
 
-        logger.info(f'RUC sync process completed: {len(tasks_sent)} tasks sent, {total_records} total records')
+        logger.info(f'RUC sync process completed: {len(tasks_sent)} tasks sent')
         return {
             'tasks_sent': len(tasks_sent),
             'task_ids': tasks_sent,
-            'total_records': total_records
+            'total_records': None
         }
+
+
+def copy_text(value):
+    """Value in the COPY text format"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class CopyStream(io.RawIOBase):
+    """
+    File like object that renders rows lazily for COPY ... FROM STDIN,
+    memory stays flat whatever the size of the file
+    """
+
+    def __init__(self, rows, progress=None, every=100000):
+        self.rows = iter(rows)
+        self.buf = bytearray()
+        self.count = 0
+        self.progress = progress
+        self.every = every
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self.buf) < size:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                break
+            self.buf += ('\t'.join(copy_text(v) for v in row) + '\n').encode('utf-8')
+            self.count += 1
+            if self.progress and self.count % self.every == 0:
+                self.progress(self.count)
+        if size is None or size < 0:
+            size = len(self.buf)
+        chunk = bytes(self.buf[:size])
+        del self.buf[:size]
+        return chunk
+
+
+def copy_from(cursor, sql, stream, size=65536):
+    """COPY FROM STDIN for psycopg2 (copy_expert) and psycopg 3 (cursor.copy)"""
+    raw = cursor.cursor
+    if hasattr(raw, 'copy_expert'):
+        raw.copy_expert(sql, stream, size=size)
+        return
+    with raw.copy(sql) as cp:
+        while True:
+            chunk = stream.read(size)
+            if not chunk:
+                break
+            cp.write(chunk)
@@ -0,0 +1,258 @@
+"""
+Resumen diario de ventas (VentaDiaria).
+
+Una fila por negocio, día, doc_tipo, moneda y establecimiento con gravadas,
+IVA, exenta, total, cantidad y saldo. Los reportes de un mes o de un año
+suman filas por día en lugar de recorrer documentos.
+
+Mantenimiento:
+- Las señales de DocumentHeader/DocumentDetail marcan el (negocio, día) del
+  documento y al confirmar la transacción se recalcula ese día.
+- Si un save() cambia la fecha o el negocio del documento también se marca
+  el día anterior (pre_save).
+- Los update() no disparan señales, llamar a mark_queryset antes y después
+  del cambio o esperar la reconciliación nocturna (task
+  reconcile_ventas_diarias) que recalcula los últimos VENTAS_DIARIAS_DIAS días.
+- Las operaciones con varias escrituras se envuelven en batch() para
+  recalcular una sola vez al final y no en cada save.
+
+Documentos anulados, cancelados o inutilizados no suman.
+"""
+import logging
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction, connections
+from django.db.models import Sum, Count, Q
+from django.db.models.functions import TruncMonth, TruncYear
+
+from Sifen.models import DocumentHeader, VentaDiaria, totals_aggregates
+from Sifen.fl_sifen_conf import VENTAS_DIARIAS_DIAS
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_EXCLUIDOS = ('Cancelado', 'Inutilizado')
+KEY_FIELDS = ('ek_bs_ruc', 'doc_fecha', 'doc_tipo', 'doc_moneda', 'doc_establecimiento')
+DETAIL_BUCKETS = ('gravada_10', 'gravada_5', 'base_gravada_10_all', 'base_gravada_5_all', 'iva_10', 'iva_5', 'exenta')
+AMOUNTS = ('gravada_10', 'gravada_5', 'base_gravada_10', 'base_gravada_5', 'iva_10', 'iva_5',
+           'exenta', 'redondeo', 'total', 'saldo', 'saldo_credito')
+COUNTS = ('cantidad', 'cantidad_credito')
+PERIODOS = {
+    'dia': None,
+    'mes': TruncMonth('fecha'),
+    'anio': TruncYear('fecha'),
+}
+
+
+def vigentes(qs):
+    return qs.filter(anulado_fecha__isnull=True).exclude(ek_estado__in=ESTADOS_EXCLUIDOS)
+
+
+class VentasDiarias:
+    def __init__(self, dbcon='default'):
+        self.dbcon = dbcon
+        self._local = threading.local()
+
+    def headers(self):
+        return vigentes(DocumentHeader.objects.using(self.dbcon))
+
+    def aggregate(self, qs) -> list:
+        """
+            Filas de VentaDiaria para los documentos de qs, en dos consultas agrupadas:
+            importes de los detalles e importes/cantidades de las cabeceras
+            (separadas para que el join con los detalles no multiplique las cabeceras).
+        """
+        qs = qs.order_by()
+        aggs = totals_aggregates('documentdetail__')
+        details = qs.values(*KEY_FIELDS).annotate(**{ k: aggs[k] for k in DETAIL_BUCKETS })
+        credito = Q(doc_cre_tipo_cod=2, doc_saldo__gt=0)
+        heads = qs.values(*KEY_FIELDS).annotate(cantidad=Count('pk'),
+                                                redondeo=Sum('doc_redondeo'),
+                                                saldo=Sum('doc_saldo'),
+                                                saldo_credito=Sum('doc_saldo', filter=credito),
+                                                cantidad_credito=Count('pk', filter=credito))
+        dmap = { tuple(d[k] for k in KEY_FIELDS): d for d in details }
+        rows = []
+        for h in heads:
+            key = tuple(h[k] for k in KEY_FIELDS)
+            d = dmap.get(key, {})
+            amt = lambda k: d.get(k) or Decimal(0)
+            redondeo = h['redondeo'] or Decimal(0)
+            rows.append(VentaDiaria(
+                bs_ruc=h['ek_bs_ruc'] or '',
+                fecha=h['doc_fecha'],
+                doc_tipo=h['doc_tipo'],
+                doc_moneda=h['doc_moneda'],
+                doc_establecimiento=h['doc_establecimiento'],
+                cantidad=h['cantidad'],
+                gravada_10=amt('gravada_10'),
+                gravada_5=amt('gravada_5'),
+                base_gravada_10=amt('base_gravada_10_all'),
+                base_gravada_5=amt('base_gravada_5_all'),
+                iva_10=amt('iva_10'),
+                iva_5=amt('iva_5'),
+                exenta=amt('exenta'),
+                redondeo=redondeo,
+                #Mismo calculo que get_total_operacion_redondeo
+                total=amt('exenta') + amt('base_gravada_5_all') + amt('iva_5')
+                      + amt('base_gravada_10_all') + amt('iva_10') - redondeo,
+                saldo=h['saldo'] or Decimal(0),
+                saldo_credito=h['saldo_credito'] or Decimal(0),
+                cantidad_credito=h['cantidad_credito'],
+            ))
+        return rows
+
+    def lock_day(self, bs_ruc, fecha):
+        """
+            Serializa los recalculos del mismo (negocio, dia) hasta el fin de la
+            transaccion, dos commits simultaneos chocarian con ventadiaria_key_uniq
+        """
+        conn = connections[self.dbcon]
+        if conn.vendor != 'postgresql':
+            return
+        digest = hashlib.sha1(f'ventadiaria|{bs_ruc or ""}|{fecha}'.encode('utf-8')).digest()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [int.from_bytes(digest[:8], 'big', signed=True)])
+
+    def refresh_day(self, bs_ruc, fecha) -> int:
+        """Recalcula las filas de un negocio en un dia"""
+        qs = self.headers().filter(doc_fecha=fecha)
+        qs = qs.filter(Q(ek_bs_ruc__isnull=True) | Q(ek_bs_ruc='')) if not bs_ruc else qs.filter(ek_bs_ruc=bs_ruc)
+        with transaction.atomic(using=self.dbcon):
+            #Se agrega con el lock tomado para leer lo que confirmo el otro writer
+            self.lock_day(bs_ruc, fecha)
+            rows = self.aggregate(qs)
+            VentaDiaria.objects.using(self.dbcon).filter(bs_ruc=bs_ruc or '', fecha=fecha).delete()
+            VentaDiaria.objects.using(self.dbcon).bulk_create(rows)
+        return len(rows)
+
+    def rebuild(self, desde=None, hasta=None, bs_ruc=None) -> dict:
+        """Reconstruye el rango completo (reconciliacion nocturna o carga inicial)"""
+        qs = self.headers()
+        vqs = VentaDiaria.objects.using(self.dbcon)
+        if desde:
+            qs = qs.filter(doc_fecha__gte=desde)
+            vqs = vqs.filter(fecha__gte=desde)
+        if hasta:
+            qs = qs.filter(doc_fecha__lte=hasta)
+            vqs = vqs.filter(fecha__lte=hasta)
+        if bs_ruc:
+            qs = qs.filter(ek_bs_ruc=bs_ruc)
+            vqs = vqs.filter(bs_ruc=bs_ruc)
+        rows = self.aggregate(qs)
+        with transaction.atomic(using=self.dbcon):
+            deleted, _ = vqs.delete()
+            VentaDiaria.objects.using(self.dbcon).bulk_create(rows, batch_size=1000)
+        logger.info(f'VentaDiaria {desde} - {hasta} {bs_ruc or ""}: {len(rows)} filas, {deleted} reemplazadas')
+        return {'exitos': 'Hecho', 'filas': len(rows), 'reemplazadas': deleted}
+
+    def reconcile(self, days=VENTAS_DIARIAS_DIAS) -> dict:
+        return self.rebuild(desde=date.today() - timedelta(days=days))
+
+    #Marcado incremental desde las señales
+    def _add(self, kind, value):
+        pend = getattr(self._local, 'pending', None)
+        if pend is None:
+            pend = self._local.pending = {'keys': set(), 'headers': set()}
+        pend[kind].add(value)
+        if not getattr(self._local, 'depth', 0):
+            self._schedule()
+
+    def _schedule(self):
+        #Fuera de una transaccion on_commit ejecuta flush en el acto; un rollback
+        #descarta el callback registrado, en ese caso se vuelve a registrar
+        if not getattr(self._local, 'pending', None):
+            return
+        conn = transaction.get_connection(self.dbcon)
+        if not any(cb[1] == self.flush for cb in conn.run_on_commit):
+            transaction.on_commit(self.flush, using=self.dbcon)
+
+    @contextmanager
+    def batch(self):
+        """
+            Junta las marcas de todas las escrituras del bloque y recalcula una
+            sola vez al salir (o al confirmar la transaccion que lo contiene).
+            Se puede usar como decorador.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._local.depth = depth
+            if not depth:
+                self._schedule()
+
+    def mark(self, bs_ruc, fecha):
+        if fecha:
+            self._add('keys', (bs_ruc or '', fecha))
+
+    def mark_header(self, header_id):
+        if header_id:
+            self._add('headers', header_id)
+
+    def mark_queryset(self, qs):
+        """Para cambios hechos con update(), que no disparan señales"""
+        for bs_ruc, fecha in qs.order_by().values_list('ek_bs_ruc', 'doc_fecha').distinct():
+            self.mark(bs_ruc, fecha)
+
+    def flush(self):
+        pend = getattr(self._local, 'pending', None)
+        self._local.pending = None
+        if not pend:
+            return
+        keys = set(pend['keys'])
+        if pend['headers']:
+            keys.update((bs_ruc or '', fecha) for bs_ruc, fecha in
+                        DocumentHeader.objects.using(self.dbcon)
+                                              .filter(pk__in=pend['headers'])
+                                              .order_by()
+                                              .values_list('ek_bs_ruc', 'doc_fecha')
+                                              .distinct())
+        for bs_ruc, fecha in keys:
+            try:
+                self.refresh_day(bs_ruc, fecha)
+            except Exception as e:
+                #La reconciliacion nocturna corrige el dia
+                logger.error(f'Error actualizando VentaDiaria {bs_ruc} {fecha}: {e}')
+
+    #Consultas para reportes
+    def resumen(self, bs_ruc=None, desde=None, hasta=None, periodo='dia', group_by=(), **filters) -> list:
+        """
+            Totales del rollup agrupados por periodo ('dia', 'mes', 'anio') y por
+            los campos de group_by (doc_tipo, doc_moneda, doc_establecimiento).
+            filters se aplican sobre VentaDiaria, p.ej. doc_tipo__in=['FE', 'AF'].
+        """
+        qs = VentaDiaria.objects.using(self.dbcon).filter(**filters)
+        if bs_ruc:
+            qs = qs.filter(bs_ruc=bs_ruc)
+        if desde:
+            qs = qs.filter(fecha__gte=desde)
+        if hasta:
+            qs = qs.filter(fecha__lte=hasta)
+        trunc = PERIODOS[periodo]
+        if trunc is not None:
+            qs = qs.annotate(periodo=trunc)
+            fields = ['periodo', *group_by]
+        else:
+            fields = ['fecha', *group_by]
+        sums = { k: Sum(k) for k in AMOUNTS + COUNTS }
+        return list(qs.values(*fields).annotate(**sums).order_by(*fields))
+
+    def totales(self, bs_ruc=None, desde=None, hasta=None, **filters) -> dict:
+        """Totales del rango sin agrupar"""
+        qs = VentaDiaria.objects.using(self.dbcon).filter(**filters)
+        if bs_ruc:
+            qs = qs.filter(bs_ruc=bs_ruc)
+        if desde:
+            qs = qs.filter(fecha__gte=desde)
+        if hasta:
+            qs = qs.filter(fecha__lte=hasta)
+        rsp = qs.aggregate(**{ k: Sum(k) for k in AMOUNTS + COUNTS })
+        return { k: v or (0 if k in COUNTS else Decimal(0)) for k, v in rsp.items() }
+
+
+ventas_diarias = VentasDiarias()
@@ -6,7 +6,8 @@ from num2words import num2words
 from OptsIO.io_serial import dict_int_none
 from OptsIO.io_formats import IoF
 import uuid
-from django.db.models import Sum
+from django.db.models import Sum, Q, Value
+from django.db.models.functions import Coalesce
 
 iof = IoF()
 
@@ -235,6 +236,24 @@ class RucQr(models.Model):
     drucfactelec = models.CharField(max_length=200)
     process_date = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['druccons', '-process_date'], name='rucqr_ruc_date_idx'),
+        ]
+
+class RucSyncFile(models.Model):
+    """Ultima version aplicada de cada archivo ruc{n}.zip del padron DNIT"""
+    fname = models.CharField(max_length=60, unique=True)
+    url = models.CharField(max_length=400)
+    sha256 = models.CharField(max_length=64)
+    etag = models.CharField(max_length=200, null=True, blank=True)
+    last_modified = models.CharField(max_length=100, null=True, blank=True)
+    total = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    unchanged = models.IntegerField(default=0)
+    synced_at = models.DateTimeField(auto_now=True)
+
 class TrackLote(models.Model):
     lote = models.CharField(max_length=120)
     estado = models.CharField(max_length=120)
@@ -270,7 +289,60 @@ class CSeg(models.Model):
     asignado_model = models.CharField(max_length=15, default='ND')
     asignado_doc = models.BigIntegerField(default=0)
 
+TOTALS_BUCKETS = (
+    'exenta', 'gravada_5', 'gravada_10', 'iva_5', 'iva_10',
+    'base_gravada_5', 'base_gravada_10', 'base_gravada_5_all', 'base_gravada_10_all',
+    'descuento_exenta', 'descuento_gravada_5', 'descuento_gravada_10',
+    'venta_exenta', 'venta_gravada_5', 'venta_gravada_10',
+)
+
+def totals_aggregates(prefix='', doc_op=None):
+    """
+        Sumas condicionales de DocumentDetail para todos los subtotales del documento.
+        Con doc_op se arma para un solo documento (consulta sobre DocumentDetail),
+        sin doc_op la exclusion de prod_cod depende del doc_op de cada cabecera
+        (anotacion sobre DocumentHeader con prefix='documentdetail__').
+        prod_cod 90000 (o -9 en GA) no suma en los totales, salvo las bases *_all
+    """
+    p = lambda f: f'{prefix}{f}'
+    activo = Q(**{p('anulado'): False, p('bonifica'): False})
+    bonifica = Q(**{p('anulado'): False, p('bonifica'): True})
+    no_cod = lambda cod: Q(**{p('prod_cod__lt'): cod}) | Q(**{p('prod_cod__gt'): cod})
+    if doc_op is None:
+        sin_ex = (Q(doc_op='GA') & no_cod(-9)) | (~Q(doc_op='GA') & no_cod(90000))
+        sin_exc = Q(doc_op__in=['GA', 'G']) | no_cod(90000)
+    else:
+        sin_ex = no_cod(-9 if doc_op == 'GA' else 90000)
+        sin_exc = Q() if doc_op in ['GA', 'G'] else no_cod(90000)
+    tsum = lambda field, cond: Coalesce(Sum(p(field), filter=cond), Value(0),
+                                        output_field=models.DecimalField(max_digits=19, decimal_places=6))
+    return {
+        'exenta': tsum('exenta', activo & sin_ex),
+        'gravada_5': tsum('gravada_5', activo & sin_ex),
+        'gravada_10': tsum('gravada_10', activo & sin_ex),
+        'iva_5': tsum('iva_5', activo & sin_ex),
+        'iva_10': tsum('iva_10', activo & sin_ex),
+        'base_gravada_5': tsum('base_gravada_5', activo & sin_ex),
+        'base_gravada_10': tsum('base_gravada_10', activo & sin_ex),
+        'base_gravada_5_all': tsum('base_gravada_5', activo),
+        'base_gravada_10_all': tsum('base_gravada_10', activo),
+        'descuento_exenta': tsum('exenta', bonifica & sin_ex),
+        'descuento_gravada_5': tsum('gravada_5', bonifica & sin_ex),
+        'descuento_gravada_10': tsum('gravada_10', bonifica & sin_ex),
+        'venta_exenta': tsum('exenta', activo & sin_exc),
+        'venta_gravada_5': tsum('gravada_5', activo & sin_exc),
+        'venta_gravada_10': tsum('gravada_10', activo & sin_exc),
+    }
+
+
+class DocumentHeaderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Anota tot_<bucket> para cada cabecera en una sola consulta, get_totals los reutiliza"""
+        return self.annotate(**{ f'tot_{k}': v for k, v in totals_aggregates('documentdetail__').items() })
+
+
 class DocumentHeader(models.Model):
+    objects = DocumentHeaderQuerySet.as_manager()
     cct = {'max_digits':19, 'decimal_places':6 }
     cd_char = {'max_length':120, 'null':True}
     prof_number = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
@@ -426,6 +498,11 @@ class DocumentHeader(models.Model):
     lote_estado = models.CharField(max_length=120, null=True)
     lote_msg = models.CharField(max_length=300, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['ek_bs_ruc', 'doc_fecha'], name='dh_bs_fecha_idx'),
+        ]
+
     def get_timbrado_id(self):
         timbradoobj = Etimbrado.objects.get(timbrado=self.ek_timbrado)
         return timbradoobj.id
@@ -464,172 +541,83 @@ class DocumentHeader(models.Model):
     def get_qr_full(self):
         return iof.url_viewfull(self.ek_qr_img)
 
+    def get_totals(self) -> dict:
+        """
+            Todos los subtotales del documento en una sola consulta, se guardan en la
+            instancia (o se toman de with_totals) hasta reset_totals
+        """
+        totals = self.__dict__.get('_totals')
+        if totals is None:
+            annotated = { k: self.__dict__[f'tot_{k}'] for k in TOTALS_BUCKETS if f'tot_{k}' in self.__dict__ }
+            if len(annotated) == len(TOTALS_BUCKETS):
+                totals = annotated
+            else:
+                totals = DocumentDetail.objects.using(self._state.db or 'default')\
+                            .filter(documentheaderobj_id=self.pk)\
+                            .aggregate(**totals_aggregates(doc_op=self.doc_op))
+            self._totals = totals
+        return totals
+
+    def reset_totals(self):
+        self.__dict__.pop('_totals', None)
+        self.__dict__.pop('_nc_raw', None)
+        for k in TOTALS_BUCKETS:
+            self.__dict__.pop(f'tot_{k}', None)
+
+    def refresh_from_db(self, *args, **kwargs):
+        self.reset_totals()
+        return super().refresh_from_db(*args, **kwargs)
+
     def get_base_gravada_master(self):
-        mbg_5 = 0
-        mbg_10 = 0
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9        
-        for p in self.documentdetail_set.filter(anulado=False, bonifica=False).exclude(prod_cod=ex):
-            bg_5, bg_10 = p.get_base_gravada()
-            mbg_5 += bg_5
-            mbg_10 += bg_10
-        return sum([mbg_5, mbg_10])
+        totals = self.get_totals()
+        return totals['base_gravada_5'] + totals['base_gravada_10']
         
     def get_base_gravada_master_10(self):
-        mbg_10 = 0
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9
-        for p in self.documentdetail_set.filter(anulado=False, bonifica=False).exclude(prod_cod=ex):
-            bg_5, bg_10 = p.get_base_gravada()
-            mbg_10 += bg_10
-        return mbg_10
+        return self.get_totals()['base_gravada_10']
         
     def get_base_gravada_master_5(self):
-        mbg_5 = 0
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9        
-        for p in self.documentdetail_set.filter(anulado=False, bonifica=False).exclude(prod_cod=ex):
-            bg_5, bg_10 = p.get_base_gravada()
-            mbg_5 += bg_5
-        return mbg_5        
+        return self.get_totals()['base_gravada_5']
         
     def get_ivas_10_master(self):
-        miva_10 = 0
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9        
-        for p in self.documentdetail_set.filter(anulado=False, bonifica=False).exclude(prod_cod=ex):
-            iva_5, iva_10 = p.get_ivas()
-            miva_10 += iva_10
-        return miva_10
+        return self.get_totals()['iva_10']
         
     def get_ivas_5_master(self):
-        miva_5 = 0
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9        
-        for p in self.documentdetail_set.filter(anulado=False, bonifica=False).exclude(prod_cod=ex):
-            iva_5, iva_10 = p.get_ivas()
-            miva_5 += iva_5
-        return miva_5
+        return self.get_totals()['iva_5']
         
     def get_ivas_master(self):
-        miva_5 = 0
-        miva_10 = 0
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9        
-        for p in self.documentdetail_set.filter(anulado=False, bonifica=False).exclude(prod_cod=ex):
-            iva_5, iva_10 = p.get_ivas()
-            miva_5 += iva_5
-            miva_10 += iva_10
-        return sum([miva_5, miva_10])
+        totals = self.get_totals()
+        return totals['iva_5'] + totals['iva_10']
     
     def get_descuento(self):
         return sum(self.get_total_descuento())
         
     def get_total_descuento(self):
-        descuento_exenta = 0
-        descuento_gravada_5 = 0
-        descuento_gravada_10 = 0
-        # if self.documentdetail_set.filter(anulado=False, bonifica=True).exclude(prod_cod=90000):
-        # if self.powerpack:
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9        
-        total_venta = self.documentdetail_set.filter(anulado=False, bonifica=True).only('exenta', 'gravada_5', 'gravada_10')\
-                                                        .exclude(prod_cod=ex).aggregate(
-            exenta=models.Sum('exenta'),
-            gravada_5=models.Sum('gravada_5'),
-            gravada_10=models.Sum('gravada_10')
-        )
-        total_venta = dict_int_none(total_venta)
-        descuento_exenta = total_venta.get('exenta')
-        descuento_gravada_5 = total_venta.get('gravada_5')
-        descuento_gravada_10 = total_venta.get('gravada_10')
-            # totales  = (
-            #     total_venta.get('exenta') + total_venta.get('gravada_5') + total_venta.get('gravada_10')
-            # )
-        return descuento_exenta, descuento_gravada_5, descuento_gravada_10
+        totals = self.get_totals()
+        return totals['descuento_exenta'], totals['descuento_gravada_5'], totals['descuento_gravada_10']
         
     def get_total_exenta(self):
         if self.doc_op == 'RS':
             exenta, gravada_5, gravada_10, iva_5, iva_10 = self.get_valor_nc_raw()
             return exenta
-        totales = 0
-        ex = 90000            
-        if self.doc_op == 'GA':
-            ex = -9        
-        if self.documentdetail_set.filter(anulado=False, bonifica=False):
-            total_venta = self.documentdetail_set.filter(anulado=False, bonifica=False)\
-                .exclude(prod_cod=ex)\
-                .aggregate(
-                exenta=models.Sum('exenta'),
-            )
-            totales  = total_venta.get('exenta')
-        return totales
+        return self.get_totals()['exenta']
 
     def get_total_gravada_10(self):
-        totales = 0
-        
         if self.doc_op == 'RS':
             exenta, gravada_5, gravada_10, iva_5, iva_10 = self.get_valor_nc_raw()
             return gravada_10
-        ex = 90000
-        if self.doc_op == 'GA':
-            ex = -9            
-        if self.documentdetail_set.filter(anulado=False, bonifica=False):
-            total_venta = self.documentdetail_set.filter(anulado=False, bonifica=False) \
-                .exclude(prod_cod=ex) \
-                .aggregate(
-                gravada_10=models.Sum('gravada_10'),
-            )
-            totales  = dict_int_none(total_venta).get('gravada_10')
-
-        return totales
+        return self.get_totals()['gravada_10']
     
     def get_total_base_gravada_10(self):
-        totales = 0
-        if self.documentdetail_set.filter(anulado=False, bonifica=False):
-            total_venta = self.documentdetail_set.filter(anulado=False, bonifica=False) \
-                .aggregate(
-                base_gravada_10=models.Sum('base_gravada_10'),
-            )
-            totales  = dict_int_none(total_venta).get('base_gravada_10')
-
-        return totales        
+        return self.get_totals()['base_gravada_10_all']
         
     def get_total_gravada_5(self):
         if self.doc_op == 'RS':
             exenta, gravada_5, gravada_10, iva_5, iva_10 = self.get_valor_nc_raw()
             return gravada_5
-        ex = 90000            
-        if self.doc_op == 'GA':
-            ex = -9            
-        totales = 0
-        if self.documentdetail_set.filter(anulado=False, bonifica=False):
-            total_venta = self.documentdetail_set.filter(anulado=False, bonifica=False) \
-                .exclude(prod_cod=ex) \
-                .aggregate(
-                gravada_5=models.Sum('gravada_5'),
-            )
-            totales  = dict_int_none(total_venta).get('gravada_5')
-
-        return totales
+        return self.get_totals()['gravada_5']
     
     def get_total_base_gravada_5(self):
-        totales = 0
-        if self.documentdetail_set.filter(anulado=False, bonifica=False):
-            total_venta = self.documentdetail_set.filter(anulado=False, bonifica=False) \
-                .aggregate(
-                base_gravada_5=models.Sum('base_gravada_5'),
-            )
-            totales  = dict_int_none(total_venta).get('base_gravada_5')
-
-        return totales
+        return self.get_totals()['base_gravada_5_all']
     
     def get_total_gravada(self):
         return self.get_total_gravada_10()+self.get_total_gravada_5()
@@ -664,20 +652,10 @@ class DocumentHeader(models.Model):
         if self.doc_op == 'RS':
             exenta, gravada_5, gravada_10, iva_5, iva_10 = self.get_valor_nc_raw()
             return sum([exenta, gravada_5, gravada_10])
-        totales = 0
-        exc = {'prod_cod':90000}
-        if self.doc_op in ['GA', 'G']: exc = {}
-        total_venta = self.documentdetail_set.filter(anulado=False, bonifica=False)\
-            .only('exenta', 'gravada_5', 'gravada_10') \
-            .exclude(**exc)\
-            .aggregate(exenta=models.Sum('exenta'),
-                 gravada_5=models.Sum('gravada_5'),
-                 gravada_10=models.Sum('gravada_10')
-            )
-        total_venta = dict_int_none(total_venta)
-        totales  = (float(total_venta.get('exenta')) +\
-                    float(total_venta.get('gravada_5')) + 
-                    float(total_venta.get('gravada_10')) )
+        totals = self.get_totals()
+        totales  = (float(totals['venta_exenta']) +\
+                    float(totals['venta_gravada_5']) + 
+                    float(totals['venta_gravada_10']) )
         hdoc = abs(self.doc_redondeo)
         if hdoc and redondeo:
             if self.doc_redondeo > 0:
@@ -687,6 +665,12 @@ class DocumentHeader(models.Model):
         return Decimal(totales)
     
     def get_valor_nc_raw(self, *args, **kwargs):
+        nc_raw = self.__dict__.get('_nc_raw')
+        if nc_raw is None:
+            nc_raw = self._nc_raw = self.valor_nc_raw()
+        return list(nc_raw)
+
+    def valor_nc_raw(self):
         texenta = 0
         tgravada_5 = 0
         tgravada_10 = 0
@@ -715,7 +699,33 @@ class DocumentHeader(models.Model):
             monto=models.Sum('monto')
         )
 
+class DocumentDetailQuerySet(models.QuerySet):
+    """
+        update()/bulk_create() no disparan señales, descartan aqui los totales memorizados
+        de las cabeceras en memoria (la del related manager y las de los detalles creados)
+    """
+    def _reset_headers(self, objs=()):
+        headers = { id(d.documentheaderobj): d.documentheaderobj for d in objs
+                    if DocumentDetail.documentheaderobj.is_cached(d) and d.documentheaderobj is not None }
+        instance = self._hints.get('instance')
+        if isinstance(instance, DocumentHeader):
+            headers[id(instance)] = instance
+        for hobj in headers.values():
+            hobj.reset_totals()
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        self._reset_headers()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self._reset_headers(objs)
+        return objs
+
+
 class DocumentDetail(models.Model):
+    objects = DocumentDetailQuerySet.as_manager()
     cct = {'max_digits':19, 'decimal_places':6, 'default':0}
     documentheaderobj = models.ForeignKey(DocumentHeader, on_delete=models.CASCADE)
     prod_autocreado = models.BooleanField(default=False)
@@ -1008,6 +1018,40 @@ class DocumentReciboDetail(models.Model):
             str(self.numero).zfill(7),
         )
     
+class VentaDiaria(models.Model):
+    """
+        Resumen diario de ventas por negocio, dia, tipo de documento, moneda y
+        establecimiento. Lo mantiene Sifen.mng_ventas_diarias, no editar a mano.
+    """
+    cct = {'max_digits':19, 'decimal_places':6, 'default':0 }
+    bs_ruc = models.CharField(max_length=120)
+    fecha = models.DateField()
+    doc_tipo = models.CharField(max_length=10)
+    doc_moneda = models.CharField(max_length=10)
+    doc_establecimiento = models.IntegerField()
+    cantidad = models.IntegerField(default=0)
+    gravada_10 = models.DecimalField(**cct)
+    gravada_5 = models.DecimalField(**cct)
+    base_gravada_10 = models.DecimalField(**cct)
+    base_gravada_5 = models.DecimalField(**cct)
+    iva_10 = models.DecimalField(**cct)
+    iva_5 = models.DecimalField(**cct)
+    exenta = models.DecimalField(**cct)
+    redondeo = models.DecimalField(**cct)
+    total = models.DecimalField(**cct)
+    saldo = models.DecimalField(**cct)
+    #Documentos a credito (doc_cre_tipo_cod=2) con saldo pendiente
+    saldo_credito = models.DecimalField(**cct)
+    cantidad_credito = models.IntegerField(default=0)
+    actualizado_fecha = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bs_ruc', 'fecha', 'doc_tipo', 'doc_moneda', 'doc_establecimiento'],
+                                    name='ventadiaria_key_uniq'),
+        ]
+
+
 class Retencion(models.Model):
     cct = {'max_digits':19, 'decimal_places':6 }
     retencion_fecha = models.DateField()
@@ -1066,6 +1110,13 @@ class Clientes(models.Model):
     cargado_usuario = models.CharField(max_length=120, null=True)
     cargado_fecha = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     anclaje_cliente = models.CharField(max_length=200, blank=True, null=True)
+    # md5 de dv|nombre|estado del padron DNIT aplicado por ultima vez (RMap)
+    pdv_ruc_fp = models.CharField(max_length=32, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pdv_ruc'], name='clientes_pdv_ruc_idx'),
+        ]
 
 
 
@@ -8,7 +8,9 @@ import json
 from django.http import HttpRequest, QueryDict
 from bs4 import BeautifulSoup
 import re
+import threading
 import requests
+from urllib3.util.retry import Retry
 from requests_pkcs12 import Pkcs12Adapter
 from Sifen.models import DocumentHeader, Business
 from Sifen import mng_xml
@@ -22,7 +24,41 @@ from Sifen.models import SoapMsg, CdcTrack, RucQr, TrackLote
 from Sifen.fl_sifen_conf import URL, ROUTE_RECIBE, ROUTE_RECIBE_LOTE, \
     ROUTE_EVENTO, ROUTE_CONSULTA_LOTE, \
         ROUTE_CONSULTA_RUC, ROUTE_CONSULTA,EFDEBUG, \
-        RFOLDER
+        RFOLDER, SESSION_POOL_SIZE, SESSION_MAX_RETRIES, \
+        SESSION_BACKOFF, SESSION_TIMEOUT
+
+#Sesiones keep-alive por hilo, indexadas por negocio
+_sessions = threading.local()
+
+
+def pooled_session(key, adapter_factory, url=URL):
+    """Retorna la sesion del hilo actual para key, creandola si hace falta.
+       adapter_factory construye (o devuelve cacheado) el adapter que se monta en url,
+       si el adapter cambia (ej. se renovo el certificado) la sesion se reemplaza
+    """
+    pool = getattr(_sessions, 'pool', None)
+    if pool is None:
+        pool = _sessions.pool = {}
+    adapter = adapter_factory()
+    entry = pool.get(key)
+    if entry and entry[0] is adapter:
+        return entry[1]
+    #La sesion anterior no se cierra, cerraria el adapter compartido con otras sesiones
+    session = requests.Session()
+    session.mount(url, adapter)
+    pool[key] = (adapter, session)
+    return session
+
+
+def session_retry():
+    #Solo reintenta POST ante errores de conexion, un lote no debe enviarse dos veces
+    return Retry(
+        total=SESSION_MAX_RETRIES,
+        connect=SESSION_MAX_RETRIES,
+        read=0,
+        backoff_factor=SESSION_BACKOFF,
+        status_forcelist=(502, 503, 504),
+    )
 
 class SoapSifen:
     def __init__(self, business=None):
@@ -39,39 +75,24 @@ class SoapSifen:
         """
         Obtiene las credenciales del certificado.
         Prioridad: Certificate model > fl_sifen_conf
+        Las credenciales descifradas se toman del cache de certificate_manager
         """
         if self._pfx_path and self._pfx_pass:
             return self._pfx_path, self._pfx_pass
-
-        # Intentar obtener del modelo Certificate
-        if self.business:
-            cert_obj = certificate_manager.get_active_certificate_for_business(self.business)
-            if cert_obj and cert_obj.pfx_file:
-                try:
-                    pfx_password = certificate_manager.decrypt_password(cert_obj.pfx_password_encrypted)
-                    self._pfx_path = cert_obj.pfx_file.path
-                    self._pfx_pass = pfx_password
-                    logging.info(f'Usando certificado {cert_obj.nombre} para negocio {self.business.name}')
-                    return self._pfx_path, self._pfx_pass
-                except Exception as e:
-                    logging.warning(f'Error obteniendo certificado del modelo: {e}')
-
-        # Fallback a fl_sifen_conf
-        logging.info('Usando certificado por defecto de fl_sifen_conf')
-        self._pfx_path = PFX
-        self._pfx_pass = PASS
+        creds = certificate_manager.get_credentials(self.business)
+        self._pfx_path = creds.get('pfx_path')
+        self._pfx_pass = creds.get('pfx_password')
         return self._pfx_path, self._pfx_pass
 
     def set_session(self, business=None):
         """
-        Crea una sesión con el certificado apropiado.
+        Obtiene la sesión keep-alive del negocio para el hilo actual.
+        La sesión y su pool de conexiones TLS se reutilizan entre llamadas.
 
         Args:
             business: Objeto Business para obtener certificado específico.
                       Si no se proporciona, usa self.business o fl_sifen_conf.
         """
-        session = requests.Session()
-
         # Actualizar business si se proporciona
         if business:
             self.business = business
@@ -80,8 +101,16 @@ class SoapSifen:
 
         pfx_path, pfx_pass = self._get_certificate_credentials()
         logging.info(f'set_session: URL={URL}, PFX={pfx_path}')
-        session.mount(URL, Pkcs12Adapter(pkcs12_filename=pfx_path, pkcs12_password=pfx_pass))
-        return session
+        return pooled_session(
+            self.business.pk if self.business else None,
+            lambda: certificate_manager.get_pkcs12_adapter(
+                self.business,
+                pool_connections=1,
+                pool_maxsize=SESSION_POOL_SIZE,
+                max_retries=session_retry(),
+            ),
+            url=URL
+        )
 
     def send_rq(self,session, pload, SRV, fake=False):
         furl = URL+SRV
@@ -102,7 +131,7 @@ class SoapSifen:
                   )
             )
             return {'exitos': 'Hecho', 'fake': True}
-        return session.post(furl, data=pload, headers=headers)
+        return session.post(furl, data=pload, headers=headers, timeout=SESSION_TIMEOUT)
 
     def qr_ruc(self, ruc, format=True):
         logging.info('Ejecutando qr_ruc')
@@ -170,16 +199,16 @@ class SoapSifen:
         )
         return rsp
 
-    def send_xde_lote(self, ppks, fnames):
+    def send_xde_lote(self, ppks, fnames, lote=None):
         logging.info('Ejecutando send_xde_lote')
-        sxml = soap_schemas_xml.SiRecepLoteDE(fnames)
+        sxml = soap_schemas_xml.SiRecepLoteDE(fnames, lote=lote)
         session = self.set_session()
         rsp = self.send_rq(session, 
                            sxml.get('xml').decode('utf-8'), 
                            ROUTE_RECIBE_LOTE)        
         self.update_rsp(rsp, 
                         sxml.get('sppk'), 
-                        cdc=sxml.get('zipfname'), metodo='SiRecepLoteDE',
+                        cdc=sxml.get('zipfname') or sxml.get('hfname'), metodo='SiRecepLoteDE',
                         ppks=ppks
                         )
         return rsp
@@ -354,6 +383,8 @@ class SoapSifen:
                         lote_estado = 'CONCLUIDO',
                         lote_msg = dMsgResLot
                     )
+                cdctracks = []
+                udhs = {}
                 for d in soup.find_all(name='gResProcLote'):
                     cdc = d.find('id').text
                     dEstRes = d.find('dEstRes').text
@@ -374,7 +405,7 @@ class SoapSifen:
                                 dFecProc, dCodResLot, dMsgResLot, cdc, dEstRes, dCodRes, dMsgRes
                             ))
                         logging.info(f'CDC {cdc} estado {dEstRes} msg {dMsgRes} dcodres {dCodRes} metodo {metodo}')
-                        CdcTrack.objects.create(
+                        cdctracks.append(CdcTrack(
                             cdc = cdc, 
                             metodo = metodo,
                             header_msg = dEstRes,
@@ -383,8 +414,7 @@ class SoapSifen:
                             dfecproc = dFecProc,
                             msg = dMsgRes,
                             transaccion = dProtAut,
-                        )
-                        logging.info(f'Actualizando DocumentHeader ek_cdc={cdc} con estado {dEstRes} msg {dMsgRes}')
+                        ))
                         udh = {
                             'lote': lote,
                             'lote_estado': dEstRes,
@@ -392,10 +422,15 @@ class SoapSifen:
                         }
                         if dEstRes == 'Aprobado':
                             udh['ek_estado'] = 'Aprobado'
-                        DocumentHeader.objects.filter(ek_cdc=cdc).update(
-                            **udh
-                        )
-                        #ek_cdc
+                        udhs[cdc] = udh
+                #Un insert para todo el lote y un update por cada combinacion estado/mensaje
+                CdcTrack.objects.bulk_create(cdctracks, batch_size=500)
+                gudh = {}
+                for cdc, udh in udhs.items():
+                    gudh.setdefault(tuple(sorted(udh.items())), []).append(cdc)
+                for udh, cdcs in gudh.items():
+                    logging.info(f'Actualizando {len(cdcs)} DocumentHeader del lote {lote} con {dict(udh)}')
+                    DocumentHeader.objects.filter(ek_cdc__in=cdcs).update(**dict(udh))
             if cltag == 'renviconsderesponse':
                 soup = BeautifulSoup(self.mxml.to_string_xml(a), 'xml')
                 dFecProc = soup.find(name='dFecProc').text
@@ -1,6 +1,6 @@
 import os
 import shutil
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
 
@@ -56,3 +56,84 @@ def process_business_css(sender, instance, **kwargs):
                 os.remove(static_css_path)
             except Exception:
                 pass
+
+
+@receiver(post_save, sender='Sifen.Certificate')
+@receiver(post_delete, sender='Sifen.Certificate')
+def invalidate_certificate_credentials(sender, instance, **kwargs):
+    """
+    Descarta las credenciales cacheadas de la empresa cuando uno de sus
+    certificados se guarda o se elimina.
+    """
+    from Sifen.mng_certificate import certificate_manager
+    certificate_manager.invalidate(business_id=instance.businessobj_id)
+
+
+@receiver(post_save, sender='Sifen.DocumentDetail')
+@receiver(post_delete, sender='Sifen.DocumentDetail')
+def reset_document_totals(sender, instance, **kwargs):
+    """
+    Descarta los totales memorizados en la cabecera cargada en memoria
+    cuando se agrega, modifica o elimina uno de sus detalles.
+    Los update()/bulk_create() no disparan la señal, DocumentDetailQuerySet
+    descarta los totales de las cabeceras que conoce, el resto se recarga.
+    """
+    from Sifen.models import DocumentDetail
+    if DocumentDetail.documentheaderobj.is_cached(instance):
+        instance.documentheaderobj.reset_totals()
+
+
+@receiver(post_save, sender='Sifen.DocumentHeader')
+def invalidate_document_pdf(sender, instance, **kwargs):
+    """
+    Elimina el PDF cacheado de un documento cancelado o anulado. La clave del
+    cache ya cambia con el estado, esto evita dejar el archivo viejo en disco.
+    """
+    if instance.ek_estado in ('Cancelado', 'Inutilizado') or instance.anulado_fecha:
+        from Sifen.mng_pdf_cache import pdf_cache
+        pdf_cache.invalidate('documentheader', instance.pk)
+
+
+@receiver(pre_save, sender='Sifen.DocumentHeader')
+def mark_ventas_diarias_previous(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """
+    Si el save cambia la fecha o el negocio del documento, marca tambien el
+    dia en el que estaba para que no conserve sus importes.
+    """
+    if raw or instance._state.adding or not instance.pk:
+        return
+    changed = { f for f in ('ek_bs_ruc', 'doc_fecha') if f in instance.__dict__ }
+    if update_fields is not None:
+        changed &= set(update_fields)
+    if not changed:
+        return
+    from Sifen.mng_ventas_diarias import ventas_diarias
+    prev = sender.objects.using(using).filter(pk=instance.pk).values('ek_bs_ruc', 'doc_fecha').first()
+    if prev and any(str(prev[f]) != str(getattr(instance, f)) for f in changed):
+        ventas_diarias.mark(prev['ek_bs_ruc'], prev['doc_fecha'])
+
+
+@receiver(post_save, sender='Sifen.DocumentHeader')
+@receiver(post_delete, sender='Sifen.DocumentHeader')
+def mark_ventas_diarias_header(sender, instance, **kwargs):
+    """
+    Marca el dia del documento para recalcular VentaDiaria al confirmar la
+    transaccion. Con campos diferidos se resuelve por pk en el flush.
+    """
+    from Sifen.mng_ventas_diarias import ventas_diarias
+    if 'doc_fecha' in instance.__dict__ and 'ek_bs_ruc' in instance.__dict__:
+        ventas_diarias.mark(instance.ek_bs_ruc, instance.doc_fecha)
+    else:
+        ventas_diarias.mark_header(instance.pk)
+
+
+@receiver(post_save, sender='Sifen.DocumentDetail')
+@receiver(post_delete, sender='Sifen.DocumentDetail')
+def mark_ventas_diarias_detail(sender, instance, **kwargs):
+    from Sifen.models import DocumentDetail
+    from Sifen.mng_ventas_diarias import ventas_diarias
+    if DocumentDetail.documentheaderobj.is_cached(instance):
+        header = instance.documentheaderobj
+        ventas_diarias.mark(header.ek_bs_ruc, header.doc_fecha)
+    else:
+        ventas_diarias.mark_header(instance.documentheaderobj_id)
@@ -2,13 +2,17 @@ from Sifen import mng_xml
 import logging
 import base64
 import hashlib
+import io
+import zlib
 import os
 import zipfile
 from Sifen.xml_signer import ESigner
 from Sifen.models import SendBulk
 from Sifen.fl_sifen_conf import RFOLDER, SOAP_NAME_SPACE, SIFEN_NAME_SPACE, EVERSION, XSI_NAME_SPACE
+from Sifen.fl_sifen_conf import LOTE_MAX_DES, LOTE_MAX_BYTES, LOTE_SAVE_FILES
 from datetime import datetime
 import lxml
+import lxml.etree
 from Sifen.models import SoapMsg
 
 mxml = mng_xml.MngXml()
@@ -53,38 +57,93 @@ def save_bulk_de(zipfname, lotefname, fname, fnames):
         )
     return {'exitos': 'Save sendbulk tracking'}
 
-def SiRecepLoteDE(fnames):
+class LoteBuilder:
+    """
+        Arma los rLoteDE en memoria respetando los limites de SIFEN:
+        hasta LOTE_MAX_DES documentos del mismo tipo por lote y un tamaño
+        maximo del zip en base64. El tamaño comprimido de cada DE se estima
+        comprimiendolo por separado, lo que sobreestima el total del lote.
+    """
+    def __init__(self, max_des=LOTE_MAX_DES, max_bytes=LOTE_MAX_BYTES):
+        self.max_des = max_des
+        self.max_bytes = max_bytes
+        self.open = {}
+        self.lotes = []
+
+    def add(self, doc_tipo, ppk, fname, xde=None):
+        if xde is None:
+            with open(fname, 'rb') as f:
+                xde = f.read()
+        raw = xde if isinstance(xde, bytes) else mxml.to_string_xml(xde)
+        if isinstance(xde, bytes):
+            xde = lxml.etree.fromstring(xde)
+        size = len(zlib.compress(raw)) * 4 // 3
+        lote = self.open.get(doc_tipo)
+        if lote and (len(lote['ppks']) >= self.max_des or lote['size'] + size > self.max_bytes):
+            self.lotes.append(self.open.pop(doc_tipo))
+            lote = None
+        if lote is None:
+            lote = self.open[doc_tipo] = {'doc_tipo': doc_tipo, 'ppks': [], 'fnames': [], 'xdes': [], 'size': 0}
+        lote['ppks'].append(ppk)
+        lote['fnames'].append(fname)
+        lote['xdes'].append(xde)
+        lote['size'] += size
+
+    def build(self):
+        self.lotes.extend(self.open.values())
+        self.open = {}
+        return [ build_lote(l['fnames'], l['xdes'], ppks=l['ppks'], doc_tipo=l['doc_tipo']) for l in self.lotes ]
+
+
+def build_lote(fnames, xdes=None, **kwargs):
+    """Arma el rLoteDE y su zip en un BytesIO, sin tocar el disco"""
+    if xdes is None:
+        xdes = [ mxml.parse_xml(a) for a in fnames ]
+    rlotede = mxml.set_eroot('rLoteDE')
+    for xde in xdes:
+        rlotede.append(xde)
+    cdcs = sorted([ os.path.basename(a).split('_')[0] for a in fnames ])
+    hfname = hashlib.md5(str.encode('^'.join(cdcs))).hexdigest()
+    xml = mxml.to_string_xml(rlotede, xml_declaration=True)
+    zbuf = io.BytesIO()
+    with zipfile.ZipFile(zbuf, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr(f'{hfname}.xml', xml)
+    kwargs.update({'hfname': hfname, 'fnames': fnames, 'xml': xml, 'zip': zbuf.getvalue()})
+    return kwargs
+
+def save_lote_files(lote):
+    """Paso opcional: guarda el XML y el zip del lote en la carpeta de soaps del dia"""
     ROOTFOLDER = set_soap_folder()
+    lotefname = '{}/{}.xml'.format(ROOTFOLDER, lote.get('hfname'))
+    zipfname = '{}/{}.zip'.format(ROOTFOLDER, lote.get('hfname'))
+    with open(lotefname, 'wb') as f:
+        f.write(lote.get('xml'))
+    with open(zipfname, 'wb') as f:
+        f.write(lote.get('zip'))
+    return {'exitos': 'Hecho', 'lotefname': lotefname, 'zipfname': zipfname}
+
+def SiRecepLoteDE(fnames, lote=None, save_files=LOTE_SAVE_FILES):
+    if lote is None:
+        lote = build_lote(fnames)
+    fnames = lote.get('fnames')
     ele, header, sbody = mxml.get_soap_schema()    
     renviolote = mxml.create_SubElement(sbody, 'rEnvioLote', xmlns="http://ekuatia.set.gov.py/sifen/xsd")
     did = mxml.create_SubElement(renviolote, 'dId')
     dxde = mxml.create_SubElement(renviolote, 'xDE')
-    rlotede = mxml.set_eroot('rLoteDE')
-    cdcs = []
-    for a in fnames:
-        cdcs.append(os.path.basename(a).split('_')[0])
-        fsxm = mxml.parse_xml(a)
-        rlotede.append(fsxm)
-    cdcs.sort()
-    cc = str.encode('^'.join(cdcs))
-    hfname = hashlib.md5(cc).hexdigest()
-    lotefname = '{}/{}.xml'.format(ROOTFOLDER, hfname)
-    zipfname = '{}/{}.zip'.format(ROOTFOLDER, hfname)
-    mxml.save_xml(rlotede, lotefname)
-    zipf = zipfile.ZipFile(zipfname, 'w', zipfile.ZIP_DEFLATED)
-    zipf.write(lotefname)
-    zipf.close()
-    with open(zipfname, "rb") as f:
-        bytes = f.read()
-        encoded = base64.b64encode(bytes)
-        dxde.text = encoded
+    dxde.text = base64.b64encode(lote.get('zip'))
     sppk = track_soap_msg('SiRecepLoteDE', mxml.to_string_xml(ele))
     did.text = str(sppk)
-    fname = '{}/SiRecepLoteDE_{}_soap.xml'.format(ROOTFOLDER, sppk)
-    logging.info('Guardando envio soap en {}'.format(fname))
-    mxml.save_xml(ele, fname)
+    #Sin save_files no hay archivos en disco, SendBulk queda con las rutas vacias
+    zipfname = lotefname = fname = ''
+    if save_files:
+        ROOTFOLDER = set_soap_folder()
+        sfiles = save_lote_files(lote)
+        zipfname, lotefname = sfiles.get('zipfname'), sfiles.get('lotefname')
+        fname = '{}/SiRecepLoteDE_{}_soap.xml'.format(ROOTFOLDER, sppk)
+        logging.info('Guardando envio soap en {}'.format(fname))
+        mxml.save_xml(ele, fname)
     save_bulk_de(zipfname, lotefname, fname, fnames)
-    return {'xml': mxml.to_string_xml(ele), 'sppk': sppk, 'zipfname': zipfname }
+    return {'xml': mxml.to_string_xml(ele), 'sppk': sppk, 'zipfname': zipfname, 'hfname': lote.get('hfname') }
 
 def siRecepDE(fname):
     ROOTFOLDER = set_soap_folder()
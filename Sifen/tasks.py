@@ -4,7 +4,6 @@ from django.contrib.auth.models import User
 from Sifen.mng_sifen import MSifen
 from Sifen.mng_sifen_ruc_mapper import RMap
 from celery import shared_task
-import pandas as pd
 
 
 @shared_task(bind=True, base=LogErrorsTask, soft_time_limit=60, time_limit=120)
@@ -36,11 +35,13 @@ def send_invoice(self, *args, **kwargs):
 
 
 @shared_task(bind=True, base=LogErrorsTask, soft_time_limit=300, time_limit=600)
-def sync_database(self, df_dict):
+def sync_database(self, file_index, url, delta=False):
     """
-    Sync RUC dataframe to database
+    Download and load one RUC registry file into Clientes
     Args:
-        df_dict: Dictionary representation of DataFrame
+        file_index: Index of the ruc{n}.zip file
+        url: DNIT url of the file
+        delta: Skip the file if unchanged and only touch rows whose fingerprint changed
     """
     from channels.layers import get_channel_layer
     from asgiref.sync import async_to_sync
@@ -48,29 +49,26 @@ def sync_database(self, df_dict):
     channel_layer = get_channel_layer()
     task_id = self.request.id
 
-    # Send start notification
-    if channel_layer:
-        async_to_sync(channel_layer.group_send)(
-            f"task_{task_id}",
-            {
-                "type": "task.update",
-                "task_id": task_id,
-                "status": "processing",
-                "message": f"Processing {len(df_dict)} records...",
-                "progress": 0
-            }
-        )
+    def progress(message, pct):
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(
+                f"task_{task_id}",
+                {
+                    "type": "task.update",
+                    "task_id": task_id,
+                    "status": "processing",
+                    "message": message,
+                    "progress": pct
+                }
+            )
 
     rmap = RMap()
-    df = pd.DataFrame(df_dict)
-    created, updated, errors = rmap.sync_to_database(df)
-
-    result = {
-        'created': created,
-        'updated': updated,
-        'errors': errors,
-        'total': len(df)
-    }
+    result = rmap.load_file(url, file_index, progress=progress, delta=delta)
+    created, updated, unchanged, errors = result['created'], result['updated'], result['unchanged'], result['errors']
+    if result['skipped']:
+        message = f"Skipped: ruc{file_index}.zip unchanged since last sync"
+    else:
+        message = f"Completed: {created} created, {updated} updated, {unchanged} unchanged, {errors} errors"
 
     # Send completion notification
     if channel_layer:
@@ -80,7 +78,7 @@ def sync_database(self, df_dict):
                 "type": "task.complete",
                 "task_id": task_id,
                 "status": "completed",
-                "message": f"Completed: {created} created, {updated} updated, {errors} errors",
+                "message": message,
                 "result": result
             }
         )
@@ -88,6 +86,18 @@ def sync_database(self, df_dict):
     return result
 
 
+@shared_task(bind=True, base=LogErrorsTask, soft_time_limit=600, time_limit=900)
+def reconcile_ventas_diarias(self, days=None):
+    """
+    Recalcula el resumen VentaDiaria de los ultimos dias (programada en CELERY_BEAT_SCHEDULE).
+    Corrige los cambios hechos con update() que no pasan por las señales.
+    """
+    from Sifen.mng_ventas_diarias import ventas_diarias
+    if days is None:
+        return ventas_diarias.reconcile()
+    return ventas_diarias.reconcile(days=int(days))
+
+
 @shared_task(bind=True, base=LogErrorsTask, soft_time_limit=600, time_limit=900)
 def create_timbrado_task(self, *args, **kwargs):
     """
@@ -0,0 +1,24 @@
+#Benchmark de reimpresion de KuDE: documento por documento contra eprint_batch
+#Ejecutar desde ./manage.py shell_plus < Sifen/test/bench_kude_batch.py
+import importlib
+import time
+from Sifen.models import DocumentHeader
+from Sifen import e_kude
+importlib.reload(e_kude)
+
+N = 500
+pedobj = DocumentHeader.objects.filter(ek_cdc__isnull=False, doc_numero__isnull=False).last()
+ek = e_kude.EKude(pedobj.ek_bs_ruc)
+profs = [ str(p) for p in DocumentHeader.objects.filter(ek_cdc__isnull=False, doc_numero__isnull=False)
+                                                 .order_by('-pk')
+                                                 .values_list('prof_number', flat=True)[:N] ]
+
+t0 = time.perf_counter()
+for p in profs[:50]:
+    ek.eprint_doc(None, query_dict={'prof_number': p, 'digital': 1})
+single = (time.perf_counter() - t0) / 50
+print(f'eprint_doc: {single*1000:.1f} ms/doc')
+
+for workers in (1, 4, 8):
+    rsp = ek.eprint_batch(profs, digital=1, workers=workers, merge=True)
+    print(f"eprint_batch workers={workers}: {rsp['elapsed']/len(profs)*1000:.1f} ms/doc, merged {rsp['merged_file']}")
@@ -0,0 +1,22 @@
+#Benchmark del libro de ventas de un año completo
+#Ejecutar desde ./manage.py shell_plus < Sifen/test/bench_libro_vta.py
+import importlib
+import time
+import tracemalloc
+from django.db import connection, reset_queries
+from Sifen import mng_libro_vta, mng_sifen
+importlib.reload(mng_libro_vta)
+
+msifen = mng_sifen.MSifen()
+q = {'qs_doc_fecha_0': '2025-01-01', 'qs_doc_fecha_1': '2025-12-31', 'dbcon': 'default'}
+lvta = mng_libro_vta.LibroVentas(msifen.bsobj)
+qs = lvta.queryset(lvta.filters(q))
+print(qs.query)
+
+reset_queries()
+tracemalloc.start()
+t0 = time.perf_counter()
+count = lvta.write('/tmp/bench_libro_vta.xlsx', 'bench', 'LIBRO VENTAS BENCH', lvta.rows(qs))
+elapsed = time.perf_counter() - t0
+current, peak = tracemalloc.get_traced_memory()
+print(f'{count} documentos en {elapsed:.2f}s, {len(connection.queries)} consultas, pico {peak/1024/1024:.1f} MB')
@@ -0,0 +1,49 @@
+#Benchmark de numeracion: reserva y asigna numeros a 10k proformas en un solo llamado
+#Ejecutar desde ./manage.py shell_plus < Sifen/test/bench_set_number.py
+import importlib
+import time
+import uuid
+from datetime import date
+from django.http import QueryDict
+from Sifen.models import DocumentHeader, Etimbrado, Enumbers
+from Sifen import ekuatia_serials
+importlib.reload(ekuatia_serials)
+
+TOTAL = 10000
+TIMBRADO = '99999999'
+ESTABLECIMIENTO = 999
+TIPO = 'FE'
+
+tmpl = DocumentHeader.objects.filter(doc_tipo=TIPO).last()
+etobj, _ = Etimbrado.objects.get_or_create(
+    timbrado=TIMBRADO,
+    defaults={'ruc': tmpl.ek_bs_ruc or '0', 'dv': '0', 'inicio': date.today(),
+              'serie': 'AA', 'fcsc': '1', 'scsc': '1'})
+eobj, _ = etobj.eestablecimiento_set.get_or_create(establecimiento=ESTABLECIMIENTO, defaults={'expedicion': [1]})
+Enumbers.objects.bulk_create([
+    Enumbers(expobj=eobj, tipo=TIPO, serie='AA', numero=n, estado='L')
+    for n in range(1, TOTAL+1)
+], batch_size=2000)
+
+docs = []
+for _ in range(TOTAL):
+    tmpl.pk = None
+    tmpl.prof_number = uuid.uuid4()
+    tmpl.doc_numero = None
+    tmpl.source = 'BENCH'
+    docs.append(DocumentHeader(**{f.attname: getattr(tmpl, f.attname) for f in DocumentHeader._meta.concrete_fields}))
+DocumentHeader.objects.bulk_create(docs, batch_size=2000)
+profs = [ str(d.prof_number) for d in docs ]
+
+qdict = QueryDict(mutable=True)
+qdict.update({'timbrado': TIMBRADO, 'establecimiento': ESTABLECIMIENTO, 'expd': 1,
+              'ruc': tmpl.ek_bs_ruc, 'tipo': TIPO, 'sign_document': False})
+qdict.setlist('prof_number', profs)
+eser = ekuatia_serials.Eserial()
+t0 = time.perf_counter()
+rsp = eser.set_number(qdict=qdict)
+elapsed = time.perf_counter() - t0
+print(f"Numerados {TOTAL} documentos en {elapsed:.2f}s ({TOTAL/elapsed:,.0f} docs/s) rango {rsp.get('reserved_range')}")
+
+DocumentHeader.objects.filter(source='BENCH', ek_timbrado=TIMBRADO).delete()
+etobj.delete()
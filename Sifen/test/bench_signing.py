@@ -0,0 +1,41 @@
+#Micro benchmark del costo de firma por documento con y sin el cache de credenciales
+#Ejecutar desde ./manage.py shell_plus < Sifen/test/bench_signing.py
+import importlib
+import time
+from Sifen.models import DocumentHeader, Business
+from Sifen import ekuatia_gf, rq_soap_handler
+from Sifen.mng_certificate import certificate_manager
+importlib.reload(ekuatia_gf)
+
+N = 200
+ek = ekuatia_gf.Egf()
+pedobj = DocumentHeader.objects.filter(ek_cdc__isnull=False).last()
+businessobj = Business.objects.get(ruc=pedobj.ek_bs_ruc)
+exml = ek.gen_xml_ekuatia(qdict={'prof_number': pedobj.prof_number}, headerobj=pedobj)
+
+def bench(label, fn):
+    t0 = time.perf_counter()
+    for _ in range(N):
+        fn()
+    elapsed = time.perf_counter() - t0
+    print(f'{label}: {elapsed/N*1000:.2f} ms/doc')
+
+def sign_cold():
+    #Antes: descifrar, leer PEM/KEY del disco en cada firma
+    certificate_manager.invalidate()
+    ek.sign_xml(exml.get('xml_file'), 'XMLSIGNER', pedobj.prof_number, headerobj=pedobj)
+
+def sign_warm():
+    ek.sign_xml(exml.get('xml_file'), 'XMLSIGNER', pedobj.prof_number, headerobj=pedobj)
+
+def session_cold():
+    certificate_manager.invalidate()
+    rq_soap_handler.SoapSifen(business=businessobj).set_session()
+
+def session_warm():
+    rq_soap_handler.SoapSifen(business=businessobj).set_session()
+
+bench('Firma sin cache', sign_cold)
+bench('Firma con cache', sign_warm)
+bench('Sesion PKCS#12 sin cache', session_cold)
+bench('Sesion PKCS#12 con cache', session_warm)
@@ -0,0 +1,43 @@
+#Compara una sesion nueva por llamada contra el pool keep-alive de SoapSifen.set_session
+#Usa el adapter PKCS#12 de certificate_manager contra el servidor SOAP local
+#Ejecutar desde ./manage.py shell_plus < Sifen/test/bench_soap_sessions.py
+import time
+from unittest import mock
+import requests
+from requests_pkcs12 import Pkcs12Adapter
+from Sifen import rq_soap_handler
+from Sifen.mng_certificate import certificate_manager
+from Sifen.test import stub_soap_server
+
+N = 500
+PLOAD = '<rEnviConsRUC><dRUCCons>80000000</dRUCCons></rEnviConsRUC>'
+server, url = stub_soap_server.start_stub_server()
+creds = stub_soap_server.stub_credentials()
+
+def run(label, get_session):
+    server.connections = 0
+    server.requests = 0
+    soap = rq_soap_handler.SoapSifen()
+    t0 = time.perf_counter()
+    for _ in range(N):
+        soap.send_rq(get_session(soap), PLOAD, rq_soap_handler.ROUTE_CONSULTA_RUC)
+    elapsed = time.perf_counter() - t0
+    print(f'{label}: {N/elapsed:,.0f} req/s, {server.connections} conexiones para {server.requests} peticiones')
+    return server.connections
+
+def fresh_session(soap):
+    #Lo que hacia set_session antes: sesion y adapter nuevos en cada llamada
+    session = requests.Session()
+    session.mount(url, Pkcs12Adapter(pkcs12_data=creds['pfx_data'], pkcs12_password=creds['pfx_password']))
+    return session
+
+certificate_manager.invalidate()
+with mock.patch.object(rq_soap_handler, 'URL', url), \
+        mock.patch.object(rq_soap_handler, 'EFDEBUG', False), \
+        mock.patch.object(certificate_manager, '_load_credentials', side_effect=lambda cert_obj: dict(creds)):
+    conns_fresh = run('Sesion nueva por llamada', fresh_session)
+    conns_pool = run('SoapSifen.set_session', lambda soap: soap.set_session())
+certificate_manager.invalidate()
+assert conns_pool == 1, 'El pool debe reutilizar una unica conexion'
+assert conns_fresh == N
+server.shutdown()
@@ -0,0 +1,73 @@
+#Servidor SOAP local que imita las respuestas de SIFEN para medir reuso de conexiones
+#Uso: server, url = start_stub_server(); ... ; server.shutdown()
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+RSP_RUC = b"""<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope">
+<env:Header/><env:Body>
+<ns2:rResEnviConsRUC xmlns:ns2="http://ekuatia.set.gov.py/sifen/xsd">
+<ns2:dCodRes>0502</ns2:dCodRes><ns2:dMsgRes>RUC encontrado</ns2:dMsgRes>
+<ns2:xContRUC><ns2:dRUCCons>80000000</ns2:dRUCCons><ns2:dRazCons>STUB S.A.</ns2:dRazCons>
+<ns2:dCodEstCons>ACT</ns2:dCodEstCons><ns2:dDesEstCons>ACTIVO</ns2:dDesEstCons>
+<ns2:dRUCFactElec>S</ns2:dRUCFactElec></ns2:xContRUC>
+</ns2:rResEnviConsRUC></env:Body></env:Envelope>"""
+
+
+class StubSoapHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/soap+xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(RSP_RUC)))
+        self.end_headers()
+        self.wfile.write(RSP_RUC)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), StubSoapHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://{}:{}'.format(*server.server_address)
+
+
+def stub_credentials(password='stub'):
+    """Credenciales como las de certificate_manager con un PKCS#12 autofirmado"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'STUB S.A.')])
+    now = datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name)\
+        .public_key(key.public_key()).serial_number(x509.random_serial_number())\
+        .not_valid_before(now).not_valid_after(now + timedelta(days=1))\
+        .sign(key, hashes.SHA256())
+    return {
+        'certificate_id': None,
+        'pfx_path': None,
+        'pfx_password': password,
+        'pfx_data': pkcs12.serialize_key_and_certificates(
+            b'stub', key, cert, None, serialization.BestAvailableEncryption(password.encode())),
+        'cert': cert.public_bytes(serialization.Encoding.PEM),
+        'key': key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                 serialization.NoEncryption()),
+        'adapter': None,
+    }
@@ -1,3 +1,470 @@
-from django.test import TestCase
+import io
+import os
+import hashlib
+import tempfile
+import threading
+import zipfile
+import requests
+from types import SimpleNamespace
+from datetime import datetime, timedelta, date
+from decimal import Decimal
+from unittest import mock
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from Sifen.models import RucQr, Clientes, RucSyncFile, DocumentHeader, DocumentDetail, DocumentRecibo, VentaDiaria, Etimbrado, Enumbers
+from Sifen.ekuatia_serials import Eserial
+from Sifen.mng_ruc_cache import RucCache
+from Sifen.mng_sifen_ruc_mapper import RMap
+from Sifen.mng_pdf_cache import PdfCache
+from Sifen.mng_libro_vta import LibroVentas
+from Sifen.mng_ventas_diarias import ventas_diarias
+from Sifen.mng_certificate import CertificateManager, certificate_manager
+from Sifen.fl_sifen_conf import PFX, PASS, PEMF, KEYF
+from Sifen import rq_soap_handler
+from Sifen.test.stub_soap_server import start_stub_server, stub_credentials
 
-# Create your tests here.
+
+def ruc_rsp(ruc, dmsgres='RUC encontrado'):
+    return {'dcodres': '0502', 'dmsgres': dmsgres, 'druccons': ruc, 'drazcons': f'RAZON {ruc}',
+            'dcodestcons': 'ACT', 'ddesestcons': 'ACTIVO', 'drucfactelec': 'S'}
+
+
+class RucCacheTest(TestCase):
+    """Las consultas repetidas de un RUC no deben volver a SIFEN dentro del TTL"""
+
+    def setUp(self):
+        self.rcache = RucCache(ttl=3600, neg_ttl=60)
+        self.rcache.cache.clear()
+        self.calls = []
+
+    def fetch(self, ruc):
+        self.calls.append(ruc)
+        return ruc_rsp(ruc)
+
+    def test_cache_hits(self):
+        for _ in range(100):
+            rsp = self.rcache.get('2463986', self.fetch)
+        self.assertEqual(rsp['drazcons'], 'RAZON 2463986')
+        self.assertEqual(len(self.calls), 1)
+        st = self.rcache.stats()
+        self.assertEqual(st['sifen'], 1)
+        self.assertEqual(st['cache'], 99)
+        self.assertEqual(st['hit_ratio'], 0.99)
+
+    def test_db_tier(self):
+        RucQr.objects.create(process_date=datetime.now() - timedelta(minutes=5), **ruc_rsp('80163121'))
+        rsp = self.rcache.get('80163121', self.fetch)
+        self.assertEqual(rsp['dmsgres'], 'RUC encontrado')
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.rcache.stats()['db'], 1)
+
+    def test_db_tier_expired(self):
+        RucQr.objects.create(process_date=datetime.now() - timedelta(hours=2), **ruc_rsp('80163121'))
+        self.rcache.get('80163121', self.fetch)
+        self.assertEqual(self.calls, ['80163121'])
+
+    def test_negative_not_from_db(self):
+        self.rcache.get('1', lambda ruc: ruc_rsp(ruc, dmsgres='RUC no encontrado'))
+        rsp = self.rcache.get('1', self.fetch)
+        self.assertEqual(rsp['dmsgres'], 'RUC no encontrado')
+        self.assertEqual(self.calls, [])
+
+    def test_foreign_lock_kept(self):
+        #Tras esperar el lock de otro proceso sin obtenerlo no se lo borra
+        lkey = f"{self.rcache.cache_key('2463986')}:lock"
+        self.rcache.cache.set(lkey, 'otro', 60)
+        with mock.patch('Sifen.mng_ruc_cache.RUC_LOCK_TIMEOUT', 0.3):
+            self.rcache.get('2463986', self.fetch)
+        self.assertEqual(self.calls, ['2463986'])
+        self.assertEqual(self.rcache.cache.get(lkey), 'otro')
+
+
+class RucCacheConcurrencyTest(TransactionTestCase):
+    """Varios hilos pidiendo el mismo RUC comparten una sola consulta"""
+
+    def test_dedup(self):
+        rcache = RucCache(ttl=3600, neg_ttl=60)
+        rcache.cache.clear()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch(ruc):
+            calls.append(ruc)
+            started.set()
+            release.wait(5)
+            return ruc_rsp(ruc)
+
+        results = []
+
+        def worker():
+            try:
+                results.append(rcache.get('2463986', fetch))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(r['druccons'] == '2463986' for r in results))
+
+
+class ReserveNumbersTest(TransactionTestCase):
+    """Dos reservas en paralelo sobre el mismo establecimiento toman bloques distintos"""
+
+    def setUp(self):
+        etobj = Etimbrado.objects.create(ruc='80163121', dv='0', timbrado='12345678', inicio=date(2025, 1, 1),
+                                         serie='AA', fcsc='1', scsc='1')
+        eobj = etobj.eestablecimiento_set.create(establecimiento=1, expedicion=[1])
+        Enumbers.objects.bulk_create([ Enumbers(expobj=eobj, tipo='FE', serie='AA', numero=n, estado='L')
+                                       for n in range(1, 11) ])
+
+    def test_overlapping_reservations(self):
+        reserved = threading.Event()
+        release = threading.Event()
+        results = {}
+
+        def first():
+            try:
+                with transaction.atomic():
+                    results['first'] = Eserial().reserve_numbers('12345678', 1, 'FE', 3)
+                    reserved.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        t = threading.Thread(target=first)
+        t.start()
+        reserved.wait(5)
+        try:
+            #La primera transaccion sigue abierta con sus filas bloqueadas
+            with transaction.atomic():
+                results['second'] = Eserial().reserve_numbers('12345678', 1, 'FE', 3)
+        finally:
+            release.set()
+            t.join()
+        self.assertEqual(results['first'].get('numeros'), [1, 2, 3])
+        self.assertEqual(results['second'].get('numeros'), [4, 5, 6])
+        self.assertEqual(Enumbers.objects.filter(estado='R').count(), 6)
+
+
+class RMapDeltaTest(TestCase):
+    """La carga del padron en modo delta omite archivos y filas sin cambios"""
+
+    URL = 'https://dnit.test/ruc0.zip'
+
+    def zip_file(self, text):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as zf:
+            zf.writestr('ruc0.txt', text)
+        data = buf.getvalue()
+        return data, {'etag': None, 'last_modified': None, 'sha256': hashlib.sha256(data).hexdigest()}
+
+    def load(self, text, delta=True):
+        data, meta = self.zip_file(text)
+        rmap = RMap()
+        with mock.patch.object(RMap, 'download', return_value=(io.BytesIO(data), meta)):
+            return rmap.load_file(self.URL, 0, delta=delta)
+
+    def test_delta(self):
+        text = '1000|PEREZ JUAN|7|X|ACTIVO|\n2000|GOMEZ SA|3|Y|ACTIVO|\n2000|GOMEZ SA|4|Y|ACTIVO|\n'
+        rsp = self.load(text)
+        self.assertEqual((rsp['created'], rsp['updated'], rsp['unchanged']), (2, 0, 0))
+        self.assertEqual(Clientes.objects.get(pdv_ruc='2000').pdv_ruc_dv, 4)
+        self.assertEqual(RucSyncFile.objects.get(fname='ruc0.zip').total, 3)
+
+        rsp = self.load(text)
+        self.assertTrue(rsp['skipped'])
+
+        rsp = self.load(text + '3000|NUEVO|1|Z|ACTIVO|\n')
+        self.assertEqual((rsp['created'], rsp['updated'], rsp['unchanged']), (1, 0, 2))
+
+        rsp = self.load('1000|PEREZ JUAN|7|X|SUSPENDIDO|\n2000|GOMEZ SA|4|Y|ACTIVO|\n3000|NUEVO|1|Z|ACTIVO|\n')
+        self.assertEqual((rsp['created'], rsp['updated'], rsp['unchanged']), (0, 1, 2))
+        self.assertEqual(Clientes.objects.get(pdv_ruc='1000').pdv_ruc_estado, 'SUSPENDIDO')
+        self.assertEqual(Clientes.objects.filter(pdv_ruc__in=['1000', '2000', '3000']).count(), 3)
+
+
+class PdfCacheTest(TestCase):
+    """Un PDF cacheado se reemplaza cuando cambia la clave del documento"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pcache = PdfCache(root=os.path.join(self.tmp.name, 'pdf_cache'))
+        self.pdf = os.path.join(self.tmp.name, 'doc.pdf')
+        with open(self.pdf, 'wb') as fh:
+            fh.write(b'%PDF-1.4 test')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_get_replace(self):
+        self.assertIsNone(self.pcache.get('documentheader', 'k1'))
+        self.assertIsNone(self.pcache.put('documentheader', 1, None, self.pdf))
+        path = self.pcache.put('documentheader', 1, 'k1', self.pdf)
+        self.assertEqual(self.pcache.get('documentheader', 'k1'), path)
+        self.pcache.put('documentheader', 1, 'k2', self.pdf)
+        self.assertIsNone(self.pcache.get('documentheader', 'k1'))
+        self.assertIsNotNone(self.pcache.get('documentheader', 'k2'))
+        self.pcache.invalidate('documentheader', 1)
+        self.assertIsNone(self.pcache.get('documentheader', 'k2'))
+
+    def test_template_version(self):
+        v1 = self.pcache.template_version('Sifen/DocumentHeaderRptUi.html')
+        self.assertEqual(v1, self.pcache.template_version('Sifen/DocumentHeaderRptUi.html'))
+        self.assertNotEqual(v1, self.pcache.template_version('Sifen/DocumentReciboRptUi.html'))
+
+    def test_recibo_key(self):
+        recobj = DocumentRecibo.objects.create(bs='80163121', source='TEST', doc_moneda='GS', doc_fecha=date(2025, 3, 7),
+                                               doc_tipo='RE', doc_op='VTA', doc_establecimiento=1, doc_estado='CONFIRMADO',
+                                               doc_total_factura=1100, doc_total_nc=0, doc_cobrar=1100, doc_retencion=0,
+                                               doc_efectivo=1100, doc_cheque=0, doc_cobrado=1100, tasa_cambio=0,
+                                               pdv_ruc='2463986', pdv_nombrefantasia='C', pdv_nombrefactura='C',
+                                               observacion='')
+        templates = ['Sifen/DocumentReciboRptUi.html']
+        k1 = self.pcache.recibo_key(recobj, templates)
+        #Marcar el envio al cliente no cambia el PDF
+        recobj.enviado_cliente = True
+        recobj.enviado_cliente_fecha = datetime.now()
+        recobj.save()
+        self.assertEqual(self.pcache.recibo_key(recobj, templates), k1)
+        recobj.doc_cobrado = 1000
+        self.assertNotEqual(self.pcache.recibo_key(recobj, templates), k1)
+
+
+class CertificateCredentialsTest(TestCase):
+    """PFX, PEM y KEY salen siempre del mismo origen"""
+
+    def setUp(self):
+        self.cm = CertificateManager()
+        self.read = mock.patch.object(self.cm, '_read_credentials',
+                                      side_effect=lambda *a: {'certificate_id': None, 'files': a}).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def cert_obj(self, pem='/certs/emp.pem', key='/certs/emp.key'):
+        return SimpleNamespace(pk=7, nombre='Empresa', pfx_password_encrypted='x',
+                               pfx_file=SimpleNamespace(path='/certs/emp.pfx'),
+                               get_pem_path=lambda: pem, get_key_path=lambda: key)
+
+    def test_business_certificate(self):
+        with mock.patch.object(self.cm, 'decrypt_password', return_value='secreto'):
+            creds = self.cm._load_credentials(self.cert_obj())
+        self.assertEqual(creds['files'], ('/certs/emp.pfx', 'secreto', '/certs/emp.pem', '/certs/emp.key'))
+        self.assertEqual(creds['certificate_id'], 7)
+
+    def test_fallback_to_defaults(self):
+        #Password que no descifra
+        with mock.patch.object(self.cm, 'decrypt_password', side_effect=ValueError('InvalidToken')):
+            creds = self.cm._load_credentials(self.cert_obj())
+        self.assertEqual(creds['files'], (PFX, PASS, PEMF, KEYF))
+        #Sin KEY extraido no se mezcla con el KEY por defecto
+        with mock.patch.object(self.cm, 'decrypt_password', return_value='secreto'):
+            creds = self.cm._load_credentials(self.cert_obj(key=None))
+        self.assertEqual(creds['files'], (PFX, PASS, PEMF, KEYF))
+        self.assertIsNone(creds['certificate_id'])
+
+
+class SoapSessionTest(TestCase):
+    """Las llamadas de SoapSifen reutilizan una conexion keep-alive del adapter PKCS#12"""
+
+    def setUp(self):
+        self.server, self.url = start_stub_server()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        creds = stub_credentials()
+        certificate_manager.invalidate()
+        self.addCleanup(certificate_manager.invalidate)
+        for patcher in [
+            mock.patch.object(rq_soap_handler, 'URL', self.url),
+            mock.patch.object(rq_soap_handler, 'EFDEBUG', False),
+            mock.patch.object(certificate_manager, '_load_credentials', side_effect=lambda cert_obj: dict(creds)),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_single_connection(self):
+        pload = '<rEnviConsRUC><dRUCCons>80000000</dRUCCons></rEnviConsRUC>'
+        for _ in range(10):
+            soap = rq_soap_handler.SoapSifen()
+            rsp = soap.send_rq(soap.set_session(), pload, rq_soap_handler.ROUTE_CONSULTA_RUC)
+            self.assertEqual(rsp.status_code, 200)
+        self.assertEqual((self.server.requests, self.server.connections), (10, 1))
+
+    def test_replaced_session_keeps_shared_adapter(self):
+        shared, renewed = requests.adapters.HTTPAdapter(), requests.adapters.HTTPAdapter()
+        rq_soap_handler.pooled_session('a', lambda: shared, url=self.url)
+        other = rq_soap_handler.pooled_session('b', lambda: shared, url=self.url)
+        with mock.patch.object(shared, 'close') as close:
+            session = rq_soap_handler.pooled_session('a', lambda: renewed, url=self.url)
+        close.assert_not_called()
+        self.assertIs(session.get_adapter(self.url), renewed)
+        self.assertIs(other.get_adapter(self.url), shared)
+
+
+class LibroVentasTest(TestCase):
+    """El libro se escribe en modo write-only con la cabecera del negocio"""
+
+    def test_write(self):
+        from openpyxl import load_workbook
+        bsobj = SimpleNamespace(nombrefactura='NEGOCIO S.A.', ruc='80163121', ruc_dv=5, direccion='CALLE 1')
+        lvta = LibroVentas(bsobj)
+        row = {'pk': 1, 'doc_op': 'VTA', 'doc_fecha': date(2025, 3, 7), 'doc_establecimiento': 1,
+               'doc_expedicion': 2, 'doc_numero': 15, 'pdv_nombrefactura': 'CLIENTE', 'pdv_ruc': '2463986',
+               'doc_redondeo': Decimal('0'), 'tot_gravada_10': Decimal('1100'), 'tot_gravada_5': Decimal('0'),
+               'tot_iva_10': Decimal('100'), 'tot_iva_5': Decimal('0'), 'tot_exenta': Decimal('0'),
+               'lv_total': Decimal('1100'), 'lv_retencion': None}
+        with tempfile.TemporaryDirectory() as tmp:
+            fpath = os.path.join(tmp, 'libro.xlsx')
+            count = lvta.write(fpath, 'ventas', 'LIBRO VENTAS', (lvta.doc_row(row) for _ in range(3)))
+            self.assertEqual(count, 3)
+            ws = load_workbook(fpath).active
+            self.assertEqual(ws['A2'].value, 'Razon Social: NEGOCIO S.A.')
+            self.assertEqual(ws['A3'].value, 'Ruc: 80163121-5')
+            self.assertEqual(ws['B9'].value, '001-002-0000015')
+            self.assertEqual(ws['J11'].value, 1100)
+            self.assertEqual(ws['L11'].value, 0)
+            self.assertEqual(ws['A9'].style, 'lv_cell')
+            self.assertIn('E7:J7', [ str(r) for r in ws.merged_cells.ranges ])
+
+
+def document_header(**kwargs):
+    cero = Decimal(0)
+    fields = {'bs': 'Toca3d', 'source': 'test', 'ek_bs_ruc': '80163121', 'doc_moneda': 'GS',
+              'doc_fecha': date(2025, 3, 7), 'doc_tipo': 'FE', 'doc_op': 'VTA', 'doc_estado': 'CONFIRMADO',
+              'doc_establecimiento': 1, 'doc_expedicion': 1, 'pdv_ruc': '2463986',
+              'pdv_nombrefantasia': 'CLIENTE', 'pdv_nombrefactura': 'CLIENTE', 'observacion': 'ND'}
+    for f in ('doc_total', 'doc_iva', 'doc_exenta', 'doc_g10', 'doc_i10', 'doc_g5', 'doc_i5', 'doc_descuento',
+              'doc_per_descuento', 'doc_descuento_global', 'doc_saldo', 'doc_pago', 'doc_costo',
+              'tasa_cambio', 'peso', 'volumen'):
+        fields[f] = cero
+    fields.update(kwargs)
+    return DocumentHeader.objects.create(**fields)
+
+
+class VentasDiariasTest(TestCase):
+    """El resumen diario se mantiene desde las señales y coincide con los totales por documento"""
+
+    def add_detail(self, docobj, gravada_10):
+        docobj.documentdetail_set.create(prod_cod=1, prod_descripcion='P', precio_unitario_source=gravada_10,
+                                         precio_unitario=gravada_10, cantidad=1, gravada_10=gravada_10,
+                                         iva_10=gravada_10 / 11, base_gravada_10=gravada_10 - gravada_10 / 11)
+
+    def test_signals_and_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            d1 = document_header(doc_saldo=Decimal(1100), doc_cre_tipo_cod=2)
+            self.add_detail(d1, Decimal(1100))
+            d2 = document_header()
+            self.add_detail(d2, Decimal(2200))
+            document_header(doc_tipo='NC', doc_fecha=date(2025, 3, 8))
+        row = VentaDiaria.objects.get(fecha=date(2025, 3, 7), doc_tipo='FE')
+        self.assertEqual(row.cantidad, 2)
+        self.assertEqual(row.gravada_10, Decimal(3300))
+        self.assertEqual(row.total, d1.get_total_operacion_redondeo() + d2.get_total_operacion_redondeo())
+        self.assertEqual((row.saldo_credito, row.cantidad_credito), (Decimal(1100), 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            d2.ek_estado = 'Cancelado'
+            d2.save()
+        row.refresh_from_db()
+        self.assertEqual((row.cantidad, row.gravada_10), (1, Decimal(1100)))
+
+        rsp = ventas_diarias.resumen(bs_ruc='80163121', desde=date(2025, 3, 1), hasta=date(2025, 3, 31),
+                                     periodo='mes', group_by=['doc_tipo'])
+        self.assertEqual([ (r['doc_tipo'], r['cantidad']) for r in rsp ], [('FE', 1), ('NC', 1)])
+
+        #update() no dispara señales, la reconciliacion lo corrige
+        DocumentHeader.objects.filter(pk=d1.pk).update(doc_saldo=0)
+        ventas_diarias.rebuild(desde=date(2025, 3, 1))
+        self.assertEqual(ventas_diarias.totales(doc_tipo='FE')['saldo_credito'], 0)
+        self.assertEqual(VentaDiaria.objects.count(), 2)
+
+    def test_moved_document_and_batch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            d1 = document_header()
+            self.add_detail(d1, Decimal(1100))
+        #Cambiar la fecha deja el dia anterior sin el documento
+        with self.captureOnCommitCallbacks(execute=True):
+            d1.doc_fecha = date(2025, 3, 9)
+            d1.save()
+        self.assertEqual(list(VentaDiaria.objects.values_list('fecha', 'cantidad')), [(date(2025, 3, 9), 1)])
+
+        #Varias escrituras dentro de batch() recalculan cada dia una sola vez
+        with mock.patch.object(ventas_diarias, 'refresh_day', wraps=ventas_diarias.refresh_day) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                with ventas_diarias.batch():
+                    d2 = document_header(doc_fecha=date(2025, 3, 9))
+                    for _ in range(3):
+                        self.add_detail(d2, Decimal(2200))
+                    d2.save()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(VentaDiaria.objects.get(fecha=date(2025, 3, 9)).cantidad, 2)
+
+
+class VentasDiariasConcurrencyTest(TransactionTestCase):
+    """Dos recalculos del mismo dia que confirman a la vez no chocan con ventadiaria_key_uniq"""
+
+    def test_concurrent_refresh(self):
+        docobj = document_header()
+        docobj.documentdetail_set.create(prod_cod=1, prod_descripcion='P', precio_unitario_source=1100,
+                                         precio_unitario=1100, cantidad=1, gravada_10=1100, iva_10=100,
+                                         base_gravada_10=1000)
+        refreshed = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def first():
+            try:
+                with transaction.atomic():
+                    ventas_diarias.refresh_day('80163121', date(2025, 3, 7))
+                    refreshed.set()
+                    release.wait(5)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def second():
+            try:
+                ventas_diarias.refresh_day('80163121', date(2025, 3, 7))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        t1 = threading.Thread(target=first)
+        t1.start()
+        refreshed.wait(5)
+        t2 = threading.Thread(target=second)
+        t2.start()
+        #El segundo queda esperando el lock del primero
+        t2.join(0.5)
+        release.set()
+        t1.join()
+        t2.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(VentaDiaria.objects.filter(fecha=date(2025, 3, 7)).count(), 1)
+
+
+class DocumentTotalsTest(TestCase):
+    """Los totales memorizados de la cabecera se descartan tambien tras update()/bulk_create()"""
+
+    def detail(self, docobj, gravada_10):
+        return DocumentDetail(documentheaderobj=docobj, prod_cod=1, prod_descripcion='P',
+                              precio_unitario_source=gravada_10, precio_unitario=gravada_10, cantidad=1,
+                              gravada_10=gravada_10, iva_10=gravada_10 / 11,
+                              base_gravada_10=gravada_10 - gravada_10 / 11)
+
+    def test_bulk_writes(self):
+        docobj = document_header()
+        self.assertEqual(docobj.get_total_gravada_10(), 0)
+        DocumentDetail.objects.bulk_create([ self.detail(docobj, Decimal(1100)) for _ in range(2) ])
+        self.assertEqual(docobj.get_total_gravada_10(), Decimal(2200))
+        docobj.documentdetail_set.update(gravada_10=Decimal(550))
+        self.assertEqual(docobj.get_total_gravada_10(), Decimal(1100))
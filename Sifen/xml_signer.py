@@ -4,6 +4,7 @@ from datetime import datetime
 from Sifen import mng_xml, mng_gmdata
 from signxml import XMLSigner, XMLVerifier, namespaces
 from Sifen.fl_sifen_conf import PASS, PFX, PEMF, KEYF, RFOLDER
+from Sifen.mng_certificate import certificate_manager
 
 
 class ESigner:
@@ -19,22 +20,26 @@ class ESigner:
             os.mkdir(self.ROOTFOLDER)
         except:pass
 
-    def digital_signature_xmlsigner(self, fname, pedobj, pem_path=None, key_path=None):
+    def digital_signature_xmlsigner(self, fname, pedobj, pem_path=None, key_path=None, root=None, cert=None, key=None):
         """
            This method receives the DE file
            Sign the xml file with the algorithm expressed in the Paraguayan manual for the
            Electronic generation of documents
+           When root is given the DE already generated in memory is signed and the file is not read back,
+           cert and key allow to pass the key material already loaded by the caller
         """
         logging.info('Running digital_signature_xmlsigner')
-        logging.info('Reading file {}'.format(fname))
         mngo = mng_gmdata.Gdata()
-        root = self.mxml.parse_xml(fname)
-        # Usar paths pasados como parámetro o fallback a fl_sifen_conf
-        pem_file = pem_path or PEMF
-        key_file = key_path or KEYF
-        logging.info('Reading CERT {} and KEY {} files'.format(pem_file, key_file))
-        cert = open(pem_file, 'rb').read()
-        key = open(key_file, 'rb').read()
+        if root is None:
+            logging.info('Reading file {}'.format(fname))
+            root = self.mxml.parse_xml(fname)
+        if cert is None or key is None:
+            # Usar paths pasados como parámetro o fallback a fl_sifen_conf
+            pem_file = pem_path or PEMF
+            key_file = key_path or KEYF
+            logging.info('Reading CERT {} and KEY {} files'.format(pem_file, key_file))
+            cert = open(pem_file, 'rb').read()
+            key = open(key_file, 'rb').read()
         signer = XMLSigner(c14n_algorithm='http://www.w3.org/2001/10/xml-exc-c14n#')
         signer.namespaces = {None: namespaces.ds}
         signed_root = signer.sign(root, reference_uri=pedobj.ek_cdc, key=key, cert=cert)
@@ -61,10 +66,11 @@ class ESigner:
                 'qri': qpar.get('qri')}
 
     def dynamically_sign(self, eroot, ref_uri, pem_path=None, key_path=None):
-        pem_file = pem_path or PEMF
-        key_file = key_path or KEYF
-        cert = open(pem_file, 'rb').read()
-        key = open(key_file, 'rb').read()
+        if pem_path and key_path:
+            cert = open(pem_path, 'rb').read()
+            key = open(key_path, 'rb').read()
+        else:
+            cert, key = certificate_manager.get_signing_material()
         signer = XMLSigner(c14n_algorithm='http://www.w3.org/2001/10/xml-exc-c14n#')
         signer.namespaces = {None: namespaces.ds}
         # logging.info('Dynamically sign {}'.format(
@@ -20,7 +20,9 @@ class Command(BaseCommand):
         # Filtros
         parser.add_argument('--fecha-desde', type=str, help='Fecha desde (YYYY-MM-DD)')
         parser.add_argument('--fecha-hasta', type=str, help='Fecha hasta (YYYY-MM-DD)')
-        parser.add_argument('--limit', type=int, default=250, help='Límite de registros por sincronización')
+        parser.add_argument('--limit', type=int, default=250, help='Registros por página (máx 250)')
+        parser.add_argument('--full', action='store_true', help='Sincronización completa, ignora la última sincronización')
+        parser.add_argument('--bulk', action='store_true', help='Importación completa con una exportación masiva GraphQL (clientes, productos, órdenes)')
 
     def handle(self, *args, **options):
         client = ShopifyAPIClient()
@@ -29,7 +31,10 @@ class Command(BaseCommand):
         # Sincronización de clientes
         if options['clientes']:
             self.stdout.write(self.style.WARNING('Sincronizando clientes...'))
-            stats = client.sync_customers(limit=options['limit'])
+            if options['bulk']:
+                stats = client.bulk_import('customers')
+            else:
+                stats = client.sync_customers(limit=options['limit'], full=options['full'])
             self.stdout.write(self.style.SUCCESS(
                 f"✓ Clientes: {stats['created']} creados, {stats['updated']} actualizados, {stats['errors']} errores"
             ))
@@ -37,7 +42,10 @@ class Command(BaseCommand):
         # Sincronización de productos
         if options['productos']:
             self.stdout.write(self.style.WARNING('Sincronizando productos...'))
-            stats = client.sync_products(limit=options['limit'])
+            if options['bulk']:
+                stats = client.bulk_import('products')
+            else:
+                stats = client.sync_products(limit=options['limit'], full=options['full'])
             self.stdout.write(self.style.SUCCESS(
                 f"✓ Productos: {stats['created']} creados, {stats['updated']} actualizados, {stats['errors']} errores"
             ))
@@ -45,7 +53,10 @@ class Command(BaseCommand):
         # Sincronización de órdenes
         if options['ordenes']:
             self.stdout.write(self.style.WARNING('Sincronizando órdenes...'))
-            stats = client.sync_orders(limit=options['limit'])
+            if options['bulk']:
+                stats = client.bulk_import('orders')
+            else:
+                stats = client.sync_orders(limit=options['limit'], full=options['full'])
             self.stdout.write(self.style.SUCCESS(
                 f"✓ Órdenes: {stats['created']} creados, {stats['updated']} actualizados, {stats['errors']} errores"
             ))
@@ -53,7 +64,7 @@ class Command(BaseCommand):
         # Sincronización de pagos
         if options['pagos']:
             self.stdout.write(self.style.WARNING('Sincronizando pagos...'))
-            stats = client.sync_paid_orders(limit=options['limit'])
+            stats = client.sync_paid_orders(limit=options['limit'], full=options['full'])
             self.stdout.write(self.style.SUCCESS(
                 f"✓ Pagos: {stats['created']} creados, {stats['updated']} actualizados, {stats['errors']} errores"
             ))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('am_shopify', '0008_add_total_shipping'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopifysynclog',
+            name='watermark',
+            field=models.DateTimeField(blank=True, help_text='updated_at_min de la próxima sincronización incremental', null=True),
+        ),
+        migrations.AddField(
+            model_name='shopifysynclog',
+            name='incremental',
+            field=models.BooleanField(default=False, help_text='Sólo registros modificados desde la sincronización anterior'),
+        ),
+    ]
@@ -8,6 +8,8 @@ from .shopify_client import ShopifyAPIClient, extract_ruc_from_tags
 from Sifen.models import Clientes, DocumentHeader, DocumentDetail, Producto, Distrito, Ciudades
 from Sifen.mng_sifen import MSifen
 from Sifen import mng_gmdata
+from celery.execute import send_task
+from .mng_shopify_invoices import PaymentInvoiceConverter, SHOPIFY_INVOICE_ASYNC_MIN
 import logging
 
 logger = logging.getLogger(__name__)
@@ -164,273 +166,29 @@ class MShopify:
         """
         Migra pagos seleccionados a facturas SIFEN (DocumentHeader).
 
-        Usa MSifen.create_documentheader para crear la factura usando
-        el proceso de validación existente.
+        La conversión es por lotes (PaymentInvoiceConverter) con los mismos
+        valores que MSifen.create_documentheader. Desde SHOPIFY_INVOICE_ASYNC_MIN
+        pagos se manda a celery y el avance llega a la campana de tareas.
         """
         q: dict = kwargs.get('qdict', {})
         userobj = kwargs.get('userobj')
         ids = io_json.from_json(q.get('ids'))
         dbcon = q.get('dbcon', 'default')
-        msgs = []
-
-        # Instanciar MSifen
-        msifen = MSifen()
-
-        for pk in ids:
-            try:
-                payment = ShopifyPayment.objects.get(pk=pk)
-
-                # Verificar si ya fue convertido
-                if payment.is_converted:
-                    msgs.append({
-                        'info': f'Pago {payment.order_name} ya fue convertido'
-                    })
-                    continue
-
-                # Verificar si ya existe factura con este ext_link
-                existing_doc = DocumentHeader.objects.filter(
-                    ext_link=payment.shopify_order_id
-                ).first()
-                if existing_doc:
-                    payment.conversion_status = 'skipped'
-                    payment.conversion_error = f'Ya existe factura con ext_link={payment.shopify_order_id}'
-                    payment.document_header = existing_doc
-                    payment.save()
-                    msgs.append({
-                        'info': f'Pago {payment.order_name} ya tiene factura asociada'
-                    })
-                    continue
-
-                # Preparar datos del cliente
-                # Valores por defecto para campos que no pueden estar vacíos
-                nombre = payment.customer_full_name or 'Sin Nombre'
-                telefono = payment.customer_phone or '00000'
-                email = payment.customer_email or 'nomail@nomail.com'
-                direccion = 'ND'
-
-                # Extraer dirección del shipping_address si existe
-                shipping = payment.shipping_address
-                if shipping:
-                    direccion = (shipping.get('address1', '') or 'ND')[:200] or 'ND'
-
-                # Obtener ubicación desde la DB (default: ASUNCION)
-                distobj = Distrito.objects.filter(nombre_distrito='ASUNCION (DISTRITO)').first()
-                ciudadobj = Ciudades.objects.filter(distritoobj=distobj).first() if distobj else None
-
-                # Valores de ubicación
-                pdv_dpto_cod = distobj.dptoobj.codigo_departamento if distobj else 1
-                pdv_dpto_nombre = distobj.dptoobj.nombre_departamento if distobj else 'CAPITAL'
-                pdv_distrito_cod = distobj.codigo_distrito if distobj else 1
-                pdv_distrito_nombre = distobj.nombre_distrito if distobj else 'ASUNCION (DISTRITO)'
-                pdv_ciudad_cod = ciudadobj.codigo_ciudad if ciudadobj else 1
-                pdv_ciudad_nombre = ciudadobj.nombre_ciudad if ciudadobj else 'ASUNCION (DISTRITO)'
-
-                # Extraer RUC de customer_tags
-                try:
-                    ruc = extract_ruc_from_tags(payment.customer_tags)
-                except:
-                    ruc = None
-
-                # Buscar si el RUC existe en Clientes
-                clienteobj = None
-                ruc_cargado = False
-                if ruc and ruc != '0':
-                    msifen.validate_ruc(qdict={'ruc': ruc})
-                    clienteobj = Clientes.objects.filter(pdv_ruc=ruc).first()
-                    ruc_cargado = True
-                    if clienteobj:
-                        pdv_tipocontribuyente =  str(clienteobj.pdv_tipocontribuyente)
-                        pdv_es_contribuyente =  clienteobj.pdv_es_contribuyente
-                        pdv_type_business =  clienteobj.pdv_type_business or 'B2C'
-                        pdv_ruc_dv = clienteobj.pdv_ruc_dv or 0
-                        pdv_nombrefantasia = clienteobj.pdv_nombrefantasia or nombre[:300]
-                        pdv_nombrefactura = clienteobj.pdv_nombrefactura or nombre[:300]
-                    else:
-                        gdata = mng_gmdata.Gdata()
-                        pdv_tipocontribuyente =  3
-                        pdv_es_contribuyente =  False
-                        pdv_type_business =  'B2C'
-                        pdv_ruc_dv = gdata.calculate_dv(ruc)
-                        pdv_nombrefantasia = nombre[:300]
-                        pdv_nombrefactura = nombre[:300]
-
-                # INNOMINADO = Sin RUC válido en Clientes (no importa si tiene nombre)
-                if ruc_cargado:
-                    # Cliente con RUC válido en DB → usar sus valores
-                    send_save = False
-                    if payment.financial_status == 'paid':
-                        send_save = True
-                    pdv_data = {
-                        'pdv_innominado': False,
-                        'pdv_pais_cod': 'PRY',
-                        'pdv_pais': 'Paraguay',
-                        'pdv_tipocontribuyente': pdv_tipocontribuyente,
-                        'pdv_es_contribuyente': pdv_es_contribuyente,
-                        'pdv_type_business': pdv_type_business,
-                        'pdv_codigo': 0,
-                        'pdv_ruc': ruc,
-                        'pdv_ruc_dv': pdv_ruc_dv,
-                        'pdv_nombrefantasia': pdv_nombrefantasia,
-                        'pdv_nombrefactura': pdv_nombrefactura,
-                        'pdv_direccion_entrega': direccion,
-                        'pdv_numero_casa': 0,
-                        'pdv_dpto_cod': pdv_dpto_cod,
-                        'pdv_dpto_nombre': pdv_dpto_nombre,
-                        'pdv_distrito_cod': pdv_distrito_cod,
-                        'pdv_distrito_nombre': pdv_distrito_nombre,
-                        'pdv_ciudad_cod': pdv_ciudad_cod,
-                        'pdv_ciudad_nombre': pdv_ciudad_nombre,
-                        'pdv_telefono': telefono,
-                        'pdv_celular': telefono,
-                        'pdv_email': email,
-                    }
-                else:
-                    # Sin RUC válido → INNOMINADO
-                    send_save = False
-                    pdv_data = {
-                        'pdv_innominado': True,
-                        'pdv_pais_cod': 'PRY',
-                        'pdv_pais': 'Paraguay',
-                        'pdv_tipocontribuyente': '3',
-                        'pdv_es_contribuyente': False,
-                        'pdv_type_business': 'B2C',
-                        'pdv_codigo': 999,
-                        'pdv_ruc': '0',
-                        'pdv_ruc_dv': 0,
-                        'pdv_nombrefantasia': 'Sin Nombre',
-                        'pdv_nombrefactura': 'Sin Nombre',
-                        'pdv_direccion_entrega': direccion,
-                        'pdv_numero_casa': 0,
-                        'pdv_dpto_cod': pdv_dpto_cod,
-                        'pdv_dpto_nombre': pdv_dpto_nombre,
-                        'pdv_distrito_cod': pdv_distrito_cod,
-                        'pdv_distrito_nombre': pdv_distrito_nombre,
-                        'pdv_ciudad_cod': pdv_ciudad_cod,
-                        'pdv_ciudad_nombre': pdv_ciudad_nombre,
-                        'pdv_telefono': telefono,
-                        'pdv_celular': telefono,
-                        'pdv_email': email,
-                    }
-                # Preparar detalles (line_items) con descuento por ítem
-                details = []
-                for idx, item in enumerate(payment.line_items, start=1):
-                    item_price = Decimal(str(item.get('price', 0)))
-                    item_qty = Decimal(str(item.get('quantity', 1)))
-                    # Usar los últimos 6 dígitos del ID de Shopify como prod_cod
-                    item_id = str(item.get('id', 0))
-                    prod_cod = int(item_id[-6:]) if item_id else 999000 + idx
-
-                    # Obtener descuento específico del ítem desde discount_allocations
-                    discount_allocations = item.get('discount_allocations', [])
-                    item_discount = sum(Decimal(str(d.get('amount', 0))) for d in discount_allocations)
-
-                    # Calcular bruto y porcentaje de descuento
-                    bruto = item_price * item_qty
-                    per_descuento = float(item_discount / bruto * 100) if bruto > 0 and item_discount > 0 else 0
-
-                    details.append({
-                        'prod_cod': prod_cod,
-                        'prod_descripcion': (item.get('title', 'Producto') or 'Producto')[:500],
-                        'precio_unitario': float(item_price),
-                        'cantidad': float(item_qty),
-                        'prod_unidad_medida_desc': '77',
-                        'prod_unidad_medida_desc_text': 'UNI',
-                        'exenta': 0,
-                        'g5': 0,
-                        'g10': 100,
-                        'descuento': float(item_discount),
-                        'per_descuento': per_descuento,
-                        'descuento_global_item': 0,
-                    })
-
-                # Agregar shipping como ítem adicional (sin descuento)
-                total_shipping = Decimal(str(payment.total_shipping or 0))
-                if total_shipping > 0:
-                    details.append({
-                        'prod_cod': 999999,
-                        'prod_descripcion': 'Envío / Shipping',
-                        'precio_unitario': float(total_shipping),
-                        'cantidad': 1,
-                        'prod_unidad_medida_desc': '77',
-                        'prod_unidad_medida_desc_text': 'UNI',
-                        'exenta': 0,
-                        'g5': 0,
-                        'g10': 100,
-                        'descuento': 0,
-                        'per_descuento': 0,
-                        'descuento_global_item': 0,
-                    })
 
-                # Preparar uc_fields para create_documentheader
-                uc_fields = {
-                    **pdv_data,
-                    'doc_tipo': 'FE',
-                    'doc_tipo_cod': '1',
-                    'doc_tipo_desc': 'Factura electrónica',
-                    'doc_op': 'VTA',
-                    'doc_motivo': 'VTA',
-                    'doc_moneda': 'GS',
-                    'doc_tipo_ope': 1,
-                    'doc_tipo_ope_desc': 'Venta de mercadería',
-                    'doc_cre_tipo': 1,
-                    'doc_tipo_pago_cod': 1,
-                    'doc_tipo_pago': 'Efectivo',
-                    'observacion': f'Orden Shopify: {payment.order_name}',
-                    'details': details,
-                    'send_save': send_save,
+        if not ids:
+            return {'msgs': [{'error': 'Falta los IDs de los pagos a convertir'}]}
+        if len(ids) >= SHOPIFY_INVOICE_ASYNC_MIN and userobj:
+            task = send_task('am_shopify.tasks.convert_payments_to_invoices',
+                kwargs={
+                    'username': userobj.username,
+                    'qdict': {'ids': io_json.to_json(ids), 'dbcon': dbcon}
                 }
+            )
+            return {'msgs': [{
+                'info': f'Conversión de {len(ids)} pagos en curso, recibirás notificaciones del progreso'
+            }], 'task_id': task.id}
 
-                # Llamar a create_documentheader
-                result, _, _ = msifen.create_documentheader(
-                    userobj=userobj,
-                    qdict={
-                        'dbcon': dbcon,
-                        'uc_fields': io_json.to_json(uc_fields),
-
-                    }
-                )
-
-                if result.get('success'):
-                    # Obtener el DocumentHeader creado y actualizar source/ext_link
-                    record_id = result.get('record_id')
-                    docobj = DocumentHeader.objects.get(pk=record_id)
-                    docobj.source = 'SHOPIFY'
-                    docobj.ext_link = payment.shopify_order_id
-                    docobj.save()
-
-                    # Actualizar el ShopifyPayment
-                    payment.conversion_status = 'converted'
-                    payment.conversion_error = ''
-                    payment.document_header = docobj
-                    payment.converted_at = timezone.now()
-                    payment.save()
-
-                    msgs.append({
-                        'success': f'Pago {payment.order_name} convertido a factura #{docobj.doc_numero}'
-                    })
-                else:
-                    payment.conversion_status = 'error'
-                    payment.conversion_error = result.get('error', 'Error desconocido')[:500]
-                    payment.save()
-                    msgs.append({
-                        'error': f'Error al convertir pago {payment.order_name}: {result.get("error")}'
-                    })
-
-            except Exception as e:
-                # Marcar como error
-                try:
-                    payment = ShopifyPayment.objects.get(pk=pk)
-                    payment.conversion_status = 'error'
-                    payment.conversion_error = str(e)[:500]
-                    payment.save()
-                except:
-                    pass
-                msgs.append({
-                    'error': f'Error migrando pago {pk}: {str(e)}'
-                })
-                logger.error(f"Error migrando pago {pk}: {str(e)}")
-
-        return {'msgs': msgs}
+        return PaymentInvoiceConverter(userobj=userobj, dbcon=dbcon).run(ids)
 
     def migrate_products_to_sifen(self, *args, **kwargs) -> dict:
         """
@@ -0,0 +1,367 @@
+"""
+Importación masiva de Shopify con GraphQL Bulk Operations.
+
+Para la carga inicial de una tienda grande: en lugar de paginar la REST API
+de a 250 registros se lanza un bulkOperationRunQuery, se espera a que
+Shopify termine la exportación y el archivo JSONL resultante se lee línea
+por línea, guardando por lotes con el mismo upsert de ShopifySync.
+
+En el JSONL las conexiones anidadas (variantes de un producto) vienen como
+líneas propias con __parentId, a continuación de su padre. Cada nodo se
+convierte a la forma de la REST API y pasa por los mismos mapeos.
+
+Al terminar se guarda la marca de sincronización (inicio de la exportación
+menos SHOPIFY_SYNC_OVERLAP), la siguiente sincronización incremental por
+REST continúa desde ahí.
+"""
+import re
+import json
+import time
+import logging
+from datetime import timedelta
+
+import requests
+from django.utils import timezone
+
+from .models import ShopifySyncLog
+from .mng_shopify_sync import RESOURCES, SHOPIFY_SYNC_BATCH_SIZE, SHOPIFY_SYNC_OVERLAP, ShopifySync
+
+logger = logging.getLogger(__name__)
+
+BULK_POLL_INTERVAL = 5
+BULK_TIMEOUT = 4 * 3600
+BULK_FINAL = ('COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED')
+
+RUN_MUTATION = '''
+mutation bulkRun($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+'''
+
+STATUS_QUERY = '''
+query bulkStatus($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url partialDataUrl }
+  }
+}
+'''
+
+BULK_QUERIES = {
+    'products': '''
+{
+  products {
+    edges { node {
+      id title descriptionHtml vendor productType handle status
+      publishedAt createdAt updatedAt
+      featuredImage { url }
+      variants(first: 1) { edges { node { id price compareAtPrice sku barcode inventoryQuantity } } }
+    } }
+  }
+}
+''',
+    'orders': '''
+{
+  orders {
+    edges { node {
+      id name currencyCode displayFinancialStatus displayFulfillmentStatus
+      cancelledAt cancelReason note tags createdAt updatedAt processedAt
+      totalPriceSet { shopMoney { amount } }
+      subtotalPriceSet { shopMoney { amount } }
+      totalTaxSet { shopMoney { amount } }
+      totalDiscountsSet { shopMoney { amount } }
+      customer { email phone firstName lastName tags }
+    } }
+  }
+}
+''',
+    'customers': '''
+{
+  customers {
+    edges { node {
+      id firstName lastName email phone state verifiedEmail numberOfOrders
+      note tags taxExempt taxExemptions multipassIdentifier createdAt updatedAt
+      amountSpent { amount currencyCode }
+      lastOrder { id name }
+      emailMarketingConsent { marketingState marketingOptInLevel consentUpdatedAt }
+      smsMarketingConsent { marketingState marketingOptInLevel consentUpdatedAt consentCollectedFrom }
+      defaultAddress { id firstName lastName company address1 address2 city province provinceCode country countryCodeV2 zip phone }
+      addresses { id firstName lastName company address1 address2 city province provinceCode country countryCodeV2 zip phone }
+    } }
+  }
+}
+''',
+}
+
+
+def gid_id(gid):
+    """gid://shopify/Product/123 -> 123 (sin el ?model_name=... de las direcciones)"""
+    return int(str(gid).split('?')[0].rsplit('/', 1)[-1]) if gid else None
+
+
+def money(value):
+    return ((value or {}).get('shopMoney') or {}).get('amount', 0)
+
+
+def enum(value):
+    return value.lower() if value else value
+
+
+def tags(value):
+    return ', '.join(value) if isinstance(value, list) else (value or '')
+
+
+def rest_address(addr):
+    if not addr:
+        return {}
+    return {
+        'id': gid_id(addr.get('id')),
+        'first_name': addr.get('firstName'),
+        'last_name': addr.get('lastName'),
+        'company': addr.get('company'),
+        'address1': addr.get('address1'),
+        'address2': addr.get('address2'),
+        'city': addr.get('city'),
+        'province': addr.get('province'),
+        'province_code': addr.get('provinceCode'),
+        'country': addr.get('country'),
+        'country_code': addr.get('countryCodeV2'),
+        'country_name': addr.get('country'),
+        'zip': addr.get('zip'),
+        'phone': addr.get('phone'),
+    }
+
+
+# ==================== NODOS GRAPHQL -> FORMA REST ====================
+
+def rest_product(node, children):
+    variants = [ c for c in children if '/ProductVariant/' in c.get('id', '') ]
+    image = node.get('featuredImage') or {}
+    return {
+        'id': gid_id(node['id']),
+        'title': node.get('title') or '',
+        'body_html': node.get('descriptionHtml'),
+        'vendor': node.get('vendor') or '',
+        'product_type': node.get('productType') or '',
+        'handle': node.get('handle') or '',
+        'status': enum(node.get('status')) or 'active',
+        'published_at': node.get('publishedAt'),
+        'created_at': node.get('createdAt'),
+        'updated_at': node.get('updatedAt'),
+        'images': [{'src': image['url']}] if image.get('url') else [],
+        'variants': [{
+            'price': v.get('price') or 0,
+            'compare_at_price': v.get('compareAtPrice'),
+            'sku': v.get('sku'),
+            'barcode': v.get('barcode'),
+            'inventory_quantity': v.get('inventoryQuantity'),
+        } for v in variants[:1]],
+    }
+
+
+def rest_order(node, children):
+    customer = node.get('customer') or {}
+    name = node.get('name') or ''
+    return {
+        'id': gid_id(node['id']),
+        'order_number': int(re.sub(r'\D', '', name) or 0),
+        'name': name,
+        'customer': {
+            'email': customer.get('email'),
+            'phone': customer.get('phone'),
+            'first_name': customer.get('firstName'),
+            'last_name': customer.get('lastName'),
+            'tags': tags(customer.get('tags')),
+        },
+        'total_price': money(node.get('totalPriceSet')),
+        'subtotal_price': money(node.get('subtotalPriceSet')),
+        'total_tax': money(node.get('totalTaxSet')),
+        'total_discounts': money(node.get('totalDiscountsSet')),
+        'currency': node.get('currencyCode') or 'PYG',
+        'financial_status': enum(node.get('displayFinancialStatus')) or 'pending',
+        'fulfillment_status': enum(node.get('displayFulfillmentStatus')),
+        'cancelled_at': node.get('cancelledAt'),
+        'cancel_reason': enum(node.get('cancelReason')),
+        'note': node.get('note'),
+        'tags': tags(node.get('tags')),
+        'created_at': node.get('createdAt'),
+        'updated_at': node.get('updatedAt'),
+        'processed_at': node.get('processedAt'),
+    }
+
+
+def rest_customer(node, children):
+    email_consent = node.get('emailMarketingConsent') or {}
+    sms_consent = node.get('smsMarketingConsent') or {}
+    spent = node.get('amountSpent') or {}
+    last_order = node.get('lastOrder') or {}
+    return {
+        'id': gid_id(node['id']),
+        'admin_graphql_api_id': node['id'],
+        'first_name': node.get('firstName'),
+        'last_name': node.get('lastName'),
+        'email': node.get('email'),
+        'phone': node.get('phone'),
+        'state': enum(node.get('state')) or 'disabled',
+        'verified_email': node.get('verifiedEmail', False),
+        'orders_count': int(node.get('numberOfOrders') or 0),
+        'total_spent': spent.get('amount', '0'),
+        'currency': spent.get('currencyCode') or 'PYG',
+        'last_order_id': gid_id(last_order.get('id')),
+        'last_order_name': last_order.get('name'),
+        'note': node.get('note'),
+        'tags': tags(node.get('tags')),
+        'tax_exempt': node.get('taxExempt', False),
+        'tax_exemptions': node.get('taxExemptions') or [],
+        'email_marketing_consent': {
+            'state': enum(email_consent.get('marketingState')) or '',
+            'opt_in_level': enum(email_consent.get('marketingOptInLevel')) or '',
+            'consent_updated_at': email_consent.get('consentUpdatedAt'),
+        },
+        'sms_marketing_consent': {
+            'state': enum(sms_consent.get('marketingState')) or '',
+            'opt_in_level': enum(sms_consent.get('marketingOptInLevel')) or '',
+            'consent_updated_at': sms_consent.get('consentUpdatedAt'),
+            'consent_collected_from': sms_consent.get('consentCollectedFrom') or '',
+        },
+        'multipass_identifier': node.get('multipassIdentifier'),
+        'addresses': [ rest_address(a) for a in node.get('addresses') or [] ],
+        'default_address': rest_address(node.get('defaultAddress')),
+        'created_at': node.get('createdAt'),
+        'updated_at': node.get('updatedAt'),
+    }
+
+
+REST_SHAPES = {
+    'products': rest_product,
+    'orders': rest_order,
+    'customers': rest_customer,
+}
+
+
+class ShopifyBulkImport:
+    """Exportación con bulkOperationRunQuery e importación del JSONL"""
+
+    def __init__(self, client=None, batch_size=SHOPIFY_SYNC_BATCH_SIZE,
+                 poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT):
+        if client is None:
+            from .shopify_client import ShopifyAPIClient
+            client = ShopifyAPIClient()
+        self.client = client
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def start(self, sync_type) -> str:
+        """Lanza la exportación, retorna el id de la operación"""
+        data = self.client.graphql(RUN_MUTATION, {'query': BULK_QUERIES[sync_type]})
+        rsp = data['bulkOperationRunQuery']
+        if rsp.get('userErrors'):
+            raise Exception(f"Error iniciando exportación de {sync_type}: {rsp['userErrors']}")
+        op = rsp['bulkOperation']
+        logger.info(f"Exportación masiva de {sync_type} iniciada: {op['id']}")
+        return op['id']
+
+    def wait(self, op_id) -> dict:
+        """Consulta el estado hasta que la operación termina"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            op = self.client.graphql(STATUS_QUERY, {'id': op_id})['node']
+            if op['status'] in BULK_FINAL:
+                break
+            if time.monotonic() > deadline:
+                raise Exception(f"Exportación {op_id} sin terminar después de {self.timeout}s ({op['status']})")
+            time.sleep(self.poll_interval)
+        if op['status'] != 'COMPLETED':
+            raise Exception(f"Exportación {op_id} terminó con estado {op['status']} ({op.get('errorCode')})")
+        logger.info(f"Exportación {op_id} completada: {op.get('objectCount')} objetos")
+        return op
+
+    def lines(self, source):
+        """Líneas del JSONL desde la URL de Shopify o un archivo local"""
+        if re.match(r'^https?://', source):
+            with requests.get(source, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        yield json.loads(line)
+        else:
+            with open(source, encoding='utf-8') as fh:
+                for line in fh:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def records(self, sync_type, lines):
+        """Agrupa cada nodo con sus hijos (__parentId) y lo convierte a la forma REST"""
+        shape = REST_SHAPES[sync_type]
+        node, children = None, []
+        for obj in lines:
+            if obj.get('__parentId'):
+                if node is not None and obj['__parentId'] == node['id']:
+                    children.append(obj)
+                continue
+            if node is not None:
+                yield shape(node, children)
+            node, children = obj, []
+        if node is not None:
+            yield shape(node, children)
+
+    def load(self, sync_type, source) -> dict:
+        """Guarda por lotes los registros del JSONL en source (URL o archivo)"""
+        resource = RESOURCES[sync_type]
+        sync = ShopifySync(self.client, batch_size=self.batch_size)
+        stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
+        total_processed = 0
+        batch = {}
+        for item in self.records(sync_type, self.lines(source)):
+            total_processed += 1
+            try:
+                batch[item['id']] = resource['mapper'](item)
+            except Exception as e:
+                stats['errors'] += 1
+                logger.error(f"✗ Error mapeando {sync_type} {item.get('id')}: {str(e)}")
+            if len(batch) >= self.batch_size:
+                sync.upsert(resource, batch, stats)
+                batch = {}
+        if batch:
+            sync.upsert(resource, batch, stats)
+        stats['processed'] = total_processed
+        return stats
+
+    def run(self, sync_type) -> dict:
+        """
+        Exportación e importación completa de un recurso.
+
+        Returns:
+            dict: Estadísticas de sincronización {created, updated, skipped, errors, processed}
+        """
+        if sync_type not in BULK_QUERIES:
+            raise Exception(f"Recurso sin exportación masiva: {sync_type}")
+        sync_log = ShopifySyncLog.objects.create(sync_type=sync_type, status='success')
+        started = timezone.now()
+        try:
+            op = self.wait(self.start(sync_type))
+            if op.get('url'):
+                stats = self.load(sync_type, op['url'])
+            else:
+                #Sin objetos Shopify no genera archivo
+                stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0, 'processed': 0}
+
+            sync_log.items_processed = stats['processed']
+            sync_log.items_created = stats['created']
+            sync_log.items_updated = stats['updated']
+            sync_log.items_failed = stats['errors']
+            if not stats['errors']:
+                sync_log.watermark = started - timedelta(seconds=SHOPIFY_SYNC_OVERLAP)
+            sync_log.complete(status='success' if stats['errors'] == 0 else 'partial')
+
+            logger.info(f"Importación masiva de {sync_type} completada: {stats}")
+            return stats
+
+        except Exception as e:
+            error_msg = f"Error en importación masiva de {sync_type}: {str(e)}"
+            logger.error(error_msg)
+            sync_log.complete(status='error', error_message=error_msg)
+            raise
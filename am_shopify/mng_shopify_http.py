@@ -0,0 +1,196 @@
+"""
+Transporte HTTP de la API de Shopify.
+
+- Session de requests por tienda con pool de conexiones (keep-alive).
+- Token de acceso cacheado en memoria, se consulta la base (y se renueva)
+  sólo cuando vence el cache o el token está por expirar.
+- Limitador por tienda con el leaky bucket de Shopify: el nivel del balde
+  se estima localmente y se corrige con X-Shopify-Shop-Api-Call-Limit en
+  cada respuesta; un 429 pausa a todos los hilos durante Retry-After.
+- Ejecutor acotado para lecturas/escrituras masivas que comparten el limitador.
+
+Los limitadores y tokens son de proceso, varios clientes de la misma
+tienda en el mismo proceso comparten el balde.
+"""
+import time
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SHOPIFY_HTTP_POOLED = getattr(settings, 'SHOPIFY_HTTP_POOLED', True)
+SHOPIFY_HTTP_WORKERS = int(getattr(settings, 'SHOPIFY_HTTP_WORKERS', 4))
+SHOPIFY_HTTP_MAX_RETRIES = int(getattr(settings, 'SHOPIFY_HTTP_MAX_RETRIES', 5))
+SHOPIFY_TOKEN_CACHE_TTL = int(getattr(settings, 'SHOPIFY_TOKEN_CACHE_TTL', 300))
+
+CALL_LIMIT_HEADER = 'X-Shopify-Shop-Api-Call-Limit'
+#Balde estandar de la REST Admin API: 40 llamadas, se vacia a 2 por segundo (Plus: 400 y 20)
+BUCKET_SIZE = 40
+LEAK_SECONDS = 20
+#Llamadas libres que se dejan en el balde para otros procesos
+BUCKET_RESERVE = 2
+#Margen igual al de ShopifyAccessToken.is_expiring_soon
+TOKEN_EXPIRY_MARGIN = timedelta(hours=2)
+
+
+class CallLimiter:
+    """Leaky bucket de Shopify visto desde el cliente"""
+
+    def __init__(self, capacity=BUCKET_SIZE, reserve=BUCKET_RESERVE, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = capacity
+        self.leak_rate = capacity / LEAK_SECONDS
+        self.reserve = reserve
+        self.level = 0.0
+        self.inflight = 0
+        self.blocked_until = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._stamp = clock()
+        self._lock = threading.Lock()
+
+    def _leak(self, now):
+        self.level = max(0.0, self.level - (now - self._stamp) * self.leak_rate)
+        self._stamp = now
+
+    def acquire(self):
+        """Reserva una llamada, espera lo necesario para no llenar el balde"""
+        with self._lock:
+            now = self._clock()
+            self._leak(now)
+            self.level += 1
+            self.inflight += 1
+            wait = max((self.level - (self.capacity - self.reserve)) / self.leak_rate,
+                       self.blocked_until - now,
+                       0.0)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def done(self, header=None):
+        """
+        Fin de una llamada. Con el header 'usadas/capacidad' de la respuesta el
+        nivel pasa a ser el del servidor mas las llamadas todavia en vuelo.
+        """
+        with self._lock:
+            self._leak(self._clock())
+            self.inflight = max(self.inflight - 1, 0)
+            if not header:
+                return
+            try:
+                used, capacity = (int(v) for v in header.split('/'))
+            except ValueError:
+                return
+            if capacity != self.capacity:
+                self.capacity = capacity
+                self.leak_rate = capacity / LEAK_SECONDS
+            self.level = float(used + self.inflight)
+
+    def pause(self, seconds):
+        """429: nadie llama hasta que pase Retry-After"""
+        with self._lock:
+            now = self._clock()
+            self._leak(now)
+            self.level = float(self.capacity)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class TokenCache:
+    """Token de acceso en memoria con vencimiento"""
+
+    def __init__(self, store_name, token_service, ttl=SHOPIFY_TOKEN_CACHE_TTL):
+        self.store_name = store_name
+        self.token_service = token_service
+        self.ttl = ttl
+        self.token = None
+        self.valid_until = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            now = timezone.now()
+            if self.token and now < self.valid_until:
+                return self.token
+            from .models import ShopifyAccessToken
+            self.token = self.token_service.get_or_create_token(store_name=self.store_name)
+            expires_at = ShopifyAccessToken.objects.filter(store_name=self.store_name, is_active=True)\
+                                                   .values_list('expires_at', flat=True)\
+                                                   .first()
+            self.valid_until = now + timedelta(seconds=self.ttl)
+            if expires_at:
+                self.valid_until = min(self.valid_until, expires_at - TOKEN_EXPIRY_MARGIN)
+            return self.token
+
+    def invalidate(self):
+        with self._lock:
+            self.token = None
+            self.valid_until = None
+
+
+_registry_lock = threading.Lock()
+_limiters = {}
+_tokens = {}
+
+
+def get_limiter(store_name) -> CallLimiter:
+    with _registry_lock:
+        if store_name not in _limiters:
+            _limiters[store_name] = CallLimiter()
+        return _limiters[store_name]
+
+
+def get_token_cache(store_name, token_service) -> TokenCache:
+    with _registry_lock:
+        if store_name not in _tokens:
+            _tokens[store_name] = TokenCache(store_name, token_service)
+        return _tokens[store_name]
+
+
+def new_session(pool_size=SHOPIFY_HTTP_WORKERS) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount('https://', adapter)
+    return session
+
+
+def retry_after(response, attempt):
+    """Segundos a esperar tras un 429, Retry-After o backoff si no viene"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return min(2.0 * (attempt + 1), 10.0)
+
+
+def run_concurrent(fn, items, workers=SHOPIFY_HTTP_WORKERS) -> list:
+    """
+    Ejecuta fn(item) con a lo sumo workers hilos.
+
+    Returns:
+        list: [{'item', 'result', 'error'}] en el orden de items
+    """
+    def task(item):
+        try:
+            return {'item': item, 'result': fn(item), 'error': None}
+        except Exception as e:
+            logger.error(f'Error en operacion masiva de Shopify {item}: {e}')
+            return {'item': item, 'result': None, 'error': str(e)}
+
+    def worker_task(item):
+        try:
+            return task(item)
+        finally:
+            #Conexiones a la base abiertas por el hilo (renovacion de token)
+            connections.close_all()
+
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [ task(item) for item in items ]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shopify') as executor:
+        return list(executor.map(worker_task, items))
@@ -0,0 +1,443 @@
+"""
+Conversión en bloque de ShopifyPayment a facturas SIFEN.
+
+Los datos que el camino de a uno (MSifen.create_documentheader por pago)
+consultaba en cada iteración se traen una sola vez por corrida:
+
+- pagos, ext_link ya facturados, distrito/ciudad por defecto
+- validate_ruc una vez por RUC distinto (el resto lo resuelve ruc_cache)
+- Clientes y Producto con pdv_ruc__in / prod_cod__in
+
+Por lote se crean cabeceras y detalles con bulk_create, los totales salen
+de una sola agregación agrupada y se guardan con bulk_update. La numeración
+se reserva para todo el lote (Eserial.set_number) en la misma transacción:
+si no hay números el lote se descarta y sus pagos quedan con error. Luego se
+firma en bloque (Eserial.sign_documents); los pagos con RUC y estado paid se
+envían al SIFEN.
+
+Los valores de cabecera y detalle son los de create_documentheader
+(documentheader_fields / documentdetail_fields / documentheader_totals).
+"""
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from celery.execute import send_task
+
+from .models import ShopifyPayment
+from .shopify_client import extract_ruc_from_tags
+from Sifen.models import Clientes, DocumentHeader, DocumentDetail, Producto, Distrito, Ciudades, Eestablecimiento
+from Sifen.mng_sifen import MSifen
+from Sifen import ekuatia_serials, mng_gmdata
+from Sifen.mng_ruc_cache import ruc_cache
+from Sifen.mng_ventas_diarias import ventas_diarias
+
+logger = logging.getLogger(__name__)
+
+SHOPIFY_INVOICE_BATCH_SIZE = int(getattr(settings, 'SHOPIFY_INVOICE_BATCH_SIZE', 500))
+#Desde cuantos pagos la conversion se manda a celery
+SHOPIFY_INVOICE_ASYNC_MIN = int(getattr(settings, 'SHOPIFY_INVOICE_ASYNC_MIN', 50))
+
+DEFAULT_DISTRITO = 'ASUNCION (DISTRITO)'
+SHIPPING_PROD_COD = 999999
+
+TOTALS_FIELDS = [
+    'doc_total', 'doc_iva', 'doc_exenta', 'doc_g10', 'doc_i10', 'doc_g5', 'doc_i5',
+    'doc_descuento', 'doc_per_descuento', 'doc_redondeo', 'doc_saldo', 'doc_cre_cond',
+    'doc_cre_plazo', 'doc_cre_cond_desc', 'doc_total_redondeo', 'doc_relacion_saldo',
+]
+PAYMENT_FIELDS = ['conversion_status', 'conversion_error', 'document_header', 'converted_at', 'updated_at']
+
+
+def geography_defaults() -> dict:
+    """Ubicación por defecto del receptor (ASUNCION)"""
+    distobj = Distrito.objects.select_related('dptoobj').filter(nombre_distrito=DEFAULT_DISTRITO).first()
+    ciudadobj = Ciudades.objects.filter(distritoobj=distobj).first() if distobj else None
+    return {
+        'pdv_dpto_cod': distobj.dptoobj.codigo_departamento if distobj else 1,
+        'pdv_dpto_nombre': distobj.dptoobj.nombre_departamento if distobj else 'CAPITAL',
+        'pdv_distrito_cod': distobj.codigo_distrito if distobj else 1,
+        'pdv_distrito_nombre': distobj.nombre_distrito if distobj else DEFAULT_DISTRITO,
+        'pdv_ciudad_cod': ciudadobj.codigo_ciudad if ciudadobj else 1,
+        'pdv_ciudad_nombre': ciudadobj.nombre_ciudad if ciudadobj else DEFAULT_DISTRITO,
+    }
+
+
+def payment_ruc(payment):
+    try:
+        ruc = extract_ruc_from_tags(payment.customer_tags)
+    except Exception:
+        return None
+    return ruc if ruc and ruc != '0' else None
+
+
+def payment_details(payment) -> list:
+    """line_items con el descuento de cada ítem, más el envío como ítem aparte"""
+    details = []
+    for idx, item in enumerate(payment.line_items, start=1):
+        item_price = Decimal(str(item.get('price', 0)))
+        item_qty = Decimal(str(item.get('quantity', 1)))
+        # Usar los últimos 6 dígitos del ID de Shopify como prod_cod
+        item_id = str(item.get('id', 0))
+        prod_cod = int(item_id[-6:]) if item_id else 999000 + idx
+
+        # Descuento específico del ítem desde discount_allocations
+        item_discount = sum(Decimal(str(d.get('amount', 0))) for d in item.get('discount_allocations', []))
+        bruto = item_price * item_qty
+        per_descuento = float(item_discount / bruto * 100) if bruto > 0 and item_discount > 0 else 0
+
+        details.append({
+            'prod_cod': prod_cod,
+            'prod_descripcion': (item.get('title', 'Producto') or 'Producto')[:500],
+            'precio_unitario': float(item_price),
+            'cantidad': float(item_qty),
+            'prod_unidad_medida_desc': '77',
+            'prod_unidad_medida_desc_text': 'UNI',
+            'exenta': 0,
+            'g5': 0,
+            'g10': 100,
+            'descuento': float(item_discount),
+            'per_descuento': per_descuento,
+            'descuento_global_item': 0,
+        })
+
+    total_shipping = Decimal(str(payment.total_shipping or 0))
+    if total_shipping > 0:
+        details.append({
+            'prod_cod': SHIPPING_PROD_COD,
+            'prod_descripcion': 'Envío / Shipping',
+            'precio_unitario': float(total_shipping),
+            'cantidad': 1,
+            'prod_unidad_medida_desc': '77',
+            'prod_unidad_medida_desc_text': 'UNI',
+            'exenta': 0,
+            'g5': 0,
+            'g10': 100,
+            'descuento': 0,
+            'per_descuento': 0,
+            'descuento_global_item': 0,
+        })
+    return details
+
+
+def payment_uc_fields(payment, ruc, clienteobj, geo, gdata) -> dict:
+    """
+    uc_fields de create_documentheader para el pago.
+    Con RUC el receptor sale de Clientes (o del RUC si no está cargado),
+    sin RUC es innominado. Sólo se envía al SIFEN lo pagado con RUC.
+    """
+    nombre = payment.customer_full_name or 'Sin Nombre'
+    telefono = payment.customer_phone or '00000'
+    shipping = payment.shipping_address
+    direccion = (shipping.get('address1', '') or 'ND')[:200] if shipping else 'ND'
+
+    if ruc and clienteobj:
+        pdv_data = {
+            'pdv_innominado': False,
+            'pdv_tipocontribuyente': str(clienteobj.pdv_tipocontribuyente),
+            'pdv_es_contribuyente': clienteobj.pdv_es_contribuyente,
+            'pdv_type_business': clienteobj.pdv_type_business or 'B2C',
+            'pdv_codigo': 0,
+            'pdv_ruc': ruc,
+            'pdv_ruc_dv': clienteobj.pdv_ruc_dv or 0,
+            'pdv_nombrefantasia': clienteobj.pdv_nombrefantasia or nombre[:300],
+            'pdv_nombrefactura': clienteobj.pdv_nombrefactura or nombre[:300],
+        }
+    elif ruc:
+        pdv_data = {
+            'pdv_innominado': False,
+            'pdv_tipocontribuyente': 3,
+            'pdv_es_contribuyente': False,
+            'pdv_type_business': 'B2C',
+            'pdv_codigo': 0,
+            'pdv_ruc': ruc,
+            'pdv_ruc_dv': gdata.calculate_dv(ruc),
+            'pdv_nombrefantasia': nombre[:300],
+            'pdv_nombrefactura': nombre[:300],
+        }
+    else:
+        pdv_data = {
+            'pdv_innominado': True,
+            'pdv_tipocontribuyente': '3',
+            'pdv_es_contribuyente': False,
+            'pdv_type_business': 'B2C',
+            'pdv_codigo': 999,
+            'pdv_ruc': '0',
+            'pdv_ruc_dv': 0,
+            'pdv_nombrefantasia': 'Sin Nombre',
+            'pdv_nombrefactura': 'Sin Nombre',
+        }
+    return {
+        **pdv_data,
+        **geo,
+        'pdv_pais_cod': 'PRY',
+        'pdv_pais': 'Paraguay',
+        'pdv_direccion_entrega': direccion or 'ND',
+        'pdv_numero_casa': 0,
+        'pdv_telefono': telefono,
+        'pdv_celular': telefono,
+        'pdv_email': payment.customer_email or 'nomail@nomail.com',
+        'doc_tipo': 'FE',
+        'doc_tipo_cod': '1',
+        'doc_tipo_desc': 'Factura electrónica',
+        'doc_op': 'VTA',
+        'doc_motivo': 'VTA',
+        'doc_moneda': 'GS',
+        'doc_tipo_ope': 1,
+        'doc_tipo_ope_desc': 'Venta de mercadería',
+        'doc_cre_tipo': 1,
+        'doc_tipo_pago_cod': 1,
+        'doc_tipo_pago': 'Efectivo',
+        'observacion': f'Orden Shopify: {payment.order_name}',
+    }
+
+
+class PaymentInvoiceConverter:
+    """Convierte pagos de Shopify a facturas SIFEN por lotes"""
+
+    def __init__(self, userobj=None, dbcon='default', msifen=None, batch_size=SHOPIFY_INVOICE_BATCH_SIZE, progress=None):
+        self.userobj = userobj
+        self.dbcon = dbcon
+        self.msifen = msifen or MSifen()
+        self.batch_size = max(int(batch_size), 1)
+        #progress(procesados, total, mensaje)
+        self.progress = progress or (lambda done, total, msg: None)
+        self.gdata = mng_gmdata.Gdata()
+        self.msgs = []
+        self.stats = {'converted': 0, 'skipped': 0, 'errors': 0, 'sent': 0}
+        self.failed = set()
+
+    def error(self, payment, msg):
+        self.failed.add(payment.pk)
+        payment.conversion_status = 'error'
+        payment.conversion_error = str(msg)[:500]
+        self.stats['errors'] += 1
+        self.msgs.append({'error': f'Error al convertir pago {payment.order_name}: {msg}'})
+
+    def validate_rucs(self, rucs):
+        """Una consulta por RUC distinto, validate_ruc puede marcar al cliente como contribuyente"""
+        for ruc in rucs:
+            try:
+                self.msifen.validate_ruc(qdict={'ruc': ruc})
+            except Exception as e:
+                logger.warning(f'No se pudo validar el RUC {ruc}: {e}')
+
+    def run(self, ids) -> dict:
+        payments = list(ShopifyPayment.objects.filter(pk__in=ids).order_by('pk'))
+        total = len(payments)
+        found = { str(p.pk) for p in payments }
+        for pk in ids:
+            if str(pk) not in found:
+                self.msgs.append({'error': f'Pago {pk} no encontrado'})
+        self.progress(0, total, f'Preparando {total} pagos')
+
+        pending = []
+        for payment in payments:
+            if payment.is_converted:
+                self.msgs.append({'info': f'Pago {payment.order_name} ya fue convertido'})
+                continue
+            pending.append(payment)
+
+        # Facturas ya existentes por ext_link, la primera de cada orden
+        existing = {}
+        for ext_link, docpk in DocumentHeader.objects.using(self.dbcon)\
+                                    .filter(ext_link__in=[ str(p.shopify_order_id) for p in pending ])\
+                                    .order_by('pk')\
+                                    .values_list('ext_link', 'pk'):
+            existing.setdefault(ext_link, docpk)
+
+        now = timezone.now()
+        skipped, todo = [], []
+        for payment in pending:
+            docpk = existing.get(str(payment.shopify_order_id))
+            if docpk is None:
+                todo.append(payment)
+                continue
+            payment.conversion_status = 'skipped'
+            payment.conversion_error = f'Ya existe factura con ext_link={payment.shopify_order_id}'
+            payment.document_header_id = docpk
+            payment.updated_at = now
+            skipped.append(payment)
+            self.stats['skipped'] += 1
+            self.msgs.append({'info': f'Pago {payment.order_name} ya tiene factura asociada'})
+        ShopifyPayment.objects.bulk_update(skipped, PAYMENT_FIELDS, batch_size=self.batch_size)
+
+        rucs = { p.pk: payment_ruc(p) for p in todo }
+        self.validate_rucs(sorted({ r for r in rucs.values() if r }))
+
+        timbradoobj = self.msifen.timbradoobj
+        estab_obj = Eestablecimiento.objects.filter(timbradoobj=timbradoobj).first() if timbradoobj else None
+        if not estab_obj:
+            for payment in todo:
+                self.error(payment, 'No hay establecimiento configurado')
+            ShopifyPayment.objects.bulk_update(todo, PAYMENT_FIELDS, batch_size=self.batch_size)
+            return self.result()
+        geo = geography_defaults()
+
+        done = total - len(todo)
+        self.progress(done, total, f'{len(todo)} pagos para facturar')
+        for start in range(0, len(todo), self.batch_size):
+            chunk = todo[start:start + self.batch_size]
+            try:
+                self.convert(chunk, rucs, geo, timbradoobj, estab_obj.establecimiento)
+            except Exception as e:
+                logger.exception('Error convirtiendo lote de pagos de Shopify')
+                for payment in chunk:
+                    if payment.conversion_status != 'converted' and payment.pk not in self.failed:
+                        self.error(payment, e)
+            for payment in chunk:
+                payment.updated_at = timezone.now()
+            ShopifyPayment.objects.bulk_update(chunk, PAYMENT_FIELDS, batch_size=self.batch_size)
+            done += len(chunk)
+            self.progress(done, total, f'{self.stats["converted"]} facturas creadas')
+
+        logger.info(f'Cache RUC tras migrar {total} pagos: {ruc_cache.stats()}')
+        return self.result()
+
+    def result(self) -> dict:
+        if self.stats['converted']:
+            self.msgs.insert(0, {'success': f'{self.stats["converted"]} pagos convertidos a facturas'})
+        return {'msgs': self.msgs, 'stats': self.stats}
+
+    def convert(self, payments, rucs, geo, timbradoobj, doc_establecimiento):
+        ms = self.msifen
+        clientes = {}
+        for clobj in Clientes.objects.filter(pdv_ruc__in=[ rucs[p.pk] or '0' for p in payments ]).order_by('pk'):
+            clientes.setdefault(clobj.pdv_ruc, clobj)
+
+        rows = []
+        for payment in payments:
+            ruc = rucs[payment.pk]
+            uc_fields = payment_uc_fields(payment, ruc, clientes.get(ruc) if ruc else None, geo, self.gdata)
+            error = ms.documentheader_fields(uc_fields, timbradoobj, doc_establecimiento, userobj=self.userobj)
+            if error:
+                self.error(payment, error)
+                continue
+            uc_fields['source'] = 'SHOPIFY'
+            uc_fields['ext_link'] = str(payment.shopify_order_id)
+            send_save = bool(ruc) and payment.financial_status == 'paid'
+            rows.append((payment, DocumentHeader(**uc_fields), payment_details(payment), send_save))
+        if not rows:
+            return
+
+        prod_cods = { d.get('prod_cod') for _, _, details, _ in rows for d in details }
+        productos = { p.prod_cod: p for p in Producto.objects.filter(prod_cod__in=prod_cods)
+                                                             .select_related('medidaobj', 'porcentaje_iva') }
+
+        with transaction.atomic(using=self.dbcon):
+            headers = DocumentHeader.objects.using(self.dbcon).bulk_create([ h for _, h, _, _ in rows ])
+            DocumentDetail.objects.using(self.dbcon).bulk_create([
+                DocumentDetail(documentheaderobj=docobj,
+                               **ms.documentdetail_fields(d, productos.get(d.get('prod_cod')), userobj=self.userobj))
+                for docobj, (_, _, details, _) in zip(headers, rows)
+                for d in details
+            ], batch_size=1000)
+
+            # Las mismas sumas que create_documentheader, agrupadas por cabecera
+            totals = {
+                t.pop('documentheaderobj_id'): t
+                for t in DocumentDetail.objects.using(self.dbcon)
+                                       .filter(documentheaderobj__in=headers)
+                                       .values('documentheaderobj_id')
+                                       .annotate(exenta=Sum('exenta'),
+                                                 iva_5=Sum('iva_5'),
+                                                 gravada_5=Sum('gravada_5'),
+                                                 iva_10=Sum('iva_10'),
+                                                 gravada_10=Sum('gravada_10'),
+                                                 afecto=Sum('afecto'),
+                                                 descuento=Sum('descuento'))
+                                       .order_by()
+            }
+            docobjs = list(DocumentHeader.objects.using(self.dbcon).filter(pk__in=[ h.pk for h in headers ]).with_totals())
+            for docobj in docobjs:
+                ms.documentheader_totals(docobj, totals.get(docobj.pk, {}))
+            DocumentHeader.objects.using(self.dbcon).bulk_update(docobjs, TOTALS_FIELDS, batch_size=1000)
+
+            self.save_clientes([ h for _, h, _, _ in rows ])
+
+            # Numeración de todo el lote; si falla se descartan las cabeceras
+            # y run() marca los pagos con error, así se pueden reintentar
+            prof_numbers = [ h.prof_number for h in headers ]
+            rsp = ms.set_number(timbradoobj.timbrado, prof_numbers, 1, doc_establecimiento, sign_document=False)
+            if not rsp.get('success'):
+                raise ValueError(f'No se pudo numerar el lote de facturas: {rsp.get("error")}')
+
+        # Los pagos pasan a convertidos sólo con las facturas numeradas
+        converted_at = timezone.now()
+        for (payment, _, _, _), docobj in zip(rows, headers):
+            payment.conversion_status = 'converted'
+            payment.conversion_error = ''
+            payment.document_header = docobj
+            payment.converted_at = converted_at
+            self.stats['converted'] += 1
+
+        # Firma en bloque y envío de lo pagado con RUC
+        eser = ekuatia_serials.Eserial()
+        srsp = eser.sign_documents(prof_numbers, ms.RUC)
+        for msg in srsp.get('errors'):
+            self.msgs.append({'error': msg})
+        to_send = [ h for (_, _, _, send_save), h in zip(rows, headers) if send_save ]
+        if to_send:
+            eser.send_pending_signedxml([ h.prof_number for h in to_send ])
+            self.stats['sent'] += len(to_send)
+            self.send_invoices(to_send)
+        ventas_diarias.mark_queryset(DocumentHeader.objects.using(self.dbcon).filter(pk__in=[ h.pk for h in headers ]))
+
+    def save_clientes(self, headers):
+        """Alta o actualización de Clientes como en create_documentheader, una vez por RUC"""
+        last = { h.pdv_ruc: h for h in headers }
+        current = {}
+        for clobj in Clientes.objects.filter(pdv_ruc__in=list(last)).order_by('pk'):
+            current.setdefault(clobj.pdv_ruc, clobj)
+        new, changed = [], []
+        for ruc, h in last.items():
+            clobj = current.get(ruc)
+            if not clobj:
+                new.append(Clientes(
+                    pdv_ruc=ruc,
+                    pdv_ruc_dv=h.pdv_ruc_dv,
+                    pdv_nombrefactura=h.pdv_nombrefactura,
+                    pdv_nombrefantasia=h.pdv_nombrefantasia,
+                    pdv_celular=h.pdv_celular or '',
+                    pdv_email=h.pdv_email or '',
+                    pdv_type_business=h.pdv_type_business,
+                    pdv_tipocontribuyente=h.pdv_tipocontribuyente,
+                    pdv_es_contribuyente=h.pdv_es_contribuyente,
+                ))
+                continue
+            clobj.pdv_ruc_dv = h.pdv_ruc_dv
+            clobj.pdv_nombrefactura = h.pdv_nombrefactura
+            if h.pdv_celular:
+                clobj.pdv_celular = h.pdv_celular
+            if h.pdv_email:
+                clobj.pdv_email = h.pdv_email
+            clobj.pdv_type_business = h.pdv_type_business
+            if h.pdv_tipocontribuyente:
+                clobj.pdv_tipocontribuyente = h.pdv_tipocontribuyente
+            clobj.pdv_es_contribuyente = str(clobj.pdv_tipocontribuyente) in ['1', '2']
+            changed.append(clobj)
+        Clientes.objects.bulk_create(new)
+        Clientes.objects.bulk_update(changed, [
+            'pdv_ruc_dv', 'pdv_nombrefactura', 'pdv_celular', 'pdv_email',
+            'pdv_type_business', 'pdv_tipocontribuyente', 'pdv_es_contribuyente'
+        ])
+
+    def send_invoices(self, headers):
+        if not self.userobj:
+            return
+        for docobj in headers:
+            if docobj.pdv_email is None or not docobj.pdv_email.strip():
+                continue
+            send_task('Sifen.tasks.send_invoice',
+                kwargs={
+                    'username': self.userobj.username,
+                    'qdict': {
+                        'dbcon': self.dbcon,
+                        'docpk': docobj.id,
+                        'from_console': False
+                    }
+                }
+            )
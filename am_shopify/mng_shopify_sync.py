@@ -0,0 +1,368 @@
+"""
+Sincronización incremental de Shopify.
+
+Cada recurso (productos, órdenes, pagos, clientes) se recorre siguiendo el
+cursor page_info del header Link y filtrando por updated_at_min desde la
+marca (watermark) guardada en el último ShopifySyncLog exitoso del recurso.
+Una corrida programada sólo trae lo que cambió desde la anterior.
+
+Los registros se guardan por lotes con bulk_create(update_conflicts=True)
+sobre la clave de Shopify; si el lote choca con otra restricción única
+(p.ej. handle de producto) se guarda registro por registro.
+
+La marca es el inicio de la corrida menos SHOPIFY_SYNC_OVERLAP segundos y
+sólo se guarda si no hubo errores ni filtros adicionales; lo que cambió
+durante la corrida vuelve a entrar en la siguiente (el upsert es idempotente).
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from dateutil import parser
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from .models import ShopifyProduct, ShopifyOrder, ShopifyPayment, ShopifyCustomer, ShopifySyncLog
+
+logger = logging.getLogger(__name__)
+
+SHOPIFY_SYNC_BATCH_SIZE = int(getattr(settings, 'SHOPIFY_SYNC_BATCH_SIZE', 500))
+SHOPIFY_SYNC_OVERLAP = int(getattr(settings, 'SHOPIFY_SYNC_OVERLAP', 300))
+
+
+def parse_date(value):
+    return parser.parse(value) if value else None
+
+
+# ==================== MAPEOS ====================
+
+def product_data(product) -> dict:
+    # Primera variante (para precio, SKU, etc.) y primera imagen
+    variants = product.get('variants', [])
+    variant = variants[0] if variants else {}
+    images = product.get('images', [])
+    image = images[0] if images else {}
+
+    compare_at_price = None
+    if variant.get('compare_at_price'):
+        compare_at_price = Decimal(str(variant.get('compare_at_price')))
+
+    return {
+        'title': product.get('title', '')[:500],
+        'description': product.get('body_html', '')[:5000] if product.get('body_html') else '',
+        'vendor': product.get('vendor', '')[:255],
+        'product_type': product.get('product_type', '')[:255],
+        'handle': product.get('handle', '')[:255],
+        'status': product.get('status', 'active'),
+        'price': Decimal(str(variant.get('price', 0))),
+        'compare_at_price': compare_at_price,
+        'inventory_quantity': variant.get('inventory_quantity', 0) or 0,
+        'sku': variant.get('sku', '')[:255] if variant.get('sku') else '',
+        'barcode': variant.get('barcode', '')[:255] if variant.get('barcode') else '',
+        'image_url': image.get('src', '')[:500] if image.get('src') else '',
+        'published_at': parse_date(product.get('published_at')),
+        'created_at_shopify': parse_date(product.get('created_at')),
+        'updated_at_shopify': parse_date(product.get('updated_at')),
+    }
+
+
+def order_data(order) -> dict:
+    customer = order.get('customer') or {}
+    return {
+        'order_number': order.get('order_number', 0),
+        'name': order.get('name', ''),
+        'customer_email': customer.get('email', '') or '',
+        'customer_phone': customer.get('phone', '') or '',
+        'customer_first_name': customer.get('first_name', '') or '',
+        'customer_last_name': customer.get('last_name', '') or '',
+        'customer_tags': customer.get('tags', '') or '',
+        'total_price': Decimal(str(order.get('total_price', 0))),
+        'subtotal_price': Decimal(str(order.get('subtotal_price', 0))),
+        'total_tax': Decimal(str(order.get('total_tax', 0))),
+        'total_discounts': Decimal(str(order.get('total_discounts', 0))),
+        'currency': order.get('currency', 'PYG'),
+        'financial_status': order.get('financial_status', 'pending'),
+        'fulfillment_status': order.get('fulfillment_status', '') or '',
+        'cancelled_at': parse_date(order.get('cancelled_at')),
+        'cancel_reason': order.get('cancel_reason', '') or '',
+        'note': order.get('note', '') or '',
+        'tags': order.get('tags', '') or '',
+        'created_at_shopify': parse_date(order.get('created_at')),
+        'updated_at_shopify': parse_date(order.get('updated_at')),
+        'processed_at': parse_date(order.get('processed_at')),
+    }
+
+
+def payment_data(order) -> dict:
+    """Orden de Shopify (pagada o no) como ShopifyPayment, sin tocar el estado de conversión"""
+    customer = order.get('customer') or {}
+    customer_email = customer.get('email') or order.get('email') or ''
+    customer_phone = customer.get('phone') or order.get('phone') or ''
+    customer_first_name = customer.get('first_name', '') or ''
+    customer_last_name = customer.get('last_name', '') or ''
+    customer_name = f"{customer_first_name} {customer_last_name}".strip()
+
+    # Innominado: sin datos de cliente identificables
+    is_innominado = not customer_email and not customer_phone and not customer_name
+
+    gateways = order.get('payment_gateway_names', [])
+    shipping_lines = order.get('shipping_lines', [])
+
+    return {
+        'order_number': order.get('order_number', 0),
+        'order_name': order.get('name', ''),
+        'customer_email': customer_email or None,
+        'customer_phone': customer_phone or None,
+        'customer_first_name': customer_first_name or None,
+        'customer_last_name': customer_last_name or None,
+        'customer_name': customer_name or None,
+        'customer_tags': customer.get('tags', '') or '',
+        'is_innominado': is_innominado,
+        'total_price': order.get('total_price', 0),
+        'subtotal_price': order.get('subtotal_price', 0),
+        'total_tax': order.get('total_tax', 0),
+        'total_discounts': order.get('total_discounts', 0),
+        'total_shipping': sum(float(line.get('price', 0)) for line in shipping_lines),
+        'currency': order.get('currency', 'PYG'),
+        'payment_gateway': ', '.join(gateways) if gateways else 'unknown',
+        # Todo es cash porque no hay info de tarjeta
+        'payment_method': 'cash',
+        'financial_status': order.get('financial_status', 'paid'),
+        'line_items': order.get('line_items', []),
+        'shipping_address': order.get('shipping_address') or {},
+        'billing_address': order.get('billing_address') or {},
+        'note': order.get('note', '') or '',
+        'tags': order.get('tags', '') or '',
+        'order_created_at': parse_date(order.get('created_at')),
+        'order_processed_at': parse_date(order.get('processed_at')),
+    }
+
+
+def customer_data(customer) -> dict:
+    email_consent = customer.get('email_marketing_consent') or {}
+    sms_consent = customer.get('sms_marketing_consent') or {}
+    default_addr = customer.get('default_address') or {}
+    return {
+        # Identificadores
+        'admin_graphql_api_id': customer.get('admin_graphql_api_id', ''),
+
+        # Datos básicos
+        'first_name': customer.get('first_name') or None,
+        'last_name': customer.get('last_name') or None,
+        'email': customer.get('email') or None,
+        'phone': customer.get('phone') or None,
+
+        # Estado y verificación
+        'state': customer.get('state', 'disabled'),
+        'verified_email': customer.get('verified_email', False),
+
+        # Estadísticas
+        'orders_count': customer.get('orders_count', 0),
+        'total_spent': Decimal(str(customer.get('total_spent', '0'))),
+        'currency': customer.get('currency', 'PYG'),
+
+        # Última orden
+        'last_order_id': customer.get('last_order_id'),
+        'last_order_name': customer.get('last_order_name') or '',
+
+        # Notas y etiquetas
+        'note': customer.get('note'),
+        'tags': customer.get('tags', ''),
+
+        # Impuestos
+        'tax_exempt': customer.get('tax_exempt', False),
+        'tax_exemptions': customer.get('tax_exemptions', []),
+
+        # Marketing - Email
+        'email_marketing_consent_state': email_consent.get('state', ''),
+        'email_marketing_consent_opt_in_level': email_consent.get('opt_in_level', ''),
+        'email_marketing_consent_updated_at': parse_date(email_consent.get('consent_updated_at')),
+
+        # Marketing - SMS
+        'sms_marketing_consent_state': sms_consent.get('state', ''),
+        'sms_marketing_consent_opt_in_level': sms_consent.get('opt_in_level', ''),
+        'sms_marketing_consent_updated_at': parse_date(sms_consent.get('consent_updated_at')),
+        'sms_marketing_consent_source': sms_consent.get('consent_collected_from', ''),
+
+        # Multipass
+        'multipass_identifier': customer.get('multipass_identifier'),
+
+        # Direcciones (JSON completo)
+        'addresses': customer.get('addresses', []),
+        'default_address': default_addr,
+
+        # Dirección por defecto desnormalizada (or '' para convertir None a vacío)
+        'default_address_id': default_addr.get('id'),
+        'default_address_first_name': default_addr.get('first_name') or '',
+        'default_address_last_name': default_addr.get('last_name') or '',
+        'default_address_company': default_addr.get('company') or '',
+        'default_address_address1': default_addr.get('address1') or '',
+        'default_address_address2': default_addr.get('address2') or '',
+        'default_address_city': default_addr.get('city') or '',
+        'default_address_province': default_addr.get('province') or '',
+        'default_address_province_code': default_addr.get('province_code') or '',
+        'default_address_country': default_addr.get('country') or '',
+        'default_address_country_code': default_addr.get('country_code') or '',
+        'default_address_country_name': default_addr.get('country_name') or '',
+        'default_address_zip': default_addr.get('zip') or '',
+        'default_address_phone': default_addr.get('phone') or '',
+
+        # Fechas
+        'created_at_shopify': parse_date(customer.get('created_at')),
+        'updated_at_shopify': parse_date(customer.get('updated_at')),
+    }
+
+
+# sync_type -> endpoint REST, clave del listado, modelo, campo único, mapeo,
+# campos auto_now a refrescar en el upsert y parámetros fijos
+RESOURCES = {
+    'products': {
+        'endpoint': 'products.json',
+        'key': 'products',
+        'model': ShopifyProduct,
+        'unique': 'shopify_id',
+        'mapper': product_data,
+        'touch': ['synced_at'],
+        'params': {},
+    },
+    'orders': {
+        'endpoint': 'orders.json',
+        'key': 'orders',
+        'model': ShopifyOrder,
+        'unique': 'shopify_id',
+        'mapper': order_data,
+        'touch': ['synced_at'],
+        'params': {'status': 'any'},
+    },
+    'payments': {
+        'endpoint': 'orders.json',
+        'key': 'orders',
+        'model': ShopifyPayment,
+        'unique': 'shopify_order_id',
+        'mapper': payment_data,
+        'touch': ['updated_at'],
+        'params': {'status': 'any'},
+    },
+    'customers': {
+        'endpoint': 'customers.json',
+        'key': 'customers',
+        'model': ShopifyCustomer,
+        'unique': 'shopify_id',
+        'mapper': customer_data,
+        'touch': ['synced_at'],
+        'params': {},
+    },
+}
+
+
+class ShopifySync:
+    """Motor de sincronización incremental por recurso"""
+
+    def __init__(self, client=None, batch_size=SHOPIFY_SYNC_BATCH_SIZE):
+        if client is None:
+            from .shopify_client import ShopifyAPIClient
+            client = ShopifyAPIClient()
+        self.client = client
+        self.batch_size = batch_size
+
+    def watermark(self, sync_type):
+        """updated_at_min de la próxima corrida: marca del último log exitoso"""
+        last = ShopifySyncLog.objects.filter(sync_type=sync_type,
+                                             status='success',
+                                             watermark__isnull=False)\
+                                     .order_by('-started_at')\
+                                     .first()
+        return last.watermark if last else None
+
+    def upsert(self, resource, batch: dict, stats: dict):
+        """batch: id de Shopify -> datos del modelo"""
+        model = resource['model']
+        ufield = resource['unique']
+        existing = set(model.objects.filter(**{f'{ufield}__in': list(batch)})
+                                    .values_list(ufield, flat=True))
+        objs = [ model(**{ufield: sid}, **data) for sid, data in batch.items() ]
+        update_fields = list(next(iter(batch.values()))) + resource['touch']
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(objs,
+                                          update_conflicts=True,
+                                          unique_fields=[ufield],
+                                          update_fields=update_fields)
+            stats['created'] += len(batch) - len(existing)
+            stats['updated'] += len(existing)
+        except IntegrityError as e:
+            #Conflicto con otra restriccion unica, se guarda de a uno
+            logger.warning(f'Lote de {len(batch)} {model.__name__} con conflicto ({e}), guardando por registro')
+            for sid, data in batch.items():
+                try:
+                    with transaction.atomic():
+                        _obj, created = model.objects.update_or_create(**{ufield: sid}, defaults=data)
+                    stats['created' if created else 'updated'] += 1
+                except Exception as e:
+                    stats['errors'] += 1
+                    logger.error(f"✗ Error sincronizando {model.__name__} {sid}: {str(e)}")
+
+    def run(self, sync_type, limit=250, full=False, **params) -> dict:
+        """
+        Sincroniza un recurso.
+
+        Args:
+            sync_type: products, orders, payments o customers
+            limit: Registros por página (máx 250)
+            full: Ignora la marca y recorre la tienda completa
+            params: Filtros adicionales de la API (p.ej. financial_status)
+
+        Returns:
+            dict: Estadísticas de sincronización {created, updated, skipped, errors}
+        """
+        resource = RESOURCES[sync_type]
+        since = None if full else self.watermark(sync_type)
+        sync_log = ShopifySyncLog.objects.create(
+            sync_type=sync_type,
+            status='success',
+            incremental=since is not None
+        )
+        started = timezone.now()
+        stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
+        total_processed = 0
+
+        filters = { k: v for k, v in params.items() if v is not None }
+        qparams = dict(resource['params'], **filters)
+        if since:
+            qparams['updated_at_min'] = since.isoformat()
+        logger.info(f"Sincronizando {sync_type} desde Shopify ({'desde ' + str(since) if since else 'completo'})")
+
+        try:
+            batch = {}
+            for page in self.client.iter_pages(resource['endpoint'], resource['key'], limit=limit, **qparams):
+                for item in page:
+                    total_processed += 1
+                    try:
+                        batch[item['id']] = resource['mapper'](item)
+                    except Exception as e:
+                        stats['errors'] += 1
+                        logger.error(f"✗ Error mapeando {sync_type} {item.get('id')}: {str(e)}")
+                if len(batch) >= self.batch_size:
+                    self.upsert(resource, batch, stats)
+                    batch = {}
+            if batch:
+                self.upsert(resource, batch, stats)
+
+            sync_log.items_processed = total_processed
+            sync_log.items_created = stats['created']
+            sync_log.items_updated = stats['updated']
+            sync_log.items_failed = stats['errors']
+            #Con errores o filtros la corrida no cubre todo, se mantiene la marca anterior
+            if not stats['errors'] and not filters:
+                sync_log.watermark = started - timedelta(seconds=SHOPIFY_SYNC_OVERLAP)
+            sync_log.complete(status='success' if stats['errors'] == 0 else 'partial')
+
+            logger.info(f"Sincronización de {sync_type} completada: {stats}")
+            return stats
+
+        except Exception as e:
+            error_msg = f"Error en sincronización de {sync_type}: {str(e)}"
+            logger.error(error_msg)
+            sync_log.complete(status='error', error_message=error_msg)
+            raise
@@ -443,6 +443,8 @@ class ShopifySyncLog(models.Model):
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     duration_seconds = models.FloatField(null=True, blank=True)
+    watermark = models.DateTimeField(null=True, blank=True, help_text="updated_at_min de la próxima sincronización incremental")
+    incremental = models.BooleanField(default=False, help_text="Sólo registros modificados desde la sincronización anterior")
 
     class Meta:
         verbose_name = "Log de Sincronización"
@@ -1,7 +1,12 @@
 import requests
 import logging
+from urllib.parse import urlparse, parse_qs
 from django.conf import settings
 from .services import ShopifyTokenService
+from .mng_shopify_http import (
+    SHOPIFY_HTTP_POOLED, SHOPIFY_HTTP_WORKERS, SHOPIFY_HTTP_MAX_RETRIES, CALL_LIMIT_HEADER,
+    get_limiter, get_token_cache, new_session, retry_after, run_concurrent
+)
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +18,7 @@ class ShopifyAPIClient:
     
     API_VERSION = '2024-10'
     
-    def __init__(self, store_name=None):
+    def __init__(self, store_name=None, pooled=None, workers=None):
         if not store_name:
             self.store_name = settings.SHOPIFY_STORE.replace('.myshopify.com', '').replace('https://', '').replace('http://', '')
         else:
@@ -21,17 +26,28 @@ class ShopifyAPIClient:
         
         self.base_url = f"https://{self.store_name}.myshopify.com/admin/api/{self.API_VERSION}"
         self.token_service = ShopifyTokenService()
+
+        # Modo pooled: session con keep-alive, token en memoria y limitador de llamadas
+        self.pooled = SHOPIFY_HTTP_POOLED if pooled is None else pooled
+        self.workers = workers or SHOPIFY_HTTP_WORKERS
+        if self.pooled:
+            self.session = new_session(self.workers)
+            self.limiter = get_limiter(self.store_name)
+            self.tokens = get_token_cache(self.store_name, self.token_service)
     
     def _get_headers(self):
         """Obtiene los headers con el token de acceso"""
-        token = self.token_service.get_valid_token()
+        token = self.tokens.get() if self.pooled else self.token_service.get_valid_token()
         return {
             'X-Shopify-Access-Token': token,
             'Content-Type': 'application/json'
         }
     
-    def _make_request(self, method, endpoint, params=None, data=None):
-        """Realiza una petición a la API de Shopify"""
+    def _request(self, method, endpoint, params=None, data=None):
+        """Realiza una petición a la API de Shopify y retorna el response"""
+        if self.pooled:
+            return self._pooled_request(method, endpoint, params=params, data=data)
+
         url = f"{self.base_url}/{endpoint}"
         headers = self._get_headers()
         
@@ -45,14 +61,94 @@ class ShopifyAPIClient:
                 timeout=30
             )
             response.raise_for_status()
-            return response.json()
+            return response
         except requests.exceptions.HTTPError as e:
             logger.error(f"HTTP Error en {endpoint}: {e.response.status_code} - {e.response.text}")
             raise
         except requests.exceptions.RequestException as e:
             logger.error(f"Error en petición a {endpoint}: {str(e)}")
             raise
-    
+
+    def _pooled_request(self, method, endpoint, params=None, data=None):
+        """
+        Petición por la session compartida respetando el balde de llamadas.
+        Un 429 pausa al limitador durante Retry-After y se reintenta;
+        un 401 descarta el token cacheado y se reintenta una vez.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        token_retry = True
+        for attempt in range(SHOPIFY_HTTP_MAX_RETRIES + 1):
+            self.limiter.acquire()
+            response = None
+            try:
+                response = self.session.request(
+                    method=method,
+                    url=url,
+                    headers=self._get_headers(),
+                    params=params,
+                    json=data,
+                    timeout=30
+                )
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error en petición a {endpoint}: {str(e)}")
+                raise
+            finally:
+                self.limiter.done(response.headers.get(CALL_LIMIT_HEADER) if response is not None else None)
+
+            if response.status_code == 429 and attempt < SHOPIFY_HTTP_MAX_RETRIES:
+                wait = retry_after(response, attempt)
+                logger.warning(f"Límite de llamadas de Shopify en {endpoint}, esperando {wait}s")
+                self.limiter.pause(wait)
+                continue
+            if response.status_code == 401 and token_retry:
+                token_retry = False
+                self.tokens.invalidate()
+                continue
+            break
+
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"HTTP Error en {endpoint}: {e.response.status_code} - {e.response.text}")
+            raise
+        return response
+
+    def _make_request(self, method, endpoint, params=None, data=None):
+        """Realiza una petición a la API de Shopify"""
+        return self._request(method, endpoint, params=params, data=data).json()
+
+    def iter_pages(self, endpoint, resource, limit=250, **params):
+        """
+        Recorre todas las páginas de un listado siguiendo el cursor del header Link.
+        Con page_info Shopify sólo acepta limit (y fields), los filtros van en la primera página.
+
+        Yields:
+            list: Registros de cada página (response[resource])
+        """
+        params = dict(params, limit=min(limit, 250))
+        while True:
+            response = self._request('GET', endpoint, params=params)
+            yield response.json().get(resource, [])
+            next_link = response.links.get('next', {}).get('url')
+            if not next_link:
+                break
+            page_info = parse_qs(urlparse(next_link).query).get('page_info')
+            if not page_info:
+                break
+            params = {'limit': params['limit'], 'page_info': page_info[0]}
+    
+    def graphql(self, query, variables=None):
+        """
+        Ejecuta una consulta de la GraphQL Admin API
+
+        Returns:
+            dict: data de la respuesta
+        """
+        rsp = self._make_request('POST', 'graphql.json', data={'query': query, 'variables': variables or {}})
+        if rsp.get('errors'):
+            raise Exception(f"Error GraphQL: {rsp['errors']}")
+        return rsp.get('data', {})
+
     # ==================== PRODUCTOS ====================
     
     def get_products(self, limit=50, page_info=None, **filters):
@@ -223,6 +319,39 @@ class ShopifyAPIClient:
         """Elimina una imagen de producto"""
         return self._make_request('DELETE', f'products/{product_id}/images/{image_id}.json')
     
+    # ==================== OPERACIONES MASIVAS ====================
+
+    def bulk(self, fn, items, workers=None):
+        """
+        Ejecuta fn(item) en paralelo con a lo sumo workers hilos.
+        Todas las llamadas comparten la session y el limitador de la tienda.
+
+        Returns:
+            list: [{'item', 'result', 'error'}] en el orden de items
+        """
+        if self.pooled:
+            # Token cargado en este hilo, los workers lo leen de memoria
+            self._get_headers()
+        else:
+            workers = 1
+        return run_concurrent(fn, items, workers or self.workers)
+
+    def bulk_get_products(self, product_ids, workers=None):
+        """Obtiene varios productos por ID"""
+        return self.bulk(self.get_product, product_ids, workers)
+
+    def bulk_update_products(self, updates, workers=None):
+        """updates: [(product_id, product_data)]"""
+        return self.bulk(lambda u: self.update_product(*u), updates, workers)
+
+    def bulk_update_variants(self, updates, workers=None):
+        """updates: [(variant_id, variant_data)]"""
+        return self.bulk(lambda u: self.update_variant(*u), updates, workers)
+
+    def bulk_set_inventory_levels(self, levels, workers=None):
+        """levels: [(inventory_item_id, location_id, available)]"""
+        return self.bulk(lambda lv: self.set_inventory_level(*lv), levels, workers)
+
     # ==================== LOCATIONS ====================
     
     def get_locations(self):
@@ -265,127 +394,20 @@ class ShopifyAPIClient:
 
     # ==================== PAGOS (Sincronización) ====================
 
-    def sync_paid_orders(self, limit=50):
+    def sync_paid_orders(self, limit=250, full=False):
         """
         Sincroniza órdenes de Shopify al modelo ShopifyPayment.
-        Importa todas las órdenes (pagadas y no pagadas).
+        Importa todas las órdenes (pagadas y no pagadas) modificadas desde la última sincronización.
+
+        Args:
+            limit: Número de órdenes por página (máx 250)
+            full: Recorre todas las órdenes ignorando la última sincronización
 
         Returns:
             dict: Estadísticas de sincronización {created, updated, skipped, errors}
         """
-        from .models import ShopifyPayment, ShopifySyncLog
-        from dateutil import parser
-
-        sync_log = ShopifySyncLog.objects.create(
-            sync_type='payments',
-            status='success'
-        )
-
-        stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
-
-        try:
-            # Obtener todas las órdenes (sin filtro de financial_status)
-            response = self.get_orders(limit=limit, status='any')
-            orders = response.get('orders', [])
-
-            logger.info(f"Sincronizando {len(orders)} órdenes desde Shopify")
-
-            for order in orders:
-                try:
-                    shopify_order_id = order.get('id')
-
-                    # Extraer información del cliente
-                    customer = order.get('customer') or {}
-                    customer_email = customer.get('email') or order.get('email') or ''
-                    customer_phone = customer.get('phone') or order.get('phone') or ''
-                    customer_first_name = customer.get('first_name', '') or ''
-                    customer_last_name = customer.get('last_name', '') or ''
-
-                    # Construir nombre completo
-                    customer_name = f"{customer_first_name} {customer_last_name}".strip()
-
-                    # Determinar si es innominado (sin datos de cliente identificables)
-                    is_innominado = not customer_email and not customer_phone and not customer_name
-
-                    # Extraer gateway de pago
-                    gateways = order.get('payment_gateway_names', [])
-                    payment_gateway = ', '.join(gateways) if gateways else 'unknown'
-
-                    # Determinar método de pago (todo es cash porque no hay info de tarjeta)
-                    payment_method = 'cash'
-
-                    # Parsear fechas
-                    order_created_at = parser.parse(order.get('created_at'))
-                    order_processed_at = None
-                    if order.get('processed_at'):
-                        order_processed_at = parser.parse(order.get('processed_at'))
-
-                    # Preparar datos
-                    customer_tags = customer.get('tags', '') or ''
-
-                    # Calcular total shipping desde shipping_lines
-                    shipping_lines = order.get('shipping_lines', [])
-                    total_shipping = sum(float(line.get('price', 0)) for line in shipping_lines)
-
-                    payment_data = {
-                        'order_number': order.get('order_number', 0),
-                        'order_name': order.get('name', ''),
-                        'customer_email': customer_email or None,
-                        'customer_phone': customer_phone or None,
-                        'customer_first_name': customer_first_name or None,
-                        'customer_last_name': customer_last_name or None,
-                        'customer_name': customer_name or None,
-                        'customer_tags': customer_tags,
-                        'is_innominado': is_innominado,
-                        'total_price': order.get('total_price', 0),
-                        'subtotal_price': order.get('subtotal_price', 0),
-                        'total_tax': order.get('total_tax', 0),
-                        'total_discounts': order.get('total_discounts', 0),
-                        'total_shipping': total_shipping,
-                        'currency': order.get('currency', 'PYG'),
-                        'payment_gateway': payment_gateway,
-                        'payment_method': payment_method,
-                        'financial_status': order.get('financial_status', 'paid'),
-                        'line_items': order.get('line_items', []),
-                        'shipping_address': order.get('shipping_address') or {},
-                        'billing_address': order.get('billing_address') or {},
-                        'note': order.get('note', '') or '',
-                        'tags': order.get('tags', '') or '',
-                        'order_created_at': order_created_at,
-                        'order_processed_at': order_processed_at,
-                    }
-
-                    # Crear o actualizar
-                    payment_obj, created = ShopifyPayment.objects.update_or_create(
-                        shopify_order_id=shopify_order_id,
-                        defaults=payment_data
-                    )
-
-                    if created:
-                        stats['created'] += 1
-                        logger.info(f"✓ Pago creado: {payment_obj.order_name} - {payment_obj.customer_full_name}")
-                    else:
-                        stats['updated'] += 1
-                        logger.debug(f"↻ Pago actualizado: {payment_obj.order_name}")
-
-                except Exception as e:
-                    stats['errors'] += 1
-                    logger.error(f"✗ Error sincronizando orden {order.get('name')}: {str(e)}")
-
-            sync_log.items_processed = len(orders)
-            sync_log.items_created = stats['created']
-            sync_log.items_updated = stats['updated']
-            sync_log.items_failed = stats['errors']
-            sync_log.complete(status='success' if stats['errors'] == 0 else 'partial')
-
-            logger.info(f"Sincronización completada: {stats}")
-            return stats
-
-        except Exception as e:
-            error_msg = f"Error en sincronización de pagos: {str(e)}"
-            logger.error(error_msg)
-            sync_log.complete(status='error', error_message=error_msg)
-            raise
+        from .mng_shopify_sync import ShopifySync
+        return ShopifySync(self).run('payments', limit=limit, full=full)
 
     def get_pending_payments_count(self):
         """Retorna el número de pagos pendientes de conversión"""
@@ -445,189 +467,20 @@ class ShopifyAPIClient:
         params = {'query': query}
         return self._make_request('GET', 'customers/search.json', params=params)
 
-    def sync_customers(self, limit=250):
+    def sync_customers(self, limit=250, full=False):
         """
-        Sincroniza TODOS los clientes de Shopify al modelo ShopifyCustomer.
+        Sincroniza los clientes de Shopify al modelo ShopifyCustomer.
         Guarda todos los datos disponibles sin importar si parecen relevantes.
 
         Args:
             limit: Número de clientes por página (máx 250)
+            full: Recorre todos los clientes ignorando la última sincronización
 
         Returns:
             dict: Estadísticas de sincronización {created, updated, skipped, errors}
         """
-        from .models import ShopifyCustomer, ShopifySyncLog
-        from dateutil import parser
-        from decimal import Decimal
-
-        sync_log = ShopifySyncLog.objects.create(
-            sync_type='customers',
-            status='success'
-        )
-
-        stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
-        total_processed = 0
-
-        try:
-            # Obtener todos los clientes (paginado)
-            page_info = None
-            has_more = True
-
-            while has_more:
-                response = self.get_customers(limit=limit, page_info=page_info)
-                customers = response.get('customers', [])
-
-                if not customers:
-                    break
-
-                logger.info(f"Sincronizando {len(customers)} clientes desde Shopify")
-
-                for customer in customers:
-                    try:
-                        shopify_id = customer.get('id')
-
-                        # Parsear fechas
-                        created_at_shopify = None
-                        if customer.get('created_at'):
-                            created_at_shopify = parser.parse(customer.get('created_at'))
-
-                        updated_at_shopify = None
-                        if customer.get('updated_at'):
-                            updated_at_shopify = parser.parse(customer.get('updated_at'))
-
-                        # Email marketing consent
-                        email_consent = customer.get('email_marketing_consent') or {}
-                        email_consent_state = email_consent.get('state', '')
-                        email_consent_opt_in = email_consent.get('opt_in_level', '')
-                        email_consent_updated = None
-                        if email_consent.get('consent_updated_at'):
-                            email_consent_updated = parser.parse(email_consent.get('consent_updated_at'))
-
-                        # SMS marketing consent
-                        sms_consent = customer.get('sms_marketing_consent') or {}
-                        sms_consent_state = sms_consent.get('state', '')
-                        sms_consent_opt_in = sms_consent.get('opt_in_level', '')
-                        sms_consent_source = sms_consent.get('consent_collected_from', '')
-                        sms_consent_updated = None
-                        if sms_consent.get('consent_updated_at'):
-                            sms_consent_updated = parser.parse(sms_consent.get('consent_updated_at'))
-
-                        # Dirección por defecto
-                        default_addr = customer.get('default_address') or {}
-
-                        # Preparar datos del cliente
-                        customer_data = {
-                            # Identificadores
-                            'admin_graphql_api_id': customer.get('admin_graphql_api_id', ''),
-
-                            # Datos básicos
-                            'first_name': customer.get('first_name') or None,
-                            'last_name': customer.get('last_name') or None,
-                            'email': customer.get('email') or None,
-                            'phone': customer.get('phone') or None,
-
-                            # Estado y verificación
-                            'state': customer.get('state', 'disabled'),
-                            'verified_email': customer.get('verified_email', False),
-
-                            # Estadísticas
-                            'orders_count': customer.get('orders_count', 0),
-                            'total_spent': Decimal(str(customer.get('total_spent', '0'))),
-                            'currency': customer.get('currency', 'PYG'),
-
-                            # Última orden
-                            'last_order_id': customer.get('last_order_id'),
-                            'last_order_name': customer.get('last_order_name') or '',
-
-                            # Notas y etiquetas
-                            'note': customer.get('note'),
-                            'tags': customer.get('tags', ''),
-
-                            # Impuestos
-                            'tax_exempt': customer.get('tax_exempt', False),
-                            'tax_exemptions': customer.get('tax_exemptions', []),
-
-                            # Marketing - Email
-                            'email_marketing_consent_state': email_consent_state,
-                            'email_marketing_consent_opt_in_level': email_consent_opt_in,
-                            'email_marketing_consent_updated_at': email_consent_updated,
-
-                            # Marketing - SMS
-                            'sms_marketing_consent_state': sms_consent_state,
-                            'sms_marketing_consent_opt_in_level': sms_consent_opt_in,
-                            'sms_marketing_consent_updated_at': sms_consent_updated,
-                            'sms_marketing_consent_source': sms_consent_source,
-
-                            # Multipass
-                            'multipass_identifier': customer.get('multipass_identifier'),
-
-                            # Direcciones (JSON completo)
-                            'addresses': customer.get('addresses', []),
-                            'default_address': default_addr,
-
-                            # Dirección por defecto desnormalizada (usar or '' para convertir None a vacío)
-                            'default_address_id': default_addr.get('id'),
-                            'default_address_first_name': default_addr.get('first_name') or '',
-                            'default_address_last_name': default_addr.get('last_name') or '',
-                            'default_address_company': default_addr.get('company') or '',
-                            'default_address_address1': default_addr.get('address1') or '',
-                            'default_address_address2': default_addr.get('address2') or '',
-                            'default_address_city': default_addr.get('city') or '',
-                            'default_address_province': default_addr.get('province') or '',
-                            'default_address_province_code': default_addr.get('province_code') or '',
-                            'default_address_country': default_addr.get('country') or '',
-                            'default_address_country_code': default_addr.get('country_code') or '',
-                            'default_address_country_name': default_addr.get('country_name') or '',
-                            'default_address_zip': default_addr.get('zip') or '',
-                            'default_address_phone': default_addr.get('phone') or '',
-
-                            # Fechas
-                            'created_at_shopify': created_at_shopify,
-                            'updated_at_shopify': updated_at_shopify,
-                        }
-
-                        # Crear o actualizar
-                        customer_obj, created = ShopifyCustomer.objects.update_or_create(
-                            shopify_id=shopify_id,
-                            defaults=customer_data
-                        )
-
-                        if created:
-                            stats['created'] += 1
-                            logger.info(f"✓ Cliente creado: {customer_obj.full_name or customer_obj.email or shopify_id}")
-                        else:
-                            stats['updated'] += 1
-                            logger.debug(f"↻ Cliente actualizado: {customer_obj.full_name or customer_obj.email or shopify_id}")
-
-                        total_processed += 1
-
-                    except Exception as e:
-                        stats['errors'] += 1
-                        logger.error(f"✗ Error sincronizando cliente {customer.get('id')}: {str(e)}")
-
-                # Verificar si hay más páginas (Shopify usa Link headers para paginación)
-                # Por ahora, si recibimos menos de limit, asumimos que no hay más
-                has_more = len(customers) == limit
-
-                # TODO: Implementar paginación basada en Link header si es necesario
-                # Por ahora salimos después de la primera página si limit < 250
-                if limit < 250:
-                    has_more = False
-
-            sync_log.items_processed = total_processed
-            sync_log.items_created = stats['created']
-            sync_log.items_updated = stats['updated']
-            sync_log.items_failed = stats['errors']
-            sync_log.complete(status='success' if stats['errors'] == 0 else 'partial')
-
-            logger.info(f"Sincronización de clientes completada: {stats}")
-            return stats
-
-        except Exception as e:
-            error_msg = f"Error en sincronización de clientes: {str(e)}"
-            logger.error(error_msg)
-            sync_log.complete(status='error', error_message=error_msg)
-            raise
+        from .mng_shopify_sync import ShopifySync
+        return ShopifySync(self).run('customers', limit=limit, full=full)
 
     def get_customers_summary(self):
         """Retorna un resumen de todos los clientes sincronizados"""
@@ -649,226 +502,51 @@ class ShopifyAPIClient:
 
     # ==================== PRODUCTOS (Sincronización) ====================
 
-    def sync_products(self, limit=250):
+    def sync_products(self, limit=250, full=False):
         """
         Sincroniza productos de Shopify al modelo ShopifyProduct.
-        Usa update_or_create para evitar duplicados.
 
         Args:
             limit: Número de productos por página (máx 250)
+            full: Recorre todos los productos ignorando la última sincronización
 
         Returns:
-            dict: Estadísticas de sincronización {created, updated, errors}
+            dict: Estadísticas de sincronización {created, updated, skipped, errors}
         """
-        from .models import ShopifyProduct, ShopifySyncLog
-        from dateutil import parser
-        from decimal import Decimal
+        from .mng_shopify_sync import ShopifySync
+        return ShopifySync(self).run('products', limit=limit, full=full)
 
-        sync_log = ShopifySyncLog.objects.create(
-            sync_type='products',
-            status='success'
-        )
+    def bulk_import(self, sync_type):
+        """
+        Importa todos los productos, órdenes o clientes con una exportación
+        masiva (GraphQL bulkOperationRunQuery) en lugar de paginar la REST API.
+        Pensado para la carga inicial de una tienda grande.
 
-        stats = {'created': 0, 'updated': 0, 'errors': 0}
-        total_processed = 0
+        Args:
+            sync_type: products, orders o customers
 
-        try:
-            response = self.get_products(limit=limit)
-            products = response.get('products', [])
-
-            logger.info(f"Sincronizando {len(products)} productos desde Shopify")
-
-            for product in products:
-                try:
-                    # Obtener primera variante (para precio, SKU, etc.)
-                    variants = product.get('variants', [])
-                    variant = variants[0] if variants else {}
-
-                    # Obtener primera imagen
-                    images = product.get('images', [])
-                    image = images[0] if images else {}
-
-                    # Parsear fechas
-                    published_at = None
-                    if product.get('published_at'):
-                        published_at = parser.parse(product.get('published_at'))
-
-                    created_at_shopify = None
-                    if product.get('created_at'):
-                        created_at_shopify = parser.parse(product.get('created_at'))
-
-                    updated_at_shopify = None
-                    if product.get('updated_at'):
-                        updated_at_shopify = parser.parse(product.get('updated_at'))
-
-                    # Preparar precio comparativo
-                    compare_at_price = None
-                    if variant.get('compare_at_price'):
-                        compare_at_price = Decimal(str(variant.get('compare_at_price')))
-
-                    product_data = {
-                        'title': product.get('title', '')[:500],
-                        'description': product.get('body_html', '')[:5000] if product.get('body_html') else '',
-                        'vendor': product.get('vendor', '')[:255],
-                        'product_type': product.get('product_type', '')[:255],
-                        'handle': product.get('handle', '')[:255],
-                        'status': product.get('status', 'active'),
-                        'price': Decimal(str(variant.get('price', 0))),
-                        'compare_at_price': compare_at_price,
-                        'inventory_quantity': variant.get('inventory_quantity', 0) or 0,
-                        'sku': variant.get('sku', '')[:255] if variant.get('sku') else '',
-                        'barcode': variant.get('barcode', '')[:255] if variant.get('barcode') else '',
-                        'image_url': image.get('src', '')[:500] if image.get('src') else '',
-                        'published_at': published_at,
-                        'created_at_shopify': created_at_shopify,
-                        'updated_at_shopify': updated_at_shopify,
-                    }
-
-                    product_obj, created = ShopifyProduct.objects.update_or_create(
-                        shopify_id=product.get('id'),
-                        defaults=product_data
-                    )
-
-                    if created:
-                        stats['created'] += 1
-                        logger.info(f"✓ Producto creado: {product_obj.title}")
-                    else:
-                        stats['updated'] += 1
-                        logger.debug(f"↻ Producto actualizado: {product_obj.title}")
-
-                    total_processed += 1
-
-                except Exception as e:
-                    stats['errors'] += 1
-                    logger.error(f"✗ Error sincronizando producto {product.get('id')}: {str(e)}")
-
-            sync_log.items_processed = total_processed
-            sync_log.items_created = stats['created']
-            sync_log.items_updated = stats['updated']
-            sync_log.items_failed = stats['errors']
-            sync_log.complete(status='success' if stats['errors'] == 0 else 'partial')
-
-            logger.info(f"Sincronización de productos completada: {stats}")
-            return stats
-
-        except Exception as e:
-            error_msg = f"Error en sincronización de productos: {str(e)}"
-            logger.error(error_msg)
-            sync_log.complete(status='error', error_message=error_msg)
-            raise
+        Returns:
+            dict: Estadísticas de sincronización {created, updated, skipped, errors, processed}
+        """
+        from .mng_shopify_bulk import ShopifyBulkImport
+        return ShopifyBulkImport(self).run(sync_type)
 
     # ==================== ÓRDENES (Sincronización) ====================
 
-    def sync_orders(self, limit=250, financial_status=None):
+    def sync_orders(self, limit=250, financial_status=None, full=False):
         """
         Sincroniza TODAS las órdenes de Shopify (no solo pagadas).
 
         Args:
-            limit: Número de órdenes a sincronizar
+            limit: Número de órdenes por página (máx 250)
             financial_status: Filtro opcional (pending, paid, etc.)
+            full: Recorre todas las órdenes ignorando la última sincronización
 
         Returns:
-            dict: Estadísticas de sincronización {created, updated, errors}
+            dict: Estadísticas de sincronización {created, updated, skipped, errors}
         """
-        from .models import ShopifyOrder, ShopifySyncLog
-        from dateutil import parser
-        from decimal import Decimal
-
-        sync_log = ShopifySyncLog.objects.create(
-            sync_type='orders',
-            status='success'
-        )
-
-        stats = {'created': 0, 'updated': 0, 'errors': 0}
-        total_processed = 0
-
-        try:
-            response = self.get_orders(
-                limit=limit,
-                status='any',
-                financial_status=financial_status
-            )
-            orders = response.get('orders', [])
-
-            logger.info(f"Sincronizando {len(orders)} órdenes desde Shopify")
-
-            for order in orders:
-                try:
-                    customer = order.get('customer') or {}
-
-                    # Parsear fechas
-                    cancelled_at = None
-                    if order.get('cancelled_at'):
-                        cancelled_at = parser.parse(order.get('cancelled_at'))
-
-                    created_at_shopify = None
-                    if order.get('created_at'):
-                        created_at_shopify = parser.parse(order.get('created_at'))
-
-                    updated_at_shopify = None
-                    if order.get('updated_at'):
-                        updated_at_shopify = parser.parse(order.get('updated_at'))
-
-                    processed_at = None
-                    if order.get('processed_at'):
-                        processed_at = parser.parse(order.get('processed_at'))
-
-                    order_data = {
-                        'order_number': order.get('order_number', 0),
-                        'name': order.get('name', ''),
-                        'customer_email': customer.get('email', '') or '',
-                        'customer_phone': customer.get('phone', '') or '',
-                        'customer_first_name': customer.get('first_name', '') or '',
-                        'customer_last_name': customer.get('last_name', '') or '',
-                        'customer_tags': customer.get('tags', '') or '',
-                        'total_price': Decimal(str(order.get('total_price', 0))),
-                        'subtotal_price': Decimal(str(order.get('subtotal_price', 0))),
-                        'total_tax': Decimal(str(order.get('total_tax', 0))),
-                        'total_discounts': Decimal(str(order.get('total_discounts', 0))),
-                        'currency': order.get('currency', 'PYG'),
-                        'financial_status': order.get('financial_status', 'pending'),
-                        'fulfillment_status': order.get('fulfillment_status', '') or '',
-                        'cancelled_at': cancelled_at,
-                        'cancel_reason': order.get('cancel_reason', '') or '',
-                        'note': order.get('note', '') or '',
-                        'tags': order.get('tags', '') or '',
-                        'created_at_shopify': created_at_shopify,
-                        'updated_at_shopify': updated_at_shopify,
-                        'processed_at': processed_at,
-                    }
-
-                    order_obj, created = ShopifyOrder.objects.update_or_create(
-                        shopify_id=order.get('id'),
-                        defaults=order_data
-                    )
-
-                    if created:
-                        stats['created'] += 1
-                        logger.info(f"✓ Orden creada: {order_obj.name}")
-                    else:
-                        stats['updated'] += 1
-                        logger.debug(f"↻ Orden actualizada: {order_obj.name}")
-
-                    total_processed += 1
-
-                except Exception as e:
-                    stats['errors'] += 1
-                    logger.error(f"✗ Error sincronizando orden {order.get('id')}: {str(e)}")
-
-            sync_log.items_processed = total_processed
-            sync_log.items_created = stats['created']
-            sync_log.items_updated = stats['updated']
-            sync_log.items_failed = stats['errors']
-            sync_log.complete(status='success' if stats['errors'] == 0 else 'partial')
-
-            logger.info(f"Sincronización de órdenes completada: {stats}")
-            return stats
-
-        except Exception as e:
-            error_msg = f"Error en sincronización de órdenes: {str(e)}"
-            logger.error(error_msg)
-            sync_log.complete(status='error', error_message=error_msg)
-            raise
+        from .mng_shopify_sync import ShopifySync
+        return ShopifySync(self).run('orders', limit=limit, full=full, financial_status=financial_status)
 
 
 # ==================== HELPER FUNCTIONS ====================
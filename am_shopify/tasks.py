@@ -0,0 +1,64 @@
+from OptsIO.io_tasks import LogErrorsTask
+from OptsIO.io_json import from_json
+from django.contrib.auth.models import User
+from celery import shared_task
+
+
+@shared_task(bind=True, base=LogErrorsTask, soft_time_limit=1800, time_limit=2400)
+def convert_payments_to_invoices(self, *args, **kwargs):
+    """
+    Convierte pagos de Shopify a facturas SIFEN por lotes
+    con el avance en la campana de tareas
+    """
+    from am_shopify.mng_shopify_invoices import PaymentInvoiceConverter
+    from OptsIO.ws_utils import ws_send_task_update, ws_send_task_complete, ws_send_task_error
+
+    username = kwargs.get('username')
+    userobj = User.objects.get(username=username)
+    q: dict = kwargs.get('qdict', {})
+    ids = from_json(q.get('ids'))
+
+    task_id = self.request.id
+    task_name = f'Facturar {len(ids)} pagos Shopify'
+
+    ws_send_task_update(
+        username,
+        task_id,
+        task_name,
+        'Iniciando conversión de pagos...',
+        progress=0
+    )
+
+    def progress(done, total, msg):
+        ws_send_task_update(
+            username,
+            task_id,
+            task_name,
+            msg,
+            progress=int(done * 100 / total) if total else 100
+        )
+
+    try:
+        rsp = PaymentInvoiceConverter(userobj=userobj,
+                                      dbcon=q.get('dbcon', 'default'),
+                                      progress=progress).run(ids)
+        stats = rsp.get('stats')
+        ws_send_task_complete(
+            username,
+            task_id,
+            task_name,
+            f'Conversión completada: {stats["converted"]} facturas, '
+            f'{stats["skipped"]} omitidos, {stats["errors"]} errores',
+            result=stats
+        )
+        return {'success': True, **stats}
+
+    except Exception as e:
+        ws_send_task_error(
+            username,
+            task_id,
+            task_name,
+            str(e),
+            f'Error al convertir pagos: {str(e)}'
+        )
+        raise
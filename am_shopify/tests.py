@@ -0,0 +1,310 @@
+import os
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
+from django.test import TestCase
+from am_shopify.models import ShopifyOrder, ShopifyPayment, ShopifyProduct, ShopifyCustomer, ShopifySyncLog
+from am_shopify.shopify_client import ShopifyAPIClient
+from am_shopify.mng_shopify_sync import ShopifySync
+from am_shopify.mng_shopify_http import CallLimiter
+from am_shopify.mng_shopify_bulk import ShopifyBulkImport
+from am_shopify.mng_shopify_invoices import PaymentInvoiceConverter
+from Sifen.models import Clientes, DocumentHeader
+from Sifen.mng_sifen import MSifen
+from Sifen.tests import document_header
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+def shopify_order(oid, updated_at='2025-12-01T10:00:00-03:00', **kwargs):
+    order = {
+        'id': oid, 'order_number': oid, 'name': f'#{oid}',
+        'total_price': '110000.00', 'subtotal_price': '100000.00', 'total_tax': '10000.00',
+        'total_discounts': '0.00', 'currency': 'PYG', 'financial_status': 'paid',
+        'customer': {'email': f'c{oid}@mail.com', 'first_name': 'Juan', 'last_name': 'Perez'},
+        'created_at': '2025-12-01T09:00:00-03:00', 'updated_at': updated_at,
+    }
+    order.update(kwargs)
+    return order
+
+
+class FakeClient:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def iter_pages(self, endpoint, resource, limit=250, **params):
+        self.calls.append((endpoint, params))
+        yield from self.pages
+
+
+class ShopifySyncTest(TestCase):
+    """Las corridas siguientes solo piden lo modificado desde la marca anterior"""
+
+    def test_upsert_by_batches_and_watermark(self):
+        client = FakeClient([[shopify_order(1), shopify_order(2)], [shopify_order(3)]])
+        stats = ShopifySync(client, batch_size=2).run('orders')
+        self.assertEqual(stats['created'], 3)
+        self.assertEqual(ShopifyOrder.objects.count(), 3)
+        self.assertNotIn('updated_at_min', client.calls[0][1])
+        log = ShopifySyncLog.objects.get(sync_type='orders')
+        self.assertFalse(log.incremental)
+        self.assertIsNotNone(log.watermark)
+
+        client = FakeClient([[shopify_order(2, financial_status='refunded', updated_at='2025-12-02T10:00:00-03:00')]])
+        stats = ShopifySync(client).run('orders')
+        self.assertEqual((stats['created'], stats['updated']), (0, 1))
+        self.assertEqual(client.calls[0][1]['updated_at_min'], log.watermark.isoformat())
+        self.assertEqual(ShopifyOrder.objects.get(shopify_id=2).financial_status, 'refunded')
+
+    def test_full_and_filters(self):
+        ShopifySync(FakeClient([[shopify_order(1)]])).run('orders')
+        client = FakeClient([[shopify_order(1)]])
+        ShopifySync(client).run('orders', full=True, financial_status='paid')
+        self.assertNotIn('updated_at_min', client.calls[0][1])
+        #Una corrida filtrada no mueve la marca
+        self.assertIsNone(ShopifySyncLog.objects.order_by('-pk').first().watermark)
+
+    def test_payment_keeps_conversion(self):
+        ShopifySync(FakeClient([[shopify_order(7)]])).run('payments')
+        ShopifyPayment.objects.filter(shopify_order_id=7).update(conversion_status='converted')
+        ShopifySync(FakeClient([[shopify_order(7, total_price='120000.00')]])).run('payments')
+        pobj = ShopifyPayment.objects.get(shopify_order_id=7)
+        self.assertEqual(pobj.conversion_status, 'converted')
+        self.assertEqual(pobj.total_price, 120000)
+
+
+class IterPagesTest(TestCase):
+    def test_follows_link_cursor(self):
+        base = 'https://tienda.myshopify.com/admin/api/2024-10/orders.json'
+        rsps = [
+            SimpleNamespace(json=lambda: {'orders': [{'id': 1}]},
+                            links={'next': {'url': f'{base}?limit=2&page_info=abc'}}),
+            SimpleNamespace(json=lambda: {'orders': [{'id': 2}]}, links={}),
+        ]
+        client = ShopifyAPIClient(store_name='tienda')
+        with mock.patch.object(ShopifyAPIClient, '_request', side_effect=rsps) as rq:
+            pages = list(client.iter_pages('orders.json', 'orders', limit=2, status='any'))
+        self.assertEqual(pages, [[{'id': 1}], [{'id': 2}]])
+        self.assertEqual(rq.call_args_list[0].kwargs['params'], {'status': 'any', 'limit': 2})
+        self.assertEqual(rq.call_args_list[1].kwargs['params'], {'limit': 2, 'page_info': 'abc'})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class CallLimiterTest(TestCase):
+    """El limitador espera antes de llenar el balde en lugar de provocar 429"""
+
+    def test_bucket(self):
+        clock = FakeClock()
+        limiter = CallLimiter(capacity=40, reserve=2, clock=clock, sleep=clock.sleep)
+        for _ in range(38):
+            self.assertEqual(limiter.acquire(), 0)
+        #40 / 20s = 2 llamadas por segundo
+        self.assertAlmostEqual(limiter.acquire(), 0.5)
+        limiter.done('10/40')
+        self.assertEqual(limiter.level, 10 + limiter.inflight)
+        limiter.pause(3)
+        self.assertGreaterEqual(limiter.acquire(), 3)
+
+    def test_plus_capacity_from_header(self):
+        limiter = CallLimiter()
+        limiter.acquire()
+        limiter.done('1/400')
+        self.assertEqual((limiter.capacity, limiter.leak_rate), (400, 20))
+
+
+class PooledRequestTest(TestCase):
+    def setUp(self):
+        self.client = ShopifyAPIClient(store_name='tienda', pooled=True)
+        self.clock = FakeClock()
+        self.client.limiter = CallLimiter(clock=self.clock, sleep=self.clock.sleep)
+        self.client.tokens = mock.Mock(get=mock.Mock(return_value='tk'))
+
+    def response(self, status, headers=None, body=None):
+        rsp = mock.Mock(status_code=status, headers=headers or {})
+        rsp.json.return_value = body or {}
+        return rsp
+
+    def test_retry_after_429(self):
+        rsps = [self.response(429, {'Retry-After': '2.0', 'X-Shopify-Shop-Api-Call-Limit': '40/40'}),
+                self.response(200, {'X-Shopify-Shop-Api-Call-Limit': '39/40'}, {'shop': {'id': 1}})]
+        with mock.patch.object(self.client.session, 'request', side_effect=rsps) as rq:
+            self.assertEqual(self.client.get_shop_info(), {'shop': {'id': 1}})
+        self.assertEqual(rq.call_count, 2)
+        self.assertGreaterEqual(sum(self.clock.sleeps), 2.0)
+        self.client.tokens.get.assert_called()
+
+    def test_token_invalidated_on_401(self):
+        rsps = [self.response(401), self.response(200, body={'shop': {}})]
+        with mock.patch.object(self.client.session, 'request', side_effect=rsps):
+            self.client.get_shop_info()
+        self.client.tokens.invalidate.assert_called_once()
+
+    def test_bulk_keeps_order_and_errors(self):
+        def update(u):
+            if u[0] == 2:
+                raise ValueError('sin stock')
+            return u[0]
+        with mock.patch.object(ShopifyAPIClient, 'update_variant', side_effect=lambda vid, data: update((vid, data))):
+            rsp = self.client.bulk_update_variants([(1, {}), (2, {}), (3, {})], workers=3)
+        self.assertEqual([ r['result'] for r in rsp ], [1, None, 3])
+        self.assertEqual(rsp[1]['error'], 'sin stock')
+
+
+class ShopifyBulkImportTest(TestCase):
+    """Importacion desde exportaciones JSONL grabadas de bulkOperationRunQuery"""
+
+    def fixture(self, sync_type):
+        return os.path.join(TEST_DATA, f'bulk_{sync_type}.jsonl')
+
+    def test_products(self):
+        stats = ShopifyBulkImport(client=mock.Mock(), batch_size=2).load('products', self.fixture('products'))
+        self.assertEqual((stats['processed'], stats['created'], stats['errors']), (3, 3, 0))
+        pla = ShopifyProduct.objects.get(shopify_id=8011)
+        self.assertEqual((pla.sku, pla.price, pla.inventory_quantity), ('PLA-1KG', 150000, 12))
+        self.assertEqual(pla.image_url, 'https://cdn.shopify.com/s/files/pla.jpg')
+        self.assertEqual(ShopifyProduct.objects.get(shopify_id=8012).status, 'draft')
+        #Sin variantes
+        self.assertEqual(ShopifyProduct.objects.get(shopify_id=8013).price, 0)
+
+    def test_orders_and_customers(self):
+        importer = ShopifyBulkImport(client=mock.Mock())
+        importer.load('orders', self.fixture('orders'))
+        importer.load('customers', self.fixture('customers'))
+        order = ShopifyOrder.objects.get(shopify_id=6001)
+        self.assertEqual((order.order_number, order.financial_status, order.tags), (1001, 'paid', 'web, retiro'))
+        self.assertEqual(order.customer_tags, 'RUC:80012345-6')
+        self.assertEqual(ShopifyOrder.objects.get(shopify_id=6002).cancel_reason, 'customer')
+        ana = ShopifyCustomer.objects.get(shopify_id=7001)
+        self.assertEqual((ana.orders_count, ana.default_address_id, ana.last_order_id), (3, 5001, 6001))
+        self.assertEqual(ana.email_marketing_consent_state, 'subscribed')
+        self.assertEqual(ShopifyCustomer.objects.get(shopify_id=7002).state, 'disabled')
+
+    def test_run_polls_and_sets_watermark(self):
+        client = mock.Mock()
+        client.graphql.side_effect = [
+            {'bulkOperationRunQuery': {'bulkOperation': {'id': 'gid://shopify/BulkOperation/1', 'status': 'CREATED'},
+                                       'userErrors': []}},
+            {'node': {'id': 'gid://shopify/BulkOperation/1', 'status': 'RUNNING'}},
+            {'node': {'id': 'gid://shopify/BulkOperation/1', 'status': 'COMPLETED', 'objectCount': '2',
+                      'url': self.fixture('orders')}},
+        ]
+        stats = ShopifyBulkImport(client=client, poll_interval=0).run('orders')
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(client.graphql.call_count, 3)
+        log = ShopifySyncLog.objects.get(sync_type='orders')
+        self.assertEqual(log.status, 'success')
+        self.assertIsNotNone(log.watermark)
+
+    def test_failed_operation(self):
+        client = mock.Mock()
+        client.graphql.side_effect = [
+            {'bulkOperationRunQuery': {'bulkOperation': {'id': 'op', 'status': 'CREATED'}, 'userErrors': []}},
+            {'node': {'id': 'op', 'status': 'FAILED', 'errorCode': 'TIMEOUT'}},
+        ]
+        with self.assertRaises(Exception):
+            ShopifyBulkImport(client=client, poll_interval=0).run('products')
+        self.assertEqual(ShopifySyncLog.objects.get(sync_type='products').status, 'error')
+
+
+def shopify_payment(oid, tags='', **kwargs):
+    fields = {
+        'shopify_order_id': oid, 'order_number': oid, 'order_name': f'#{oid}',
+        'total_price': 110000, 'subtotal_price': 110000, 'total_shipping': 0,
+        'customer_first_name': 'Juan', 'customer_last_name': 'Perez', 'customer_tags': tags,
+        'order_created_at': datetime(2025, 12, 1, 12, tzinfo=timezone.utc),
+        'line_items': [{'id': 5550000 + oid, 'title': 'PLA 1KG', 'price': '55000', 'quantity': 2,
+                        'discount_allocations': []}],
+    }
+    fields.update(kwargs)
+    return ShopifyPayment.objects.create(**fields)
+
+
+class PaymentInvoiceConverterTest(TestCase):
+    """Los pagos se facturan por lote, una numeracion y una firma para todo el lote"""
+
+    def msifen(self):
+        ms = MSifen.__new__(MSifen)
+        ms.RUC = '80163121'
+        ms.bsobj = SimpleNamespace(name='Toca3d', ruc='80163121',
+                                   actividadecoobj=SimpleNamespace(nombre_actividad='VENTA', codigo_actividad='47190'))
+        ms.timbradoobj = SimpleNamespace(timbrado=12345678, fcsc='0001', scsc='ABCD', inicio=date(2025, 1, 1),
+                                         vencimiento=date(2026, 12, 31))
+        return ms
+
+    def test_batch(self):
+        ms = self.msifen()
+        Clientes.objects.create(pdv_ruc='4492525', pdv_ruc_dv=7, pdv_nombrefactura='JUAN PEREZ',
+                                pdv_nombrefantasia='JUAN PEREZ', pdv_tipocontribuyente='1')
+        conruc = shopify_payment(1, tags='vip, RUC:4492525', financial_status='paid', total_shipping=20000)
+        innominado = shopify_payment(2)
+        repetido = shopify_payment(3, tags='ruc:4492525')
+        document_header(source='SHOPIFY', ext_link='3')
+        estab = mock.Mock()
+        estab.objects.filter.return_value.first.return_value = SimpleNamespace(establecimiento=1)
+        with mock.patch('am_shopify.mng_shopify_invoices.Eestablecimiento', estab), \
+             mock.patch.object(MSifen, 'validate_ruc') as vruc, \
+             mock.patch.object(MSifen, 'set_number', return_value={'success': 'Done'}) as snum, \
+             mock.patch('Sifen.ekuatia_serials.Eserial.sign_documents', return_value={'signed': 2, 'errors': []}), \
+             mock.patch('Sifen.ekuatia_serials.Eserial.send_pending_signedxml') as send:
+            progress = mock.Mock()
+            rsp = PaymentInvoiceConverter(msifen=ms, progress=progress).run([conruc.pk, innominado.pk, repetido.pk])
+
+        self.assertEqual(rsp['stats'], {'converted': 2, 'skipped': 1, 'errors': 0, 'sent': 1})
+        #Un solo validate_ruc aunque dos pagos tengan el mismo RUC
+        vruc.assert_called_once()
+        snum.assert_called_once()
+        self.assertEqual(len(snum.call_args.args[1]), 2)
+        send.assert_called_once()
+        self.assertEqual(progress.call_args.args[:2], (3, 3))
+
+        conruc.refresh_from_db()
+        docobj = conruc.document_header
+        self.assertEqual(conruc.conversion_status, 'converted')
+        self.assertEqual((docobj.source, docobj.ext_link, docobj.pdv_nombrefactura), ('SHOPIFY', '1', 'JUAN PEREZ'))
+        self.assertEqual(docobj.documentdetail_set.count(), 2)
+        self.assertEqual(docobj.doc_total, 130000)
+        self.assertEqual(docobj.doc_relacion_saldo, 130000)
+        innominado.refresh_from_db()
+        self.assertEqual(innominado.document_header.pdv_ruc, '0')
+        repetido.refresh_from_db()
+        self.assertEqual(repetido.conversion_status, 'skipped')
+        self.assertTrue(Clientes.objects.filter(pdv_ruc='0').exists())
+
+    def test_set_number_fails(self):
+        ms = self.msifen()
+        payments = [ shopify_payment(i, tags='RUC:4492525', financial_status='paid') for i in (1, 2) ]
+        ids = [ p.pk for p in payments ]
+        estab = mock.Mock()
+        estab.objects.filter.return_value.first.return_value = SimpleNamespace(establecimiento=1)
+        with mock.patch('am_shopify.mng_shopify_invoices.Eestablecimiento', estab), \
+             mock.patch.object(MSifen, 'validate_ruc'), \
+             mock.patch('Sifen.ekuatia_serials.Eserial.sign_documents', return_value={'signed': 2, 'errors': []}) as sign, \
+             mock.patch('Sifen.ekuatia_serials.Eserial.send_pending_signedxml'):
+            for failure in ({'return_value': {'error': 'No se puede asignar numero'}},
+                            {'side_effect': ValueError('LA CANTIDAD DE NUMEROS ES INSUFICIENTE')}):
+                with mock.patch.object(MSifen, 'set_number', **failure):
+                    rsp = PaymentInvoiceConverter(msifen=ms).run(ids)
+                self.assertEqual(rsp['stats'], {'converted': 0, 'skipped': 0, 'errors': 2, 'sent': 0})
+                #Sin cabeceras sin numerar ni pagos marcados como convertidos
+                self.assertFalse(DocumentHeader.objects.filter(source='SHOPIFY').exists())
+                self.assertEqual(set(ShopifyPayment.objects.filter(pk__in=ids).values_list('conversion_status', flat=True)), {'error'})
+            sign.assert_not_called()
+
+            #Con numeros disponibles el reintento los convierte
+            with mock.patch.object(MSifen, 'set_number', return_value={'success': 'Done'}):
+                rsp = PaymentInvoiceConverter(msifen=ms).run(ids)
+        self.assertEqual(rsp['stats']['converted'], 2)
+        self.assertEqual(DocumentHeader.objects.filter(source='SHOPIFY').count(), 2)
@@ -6,7 +6,9 @@ Frontliner para las operaciones de facturación.
 """
 
 import os
+import time
 import logging
+import threading
 from contextlib import contextmanager
 from typing import List, Dict, Optional, Any
 from decimal import Decimal
@@ -15,6 +17,8 @@ from datetime import datetime, date
 import MySQLdb
 from MySQLdb.cursors import DictCursor
 
+from .fl_mysql_pool import FL_MYSQL_POOLED, PooledConnection, get_pool
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,37 +32,126 @@ class FLMySQLClient:
     - FL_MYSQL_DATABASE: Nombre de la base de datos (default: frontlin_db)
     - FL_MYSQL_USER: Usuario (default: frontlin_user)
     - FL_MYSQL_PASSWORD: Contraseña
+
+    Las conexiones salen del pool del proceso (fl_mysql_pool). En un mismo
+    hilo, un get_connection/transaction dentro de otro, o todo lo que corre
+    dentro de reuse_connection, usa la misma conexión.
     """
 
-    def __init__(self):
+    def __init__(self, pooled: bool = None):
         self.host = os.environ.get('FL_MYSQL_HOST', 'localhost')
         self.port = int(os.environ.get('FL_MYSQL_PORT', 3306))
         self.database = os.environ.get('FL_MYSQL_DATABASE', 'frontlin_db')
         self.user = os.environ.get('FL_MYSQL_USER', 'frontlin_user')
         self.password = os.environ.get('FL_MYSQL_PASSWORD', 'admin')
         self.charset = 'utf8mb4'
+        self.pooled = FL_MYSQL_POOLED if pooled is None else pooled
+        self.pool = None
+        if self.pooled:
+            self.pool = get_pool((self.host, self.port, self.database, self.user), self._connect)
+        self._local = threading.local()
+
+    def _connect(self):
+        return MySQLdb.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            passwd=self.password,
+            db=self.database,
+            charset=self.charset,
+            cursorclass=DictCursor
+        )
+
+    def _state(self):
+        """Conexión que usa el hilo y si está dentro de reuse_connection / transaction"""
+        st = self._local
+        if not hasattr(st, 'held'):
+            st.held = None
+            st.keep = False
+            st.broken = False
+            st.in_transaction = False
+        return st
+
+    def _acquire(self) -> PooledConnection:
+        try:
+            if self.pool:
+                return self.pool.acquire()
+            return PooledConnection(self._connect(), time.monotonic())
+        except MySQLdb.Error as e:
+            logger.error(f"Error conectando a MySQL: {e}")
+            raise
+
+    def _release(self, pconn, discard=False):
+        if self.pool:
+            self.pool.release(pconn, discard=discard)
+        else:
+            pconn.close()
 
     @contextmanager
     def get_connection(self):
         """Context manager para obtener una conexión a MySQL."""
-        conn = None
+        st = self._state()
+        owner = st.held is None
+        if owner:
+            st.held = self._acquire()
+            st.broken = False
         try:
-            conn = MySQLdb.connect(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                passwd=self.password,
-                db=self.database,
-                charset=self.charset,
-                cursorclass=DictCursor
-            )
-            yield conn
+            yield st.held.conn
+        except MySQLdb.OperationalError as e:
+            #Conexion caida (2006, 2013...), no vuelve al pool
+            st.broken = True
+            logger.error(f"Error de conexion MySQL: {e}")
+            raise
         except MySQLdb.Error as e:
-            logger.error(f"Error conectando a MySQL: {e}")
+            logger.error(f"Error en consulta MySQL: {e}")
             raise
         finally:
-            if conn:
-                conn.close()
+            if owner and not st.keep:
+                held, st.held = st.held, None
+                self._release(held, discard=st.broken)
+
+    @contextmanager
+    def reuse_connection(self):
+        """
+        Todas las consultas del bloque van por una sola conexión; se toma en
+        la primera consulta (no antes) y se devuelve al salir.
+        """
+        st = self._state()
+        if st.keep or st.held is not None:
+            yield
+            return
+        st.keep = True
+        try:
+            yield
+        finally:
+            st.keep = False
+            if st.held is not None:
+                held, st.held = st.held, None
+                self._release(held, discard=st.broken)
+
+    @contextmanager
+    def transaction(self):
+        """Una conexión y una transacción: commit al salir del bloque, rollback ante cualquier error."""
+        with self.get_connection() as conn:
+            st = self._state()
+            if st.in_transaction:
+                yield conn
+                return
+            st.in_transaction = True
+            try:
+                conn.begin()
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                st.in_transaction = False
+
+    def _commit(self, conn):
+        """Dentro de transaction el commit lo hace la transacción, en autocommit no hace falta"""
+        if not self._state().in_transaction and not conn.get_autocommit():
+            conn.commit()
 
     def execute_query(self, query: str, params: tuple = None) -> List[Dict]:
         """Ejecuta una consulta SELECT y retorna los resultados."""
@@ -79,7 +172,7 @@ class FLMySQLClient:
         with self.get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query, params or ())
-                conn.commit()
+                self._commit(conn)
                 return cursor.rowcount
 
     def execute_insert(self, query: str, params: tuple = None) -> int:
@@ -87,7 +180,7 @@ class FLMySQLClient:
         with self.get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query, params or ())
-                conn.commit()
+                self._commit(conn)
                 return cursor.lastrowid
 
     # =========================================================================
@@ -521,7 +614,7 @@ class FLMySQLClient:
         Returns:
             acuse_id generado
         """
-        with self.get_connection() as conn:
+        with self.transaction() as conn:
             cursor = conn.cursor()
 
             try:
@@ -608,12 +701,10 @@ class FLMySQLClient:
                     '127.0.0.1'
                 ))
 
-                conn.commit()
                 logger.info(f"Ticket generado: acuse_id={acuse_id}")
                 return acuse_id
 
             except Exception as e:
-                conn.rollback()
                 logger.error(f"Error generando ticket: {e}")
                 raise
 
@@ -643,7 +734,7 @@ class FLMySQLClient:
         Returns:
             True si se confirmó correctamente
         """
-        with self.get_connection() as conn:
+        with self.transaction() as conn:
             cursor = conn.cursor()
 
             try:
@@ -779,12 +870,10 @@ class FLMySQLClient:
                         monto_gravada, monto_exenta
                     ))
 
-                conn.commit()
                 logger.info(f"Pago confirmado para acuse_id={acuse_id}, pendiente={pendiente}")
                 return True
 
             except Exception as e:
-                conn.rollback()
                 logger.error(f"Error confirmando pago: {e}")
                 raise
 
@@ -805,7 +894,7 @@ class FLMySQLClient:
         Returns:
             True si se actualizó correctamente
         """
-        with self.get_connection() as conn:
+        with self.transaction() as conn:
             cursor = conn.cursor()
 
             try:
@@ -832,12 +921,10 @@ class FLMySQLClient:
                     WHERE acuse_id = %s
                 """, (acuse_id,))
 
-                conn.commit()
                 logger.info(f"Factura marcada como emitida: acuse_id={acuse_id}, id_factura={id_factura}")
                 return True
 
             except Exception as e:
-                conn.rollback()
                 logger.error(f"Error marcando factura emitida: {e}")
                 raise
 
@@ -0,0 +1,162 @@
+"""
+Pool de conexiones MySQL para FLMySQLClient.
+
+- Conexiones reutilizables por proceso y por servidor/base/usuario, con
+  a lo sumo FL_MYSQL_POOL_SIZE abiertas a la vez (se espera
+  FL_MYSQL_POOL_TIMEOUT segundos por una libre).
+- Una conexión inactiva más de FL_MYSQL_POOL_PING_AFTER segundos se
+  verifica con ping() antes de entregarla; si falla se descarta.
+- Ninguna conexión vive más de FL_MYSQL_POOL_MAX_LIFETIME segundos, así no
+  choca con wait_timeout del servidor.
+- Las conexiones trabajan en autocommit; las operaciones de varias
+  sentencias abren su transacción con begin() (FLMySQLClient.transaction).
+
+Configuración via variables de entorno:
+- FL_MYSQL_POOLED (default: True, False abre una conexión por uso como antes)
+- FL_MYSQL_POOL_SIZE (default: 5)
+- FL_MYSQL_POOL_TIMEOUT (default: 10)
+- FL_MYSQL_POOL_PING_AFTER (default: 30)
+- FL_MYSQL_POOL_MAX_LIFETIME (default: 600)
+"""
+import os
+import time
+import logging
+import threading
+
+import MySQLdb
+
+logger = logging.getLogger(__name__)
+
+FL_MYSQL_POOLED = os.environ.get('FL_MYSQL_POOLED', 'True') == 'True'
+FL_MYSQL_POOL_SIZE = int(os.environ.get('FL_MYSQL_POOL_SIZE', 5))
+FL_MYSQL_POOL_TIMEOUT = float(os.environ.get('FL_MYSQL_POOL_TIMEOUT', 10))
+FL_MYSQL_POOL_PING_AFTER = float(os.environ.get('FL_MYSQL_POOL_PING_AFTER', 30))
+FL_MYSQL_POOL_MAX_LIFETIME = float(os.environ.get('FL_MYSQL_POOL_MAX_LIFETIME', 600))
+
+
+class PoolTimeout(MySQLdb.OperationalError):
+    """No se liberó ninguna conexión dentro de FL_MYSQL_POOL_TIMEOUT"""
+
+
+class PooledConnection:
+    """Conexión del pool con sus marcas de creación y último uso"""
+
+    def __init__(self, conn, now):
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Pool acotado y thread-safe de conexiones MySQLdb"""
+
+    def __init__(self, connect, size=FL_MYSQL_POOL_SIZE, timeout=FL_MYSQL_POOL_TIMEOUT,
+                 ping_after=FL_MYSQL_POOL_PING_AFTER, max_lifetime=FL_MYSQL_POOL_MAX_LIFETIME,
+                 clock=time.monotonic):
+        self.connect = connect
+        self.size = max(int(size), 1)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.max_lifetime = max_lifetime
+        self.opened = 0
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+        self._idle = []
+        self._clock = clock
+        self._cond = threading.Condition()
+
+    def _expired(self, pconn, now):
+        return now - pconn.created_at >= self.max_lifetime
+
+    def _discard(self, pconn):
+        pconn.close()
+        with self._cond:
+            self.opened -= 1
+            self.stats['discarded'] += 1
+            self._cond.notify()
+
+    def _healthy(self, pconn, now):
+        if self._expired(pconn, now):
+            return False
+        if now - pconn.last_used < self.ping_after:
+            return True
+        try:
+            pconn.conn.ping()
+            return True
+        except MySQLdb.Error as e:
+            logger.info(f'Conexion MySQL inactiva descartada: {e}')
+            return False
+
+    def acquire(self) -> PooledConnection:
+        deadline = self._clock() + self.timeout
+        while True:
+            with self._cond:
+                while not self._idle and self.opened >= self.size:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        raise PoolTimeout(f'Sin conexiones MySQL libres ({self.size} en uso)')
+                    self._cond.wait(remaining)
+                if self._idle:
+                    #LIFO: la ultima devuelta es la que menos probablemente cerró el servidor
+                    pconn = self._idle.pop()
+                else:
+                    pconn = None
+                    self.opened += 1
+            if pconn is None:
+                try:
+                    conn = self.connect()
+                    conn.autocommit(True)
+                except Exception:
+                    with self._cond:
+                        self.opened -= 1
+                        self._cond.notify()
+                    raise
+                self.stats['created'] += 1
+                return PooledConnection(conn, self._clock())
+            #ping fuera del lock
+            if self._healthy(pconn, self._clock()):
+                self.stats['reused'] += 1
+                return pconn
+            self._discard(pconn)
+
+    def release(self, pconn, discard=False):
+        now = self._clock()
+        if discard or self._expired(pconn, now):
+            self._discard(pconn)
+            return
+        pconn.last_used = now
+        with self._cond:
+            self._idle.append(pconn)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.opened -= len(idle)
+            self._cond.notify_all()
+        for pconn in idle:
+            pconn.close()
+
+
+_registry_lock = threading.Lock()
+_pools = {}
+
+
+def get_pool(key, connect) -> ConnectionPool:
+    """Un pool por (host, port, database, user) en el proceso"""
+    with _registry_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connect)
+        return _pools[key]
+
+
+def close_pools():
+    with _registry_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
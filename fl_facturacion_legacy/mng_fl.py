@@ -6,6 +6,7 @@ integrándose con SIFEN para facturación electrónica.
 """
 
 import logging
+from functools import wraps
 from decimal import Decimal
 from datetime import datetime
 from typing import Dict, List, Optional, Any
@@ -23,6 +24,15 @@ from .fl_mysql_client import FLMySQLClient
 logger = logging.getLogger(__name__)
 
 
+def reuse_connection(fn):
+    """Las consultas a MySQL del método comparten una sola conexión del pool"""
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self.mysql_client.reuse_connection():
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
 class MFLFacturacion:
     """
     Clase para manejar las operaciones de facturación del sistema Frontliner.
@@ -192,6 +202,7 @@ class MFLFacturacion:
             traceback.print_exc()
             return {'items': [], 'total_count': 0, 'error': str(e)}
 
+    @reuse_connection
     def get_datos_cliente_entrega(self, *args, **kwargs) -> Dict:
         """
         Obtiene datos del cliente para entrega de paquetes.
@@ -279,6 +290,7 @@ class MFLFacturacion:
                 'mensaje': f'Error obteniendo datos: {str(e)}'
             }
 
+    @reuse_connection
     def get_cliente(self, *args, **kwargs) -> Dict:
         """Obtiene datos de un cliente específico."""
         q = kwargs.get('qdict', {})
@@ -323,6 +335,7 @@ class MFLFacturacion:
     # PAQUETES
     # =========================================================================
 
+    @reuse_connection
     def get_paquetes_cliente(self, *args, **kwargs) -> Dict:
         """
         Obtiene los paquetes pendientes de entrega para un cliente.
@@ -486,6 +499,7 @@ class MFLFacturacion:
             logger.error(f"Error obteniendo facturas pendientes: {e}")
             return {'error': f'Error obteniendo facturas: {str(e)}'}
 
+    @reuse_connection
     def get_todas_facturas(self, *args, **kwargs) -> Dict:
         """
         Obtiene todas las facturas con paginación y filtros.
@@ -560,6 +574,7 @@ class MFLFacturacion:
             logger.error(f"Error obteniendo facturas: {e}")
             return {'error': f'Error obteniendo facturas: {str(e)}'}
 
+    @reuse_connection
     def get_factura_detalle(self, *args, **kwargs) -> Dict:
         """
         Obtiene el detalle completo de una factura/acuse.
@@ -0,0 +1,52 @@
+#Compara una conexion nueva por consulta contra el pool de FLMySQLClient
+#Necesita un MySQL/MariaDB local con la base de Frontliner (FL_MYSQL_*)
+#Ejecutar desde ./manage.py shell_plus < fl_facturacion_legacy/test/bench_mysql_pool.py
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from fl_facturacion_legacy.fl_mysql_client import FLMySQLClient
+from fl_facturacion_legacy.mng_fl import MFLFacturacion
+
+N = 300
+THREADS = 4
+TERMINOS = ['JUA', 'JUAN', 'JUAN P', 'JUAN PE', 'JUAN PER', 'MAR', 'MARI', 'MARIA']
+
+def run(label, client):
+    mfl = MFLFacturacion()
+    mfl.mysql_client = client
+    lat = []
+    for i in range(N):
+        t0 = time.perf_counter()
+        mfl.buscar_clientes_select2(qdict={'q': TERMINOS[i % len(TERMINOS)]})
+        lat.append((time.perf_counter() - t0) * 1000)
+    lat.sort()
+    print(f'{label}: media {statistics.mean(lat):.2f} ms, p50 {lat[len(lat)//2]:.2f} ms, '
+          f'p95 {lat[int(len(lat)*0.95)]:.2f} ms')
+    return statistics.mean(lat)
+
+def run_threads(label, client):
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        list(executor.map(lambda i: client.buscar_clientes(TERMINOS[i % len(TERMINOS)], limit=31), range(N)))
+    elapsed = time.perf_counter() - t0
+    print(f'{label} con {THREADS} hilos: {N/elapsed:,.0f} consultas/s')
+
+fresh = FLMySQLClient(pooled=False)
+pooled = FLMySQLClient(pooled=True)
+pooled.execute_one('SELECT 1')
+
+fresh_ms = run('Conexion por consulta', fresh)
+pooled_ms = run('Pool', pooled)
+print(f'Mejora: {fresh_ms / pooled_ms:.1f}x, pool {pooled.pool.stats}')
+run_threads('Conexion por consulta', fresh)
+run_threads('Pool', pooled)
+print(f'Pool tras hilos: {pooled.pool.stats}, abiertas {pooled.pool.opened}/{pooled.pool.size}')
+assert pooled.pool.opened <= pooled.pool.size
+
+#Una transaccion con varias sentencias usa una sola conexion
+created = pooled.pool.stats['created']
+with pooled.transaction() as conn:
+    cid = conn.thread_id()
+    with pooled.get_connection() as inner:
+        assert inner.thread_id() == cid, 'Las sentencias de la transaccion deben ir por la misma conexion'
+assert pooled.pool.stats['created'] == created
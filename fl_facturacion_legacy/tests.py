@@ -0,0 +1,92 @@
+from unittest import mock
+import MySQLdb
+from django.test import SimpleTestCase
+from fl_facturacion_legacy.fl_mysql_pool import ConnectionPool, PoolTimeout
+from fl_facturacion_legacy.fl_mysql_client import FLMySQLClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_conn():
+    conn = mock.MagicMock()
+    conn.get_autocommit.return_value = True
+    return conn
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """Conexiones reutilizadas, verificadas tras estar inactivas y con vida maxima"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.connect = mock.Mock(side_effect=lambda: fake_conn())
+        self.pool = ConnectionPool(self.connect, size=2, timeout=0, ping_after=30, max_lifetime=600, clock=self.clock)
+
+    def test_reuse_and_bound(self):
+        a = self.pool.acquire()
+        a.conn.autocommit.assert_called_once_with(True)
+        self.pool.release(a)
+        self.assertIs(self.pool.acquire(), a)
+        b = self.pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+        self.pool.release(b)
+        self.assertEqual((self.connect.call_count, self.pool.opened), (2, 2))
+
+    def test_ping_and_lifetime(self):
+        a = self.pool.acquire()
+        self.pool.release(a)
+        self.clock.now = 10
+        self.assertIs(self.pool.acquire(), a)
+        a.conn.ping.assert_not_called()
+        self.pool.release(a)
+        #Inactiva: ping, y si falla se descarta
+        self.clock.now = 50
+        a.conn.ping.side_effect = MySQLdb.OperationalError(2006, 'MySQL server has gone away')
+        b = self.pool.acquire()
+        self.assertIsNot(b, a)
+        a.conn.close.assert_called_once()
+        #Vencida al devolverla
+        self.clock.now = 700
+        self.pool.release(b)
+        b.conn.close.assert_called_once()
+        self.assertEqual(self.pool.opened, 0)
+
+
+class FLMySQLClientTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(lambda: fake_conn(), size=2, timeout=0)
+        self.client = FLMySQLClient(pooled=False)
+        self.client.pool = self.pool
+
+    def test_reuse_connection(self):
+        with self.client.reuse_connection():
+            self.client.execute_query('SELECT 1')
+            self.client.execute_one('SELECT 2')
+            self.assertEqual(self.pool.opened, 1)
+            self.assertEqual(len(self.pool._idle), 0)
+        self.assertEqual((self.pool.stats['created'], len(self.pool._idle)), (1, 1))
+
+    def test_transaction(self):
+        with self.client.transaction() as conn:
+            self.client.execute_update('UPDATE facturas SET estado = 2')
+            conn.begin.assert_called_once()
+            conn.commit.assert_not_called()
+        conn.commit.assert_called_once()
+
+        with self.assertRaises(ValueError):
+            with self.client.transaction() as conn:
+                raise ValueError('Acuse no encontrado')
+        conn.rollback.assert_called_once()
+        self.assertEqual(self.pool.stats['created'], 1)
+
+    def test_broken_connection_discarded(self):
+        with self.assertRaises(MySQLdb.OperationalError):
+            with self.client.get_connection():
+                raise MySQLdb.OperationalError(2013, 'Lost connection')
+        self.assertEqual((self.pool.opened, self.pool.stats['discarded']), (0, 1))